@@ -0,0 +1,46 @@
+"""
+Runs the benchmark suite and compares it with the last saved baseline, failing when the median of any benchmark got
+slower by more than --threshold percent. Needs benchmarks/requirements.txt on top of the services' requirements.
+
+    python benchmarks/compare.py --save    # on the base branch: record a baseline
+    python benchmarks/compare.py           # on the change: run again and compare
+
+Baselines are kept in benchmarks/.benchmarks, split by machine and Python version the way pytest-benchmark stores
+them, so only runs on the same machine are compared. Arguments after -- go to pytest, e.g. -- -k car_listing.
+"""
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+STORAGE = ROOT / "benchmarks" / ".benchmarks"
+
+DEFAULT_THRESHOLD = 15
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the microbenchmarks and fails on a regression against the saved baseline")
+    parser.add_argument("--save", action="store_true", help="save this run as the new baseline instead of comparing")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed median slowdown in percent")
+    args, pytest_args = parser.parse_known_args()
+    if pytest_args[:1] == ["--"]:
+        pytest_args = pytest_args[1:]
+
+    command = [
+        sys.executable, "-m", "pytest", str(ROOT / "benchmarks"), "-q", "--benchmark-only",
+        f"--benchmark-storage=file://{STORAGE}", "--benchmark-columns=min,median,iqr,ops,rounds",
+        "--benchmark-sort=name", "--benchmark-warmup=on",
+        # Rounds of at least 200us, so sub-microsecond functions are timed over many iterations rather than one
+        "--benchmark-min-time=0.0002",
+    ]
+    if args.save:
+        command.append("--benchmark-save=baseline")
+    else:
+        if not any(STORAGE.glob("*/*.json")):
+            parser.error(f"no baseline in {STORAGE}; run with --save first")
+        # Medians rather than means, so a few descheduled rounds on a busy runner don't fail the gate
+        command += ["--benchmark-compare", f"--benchmark-compare-fail=median:{args.threshold:g}%"]
+    sys.exit(subprocess.run(command + pytest_args, cwd=ROOT).returncode)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import pytest
+from google.protobuf.field_mask_pb2 import FieldMask
+from services import car_service_pb2, car_service_pb2_grpc
+from microservices.car.car import CarService, car_from_row, read_mask_fields, encode_page_token, decode_page_token
+
+pytestmark = pytest.mark.benchmark(group="car")
+
+# The services' DEFAULT_PAGE_SIZE
+PAGE_SIZE = 100
+
+CAR_ROW = (42, 2016, "Toyota", "Corolla", "good", "4 cylinders", "gas", 85000, "automatic", "4T1BF1FK5GU123456",
+           "fwd", "compact", "sedan", "silver", 3)
+PAGE_ROWS = [(car_id, *CAR_ROW[1:]) for car_id in range(1, PAGE_SIZE + 2)]
+LIST_MASK = FieldMask(paths=["carId", "year", "manufacturer", "model", "odometer", "fuel"])
+
+def test_car_from_row(benchmark):
+    car = benchmark(car_from_row, CAR_ROW)
+    assert car.carId == 42 and car.VIN == CAR_ROW[9]
+
+def test_car_page_from_rows(benchmark):
+    cars = benchmark(lambda: [car_from_row(row) for row in PAGE_ROWS[:PAGE_SIZE]])
+    assert len(cars) == PAGE_SIZE
+
+def test_read_all_validation(benchmark):
+    """readMask and page token checks CarsReadAll runs before touching the database"""
+    page_token = encode_page_token("-year", 2016, 42)
+
+    def validate():
+        return read_mask_fields(LIST_MASK), decode_page_token(page_token, "-year")
+
+    fields, after = benchmark(validate)
+    assert "manufacturer" in fields and after == (2016, 42)
+
+def test_read_one_rpc(benchmark, stub_cursor, serve):
+    stub_cursor.row = CAR_ROW
+    client = serve(CarService(), car_service_pb2_grpc.add_CarServiceServicer_to_server, car_service_pb2_grpc.CarServiceStub)
+    car = benchmark(client.CarsReadOne, car_service_pb2.CarsReadOneRequest(carId=42))
+    assert car.carId == 42
+
+def test_read_all_rpc(benchmark, stub_cursor, serve):
+    stub_cursor.rows = PAGE_ROWS
+    client = serve(CarService(), car_service_pb2_grpc.add_CarServiceServicer_to_server, car_service_pb2_grpc.CarServiceStub)
+    response = benchmark(client.CarsReadAll, car_service_pb2.CarsReadAllRequest(pageSize=PAGE_SIZE))
+    assert len(response.data) == PAGE_SIZE and response.nextPageToken
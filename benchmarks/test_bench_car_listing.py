@@ -0,0 +1,54 @@
+import pytest
+from datetime import datetime
+from google.protobuf.field_mask_pb2 import FieldMask
+from services import car_listing_service_pb2, car_listing_service_pb2_grpc
+from services.car_listing_service_pb2 import CarListing
+from microservices.car_listing.car_listing import (
+    CarListingService, listing_from_row, read_mask_fields, encode_page_token, decode_page_token
+)
+
+pytestmark = pytest.mark.benchmark(group="car_listing")
+
+# The services' DEFAULT_PAGE_SIZE
+PAGE_SIZE = 100
+
+LISTING_ROW = (42, 7, 3, "TypeEnum_BUY", "2016 Toyota Corolla, 85,000 miles, good", datetime(2024, 3, 10, 14, 30),
+               15450.0, False, "StatusEnum_AVAILABLE", 2)
+PAGE_ROWS = [(listing_id, *LISTING_ROW[1:]) for listing_id in range(1, PAGE_SIZE + 2)]
+LIST_MASK = FieldMask(paths=["listingId", "carId", "type", "status", "sale_price", "posting_date", "promoted"])
+
+def test_listing_from_row(benchmark):
+    listing = benchmark(listing_from_row, LISTING_ROW)
+    assert listing.listingId == 42 and listing.status == CarListing.StatusEnum.Value("StatusEnum_AVAILABLE")
+
+def test_listing_page_from_rows(benchmark):
+    listings = benchmark(lambda: [listing_from_row(row) for row in PAGE_ROWS[:PAGE_SIZE]])
+    assert len(listings) == PAGE_SIZE
+
+def test_status_enum_conversion(benchmark):
+    """Column value to enum number on reads and back to the column value on writes"""
+    status = benchmark(lambda: CarListing.StatusEnum.Name(CarListing.StatusEnum.Value("StatusEnum_SOLD")))
+    assert status == "StatusEnum_SOLD"
+
+def test_read_all_validation(benchmark):
+    page_token = encode_page_token("-posting_date", "2024-03-10T14:30:00", 42)
+
+    def validate():
+        return read_mask_fields(LIST_MASK), decode_page_token(page_token, "-posting_date")
+
+    fields, after = benchmark(validate)
+    assert "status" in fields and after == ("2024-03-10T14:30:00", 42)
+
+def test_read_one_rpc(benchmark, stub_cursor, serve):
+    stub_cursor.row = LISTING_ROW
+    client = serve(CarListingService(), car_listing_service_pb2_grpc.add_CarListingServiceServicer_to_server,
+                   car_listing_service_pb2_grpc.CarListingServiceStub)
+    listing = benchmark(client.CarlistingReadOne, car_listing_service_pb2.CarlistingReadOneRequest(listingId=42))
+    assert listing.listingId == 42
+
+def test_read_all_rpc(benchmark, stub_cursor, serve):
+    stub_cursor.rows = PAGE_ROWS
+    client = serve(CarListingService(), car_listing_service_pb2_grpc.add_CarListingServiceServicer_to_server,
+                   car_listing_service_pb2_grpc.CarListingServiceStub)
+    response = benchmark(client.CarlistingReadAll, car_listing_service_pb2.CarlistingReadAllRequest(pageSize=PAGE_SIZE))
+    assert len(response.data) == PAGE_SIZE and response.nextPageToken
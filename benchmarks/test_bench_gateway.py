@@ -0,0 +1,49 @@
+import pytest
+from datetime import datetime
+from flask import Flask, jsonify
+from google.protobuf.json_format import MessageToDict
+from services import car_service_pb2, car_listing_service_pb2, transaction_service_pb2
+from microservices.car.car import car_from_row
+from microservices.car_listing.car_listing import listing_from_row
+from microservices.transaction.transaction import transaction_from_row
+
+pytestmark = pytest.mark.benchmark(group="gateway")
+
+# The services' DEFAULT_PAGE_SIZE
+PAGE_SIZE = 100
+
+CARS = car_service_pb2.CarsReadAllResponse(data=[
+    car_from_row((car_id, 2016, "Toyota", "Corolla", "good", "4 cylinders", "gas", 85000, "automatic",
+                  f"4T1BF1FK5GU{car_id:06d}", "fwd", "compact", "sedan", "silver", 3))
+    for car_id in range(1, PAGE_SIZE + 1)
+], nextPageToken="WyJjYXJJZCIsIDEwMCwgMTAwXQ==")
+LISTINGS = car_listing_service_pb2.CarlistingReadAllResponse(data=[
+    listing_from_row((listing_id, 7, 3, "TypeEnum_BUY", "2016 Toyota Corolla, 85,000 miles, good",
+                      datetime(2024, 3, 10, 14, 30), 15450.0, False, "StatusEnum_AVAILABLE", 2))
+    for listing_id in range(1, PAGE_SIZE + 1)
+])
+TRANSACTIONS = transaction_service_pb2.TransactionsReadAllResponse(data=[
+    transaction_from_row((transaction_id, 3, 7, "TypeEnum_RENT", 480.0, "StatusEnum_COMPLETED",
+                          datetime(2024, 3, 15, 9, 0), datetime(2024, 3, 22, 9, 0), 1))
+    for transaction_id in range(1, PAGE_SIZE + 1)
+])
+
+@pytest.fixture
+def app_context():
+    """jsonify needs an application; a bare one encodes JSON the same way the gateway's does"""
+    with Flask(__name__).app_context():
+        yield
+
+def test_cars_message_to_dict(benchmark):
+    page = benchmark(MessageToDict, CARS)
+    assert len(page["data"]) == PAGE_SIZE
+
+def test_listings_message_to_dict(benchmark):
+    page = benchmark(MessageToDict, LISTINGS)
+    assert page["data"][0]["status"] == "StatusEnum_AVAILABLE"
+
+@pytest.mark.parametrize("page", [CARS, LISTINGS, TRANSACTIONS], ids=["cars", "listings", "transactions"])
+def test_read_all_json_response(benchmark, app_context, page):
+    """What every gateway list route does with a ReadAll response: jsonify(MessageToDict(response))"""
+    response = benchmark(lambda: jsonify(MessageToDict(page)))
+    assert response.status_code == 200 and len(response.get_data()) > PAGE_SIZE
@@ -0,0 +1,48 @@
+import grpc
+import pytest
+from datetime import datetime
+from services import inspection_service_pb2, inspection_service_pb2_grpc
+from services.inspection_service_pb2 import Inspection
+from microservices.inspection.inspection import InspectionService, inspection_from_row
+
+pytestmark = pytest.mark.benchmark(group="inspection")
+
+# The services' DEFAULT_PAGE_SIZE
+PAGE_SIZE = 100
+
+INSPECTION_ROW = (42, 7, "InspectionStatusEnum_FINISHED", "Check engine light on", "Replaced spark plugs", 150.0,
+                  datetime(2024, 3, 20, 10, 30), datetime(2024, 3, 20, 12, 45))
+PAGE_ROWS = [(inspection_id, *INSPECTION_ROW[1:]) for inspection_id in range(1, PAGE_SIZE + 2)]
+
+def test_inspection_from_row(benchmark):
+    inspection = benchmark(inspection_from_row, INSPECTION_ROW)
+    assert inspection.inspectionId == 42
+
+def test_inspection_page_from_rows(benchmark):
+    inspections = benchmark(lambda: [inspection_from_row(row) for row in PAGE_ROWS[:PAGE_SIZE]])
+    assert len(inspections) == PAGE_SIZE
+
+def test_status_enum_conversion(benchmark):
+    status = benchmark(lambda: Inspection.InspectionStatusEnum.Name(
+        Inspection.InspectionStatusEnum.Value("InspectionStatusEnum_ONGOING")))
+    assert status == "InspectionStatusEnum_ONGOING"
+
+def test_read_all_rejects_invalid_request(benchmark, stub_cursor, context):
+    """The checks InspectionReadAll runs before the database, on a request that fails them"""
+    service = InspectionService()
+    benchmark(service.InspectionReadAll, inspection_service_pb2.InspectionReadAllRequest(pageToken="not-a-number"), context)
+    assert context.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+def test_read_one_rpc(benchmark, stub_cursor, serve):
+    stub_cursor.row = INSPECTION_ROW
+    client = serve(InspectionService(), inspection_service_pb2_grpc.add_InspectionServiceServicer_to_server,
+                   inspection_service_pb2_grpc.InspectionServiceStub)
+    inspection = benchmark(client.InspectionReadOne, inspection_service_pb2.InspectionReadOneRequest(inspectionId=42))
+    assert inspection.inspectionId == 42
+
+def test_read_all_rpc(benchmark, stub_cursor, serve):
+    stub_cursor.rows = PAGE_ROWS
+    client = serve(InspectionService(), inspection_service_pb2_grpc.add_InspectionServiceServicer_to_server,
+                   inspection_service_pb2_grpc.InspectionServiceStub)
+    response = benchmark(client.InspectionReadAll, inspection_service_pb2.InspectionReadAllRequest(pageSize=PAGE_SIZE))
+    assert len(response.data) == PAGE_SIZE and response.nextPageToken
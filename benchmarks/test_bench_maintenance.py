@@ -0,0 +1,50 @@
+import grpc
+import pytest
+from datetime import datetime
+from services import maintenance_service_pb2, maintenance_service_pb2_grpc
+from services.maintenance_service_pb2 import Maintenance
+from microservices.maintenance.maintenance import MaintenanceService, maintenance_from_row
+
+pytestmark = pytest.mark.benchmark(group="maintenance")
+
+# The services' DEFAULT_PAGE_SIZE
+PAGE_SIZE = 100
+
+MAINTENANCE_ROW = (42, 7, "MaintenanceTypeEnum_FULL", "MaintenanceStatusEnum_FINISHED", "Brakes making noise",
+                   "Replaced brake pads", 200.0, datetime(2024, 3, 20, 8, 30), datetime(2024, 3, 22, 15, 45))
+PAGE_ROWS = [(maintenance_id, *MAINTENANCE_ROW[1:]) for maintenance_id in range(1, PAGE_SIZE + 2)]
+
+def test_maintenance_from_row(benchmark):
+    maintenance = benchmark(maintenance_from_row, MAINTENANCE_ROW)
+    assert maintenance.maintenanceId == 42
+
+def test_maintenance_page_from_rows(benchmark):
+    records = benchmark(lambda: [maintenance_from_row(row) for row in PAGE_ROWS[:PAGE_SIZE]])
+    assert len(records) == PAGE_SIZE
+
+def test_type_and_status_enum_conversion(benchmark):
+    def convert():
+        return (Maintenance.MaintenanceTypeEnum.Name(Maintenance.MaintenanceTypeEnum.Value("MaintenanceTypeEnum_BASIC")),
+                Maintenance.MaintenanceStatusEnum.Name(Maintenance.MaintenanceStatusEnum.Value("MaintenanceStatusEnum_ONGOING")))
+
+    assert benchmark(convert) == ("MaintenanceTypeEnum_BASIC", "MaintenanceStatusEnum_ONGOING")
+
+def test_read_all_rejects_invalid_request(benchmark, stub_cursor, context):
+    """The checks MaintenanceReadAll runs before the database, on a request that fails them"""
+    service = MaintenanceService()
+    benchmark(service.MaintenanceReadAll, maintenance_service_pb2.MaintenanceReadAllRequest(pageToken="not-a-number"), context)
+    assert context.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+def test_read_one_rpc(benchmark, stub_cursor, serve):
+    stub_cursor.row = MAINTENANCE_ROW
+    client = serve(MaintenanceService(), maintenance_service_pb2_grpc.add_MaintenanceServiceServicer_to_server,
+                   maintenance_service_pb2_grpc.MaintenanceServiceStub)
+    maintenance = benchmark(client.MaintenanceReadOne, maintenance_service_pb2.MaintenanceReadOneRequest(maintenanceId=42))
+    assert maintenance.maintenanceId == 42
+
+def test_read_all_rpc(benchmark, stub_cursor, serve):
+    stub_cursor.rows = PAGE_ROWS
+    client = serve(MaintenanceService(), maintenance_service_pb2_grpc.add_MaintenanceServiceServicer_to_server,
+                   maintenance_service_pb2_grpc.MaintenanceServiceStub)
+    response = benchmark(client.MaintenanceReadAll, maintenance_service_pb2.MaintenanceReadAllRequest(pageSize=PAGE_SIZE))
+    assert len(response.data) == PAGE_SIZE and response.nextPageToken
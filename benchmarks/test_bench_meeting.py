@@ -0,0 +1,47 @@
+import grpc
+import pytest
+from datetime import datetime
+from services import meeting_service_pb2, meeting_service_pb2_grpc
+from services.meeting_service_pb2 import Meeting
+from microservices.meeting.meeting import MeetingService, meeting_from_row
+
+pytestmark = pytest.mark.benchmark(group="meeting")
+
+# The services' DEFAULT_PAGE_SIZE
+PAGE_SIZE = 100
+
+MEETING_ROW = (42, 3, datetime(2024, 3, 12, 10, 0), "StatusEnum_SCHEDULED", 30, 2)
+PAGE_ROWS = [(meeting_id, *MEETING_ROW[1:]) for meeting_id in range(1, PAGE_SIZE + 2)]
+
+def test_meeting_from_row(benchmark):
+    meeting = benchmark(meeting_from_row, MEETING_ROW)
+    assert meeting.meetingId == 42 and meeting.staffId == 2
+
+def test_meeting_page_from_rows(benchmark):
+    meetings = benchmark(lambda: [meeting_from_row(row) for row in PAGE_ROWS[:PAGE_SIZE]])
+    assert len(meetings) == PAGE_SIZE
+
+def test_status_enum_conversion(benchmark):
+    status = benchmark(lambda: Meeting.StatusEnum.Name(Meeting.StatusEnum.Value("StatusEnum_COMPLETED")))
+    assert status == "StatusEnum_COMPLETED"
+
+def test_free_slots_rejects_invalid_request(benchmark, stub_cursor, context):
+    """The date range and working hours checks MeetingsFindFreeSlots runs before the database"""
+    service = MeetingService()
+    request = meeting_service_pb2.MeetingsFindFreeSlotsRequest(staffId=2, fromDate="2024-03-20", toDate="2024-03-12")
+    benchmark(service.MeetingsFindFreeSlots, request, context)
+    assert context.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+def test_read_one_rpc(benchmark, stub_cursor, serve):
+    stub_cursor.row = MEETING_ROW
+    client = serve(MeetingService(), meeting_service_pb2_grpc.add_MeetingServiceServicer_to_server,
+                   meeting_service_pb2_grpc.MeetingServiceStub)
+    meeting = benchmark(client.MeetingsReadOne, meeting_service_pb2.MeetingsReadOneRequest(meetingId=42))
+    assert meeting.meetingId == 42
+
+def test_read_all_rpc(benchmark, stub_cursor, serve):
+    stub_cursor.rows = PAGE_ROWS
+    client = serve(MeetingService(), meeting_service_pb2_grpc.add_MeetingServiceServicer_to_server,
+                   meeting_service_pb2_grpc.MeetingServiceStub)
+    response = benchmark(client.MeetingsReadAll, meeting_service_pb2.MeetingsReadAllRequest(pageSize=PAGE_SIZE))
+    assert len(response.data) == PAGE_SIZE and response.nextPageToken
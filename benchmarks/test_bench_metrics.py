@@ -0,0 +1,47 @@
+import grpc
+import pytest
+from collections import namedtuple
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+from services import car_service_pb2
+from microservices.common.metrics import ServerMetricsInterceptor
+
+pytestmark = pytest.mark.benchmark(group="metrics")
+
+# Per-call cost of the RPC metrics alone, around a method that does nothing: the label lookups every servicer method
+# used to do by hand against the interceptor's pre-bound children
+REGISTRY = CollectorRegistry()
+INTERCEPTOR = ServerMetricsInterceptor("bench_interceptor", registry=REGISTRY)
+REQUEST_COUNT = Counter('bench_request_count', 'Total number of requests by endpoint', ['endpoint', 'status'], registry=REGISTRY)
+REQUEST_LATENCY = Histogram('bench_request_latency_seconds', 'Request latency in seconds', ['endpoint'], registry=REGISTRY)
+ACTIVE_REQUESTS = Gauge('bench_active_requests', 'Number of active requests', ['endpoint'], registry=REGISTRY)
+
+REQUEST = car_service_pb2.CarsReadOneRequest(carId=42)
+RESPONSE = car_service_pb2.Car(carId=42)
+
+HandlerCallDetails = namedtuple("HandlerCallDetails", ["method", "invocation_metadata"])
+
+def read_one(request, context):
+    return RESPONSE
+
+def hand_rolled_read_one(request, context):
+    ACTIVE_REQUESTS.labels(endpoint='CarsReadOne').inc()
+    try:
+        with REQUEST_LATENCY.labels(endpoint='CarsReadOne').time():
+            response = read_one(request, context)
+            REQUEST_COUNT.labels(endpoint='CarsReadOne', status='success').inc()
+            return response
+    finally:
+        ACTIVE_REQUESTS.labels(endpoint='CarsReadOne').dec()
+
+def test_hand_rolled_metrics(benchmark, context):
+    assert benchmark(hand_rolled_read_one, REQUEST, context) is RESPONSE
+
+def test_interceptor_metrics(benchmark, context):
+    handler = INTERCEPTOR.intercept_service(
+        lambda details: grpc.unary_unary_rpc_method_handler(read_one),
+        HandlerCallDetails("/car.CarService/CarsReadOne", ()),
+    )
+    assert benchmark(handler.unary_unary, REQUEST, context) is RESPONSE
+    assert REGISTRY.get_sample_value(
+        "bench_interceptor_request_count_total", {"endpoint": "CarsReadOne", "status": "success"}
+    ) > 0
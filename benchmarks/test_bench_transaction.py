@@ -0,0 +1,56 @@
+import grpc
+import pytest
+from datetime import datetime
+from google.protobuf.field_mask_pb2 import FieldMask
+from services import transaction_service_pb2, transaction_service_pb2_grpc
+from services.transaction_service_pb2 import Transaction
+from microservices.transaction.transaction import TransactionService, transaction_from_row, read_mask_fields
+
+pytestmark = pytest.mark.benchmark(group="transaction")
+
+# The services' DEFAULT_PAGE_SIZE
+PAGE_SIZE = 100
+
+TRANSACTION_ROW = (42, 3, 7, "TypeEnum_RENT", 480.0, "StatusEnum_COMPLETED", datetime(2024, 3, 15, 9, 0),
+                   datetime(2024, 3, 22, 9, 0), 1)
+PAGE_ROWS = [(transaction_id, *TRANSACTION_ROW[1:]) for transaction_id in range(1, PAGE_SIZE + 2)]
+
+def test_transaction_from_row(benchmark):
+    transaction = benchmark(transaction_from_row, TRANSACTION_ROW)
+    assert transaction.transactionId == 42 and transaction.endDate == "2024-03-22T09:00:00"
+
+def test_transaction_page_from_rows(benchmark):
+    transactions = benchmark(lambda: [transaction_from_row(row) for row in PAGE_ROWS[:PAGE_SIZE]])
+    assert len(transactions) == PAGE_SIZE
+
+def test_type_and_status_enum_conversion(benchmark):
+    def convert():
+        return (Transaction.TypeEnum.Name(Transaction.TypeEnum.Value("TypeEnum_RENT")),
+                Transaction.StatusEnum.Name(Transaction.StatusEnum.Value("StatusEnum_PENDING")))
+
+    assert benchmark(convert) == ("TypeEnum_RENT", "StatusEnum_PENDING")
+
+def test_read_all_rejects_invalid_request(benchmark, stub_cursor, context):
+    """The checks TransactionsReadAll runs before the database, on a request that fails them"""
+    service = TransactionService()
+    request = transaction_service_pb2.TransactionsReadAllRequest(pageToken="not-a-number", readMask=FieldMask(paths=["status"]))
+    benchmark(service.TransactionsReadAll, request, context)
+    assert context.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+def test_read_mask_fields(benchmark):
+    fields = benchmark(read_mask_fields, FieldMask(paths=["carId", "totalAmount", "transactionDate"]))
+    assert fields == ("transactionId", "carId", "totalAmount", "transactionDate", "version")
+
+def test_read_one_rpc(benchmark, stub_cursor, serve):
+    stub_cursor.row = TRANSACTION_ROW
+    client = serve(TransactionService(), transaction_service_pb2_grpc.add_TransactionServiceServicer_to_server,
+                   transaction_service_pb2_grpc.TransactionServiceStub)
+    transaction = benchmark(client.TransactionsReadOne, transaction_service_pb2.TransactionsReadOneRequest(transactionId=42))
+    assert transaction.transactionId == 42
+
+def test_read_all_rpc(benchmark, stub_cursor, serve):
+    stub_cursor.rows = PAGE_ROWS
+    client = serve(TransactionService(), transaction_service_pb2_grpc.add_TransactionServiceServicer_to_server,
+                   transaction_service_pb2_grpc.TransactionServiceStub)
+    response = benchmark(client.TransactionsReadAll, transaction_service_pb2.TransactionsReadAllRequest(pageSize=PAGE_SIZE))
+    assert len(response.data) == PAGE_SIZE and response.nextPageToken
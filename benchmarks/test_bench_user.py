@@ -0,0 +1,38 @@
+import grpc
+import pytest
+from services import user_service_pb2, user_service_pb2_grpc
+from microservices.user.user import UserService, user_from_row
+
+pytestmark = pytest.mark.benchmark(group="user")
+
+# The services' DEFAULT_PAGE_SIZE
+PAGE_SIZE = 100
+
+USER_ROW = (42, "Maria", "Silva", "maria.silva.42@example.com")
+PAGE_ROWS = [(user_id, *USER_ROW[1:]) for user_id in range(1, PAGE_SIZE + 2)]
+
+def test_user_from_row(benchmark):
+    user = benchmark(user_from_row, USER_ROW)
+    assert user.userId == 42
+
+def test_user_page_from_rows(benchmark):
+    users = benchmark(lambda: [user_from_row(row) for row in PAGE_ROWS[:PAGE_SIZE]])
+    assert len(users) == PAGE_SIZE
+
+def test_read_all_rejects_invalid_request(benchmark, stub_cursor, context):
+    """The checks UsersReadAll runs before the database, on a request that fails them"""
+    service = UserService()
+    benchmark(service.UsersReadAll, user_service_pb2.UsersReadAllRequest(pageToken="not-a-number"), context)
+    assert context.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+def test_read_one_rpc(benchmark, stub_cursor, serve):
+    stub_cursor.row = USER_ROW
+    client = serve(UserService(), user_service_pb2_grpc.add_UserServiceServicer_to_server, user_service_pb2_grpc.UserServiceStub)
+    user = benchmark(client.UsersReadOne, user_service_pb2.UsersReadOneRequest(userId=42))
+    assert user.userId == 42
+
+def test_read_all_rpc(benchmark, stub_cursor, serve):
+    stub_cursor.rows = PAGE_ROWS
+    client = serve(UserService(), user_service_pb2_grpc.add_UserServiceServicer_to_server, user_service_pb2_grpc.UserServiceStub)
+    response = benchmark(client.UsersReadAll, user_service_pb2.UsersReadAllRequest(pageSize=PAGE_SIZE))
+    assert len(response.data) == PAGE_SIZE and response.nextPageToken
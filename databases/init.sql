@@ -13,7 +13,9 @@ CREATE TABLE car (
     car_drive VARCHAR(50),
     car_size VARCHAR(50),
     car_type VARCHAR(50),
-    car_paint_color VARCHAR(50)
+    car_paint_color VARCHAR(50),
+    -- Bumped on every update; writers pass the version they read and lose if it has moved on
+    version INT NOT NULL DEFAULT 1
 );
 
 CREATE TABLE users (
@@ -23,12 +25,23 @@ CREATE TABLE users (
     email VARCHAR(255) UNIQUE NOT NULL
 );
 
+-- Needed to mix equality on staff_id with range overlap in one GiST exclusion constraint
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
 CREATE TABLE meeting (
     meeting_id SERIAL PRIMARY KEY,
     client_id INT NOT NULL,
     schedule_date TIMESTAMP NOT NULL,
     meeting_status VARCHAR(60) CHECK (meeting_status IN ('StatusEnum_SCHEDULED', 'StatusEnum_COMPLETED', 'StatusEnum_CANCELED')) NOT NULL,
-    FOREIGN KEY (client_id) REFERENCES users(user_id) ON DELETE CASCADE
+    duration_minutes INT NOT NULL DEFAULT 60 CHECK (duration_minutes > 0),
+    staff_id INT,
+    FOREIGN KEY (client_id) REFERENCES users(user_id) ON DELETE CASCADE,
+    FOREIGN KEY (staff_id) REFERENCES users(user_id) ON DELETE SET NULL,
+    -- A staff member can't be booked into two overlapping scheduled meetings
+    CONSTRAINT meeting_staff_no_overlap EXCLUDE USING gist (
+        staff_id WITH =,
+        tsrange(schedule_date, schedule_date + duration_minutes * INTERVAL '1 minute') WITH &&
+    ) WHERE (meeting_status = 'StatusEnum_SCHEDULED')
 );
 
 
@@ -67,12 +80,70 @@ CREATE TABLE car_listing (
     listing_sale_price DOUBLE PRECISION NOT NULL,
     listing_promoted BOOLEAN NOT NULL,
     listing_status VARCHAR(60) CHECK (listing_status IN ('StatusEnum_AVAILABLE', 'StatusEnum_RESERVED', 'StatusEnum_SOLD')) NOT NULL,
+    version INT NOT NULL DEFAULT 1,
     FOREIGN KEY (listing_car_id) REFERENCES car(car_id) ON DELETE CASCADE,
     FOREIGN KEY (listing_user_id) REFERENCES users(user_id) ON DELETE CASCADE
 );
 
+-- Sales waiting to become transactions, written by a trigger in the same DB transaction that marks a listing SOLD.
+-- The car listing service dispatches them in the background and sends idempotency_key with each attempt.
+CREATE TABLE listing_sale_outbox (
+    outbox_id BIGSERIAL PRIMARY KEY,
+    listing_id INT NOT NULL,
+    idempotency_key UUID NOT NULL UNIQUE DEFAULT gen_random_uuid(),
+    buyer_id INT NOT NULL,
+    car_id INT NOT NULL,
+    transaction_type VARCHAR(60) NOT NULL,
+    total_amount DOUBLE PRECISION NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT now(),
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT now(),
+    last_error TEXT,
+    dispatched_at TIMESTAMP,
+    transaction_id INT,
+    -- W3C traceparent of the traced request that sold the listing, so the dispatch shows up in the same trace
+    traceparent TEXT
+);
+
+CREATE INDEX listing_sale_outbox_pending ON listing_sale_outbox (next_attempt_at) WHERE dispatched_at IS NULL;
+
+-- Sees the status before and after the update, so concurrent writers can't both record (or both miss) the sale
+CREATE OR REPLACE FUNCTION car_listing_sale_outbox_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO listing_sale_outbox (listing_id, buyer_id, car_id, transaction_type, total_amount, traceparent)
+    VALUES (NEW.listing_id, NEW.listing_user_id, NEW.listing_car_id, NEW.listing_type, NEW.listing_sale_price,
+            NULLIF(current_setting('app.traceparent', true), ''));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER car_listing_sale_outbox AFTER UPDATE OF listing_status ON car_listing
+    FOR EACH ROW WHEN (OLD.listing_status <> 'StatusEnum_SOLD' AND NEW.listing_status = 'StatusEnum_SOLD')
+    EXECUTE FUNCTION car_listing_sale_outbox_trigger();
+
+-- Status changes are published on the listing_status channel once the updating transaction commits.
+-- Car listing service replicas LISTEN on it and stream the events to the gateways, which push them to browsers.
+CREATE SEQUENCE listing_status_event_id;
+
+CREATE OR REPLACE FUNCTION car_listing_status_notify_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('listing_status', json_build_object(
+        'eventId', nextval('listing_status_event_id'),
+        'listingId', NEW.listing_id,
+        'status', NEW.listing_status,
+        'version', NEW.version
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER car_listing_status_notify AFTER UPDATE OF listing_status ON car_listing
+    FOR EACH ROW WHEN (OLD.listing_status IS DISTINCT FROM NEW.listing_status)
+    EXECUTE FUNCTION car_listing_status_notify_trigger();
+
+-- Partitioned by month of transaction_date; the primary key has to include the partition key
 CREATE TABLE transaction (
-    transaction_id SERIAL PRIMARY KEY,
+    transaction_id SERIAL,
     buyer_id INT NOT NULL,
     car_id INT NOT NULL,
     transaction_type VARCHAR(60) CHECK (transaction_type IN ('TypeEnum_RENT', 'TypeEnum_BUY')) NOT NULL,
@@ -80,9 +151,81 @@ CREATE TABLE transaction (
     transaction_status VARCHAR(60) CHECK (transaction_status IN ('StatusEnum_PENDING', 'StatusEnum_COMPLETED', 'StatusEnum_CANCELED')) NOT NULL,
     transaction_date TIMESTAMP NOT NULL,
     end_date TIMESTAMP,
+    version INT NOT NULL DEFAULT 1,
+    PRIMARY KEY (transaction_id, transaction_date),
     FOREIGN KEY (car_id) REFERENCES car(car_id) ON DELETE CASCADE,
     FOREIGN KEY (buyer_id) REFERENCES users(user_id) ON DELETE CASCADE
-);
+) PARTITION BY RANGE (transaction_date);
+
+-- Catches rows outside the created months so inserts never fail
+CREATE TABLE transaction_default PARTITION OF transaction DEFAULT;
+
+-- Rows are appended roughly in date order, so a BRIN index stays tiny and prunes well
+CREATE INDEX transaction_date_brin ON transaction USING brin (transaction_date);
+
+-- Creates the monthly partitions from from_month up to months_ahead months after the current one. A month whose rows
+-- already landed in transaction_default can't be attached next to them, so the default partition is detached, the
+-- rows moved into the new month and the default reattached, with a warning since such rows mean the months ahead ran out
+CREATE OR REPLACE FUNCTION create_transaction_partitions(from_month DATE, months_ahead INT) RETURNS SETOF TEXT AS $$
+DECLARE
+    month_start DATE := date_trunc('month', from_month);
+    month_end DATE;
+    partition_name TEXT;
+    moved BIGINT;
+BEGIN
+    WHILE month_start <= date_trunc('month', now()) + make_interval(months => months_ahead) LOOP
+        partition_name := 'transaction_' || to_char(month_start, 'YYYY_MM');
+        month_end := (month_start + INTERVAL '1 month')::DATE;
+        IF to_regclass(partition_name) IS NULL THEN
+            IF EXISTS (SELECT 1 FROM transaction_default WHERE transaction_date >= month_start AND transaction_date < month_end) THEN
+                ALTER TABLE transaction DETACH PARTITION transaction_default;
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF transaction FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, month_start, month_end
+                );
+                EXECUTE format(
+                    'WITH moved AS (DELETE FROM transaction_default WHERE transaction_date >= %L AND transaction_date < %L RETURNING *)
+                     INSERT INTO %I SELECT * FROM moved',
+                    month_start, month_end, partition_name
+                );
+                GET DIAGNOSTICS moved = ROW_COUNT;
+                ALTER TABLE transaction ATTACH PARTITION transaction_default DEFAULT;
+                RAISE WARNING 'Moved % transaction rows from transaction_default into %', moved, partition_name;
+            ELSE
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF transaction FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, month_start, month_end
+                );
+            END IF;
+            RETURN NEXT partition_name;
+        END IF;
+        month_start := month_end;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Detaches monthly partitions older than retain_months; they stay behind as plain tables for archiving
+CREATE OR REPLACE FUNCTION detach_old_transaction_partitions(retain_months INT) RETURNS SETOF TEXT AS $$
+DECLARE
+    cutoff DATE := date_trunc('month', now()) - make_interval(months => retain_months);
+    partition_name TEXT;
+BEGIN
+    FOR partition_name IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'transaction'::regclass
+          AND c.relname ~ '^transaction_[0-9]{4}_[0-9]{2}$'
+          AND to_date(substring(c.relname FROM 13), 'YYYY_MM') < cutoff
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('ALTER TABLE transaction DETACH PARTITION %I', partition_name);
+        RETURN NEXT partition_name;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT create_transaction_partitions('2024-01-01', 3);
 
 -- Insert Dummy Users
 INSERT INTO users (first_name, last_name, email) 
@@ -92,8 +235,15 @@ VALUES
     ('Manuel', 'Campos', 'manuel.campos@example.com'),
     ('Taigo', 'Almeida', 'taigo.almeida@example.com');
 
-COPY car FROM '/docker-entrypoint-initdb.d/cars.csv' DELIMITER ',' CSV HEADER;
-COPY car_listing FROM '/docker-entrypoint-initdb.d/listings.csv' DELIMITER ',' CSV HEADER;
+COPY car (car_id, car_year, car_manufacturer, car_model, car_condition, car_cylinders, car_fuel, car_odometer,
+          car_transmission, car_vin, car_drive, car_size, car_type, car_paint_color)
+FROM '/docker-entrypoint-initdb.d/cars.csv' DELIMITER ',' CSV HEADER;
+COPY car_listing (listing_id, listing_car_id, listing_user_id, listing_type, listing_description, listing_posting_date,
+                  listing_sale_price, listing_promoted, listing_status)
+FROM '/docker-entrypoint-initdb.d/listings.csv' DELIMITER ',' CSV HEADER;
+-- COPY with explicit IDs leaves the SERIAL sequences behind; move them past the loaded rows so inserts don't collide
+SELECT setval(pg_get_serial_sequence('car', 'car_id'), COALESCE(MAX(car_id), 0) + 1, false) FROM car;
+SELECT setval(pg_get_serial_sequence('car_listing', 'listing_id'), COALESCE(MAX(listing_id), 0) + 1, false) FROM car_listing;
 
 -- Insert Dummy Maintenance Records
 INSERT INTO maintenance (maintenance_car_id, maintenance_type, maintenance_status, maintenance_client_notes, maintenance_staff_notes, maintenance_cost, maintenance_start_date, maintenance_end_date)
@@ -121,4 +271,199 @@ INSERT INTO meeting (client_id, schedule_date, meeting_status)
 VALUES 
     (1, '2024-03-12 10:00:00', 'StatusEnum_SCHEDULED'),
     (2, '2024-03-14 11:30:00', 'StatusEnum_COMPLETED'),
-    (3, '2024-03-20 15:00:00', 'StatusEnum_CANCELED');
\ No newline at end of file
+    (3, '2024-03-20 15:00:00', 'StatusEnum_CANCELED');
+
+-- Pre-aggregated sales per month, car and transaction type/status backing the report RPCs.
+-- Refreshed concurrently by the transaction reports job, which needs the unique index.
+CREATE MATERIALIZED VIEW transaction_monthly_summary AS
+SELECT
+    date_trunc('month', t.transaction_date)::DATE AS month,
+    t.transaction_type,
+    t.transaction_status,
+    c.car_manufacturer,
+    c.car_model,
+    c.car_year,
+    COUNT(*) AS transaction_count,
+    SUM(t.total_amount) AS total_amount
+FROM transaction t
+JOIN car c ON c.car_id = t.car_id
+GROUP BY 1, 2, 3, 4, 5, 6;
+
+CREATE UNIQUE INDEX transaction_monthly_summary_key ON transaction_monthly_summary
+    (month, transaction_type, transaction_status, car_manufacturer, car_model, car_year);
+
+-- Idempotency keys seen by each service's Create RPC with the response it returned, so a retried
+-- create replays that response instead of inserting again. Services purge keys older than IDEMPOTENCY_TTL.
+CREATE TABLE car_idempotency (
+    idempotency_key VARCHAR(255) PRIMARY KEY,
+    response BYTEA,
+    created_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX car_idempotency_created_at ON car_idempotency (created_at);
+
+CREATE TABLE user_idempotency (
+    idempotency_key VARCHAR(255) PRIMARY KEY,
+    response BYTEA,
+    created_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX user_idempotency_created_at ON user_idempotency (created_at);
+
+CREATE TABLE maintenance_idempotency (
+    idempotency_key VARCHAR(255) PRIMARY KEY,
+    response BYTEA,
+    created_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX maintenance_idempotency_created_at ON maintenance_idempotency (created_at);
+
+CREATE TABLE inspection_idempotency (
+    idempotency_key VARCHAR(255) PRIMARY KEY,
+    response BYTEA,
+    created_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX inspection_idempotency_created_at ON inspection_idempotency (created_at);
+
+CREATE TABLE transaction_idempotency (
+    idempotency_key VARCHAR(255) PRIMARY KEY,
+    response BYTEA,
+    created_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX transaction_idempotency_created_at ON transaction_idempotency (created_at);
+
+CREATE TABLE car_listing_idempotency (
+    idempotency_key VARCHAR(255) PRIMARY KEY,
+    response BYTEA,
+    created_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX car_listing_idempotency_created_at ON car_listing_idempotency (created_at);
+
+CREATE TABLE meeting_idempotency (
+    idempotency_key VARCHAR(255) PRIMARY KEY,
+    response BYTEA,
+    created_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX meeting_idempotency_created_at ON meeting_idempotency (created_at);
+
+-- Summary tables kept up to date by triggers, so dashboard counts read one row per group instead of scanning.
+-- The *_expected views recompute the same aggregates from scratch for the consistency checkers.
+CREATE TABLE listing_stats_by_manufacturer (
+    car_manufacturer VARCHAR(100) NOT NULL,
+    car_type VARCHAR(50) NOT NULL,
+    listing_status VARCHAR(60) NOT NULL,
+    listing_count BIGINT NOT NULL,
+    price_sum NUMERIC NOT NULL,
+    PRIMARY KEY (car_manufacturer, car_type, listing_status)
+);
+
+CREATE VIEW listing_stats_by_manufacturer_expected AS
+SELECT c.car_manufacturer, COALESCE(c.car_type, '') AS car_type, l.listing_status,
+       COUNT(*) AS listing_count, SUM(l.listing_sale_price::NUMERIC) AS price_sum
+FROM car_listing l
+JOIN car c ON c.car_id = l.listing_car_id
+GROUP BY 1, 2, 3;
+
+CREATE TABLE maintenance_open_counts (
+    maintenance_type VARCHAR(60) PRIMARY KEY,
+    open_count BIGINT NOT NULL
+);
+
+CREATE VIEW maintenance_open_counts_expected AS
+SELECT maintenance_type, COUNT(*) AS open_count
+FROM maintenance
+WHERE maintenance_status = 'MaintenanceStatusEnum_ONGOING'
+GROUP BY 1;
+
+INSERT INTO listing_stats_by_manufacturer SELECT * FROM listing_stats_by_manufacturer_expected;
+INSERT INTO maintenance_open_counts SELECT * FROM maintenance_open_counts_expected;
+
+-- Adds sign * (count, price) of listings to a group; groups that drop to zero are kept and filtered on read
+CREATE OR REPLACE FUNCTION listing_stats_add(p_manufacturer VARCHAR, p_car_type VARCHAR, p_status VARCHAR, p_listings BIGINT, p_prices NUMERIC) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO listing_stats_by_manufacturer AS s (car_manufacturer, car_type, listing_status, listing_count, price_sum)
+    VALUES (p_manufacturer, COALESCE(p_car_type, ''), p_status, p_listings, p_prices)
+    ON CONFLICT (car_manufacturer, car_type, listing_status) DO UPDATE
+    SET listing_count = s.listing_count + EXCLUDED.listing_count, price_sum = s.price_sum + EXCLUDED.price_sum;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION car_listing_stats_trigger() RETURNS TRIGGER AS $$
+DECLARE
+    listing_car car%ROWTYPE;
+BEGIN
+    IF TG_OP = 'UPDATE' AND (OLD.listing_car_id, OLD.listing_status, OLD.listing_sale_price)
+                            IS NOT DISTINCT FROM (NEW.listing_car_id, NEW.listing_status, NEW.listing_sale_price) THEN
+        RETURN NULL;
+    END IF;
+    -- A car delete has already taken its cascaded listings out in car_stats_trigger, so a missing car is skipped
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        SELECT * INTO listing_car FROM car WHERE car_id = OLD.listing_car_id;
+        IF FOUND THEN
+            PERFORM listing_stats_add(listing_car.car_manufacturer, listing_car.car_type, OLD.listing_status,
+                                      -1, -OLD.listing_sale_price::NUMERIC);
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        SELECT * INTO listing_car FROM car WHERE car_id = NEW.listing_car_id;
+        PERFORM listing_stats_add(listing_car.car_manufacturer, listing_car.car_type, NEW.listing_status,
+                                  1, NEW.listing_sale_price::NUMERIC);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER car_listing_stats AFTER INSERT OR UPDATE OR DELETE ON car_listing
+    FOR EACH ROW EXECUTE FUNCTION car_listing_stats_trigger();
+
+-- Moves a car's listings between groups when its manufacturer or type changes, and removes them before a delete
+CREATE OR REPLACE FUNCTION car_stats_trigger() RETURNS TRIGGER AS $$
+DECLARE
+    grouped RECORD;
+BEGIN
+    FOR grouped IN
+        SELECT listing_status, COUNT(*) AS listings, SUM(listing_sale_price::NUMERIC) AS prices
+        FROM car_listing WHERE listing_car_id = OLD.car_id GROUP BY listing_status
+    LOOP
+        PERFORM listing_stats_add(OLD.car_manufacturer, OLD.car_type, grouped.listing_status, -grouped.listings, -grouped.prices);
+        IF TG_OP = 'UPDATE' THEN
+            PERFORM listing_stats_add(NEW.car_manufacturer, NEW.car_type, grouped.listing_status, grouped.listings, grouped.prices);
+        END IF;
+    END LOOP;
+    RETURN CASE WHEN TG_OP = 'DELETE' THEN OLD ELSE NEW END;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER car_stats_update AFTER UPDATE OF car_manufacturer, car_type ON car
+    FOR EACH ROW WHEN ((OLD.car_manufacturer, OLD.car_type) IS DISTINCT FROM (NEW.car_manufacturer, NEW.car_type))
+    EXECUTE FUNCTION car_stats_trigger();
+
+CREATE TRIGGER car_stats_delete BEFORE DELETE ON car
+    FOR EACH ROW EXECUTE FUNCTION car_stats_trigger();
+
+CREATE OR REPLACE FUNCTION maintenance_open_counts_trigger() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.maintenance_status = 'MaintenanceStatusEnum_ONGOING' THEN
+        UPDATE maintenance_open_counts SET open_count = open_count - 1 WHERE maintenance_type = OLD.maintenance_type;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.maintenance_status = 'MaintenanceStatusEnum_ONGOING' THEN
+        INSERT INTO maintenance_open_counts AS m (maintenance_type, open_count) VALUES (NEW.maintenance_type, 1)
+        ON CONFLICT (maintenance_type) DO UPDATE SET open_count = m.open_count + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER maintenance_open_counts_sync AFTER INSERT OR UPDATE OF maintenance_type, maintenance_status OR DELETE ON maintenance
+    FOR EACH ROW EXECUTE FUNCTION maintenance_open_counts_trigger();
+
+-- Keyset indexes for the sortable cars and car listings pages: each page is a range scan starting after the cursor
+CREATE INDEX car_year_id ON car (car_year, car_id);
+CREATE INDEX car_manufacturer_id ON car (car_manufacturer, car_id);
+CREATE INDEX car_model_id ON car (car_model, car_id);
+CREATE INDEX car_listing_posting_date_id ON car_listing (listing_posting_date, listing_id);
+CREATE INDEX car_listing_sale_price_id ON car_listing (listing_sale_price, listing_id);
@@ -1,32 +1,30 @@
-from locust import HttpUser, task, between
-from test_search import TestSearch
-from test_companies import TestCompanies
-from test_companies_specialties import TestCompaniesSpecialties
-from test_job_postings_company import TestJobPostingsCompany
+"""
+Dealership load test: anonymous browsing, buyers booking viewings, sales recording sales and admin CRUD, weighted
+roughly like real traffic. Run against a gateway started with the load-test key set (see tokens.py):
 
-class MasterUser(HttpUser):
-    wait_time = between(1, 3)
-    
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    locust -f locust_tests/master_test.py --host http://localhost:50000 --headless -u 200 -r 20 -t 5m
 
-        self.search_test = TestSearch(self.environment)
-        self.companies_test = TestCompanies(self.environment)
-        self.companies_specialties_test = TestCompaniesSpecialties(self.environment)
-        self.job_postings_test = TestJobPostingsCompany(self.environment)
+The run exits non-zero if any scenario misses its p95 or failure-ratio objective in slo.py.
+"""
+import os
 
-    @task
-    def run_search_test(self):
-        self.search_test.test_search()
+from locust import events
+from locust.runners import MasterRunner, LocalRunner
 
-    @task
-    def run_companies_test(self):
-        self.companies_test.get_companies()
+from scenarios import BrowsingUser, BuyerUser, SalesUser, AdminUser
+from seed import seed
+from slo import check_slos
 
-    @task
-    def run_companies_specialties_test(self):
-        self.companies_specialties_test.get_companies_specialities()
+@events.test_start.add_listener
+def seed_data(environment, **kwargs):
+    """Loads the IDs the scenarios use; a local run also creates missing data, distributed workers only read it"""
+    if isinstance(environment.runner, MasterRunner):
+        return
+    create = isinstance(environment.runner, LocalRunner) and os.getenv("LOADTEST_SEED", "1") == "1"
+    environment.seed_data = seed(environment.host, create=create)
 
-    @task
-    def run_job_postings_test(self):
-        self.job_postings_test.get_job_postings_company() 
\ No newline at end of file
+@events.quitting.add_listener
+def enforce_slos(environment, **kwargs):
+    if not isinstance(environment.runner, (MasterRunner, LocalRunner)):
+        return
+    check_slos(environment)
@@ -0,0 +1,161 @@
+import random
+from datetime import date, datetime, timedelta
+
+from locust import HttpUser, task, between
+
+from seed import random_car, random_listing
+from tokens import mint_token
+
+BROWSE_PAGE_SIZE = 20
+CAR_FIELDS = "carId,year,manufacturer,model,odometer,fuel"
+LISTING_FIELDS = "listingId,carId,type,status,sale_price,posting_date,promoted"
+CAR_ORDERS = ["year", "-year", "manufacturer", "model"]
+LISTING_ORDERS = ["-posting_date", "sale_price", "-sale_price"]
+
+class DealershipUser(HttpUser):
+    """Common setup: a token for the user's role and the IDs seeded at test start"""
+    abstract = True
+    role = None
+    wait_time = between(1, 3)
+
+    def on_start(self):
+        if self.role:
+            self.client.headers["Authorization"] = f"Bearer {mint_token(self.role)}"
+
+    @property
+    def seed(self):
+        return self.environment.seed_data
+
+    def view_listing(self):
+        """Opens a listing page: the listing, then the car it is for"""
+        listing_id = random.choice(self.seed.listings)
+        with self.client.get(f"/api/carlistings/{listing_id}", name="details: GET /api/carlistings/[id]", catch_response=True) as response:
+            # Listings deleted by a concurrent admin are an expected outcome, not an error
+            if response.status_code == 404:
+                response.success()
+                return
+            car_id = response.json().get("carId") if response.ok else None
+        if car_id:
+            self.client.get(f"/api/cars/{car_id}", name="details: GET /api/cars/[id]")
+
+class BrowsingUser(DealershipUser):
+    """Anonymous visitor scrolling the car and listing tables, occasionally opening a listing"""
+    weight = 60
+
+    def browse(self, path, fields, orders, name):
+        params = {"pageSize": BROWSE_PAGE_SIZE, "fields": fields}
+        if orders:
+            params["orderBy"] = random.choice(orders)
+        # Most visitors look at the first page; some scroll a couple more
+        for _ in range(random.choice([1, 1, 1, 2, 3])):
+            response = self.client.get(path, params=params, name=name)
+            if not response.ok or not response.json().get("nextPageToken"):
+                break
+            params["pageToken"] = response.json()["nextPageToken"]
+
+    @task(4)
+    def browse_cars(self):
+        self.browse("/api/cars", CAR_FIELDS, None, "browse: GET /api/cars")
+
+    @task(2)
+    def browse_cars_sorted(self):
+        self.browse("/api/cars", CAR_FIELDS, CAR_ORDERS, "browse: GET /api/cars?orderBy")
+
+    @task(4)
+    def browse_listings(self):
+        self.browse("/api/carlistings", LISTING_FIELDS, None, "browse: GET /api/carlistings")
+
+    @task(2)
+    def browse_listings_sorted(self):
+        self.browse("/api/carlistings", LISTING_FIELDS, LISTING_ORDERS, "browse: GET /api/carlistings?orderBy")
+
+    @task(5)
+    def open_listing(self):
+        self.view_listing()
+
+class BuyerUser(DealershipUser):
+    """Signed-in buyer comparing listings and booking a viewing with a salesperson"""
+    weight = 25
+    role = "buyer"
+
+    @task(3)
+    def open_listing(self):
+        self.view_listing()
+
+    @task(1)
+    def book_meeting(self):
+        staff_id, client_id = random.sample(self.seed.users, 2)
+        start = date.today() + timedelta(days=random.randint(1, 14))
+        response = self.client.get("/api/meetings/free-slots", params={
+            "staffId": staff_id, "from": start.isoformat(), "to": (start + timedelta(days=2)).isoformat(), "slotMinutes": 30
+        }, name="meeting: GET /api/meetings/free-slots")
+        slots = response.json().get("data", []) if response.ok else []
+        if not slots:
+            return
+        with self.client.post("/api/meetings", json={
+            "clientId": client_id,
+            "staffId": staff_id,
+            "scheduleDate": random.choice(slots)["start"],
+            "durationMinutes": 30,
+            "status": "StatusEnum_SCHEDULED",
+        }, name="meeting: POST /api/meetings", catch_response=True) as booking:
+            # Another buyer taking the same slot first is normal contention
+            if booking.status_code == 409:
+                booking.success()
+
+class SalesUser(DealershipUser):
+    """Salesperson listing a car, reserving it for a buyer and then recording the sale"""
+    weight = 10
+    role = "sales"
+
+    @task
+    def sell_car(self):
+        listing = random_listing(random, random.choice(self.seed.cars), random.choice(self.seed.users))
+        response = self.client.post("/api/carlistings", json=listing, name="sell: POST /api/carlistings")
+        if not response.ok:
+            return
+        listing_id = response.json()["listingId"]
+        etag = None
+        for status in ["StatusEnum_RESERVED", "StatusEnum_SOLD"]:
+            headers = {"If-Match": etag} if etag else {}
+            response = self.client.patch(
+                f"/api/carlistings/{listing_id}", json={"status": status}, headers=headers,
+                name="sell: PATCH /api/carlistings/[id]"
+            )
+            if not response.ok:
+                return
+            etag = response.headers.get("ETag")
+
+class AdminUser(DealershipUser):
+    """Back-office staff maintaining the inventory and user accounts and checking the dashboard"""
+    weight = 5
+    role = "admin"
+
+    @task(3)
+    def manage_car(self):
+        response = self.client.post("/api/cars", json=random_car(random), name="admin: POST /api/cars")
+        if not response.ok:
+            return
+        car_id = response.json()["carId"]
+        response = self.client.get(f"/api/cars/{car_id}", name="admin: GET /api/cars/[id]")
+        if not response.ok:
+            return
+        self.client.patch(
+            f"/api/cars/{car_id}", json={"odometer": response.json().get("odometer", 0) + random.randint(10, 500)},
+            headers={"If-Match": response.headers.get("ETag", "")}, name="admin: PATCH /api/cars/[id]"
+        )
+        self.client.delete(f"/api/cars/{car_id}", name="admin: DELETE /api/cars/[id]")
+
+    @task(1)
+    def manage_user(self):
+        response = self.client.post("/api/users", json={
+            "firstName": "Temp",
+            "lastName": "Account",
+            "email": f"temp{random.getrandbits(48)}.{datetime.now().timestamp()}@example.com",
+        }, name="admin: POST /api/users")
+        if response.ok:
+            self.client.delete(f"/api/users/{response.json()['userId']}", name="admin: DELETE /api/users/[id]")
+
+    @task(2)
+    def check_dashboard(self):
+        self.client.get("/api/dashboard/summary", name="admin: GET /api/dashboard/summary")
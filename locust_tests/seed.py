@@ -0,0 +1,117 @@
+import argparse
+import os
+import random
+from datetime import datetime, timedelta
+
+import requests
+
+from tokens import mint_token
+
+# Minimum data the scenarios need; seeding only creates what is missing
+SEED_CARS = int(os.getenv("SEED_CARS", "200"))
+SEED_LISTINGS = int(os.getenv("SEED_LISTINGS", "150"))
+SEED_USERS = int(os.getenv("SEED_USERS", "30"))
+
+# IDs loaded per collection for the scenarios to pick from
+MAX_POOL_SIZE = int(os.getenv("SEED_MAX_POOL_SIZE", "5000"))
+PAGE_SIZE = 500
+
+MODELS = {
+    "Toyota": ["Corolla", "Camry", "RAV4", "Yaris"],
+    "Volkswagen": ["Golf", "Polo", "Passat", "Tiguan"],
+    "Renault": ["Clio", "Megane", "Captur"],
+    "Peugeot": ["208", "308", "3008"],
+    "BMW": ["Series 1", "Series 3", "X1"],
+    "Mercedes-Benz": ["A-Class", "C-Class", "GLA"],
+    "Ford": ["Fiesta", "Focus", "Kuga"],
+}
+
+class SeedData:
+    """IDs of existing rows the scenarios read, book meetings for and update"""
+    def __init__(self, cars, listings, users):
+        self.cars = cars
+        self.listings = listings
+        self.users = users
+
+def load_ids(session, host, path, id_field, params=None):
+    """Pages through a collection, collecting up to MAX_POOL_SIZE IDs"""
+    ids = []
+    page_token = ""
+    while len(ids) < MAX_POOL_SIZE:
+        query = dict(params or {}, pageSize=PAGE_SIZE)
+        if page_token:
+            query["pageToken"] = page_token
+        response = session.get(f"{host}{path}", params=query)
+        response.raise_for_status()
+        page = response.json()
+        ids.extend(int(item[id_field]) for item in page.get("data", []))
+        page_token = page.get("nextPageToken", "")
+        if not page_token:
+            break
+    return ids[:MAX_POOL_SIZE]
+
+def random_car(rng):
+    manufacturer = rng.choice(list(MODELS))
+    return {
+        "year": rng.randint(2005, 2024),
+        "manufacturer": manufacturer,
+        "model": rng.choice(MODELS[manufacturer]),
+        "condition": rng.choice(["new", "like new", "good", "fair"]),
+        "cylinders": rng.choice(["3 cylinders", "4 cylinders", "6 cylinders"]),
+        "fuel": rng.choice(["gas", "diesel", "hybrid", "electric"]),
+        "odometer": rng.randint(0, 250000),
+        "transmission": rng.choice(["manual", "automatic"]),
+        "VIN": "".join(rng.choice("ABCDEFGHJKLMNPRSTUVWXYZ0123456789") for _ in range(17)),
+        "drive": rng.choice(["fwd", "rwd", "4wd"]),
+        "size": rng.choice(["compact", "mid-size", "full-size"]),
+        "type": rng.choice(["sedan", "hatchback", "SUV", "wagon"]),
+        "paint_color": rng.choice(["white", "black", "silver", "red", "blue"]),
+    }
+
+def random_listing(rng, car_id, user_id):
+    return {
+        "carId": car_id,
+        "userId": user_id,
+        "type": rng.choice(["TypeEnum_BUY"] * 4 + ["TypeEnum_RENT"]),
+        "description": "Load test listing",
+        "posting_date": (datetime.now() - timedelta(days=rng.randint(0, 365))).isoformat(timespec="seconds"),
+        "sale_price": round(rng.uniform(3000, 60000), 2),
+        "promoted": rng.random() < 0.1,
+        "status": "StatusEnum_AVAILABLE",
+    }
+
+def seed(host, create=True, seed_value=0):
+    """Loads the IDs the scenarios use, first creating users, cars and listings up to the SEED_* minimums"""
+    rng = random.Random(seed_value)
+    session = requests.Session()
+    session.headers["Authorization"] = f"Bearer {mint_token('admin', 'loadtest|seeder')}"
+
+    users = load_ids(session, host, "/api/users", "userId")
+    cars = load_ids(session, host, "/api/cars", "carId", {"fields": "carId"})
+    listings = load_ids(session, host, "/api/carlistings", "listingId", {"fields": "listingId"})
+    if not create:
+        return SeedData(cars, listings, users)
+
+    for index in range(len(users), SEED_USERS):
+        response = session.post(f"{host}/api/users", json={
+            "firstName": f"Load{index}", "lastName": "Test", "email": f"loadtest{index}.{rng.getrandbits(32)}@example.com"
+        })
+        response.raise_for_status()
+        users.append(int(response.json()["userId"]))
+    for _ in range(len(cars), SEED_CARS):
+        response = session.post(f"{host}/api/cars", json=random_car(rng))
+        response.raise_for_status()
+        cars.append(int(response.json()["carId"]))
+    for _ in range(len(listings), SEED_LISTINGS):
+        response = session.post(f"{host}/api/carlistings", json=random_listing(rng, rng.choice(cars), rng.choice(users)))
+        response.raise_for_status()
+        listings.append(int(response.json()["listingId"]))
+    return SeedData(cars, listings, users)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Creates the users, cars and listings the load test scenarios need")
+    parser.add_argument("--host", default="http://localhost:50000")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    data = seed(args.host, seed_value=args.seed)
+    print(f"{len(data.users)} users, {len(data.cars)} cars, {len(data.listings)} listings")
@@ -0,0 +1,58 @@
+import logging
+import os
+
+# p95 latency objective per request name, in milliseconds. Names are "<scenario>: <route>" so each scenario is held
+# to its own target; SLO_SCALE loosens or tightens all of them at once, e.g. for a slower CI box
+SLO_P95_MS = {
+    "browse: GET /api/cars": 250,
+    "browse: GET /api/cars?orderBy": 300,
+    "browse: GET /api/carlistings": 250,
+    "browse: GET /api/carlistings?orderBy": 300,
+    "details: GET /api/carlistings/[id]": 150,
+    "details: GET /api/cars/[id]": 150,
+    "meeting: GET /api/meetings/free-slots": 300,
+    "meeting: POST /api/meetings": 300,
+    "sell: POST /api/carlistings": 300,
+    "sell: PATCH /api/carlistings/[id]": 300,
+    "admin: POST /api/cars": 300,
+    "admin: GET /api/cars/[id]": 150,
+    "admin: PATCH /api/cars/[id]": 300,
+    "admin: DELETE /api/cars/[id]": 300,
+    "admin: POST /api/users": 300,
+    "admin: DELETE /api/users/[id]": 300,
+    "admin: GET /api/dashboard/summary": 200,
+}
+SLO_SCALE = float(os.getenv("SLO_SCALE", "1"))
+
+# Share of failed requests, per request name, above which the run fails
+SLO_MAX_FAILURE_RATIO = float(os.getenv("SLO_MAX_FAILURE_RATIO", "0.01"))
+
+# Names with fewer requests than this have too few samples for a meaningful p95 and are only reported
+SLO_MIN_REQUESTS = int(os.getenv("SLO_MIN_REQUESTS", "20"))
+
+def slo_violations(stats):
+    """Describes every request name whose p95 or failure ratio is over its objective"""
+    violations = []
+    for entry in stats.entries.values():
+        objective = SLO_P95_MS.get(entry.name)
+        if objective is None or entry.num_requests < SLO_MIN_REQUESTS:
+            continue
+        p95 = entry.get_response_time_percentile(0.95)
+        if p95 > objective * SLO_SCALE:
+            violations.append(f"{entry.name}: p95 {p95:.0f} ms > {objective * SLO_SCALE:.0f} ms")
+        if entry.fail_ratio > SLO_MAX_FAILURE_RATIO:
+            violations.append(f"{entry.name}: {entry.fail_ratio:.1%} failed > {SLO_MAX_FAILURE_RATIO:.1%}")
+    missing = [name for name in SLO_P95_MS if not any(entry.name == name for entry in stats.entries.values())]
+    if missing:
+        logging.warning(f"No requests recorded for: {', '.join(missing)}")
+    return violations
+
+def check_slos(environment):
+    """Sets a non-zero exit code when the run missed an objective, so CI fails on a latency regression"""
+    violations = slo_violations(environment.stats)
+    for violation in violations:
+        logging.error(f"SLO violated: {violation}")
+    if not violations:
+        logging.info("All SLOs met")
+    # Overrides Locust's own rule of failing on any error; occasional errors are judged by SLO_MAX_FAILURE_RATIO instead
+    environment.process_exit_code = 1 if violations else 0
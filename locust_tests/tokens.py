@@ -0,0 +1,80 @@
+import json
+import os
+import time
+import uuid
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwt
+from jose.utils import long_to_base64
+
+# The gateway checks these exactly as it does for Auth0 tokens, so they must match its AUTH0_DOMAIN and AUTH0_AUDIENCE
+AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN", "loadtest.local")
+AUTH0_AUDIENCE = os.getenv("AUTH0_AUDIENCE", "https://standfcool/api")
+
+# Signing key, created on first use. The gateway trusts it when started with AUTH0_JWKS_URL=file://<LOADTEST_JWKS>
+LOADTEST_KEY = os.getenv("LOADTEST_KEY", os.path.join(os.path.dirname(__file__), ".loadtest_key.pem"))
+LOADTEST_JWKS = os.getenv("LOADTEST_JWKS", os.path.join(os.path.dirname(__file__), ".loadtest_jwks.json"))
+KEY_ID = "loadtest"
+
+TOKEN_LIFETIME = 4 * 60 * 60
+
+# Permissions per role, mirroring what the Auth0 roles grant
+ROLE_PERMISSIONS = {
+    "buyer": ["create:meeting"],
+    "sales": ["create:carlisting", "update:carlisting", "create:meeting", "update:meeting"],
+    "admin": [
+        "read:dashboard",
+        "create:car", "update:car", "delete:car",
+        "create:user", "update:user", "delete:user",
+        "create:carlisting", "update:carlisting", "delete:carlisting",
+        "create:meeting", "update:meeting", "delete:meeting",
+        "create:transaction", "update:transaction", "delete:transaction",
+        "create:maintenance", "update:maintenance", "delete:maintenance",
+        "create:inspection", "update:inspection", "delete:inspection",
+    ],
+}
+
+def jwks(private_key):
+    """The public half of private_key as a JSON Web Key Set"""
+    numbers = private_key.public_key().public_numbers()
+    return {"keys": [{
+        "kty": "RSA",
+        "kid": KEY_ID,
+        "use": "sig",
+        "alg": "RS256",
+        "n": long_to_base64(numbers.n).decode(),
+        "e": long_to_base64(numbers.e).decode(),
+    }]}
+
+def signing_key():
+    """Loads the load-test signing key, creating it and its JWKS file the first time"""
+    if not os.path.exists(LOADTEST_KEY):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        with open(LOADTEST_KEY, "wb") as key_file:
+            key_file.write(private_key.private_bytes(
+                serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+            ))
+        with open(LOADTEST_JWKS, "w") as jwks_file:
+            json.dump(jwks(private_key), jwks_file)
+    with open(LOADTEST_KEY, "rb") as key_file:
+        return key_file.read()
+
+def mint_token(role, subject=None):
+    """Bearer token for a user with the given role, signed with the load-test key"""
+    now = int(time.time())
+    claims = {
+        "iss": f"https://{AUTH0_DOMAIN}/",
+        "aud": AUTH0_AUDIENCE,
+        "sub": subject or f"loadtest|{uuid.uuid4().hex}",
+        "iat": now,
+        "exp": now + TOKEN_LIFETIME,
+        "permissions": ROLE_PERMISSIONS[role],
+    }
+    return jwt.encode(claims, signing_key(), algorithm="RS256", headers={"kid": KEY_ID})
+
+if __name__ == "__main__":
+    signing_key()
+    print(f"AUTH0_JWKS_URL=file://{os.path.abspath(LOADTEST_JWKS)}")
+    print(f"AUTH0_DOMAIN={AUTH0_DOMAIN}")
+    print(f"AUTH0_AUDIENCE={AUTH0_AUDIENCE}")
@@ -1,9 +1,17 @@
 import os
+import base64
+import json
 import grpc
 import psycopg2
 from concurrent import futures
 from google.protobuf import empty_pb2
-from prometheus_client import start_http_server, Counter, Summary, Histogram, Gauge
+from prometheus_client import Counter
+
+from microservices.common import profiling, shutdown, tracing
+from microservices.common.metrics import ServerMetricsInterceptor
+from microservices.common.db import QueryMetrics
+from microservices.common.health import DatabaseHealth
+from microservices.common.idempotency import IdempotencyKeyInUse, IdempotencyKeys, idempotency_key_of
 import logging
 
 from services import car_service_pb2
@@ -16,228 +24,374 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 
-# Prometheus metrics
-REQUEST_COUNT = Counter('car_request_count', 'Total number of requests by endpoint', ['endpoint', 'status'])
-REQUEST_LATENCY = Histogram('car_request_latency_seconds', 'Request latency in seconds', ['endpoint'])
-ACTIVE_REQUESTS = Gauge('car_active_requests', 'Number of active requests', ['endpoint'])
-DB_OPERATION_LATENCY = Summary('car_db_operation_latency_seconds', 'Database operation latency', ['operation'])
+# Prometheus port; overridable so several services can share one host
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
+
+# Prometheus metrics; every RPC is recorded by SERVER_METRICS and every statement by QUERY_METRICS
+SERVER_METRICS = ServerMetricsInterceptor('car')
+IDEMPOTENT_REPLAYS = Counter('car_idempotent_replay_count', 'Creates answered with the response stored by an earlier attempt', ['endpoint'])
+ROW_ERRORS = Counter('car_row_error_count', 'Rows a ReadAll skipped because they could not be converted', ['endpoint'])
+QUERY_METRICS = QueryMetrics('car')
+
+# Creates retried with the same idempotency key get the response stored by the first attempt
+IDEMPOTENCY_KEYS = IdempotencyKeys("car_idempotency")
+
+# ReadAll paging limits
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+MAX_RESPONSE_BYTES = int(os.getenv("MAX_RESPONSE_BYTES", str(3 * 1024 * 1024)))
+
+# Fields CarsReadAll can be ordered by; each has a (column, car_id) index so a page is one bounded index range scan
+CAR_ORDER_FIELDS = ("carId", "year", "manufacturer", "model")
+
+# Column behind each Car field; reads select only the fields in the request's readMask
+CAR_FIELDS = {
+    "carId": "car_id",
+    "year": "car_year",
+    "manufacturer": "car_manufacturer",
+    "model": "car_model",
+    "condition": "car_condition",
+    "cylinders": "car_cylinders",
+    "fuel": "car_fuel",
+    "odometer": "car_odometer",
+    "transmission": "car_transmission",
+    "VIN": "car_vin",
+    "drive": "car_drive",
+    "size": "car_size",
+    "type": "car_type",
+    "paint_color": "car_paint_color",
+    "version": "version",
+}
+CAR_COLUMNS = ", ".join(CAR_FIELDS.values())
+
+# Car fields CarsPatch may change, with their column and how to read the value from the message
+CAR_PATCH_COLUMNS = {
+    "year": ("car_year", lambda car: car.year),
+    "manufacturer": ("car_manufacturer", lambda car: car.manufacturer),
+    "model": ("car_model", lambda car: car.model),
+    "condition": ("car_condition", lambda car: car.condition),
+    "cylinders": ("car_cylinders", lambda car: car.cylinders),
+    "fuel": ("car_fuel", lambda car: car.fuel),
+    "odometer": ("car_odometer", lambda car: car.odometer),
+    "transmission": ("car_transmission", lambda car: car.transmission),
+    "VIN": ("car_vin", lambda car: car.VIN),
+    "drive": ("car_drive", lambda car: car.drive),
+    "size": ("car_size", lambda car: car.size),
+    "type": ("car_type", lambda car: car.type),
+    "paint_color": ("car_paint_color", lambda car: car.paint_color),
+}
+
+def car_from_row(car, fields=tuple(CAR_FIELDS)):
+    """Maps a row selected with the columns of `fields` to a Car, leaving the other fields unset"""
+    return Car(**dict(zip(fields, car)))
+
+def read_mask_fields(read_mask):
+    """Car fields to select for a readMask, in column order; None when the mask names an unknown field"""
+    paths = set(read_mask.paths)
+    if not paths:
+        return tuple(CAR_FIELDS)
+    if not paths <= CAR_FIELDS.keys():
+        return None
+    return tuple(field for field in CAR_FIELDS if field in paths or field in ("carId", "version"))
+
+def encode_page_token(order_by, value, car_id):
+    """Opaque keyset cursor holding the sort value and ID of the last car returned"""
+    return base64.urlsafe_b64encode(json.dumps([order_by, value, car_id], default=str).encode()).decode()
+
+def decode_page_token(page_token, order_by):
+    """Keyset values the next page starts after, () for the first page; None if invalid or issued for another orderBy"""
+    if not page_token:
+        return ()
+    try:
+        token_order_by, value, car_id = json.loads(base64.urlsafe_b64decode(page_token))
+    except (ValueError, TypeError):
+        return None
+    if token_order_by != order_by:
+        return None
+    return (car_id,) if (order_by.removeprefix("-") or "carId") == "carId" else (value, car_id)
 
 class CarService(car_service_pb2_grpc.CarServiceServicer):
     def __init__(self):
         self.conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT
+            dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT, cursor_factory=QUERY_METRICS.cursor_factory
         )
         self.cursor = self.conn.cursor()
 
     def CarsCreate(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='CarsCreate').inc()
-        
+        idempotency_key = idempotency_key_of(context)
         try:
-            with REQUEST_LATENCY.labels(endpoint='CarsCreate').time():
-                with DB_OPERATION_LATENCY.labels(operation='insert').time():
-                    self.cursor.execute("SELECT setval('car_car_id_seq', (SELECT MAX(car_id) FROM car) + 1);")
-                    self.cursor.execute(
-                        """
-                        INSERT INTO car (
-                            car_year, car_manufacturer, car_model, car_condition, car_cylinders, 
-                            car_fuel, car_odometer, car_transmission, car_vin, car_drive, 
-                            car_size, car_type, car_paint_color
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING car_id
-                        """,
-                        (
-                            request.car.year, request.car.manufacturer, request.car.model,
-                            request.car.condition, request.car.cylinders, request.car.fuel,
-                            request.car.odometer, request.car.transmission, request.car.VIN,
-                            request.car.drive, request.car.size, request.car.type, request.car.paint_color
-                        ),
-                    )
-                    car_id = self.cursor.fetchone()[0]
+            if idempotency_key:
+                replayed = IDEMPOTENCY_KEYS.claim(self.cursor, idempotency_key, Car)
+                if replayed:
                     self.conn.commit()
-                
-                REQUEST_COUNT.labels(endpoint='CarsCreate', status='success').inc()
-                return Car(
-                    carId=car_id,
-                    year=request.car.year,
-                    manufacturer=request.car.manufacturer,
-                    model=request.car.model,
-                    condition=request.car.condition,
-                    cylinders=request.car.cylinders,
-                    fuel=request.car.fuel,
-                    odometer=request.car.odometer,
-                    transmission=request.car.transmission,
-                    VIN=request.car.VIN,
-                    drive=request.car.drive,
-                    size=request.car.size,
-                    type=request.car.type,
-                    paint_color=request.car.paint_color,
-                )
+                    IDEMPOTENT_REPLAYS.labels(endpoint='CarsCreate').inc()
+                    return replayed
+            
+            self.cursor.execute("SELECT setval('car_car_id_seq', (SELECT MAX(car_id) FROM car) + 1);")
+            self.cursor.execute(
+                """
+                INSERT INTO car (
+                    car_year, car_manufacturer, car_model, car_condition, car_cylinders, 
+                    car_fuel, car_odometer, car_transmission, car_vin, car_drive, 
+                    car_size, car_type, car_paint_color
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING car_id
+                """,
+                (
+                    request.car.year, request.car.manufacturer, request.car.model,
+                    request.car.condition, request.car.cylinders, request.car.fuel,
+                    request.car.odometer, request.car.transmission, request.car.VIN,
+                    request.car.drive, request.car.size, request.car.type, request.car.paint_color
+                ),
+            )
+            car_id = self.cursor.fetchone()[0]
+        
+            response = Car(
+                carId=car_id,
+                year=request.car.year,
+                manufacturer=request.car.manufacturer,
+                model=request.car.model,
+                condition=request.car.condition,
+                cylinders=request.car.cylinders,
+                fuel=request.car.fuel,
+                odometer=request.car.odometer,
+                transmission=request.car.transmission,
+                VIN=request.car.VIN,
+                drive=request.car.drive,
+                size=request.car.size,
+                type=request.car.type,
+                paint_color=request.car.paint_color,
+            )
+            if idempotency_key:
+                IDEMPOTENCY_KEYS.store(self.cursor, idempotency_key, response)
+            self.conn.commit()
+            
+            return response
+        except IdempotencyKeyInUse as e:
+            # The open transaction is the one holding the key, so it is left for that request to commit
+            context.set_details(str(e))
+            context.set_code(grpc.StatusCode.ABORTED)
+            return Car()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='CarsCreate', status='error').inc()
             return Car()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='CarsCreate').dec()
 
     def CarsReadOne(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='CarsReadOne').inc()
+        fields = read_mask_fields(request.readMask)
+        if fields is None:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"readMask may only name: {', '.join(CAR_FIELDS)}")
+            return Car()
         
         try:
-            with REQUEST_LATENCY.labels(endpoint='CarsReadOne').time():
-                with DB_OPERATION_LATENCY.labels(operation='select').time():
-                    self.cursor.execute(
-                        "SELECT * FROM car WHERE car_id = %s", (request.carId,)
-                    )
-                    car = self.cursor.fetchone()
-                
-                if car:
-                    REQUEST_COUNT.labels(endpoint='CarsReadOne', status='success').inc()
-                    return Car(
-                        carId=car[0], year=car[1], manufacturer=car[2], model=car[3],
-                        condition=car[4], cylinders=car[5], fuel=car[6], odometer=car[7],
-                        transmission=car[8], VIN=car[9], drive=car[10], size=car[11],
-                        type=car[12], paint_color=car[13]
-                    )
-                else:
-                    context.set_code(grpc.StatusCode.NOT_FOUND)
-                    context.set_details(f"Car with ID {request.carId} not found.")
-                    REQUEST_COUNT.labels(endpoint='CarsReadOne', status='not_found').inc()
-                    return Car()
-                
+            self.cursor.execute(
+                f"SELECT {', '.join(CAR_FIELDS[field] for field in fields)} FROM car WHERE car_id = %s",
+                (request.carId,)
+            )
+            car = self.cursor.fetchone()
+        
+            if car:
+                return car_from_row(car, fields)
+            else:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f"Car with ID {request.carId} not found.")
+                return Car()
+            
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='CarsReadOne', status='error').inc()
             return Car()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='CarsReadOne').dec()
 
     def CarsReadAll(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='CarsReadAll').inc()
+        page_size = min(request.pageSize or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        order_field = request.orderBy.removeprefix("-") or "carId"
+        after = decode_page_token(request.pageToken, request.orderBy)
+        fields = read_mask_fields(request.readMask)
+        if page_size < 1 or order_field not in CAR_ORDER_FIELDS or after is None or fields is None:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details("Invalid pageSize, pageToken, orderBy or readMask")
+            return car_service_pb2.CarsReadAllResponse()
+        
+        # The sort value goes into the next page token, so it is selected even when the mask leaves it out
+        fields = tuple(field for field in CAR_FIELDS if field in fields or field == order_field)
+        keys = ["car_id"] if order_field == "carId" else [CAR_FIELDS[order_field], "car_id"]
+        direction, comparison = ("DESC", "<") if request.orderBy.startswith("-") else ("ASC", ">")
+        # Only the masked columns are read and sent, e.g. fields=carId,manufacturer,model,year for list views
+        query = f"SELECT {', '.join(CAR_FIELDS[field] for field in fields)} FROM car"
+        if after:
+            query += f" WHERE ({', '.join(keys)}) {comparison} ({', '.join(['%s'] * len(keys))})"
+        query += f" ORDER BY {', '.join(f'{key} {direction}' for key in keys)} LIMIT %s"
         
         try:
-            with REQUEST_LATENCY.labels(endpoint='CarsReadAll').time():
-                with DB_OPERATION_LATENCY.labels(operation='select_all').time():
-                    self.cursor.execute("SELECT * FROM car LIMIT 1000")
-                    rows = self.cursor.fetchall()
-
-                cars = []
-                for row in rows:
-                    logging.info(f"Row data: {row}, Types: {[type(value) for value in row]}")
-                    try:
-                        car = Car(
-                            carId=int(row[0]), year=int(row[1]), manufacturer=row[2], model=row[3],
-                            condition=row[4], cylinders=row[5], fuel=row[6], odometer=int(row[7]),
-                            transmission=row[8], VIN=row[9], drive=row[10], size=row[11],
-                            type=row[12], paint_color=row[13]
-                        )
-                        cars.append(car)
-                    except Exception as e:
-                        logging.error(f"Error processing row {row}: {e}")
-                        REQUEST_COUNT.labels(endpoint='CarsReadAll', status='row_error').inc()
-                
-                REQUEST_COUNT.labels(endpoint='CarsReadAll', status='success').inc()
-                return car_service_pb2.CarsReadAllResponse(data=cars)
+            # Fetch one extra row to know whether another page exists
+            self.cursor.execute(query, (*after, page_size + 1))
+            rows = self.cursor.fetchall()
+
+            cars = []
+            response_bytes = 0
+            stopped_early = False
+            last_row = None
+            for row in rows[:page_size]:
+                logging.info(f"Row data: {row}, Types: {[type(value) for value in row]}")
+                try:
+                    car = car_from_row(row, fields)
+                    # Stop early once the response would exceed the byte budget
+                    response_bytes += car.ByteSize()
+                    if cars and response_bytes > MAX_RESPONSE_BYTES:
+                        stopped_early = True
+                        break
+                    cars.append(car)
+                except Exception as e:
+                    logging.error(f"Error processing row {row}: {e}")
+                    ROW_ERRORS.labels(endpoint='CarsReadAll').inc()
+                last_row = row
+            
+            next_page_token = ""
+            if last_row and (stopped_early or len(rows) > page_size):
+                next_page_token = encode_page_token(request.orderBy, last_row[fields.index(order_field)], last_row[0])
+            
+            return car_service_pb2.CarsReadAllResponse(data=cars, nextPageToken=next_page_token)
         except Exception as e:
             logging.error(f"Error in CarsReadAll: {e}")
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='CarsReadAll', status='error').inc()
             return car_service_pb2.CarsReadAllResponse()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='CarsReadAll').dec()
 
     def CarsUpdate(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='CarsUpdate').inc()
-        
         if (request.carId != request.car.carId):
             context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
             context.set_details("carId in path and body do not match")
-            REQUEST_COUNT.labels(endpoint='CarsUpdate', status='invalid_argument').inc()
-            ACTIVE_REQUESTS.labels(endpoint='CarsUpdate').dec()
             return Car()
         
         try:
-            with REQUEST_LATENCY.labels(endpoint='CarsUpdate').time():
-                with DB_OPERATION_LATENCY.labels(operation='update').time():
-                    self.cursor.execute(
-                        """
-                        UPDATE car SET 
-                            car_year = %s, car_manufacturer = %s, car_model = %s, car_condition = %s, 
-                            car_cylinders = %s, car_fuel = %s, car_odometer = %s, car_transmission = %s, 
-                            car_vin = %s, car_drive = %s, car_size = %s, car_type = %s, car_paint_color = %s
-                        WHERE car_id = %s RETURNING car_id
-                        """,
-                        (
-                            request.car.year, request.car.manufacturer, request.car.model,
-                            request.car.condition, request.car.cylinders, request.car.fuel,
-                            request.car.odometer, request.car.transmission, request.car.VIN,
-                            request.car.drive, request.car.size, request.car.type,
-                            request.car.paint_color, request.carId
-                        ),
-                    )
-                    updated_car_id = self.cursor.fetchone()
-                
-                if updated_car_id:
-                    self.conn.commit()
-                    REQUEST_COUNT.labels(endpoint='CarsUpdate', status='success').inc()
-                    return request.car
-                else:
-                    context.set_code(grpc.StatusCode.NOT_FOUND)
-                    context.set_details(f"Car with ID {request.carId} not found.")
-                    REQUEST_COUNT.labels(endpoint='CarsUpdate', status='not_found').inc()
-                    return Car()
-                
+            # Optimistic concurrency: only the writer holding the current version wins, no row lock is held
+            self.cursor.execute(
+                """
+                UPDATE car SET 
+                    car_year = %s, car_manufacturer = %s, car_model = %s, car_condition = %s, 
+                    car_cylinders = %s, car_fuel = %s, car_odometer = %s, car_transmission = %s, 
+                    car_vin = %s, car_drive = %s, car_size = %s, car_type = %s, car_paint_color = %s,
+                    version = version + 1
+                WHERE car_id = %s AND (%s = 0 OR version = %s) RETURNING version
+                """,
+                (
+                    request.car.year, request.car.manufacturer, request.car.model,
+                    request.car.condition, request.car.cylinders, request.car.fuel,
+                    request.car.odometer, request.car.transmission, request.car.VIN,
+                    request.car.drive, request.car.size, request.car.type,
+                    request.car.paint_color, request.carId,
+                    request.expectedVersion, request.expectedVersion
+                ),
+            )
+            updated_version = self.cursor.fetchone()
+        
+            if updated_version:
+                self.conn.commit()
+                response = Car()
+                response.CopyFrom(request.car)
+                response.version = updated_version[0]
+                return response
+            
+            self.cursor.execute("SELECT 1 FROM car WHERE car_id = %s", (request.carId,))
+            if self.cursor.fetchone():
+                context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+                context.set_details(f"Car with ID {request.carId} was modified since version {request.expectedVersion}.")
+            else:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f"Car with ID {request.carId} not found.")
+            return Car()
+            
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='CarsUpdate', status='error').inc()
             return Car()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='CarsUpdate').dec()
 
-    def CarsDelete(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='CarsDelete').inc()
+    def CarsPatch(self, request, context):
+        paths = list(request.updateMask.paths)
+        if not paths or any(path not in CAR_PATCH_COLUMNS for path in paths):
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"updateMask must name one or more of: {', '.join(CAR_PATCH_COLUMNS)}")
+            return Car()
         
+        # Only the masked columns are written, so unchanged indexed columns don't produce new index entries
+        assignments = ", ".join(f"{CAR_PATCH_COLUMNS[path][0]} = %s" for path in paths)
+        params = [CAR_PATCH_COLUMNS[path][1](request.car) for path in paths]
         try:
-            with REQUEST_LATENCY.labels(endpoint='CarsDelete').time():
-                with DB_OPERATION_LATENCY.labels(operation='delete').time():
-                    self.cursor.execute("DELETE FROM car WHERE car_id = %s RETURNING car_id", (request.carId,))
-                    deleted_car_id = self.cursor.fetchone()
-                
-                if deleted_car_id:
-                    self.conn.commit()
-                    REQUEST_COUNT.labels(endpoint='CarsDelete', status='success').inc()
-                    return empty_pb2.Empty()
-                else:
-                    context.set_code(grpc.StatusCode.NOT_FOUND)
-                    context.set_details("Car not found")
-                    REQUEST_COUNT.labels(endpoint='CarsDelete', status='not_found').inc()
-                    return empty_pb2.Empty()
+            self.cursor.execute(
+                f"UPDATE car SET {assignments}, version = version + 1 "
+                f"WHERE car_id = %s AND (%s = 0 OR version = %s) RETURNING {CAR_COLUMNS}",
+                params + [request.carId, request.expectedVersion, request.expectedVersion],
+            )
+            car = self.cursor.fetchone()
+        
+            if car:
+                self.conn.commit()
+                return car_from_row(car)
+            
+            self.cursor.execute("SELECT 1 FROM car WHERE car_id = %s", (request.carId,))
+            if self.cursor.fetchone():
+                context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+                context.set_details(f"Car with ID {request.carId} was modified since version {request.expectedVersion}.")
+            else:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f"Car with ID {request.carId} not found.")
+            return Car()
+        except psycopg2.Error as e:
+            self.conn.rollback()
+            context.set_details(str(e))
+            context.set_code(grpc.StatusCode.INTERNAL)
+            return Car()
+
+    def CarsDelete(self, request, context):
+        try:
+            self.cursor.execute("DELETE FROM car WHERE car_id = %s RETURNING car_id", (request.carId,))
+            deleted_car_id = self.cursor.fetchone()
+        
+            if deleted_car_id:
+                self.conn.commit()
+                return empty_pb2.Empty()
+            else:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details("Car not found")
+                return empty_pb2.Empty()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='CarsDelete', status='error').inc()
             return empty_pb2.Empty()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='CarsDelete').dec()
 
 
 def serve():
     # Start Prometheus HTTP server on port 8000
-    start_http_server(8000)
-    print("Prometheus metrics server started on port 8000...")
+    profiling.start_http_server(METRICS_PORT)
+    print(f"Prometheus metrics server started on port {METRICS_PORT}...")
+    tracing.configure("car")
     
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    car_service_pb2_grpc.add_CarServiceServicer_to_server(CarService(), server)
+    # Accept the gateway's keepalive pings, and recycle connections so its DNS round_robin picks up new replicas
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=10),
+        interceptors=[SERVER_METRICS, tracing.ServerInterceptor()],
+        options=[
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.min_recv_ping_interval_without_data_ms", 10000),
+            ("grpc.max_connection_age_ms", 5 * 60 * 1000),
+            ("grpc.max_connection_age_grace_ms", 30 * 1000),
+        ],
+    )
+    servicer = CarService()
+    car_service_pb2_grpc.add_CarServiceServicer_to_server(servicer, server)
+    # Readiness ("" and the service name) and liveness ("liveness") follow the database connections
+    health = DatabaseHealth(QUERY_METRICS, servicer.conn)
+    health.add_to_server(server, car_service_pb2.DESCRIPTOR.services_by_name["CarService"].full_name)
     server.add_insecure_port("[::]:50008")
     print("Car service running on port 50008...")
     server.start()
-    server.wait_for_termination()
+    health.start()
+    shutdown.wait_for_signal()
+    shutdown.drain(server, health)
 
 if __name__ == "__main__":
     serve()
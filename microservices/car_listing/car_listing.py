@@ -1,9 +1,22 @@
 import logging
 import os
+import base64
+import json
 import grpc
 import psycopg2
+import threading
+import select
 from concurrent import futures
-from prometheus_client import start_http_server, Counter, Summary, Histogram, Gauge
+from prometheus_client import Counter, Summary, Gauge
+
+from opentelemetry.trace import SpanKind, Status, StatusCode
+
+from microservices.common import profiling, shutdown, tracing
+from microservices.common.metrics import ServerMetricsInterceptor
+from microservices.common.db import QueryMetrics
+from microservices.common.events import EventBuffer
+from microservices.common.health import DatabaseHealth
+from microservices.common.idempotency import IdempotencyKeyInUse, IdempotencyKeys, idempotency_key_of
 
 from services import car_listing_service_pb2_grpc
 from services import car_listing_service_pb2
@@ -13,7 +26,6 @@ from services.car_listing_service_pb2 import CarListing
 
 from services.transaction_service_pb2_grpc import TransactionServiceStub
 from services import transaction_service_pb2
-from datetime import datetime
 
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
@@ -21,272 +33,589 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 
-# Prometheus metrics
-REQUEST_COUNT = Counter('car_listing_request_count', 'Total number of requests by endpoint', ['endpoint', 'status'])
-REQUEST_LATENCY = Histogram('car_listing_request_latency_seconds', 'Request latency in seconds', ['endpoint'])
-ACTIVE_REQUESTS = Gauge('car_listing_active_requests', 'Number of active requests', ['endpoint'])
-DB_OPERATION_LATENCY = Summary('car_listing_db_operation_latency_seconds', 'Database operation latency', ['operation'])
+# Prometheus port; overridable so several services can share one host
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
+
+# Prometheus metrics; every RPC is recorded by SERVER_METRICS and every statement by QUERY_METRICS
+SERVER_METRICS = ServerMetricsInterceptor('car_listing')
+IDEMPOTENT_REPLAYS = Counter('car_listing_idempotent_replay_count', 'Creates answered with the response stored by an earlier attempt', ['endpoint'])
+ROW_ERRORS = Counter('car_listing_row_error_count', 'Rows a ReadAll skipped because they could not be converted', ['endpoint'])
+OUTBOX_DISPATCH_COUNT = Counter('car_listing_outbox_dispatch_count', 'Sale outbox TransactionsCreate attempts by outcome', ['status'])
+QUERY_METRICS = QueryMetrics('car_listing')
 TRANSACTION_LATENCY = Summary('car_listing_transaction_latency_seconds', 'Transaction service call latency')
+OUTBOX_PENDING = Gauge('car_listing_outbox_pending', 'Sold listings whose transaction has not been created yet')
+
+# Creates retried with the same idempotency key get the response stored by the first attempt
+IDEMPOTENCY_KEYS = IdempotencyKeys("car_listing_idempotency")
+
+# Sale outbox dispatch: rows per batch, idle poll interval, per-call timeout and retry backoff, all in seconds
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))
+OUTBOX_RPC_TIMEOUT = float(os.getenv("OUTBOX_RPC_TIMEOUT", "5"))
+OUTBOX_BASE_BACKOFF = float(os.getenv("OUTBOX_BASE_BACKOFF", "2"))
+OUTBOX_MAX_BACKOFF = float(os.getenv("OUTBOX_MAX_BACKOFF", "300"))
+
+TRANSACTION_SERVICE_ADDRESS = os.getenv("TRANSACTION_SERVICE_ADDRESS", "TransactionService:50010")
+
+# Listing status events: how many are kept for resuming streams, how long an idle stream waits before
+# checking its caller is still there, and the delay before relistening after the DB connection drops, in seconds
+LISTING_EVENT_BUFFER = int(os.getenv("LISTING_EVENT_BUFFER", "1000"))
+LISTING_EVENT_WAIT = float(os.getenv("LISTING_EVENT_WAIT", "15"))
+LISTING_EVENT_RECONNECT = float(os.getenv("LISTING_EVENT_RECONNECT", "2"))
+
+# A watch stream holds an RPC worker thread for as long as it is open, so the pool has RPC_WORKERS threads for unary
+# calls plus one per stream, and at most MAX_WATCH_STREAMS streams are served at once. Gateways run one stream each;
+# one that gets RESOURCE_EXHAUSTED resubscribes after its delay, which round-robin usually sends to another replica
+RPC_WORKERS = int(os.getenv("RPC_WORKERS", "10"))
+MAX_WATCH_STREAMS = int(os.getenv("MAX_WATCH_STREAMS", "4"))
+
+# ReadAll paging limits
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+MAX_RESPONSE_BYTES = int(os.getenv("MAX_RESPONSE_BYTES", str(3 * 1024 * 1024)))
+
+# Fields CarlistingReadAll can be ordered by; each has a (column, listing_id) index so a page is one bounded index range scan
+LISTING_ORDER_FIELDS = ("listingId", "posting_date", "sale_price")
+
+# Column behind each CarListing field and how its value maps to the message; reads select only the readMask fields
+LISTING_FIELDS = {
+    "listingId": ("listing_id", int),
+    "carId": ("listing_car_id", int),
+    "userId": ("listing_user_id", int),
+    "type": ("listing_type", CarListing.TypeEnum.Value),
+    "description": ("listing_description", lambda description: description),
+    "posting_date": ("listing_posting_date", lambda posting_date: posting_date.isoformat() if posting_date else None),
+    "sale_price": ("listing_sale_price", lambda sale_price: sale_price),
+    "promoted": ("listing_promoted", lambda promoted: promoted),
+    "status": ("listing_status", CarListing.StatusEnum.Value),
+    "version": ("version", lambda version: version),
+}
+LISTING_COLUMNS = ", ".join(column for column, _ in LISTING_FIELDS.values())
+
+# CarListing fields CarlistingPatch may change, with their column and how to read the value from the message
+LISTING_PATCH_COLUMNS = {
+    "carId": ("listing_car_id", lambda listing: listing.carId),
+    "userId": ("listing_user_id", lambda listing: listing.userId),
+    "type": ("listing_type", lambda listing: CarListing.TypeEnum.Name(listing.type)),
+    "description": ("listing_description", lambda listing: listing.description),
+    "posting_date": ("listing_posting_date", lambda listing: listing.posting_date),
+    "sale_price": ("listing_sale_price", lambda listing: listing.sale_price),
+    "promoted": ("listing_promoted", lambda listing: listing.promoted),
+    "status": ("listing_status", lambda listing: CarListing.StatusEnum.Name(listing.status)),
+}
+
+def listing_from_row(listing, fields=tuple(LISTING_FIELDS)):
+    """Maps a row selected with the columns of `fields` to a CarListing, leaving the other fields unset"""
+    return CarListing(**{field: LISTING_FIELDS[field][1](value) for field, value in zip(fields, listing)})
+
+def read_mask_fields(read_mask):
+    """CarListing fields to select for a readMask, in column order; None when the mask names an unknown field"""
+    paths = set(read_mask.paths)
+    if not paths:
+        return tuple(LISTING_FIELDS)
+    if not paths <= LISTING_FIELDS.keys():
+        return None
+    return tuple(field for field in LISTING_FIELDS if field in paths or field in ("listingId", "version"))
+
+def encode_page_token(order_by, value, listing_id):
+    """Opaque keyset cursor holding the sort value and ID of the last listing returned"""
+    return base64.urlsafe_b64encode(json.dumps([order_by, value, listing_id], default=str).encode()).decode()
+
+def decode_page_token(page_token, order_by):
+    """Keyset values the next page starts after, () for the first page; None if invalid or issued for another orderBy"""
+    if not page_token:
+        return ()
+    try:
+        token_order_by, value, listing_id = json.loads(base64.urlsafe_b64decode(page_token))
+    except (ValueError, TypeError):
+        return None
+    if token_order_by != order_by:
+        return None
+    return (listing_id,) if (order_by.removeprefix("-") or "listingId") == "listingId" else (value, listing_id)
 
 class CarListingService(car_listing_service_pb2_grpc.CarListingServiceServicer):
-    def __init__(self):
+    def __init__(self, listing_events=None):
         self.conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT
+            dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT, cursor_factory=QUERY_METRICS.cursor_factory
         )
         self.cursor = self.conn.cursor()
-        
-        self.transaction_channel = grpc.insecure_channel("TransactionService:50010")
-        self.transaction_stub = TransactionServiceStub(self.transaction_channel) 
+        self.listing_events = listing_events
+        self.watch_slots = threading.BoundedSemaphore(MAX_WATCH_STREAMS)
+
+    def _tag_sale_trace(self):
+        """Hands the current trace to the sale outbox trigger, so the dispatcher's TransactionsCreate joins it"""
+        traceparent = tracing.traceparent()
+        if traceparent:
+            self.cursor.execute("SELECT set_config('app.traceparent', %s, true)", (traceparent,))
 
     def CarlistingCreate(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='CarlistingCreate').inc()
-        
+        idempotency_key = idempotency_key_of(context)
         try:
-            with REQUEST_LATENCY.labels(endpoint='CarlistingCreate').time():
-                with DB_OPERATION_LATENCY.labels(operation='insert').time():
-                    self.cursor.execute("SELECT setval('car_listing_listing_id_seq', (SELECT MAX(listing_id) FROM car_listing) + 1);")
-                    self.cursor.execute(
-                        """
-                        INSERT INTO car_listing (listing_car_id, listing_user_id, listing_type, listing_description,
-                                                 listing_posting_date, listing_sale_price, listing_promoted, listing_status)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING listing_id
-                        """,
-                        (request.carListing.carId, request.carListing.userId, CarListing.TypeEnum.Name(request.carListing.type),
-                         request.carListing.description, request.carListing.posting_date, request.carListing.sale_price,
-                         request.carListing.promoted, CarListing.StatusEnum.Name(request.carListing.status) )
-                    )
-                    listing_id = self.cursor.fetchone()[0]
+            if idempotency_key:
+                replayed = IDEMPOTENCY_KEYS.claim(self.cursor, idempotency_key, CarListing)
+                if replayed:
                     self.conn.commit()
-                
-                REQUEST_COUNT.labels(endpoint='CarlistingCreate', status='success').inc()
-                return CarListing(
-                    listingId=listing_id, carId=request.carListing.carId, userId=request.carListing.userId,
-                    type=request.carListing.type, description=request.carListing.description,
-                    posting_date=request.carListing.posting_date, sale_price=request.carListing.sale_price,
-                    promoted=request.carListing.promoted, status=request.carListing.status
-                )
+                    IDEMPOTENT_REPLAYS.labels(endpoint='CarlistingCreate').inc()
+                    return replayed
+            
+            self.cursor.execute("SELECT setval('car_listing_listing_id_seq', (SELECT MAX(listing_id) FROM car_listing) + 1);")
+            self.cursor.execute(
+                """
+                INSERT INTO car_listing (listing_car_id, listing_user_id, listing_type, listing_description,
+                                         listing_posting_date, listing_sale_price, listing_promoted, listing_status)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING listing_id
+                """,
+                (request.carListing.carId, request.carListing.userId, CarListing.TypeEnum.Name(request.carListing.type),
+                 request.carListing.description, request.carListing.posting_date, request.carListing.sale_price,
+                 request.carListing.promoted, CarListing.StatusEnum.Name(request.carListing.status) )
+            )
+            listing_id = self.cursor.fetchone()[0]
+        
+            response = CarListing(
+                listingId=listing_id, carId=request.carListing.carId, userId=request.carListing.userId,
+                type=request.carListing.type, description=request.carListing.description,
+                posting_date=request.carListing.posting_date, sale_price=request.carListing.sale_price,
+                promoted=request.carListing.promoted, status=request.carListing.status
+            )
+            if idempotency_key:
+                IDEMPOTENCY_KEYS.store(self.cursor, idempotency_key, response)
+            self.conn.commit()
+            
+            return response
+        except IdempotencyKeyInUse as e:
+            # The open transaction is the one holding the key, so it is left for that request to commit
+            context.set_details(str(e))
+            context.set_code(grpc.StatusCode.ABORTED)
+            return CarListing()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='CarlistingCreate', status='error').inc()
             return CarListing()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='CarlistingCreate').dec()
 
     def CarlistingReadOne(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='CarlistingReadOne').inc()
+        fields = read_mask_fields(request.readMask)
+        if fields is None:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"readMask may only name: {', '.join(LISTING_FIELDS)}")
+            return CarListing()
         
         try:
-            with REQUEST_LATENCY.labels(endpoint='CarlistingReadOne').time():
-                with DB_OPERATION_LATENCY.labels(operation='select').time():
-                    self.cursor.execute(
-                        "SELECT listing_id, listing_car_id, listing_user_id, listing_type, listing_description, "
-                        "listing_posting_date, listing_sale_price, listing_promoted, listing_status FROM car_listing "
-                        "WHERE listing_id = %s",
-                        (request.listingId,)
-                    )
-                    listing = self.cursor.fetchone()
-                
-                if listing:
-                    REQUEST_COUNT.labels(endpoint='CarlistingReadOne', status='success').inc()
-                    return CarListing(
-                            listingId=int(listing[0]),
-                            carId=int(listing[1]),
-                            userId=int(listing[2]),
-                            type=CarListing.TypeEnum.Value(listing[3]),
-                            description=listing[4] if listing[4] is not None else "",
-                            posting_date=listing[5].isoformat() if listing[5] is not None else "",
-                            sale_price=listing[6] if listing[6] is not None else 0.0,
-                            promoted=listing[7] if listing[7] is not None else False,
-                            status=CarListing.StatusEnum.Value(listing[8])
-                        )
-                else:
-                    context.set_code(grpc.StatusCode.NOT_FOUND)
-                    context.set_details(f"Car listing with ID {request.listingId} not found.")
-                    REQUEST_COUNT.labels(endpoint='CarlistingReadOne', status='not_found').inc()
-                    return CarListing()
+            self.cursor.execute(
+                f"SELECT {', '.join(LISTING_FIELDS[field][0] for field in fields)} FROM car_listing WHERE listing_id = %s",
+                (request.listingId,)
+            )
+            listing = self.cursor.fetchone()
+        
+            if listing:
+                return listing_from_row(listing, fields)
+            else:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f"Car listing with ID {request.listingId} not found.")
+                return CarListing()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='CarlistingReadOne', status='error').inc()
             return CarListing()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='CarlistingReadOne').dec()
 
     def CarlistingReadAll(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='CarlistingReadAll').inc()
+        page_size = min(request.pageSize or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        order_field = request.orderBy.removeprefix("-") or "listingId"
+        after = decode_page_token(request.pageToken, request.orderBy)
+        fields = read_mask_fields(request.readMask)
+        if page_size < 1 or order_field not in LISTING_ORDER_FIELDS or after is None or fields is None:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details("Invalid pageSize, pageToken, orderBy or readMask")
+            return car_listing_service_pb2.CarlistingReadAllResponse()
+        
+        # The sort value goes into the next page token, so it is selected even when the mask leaves it out
+        fields = tuple(field for field in LISTING_FIELDS if field in fields or field == order_field)
+        keys = ["listing_id"] if order_field == "listingId" else [LISTING_FIELDS[order_field][0], "listing_id"]
+        direction, comparison = ("DESC", "<") if request.orderBy.startswith("-") else ("ASC", ">")
+        query = f"SELECT {', '.join(LISTING_FIELDS[field][0] for field in fields)} FROM car_listing"
+        if after:
+            query += f" WHERE ({', '.join(keys)}) {comparison} ({', '.join(['%s'] * len(keys))})"
+        query += f" ORDER BY {', '.join(f'{key} {direction}' for key in keys)} LIMIT %s"
         
         try:
-            with REQUEST_LATENCY.labels(endpoint='CarlistingReadAll').time():
-                with DB_OPERATION_LATENCY.labels(operation='select_all').time():
-                    self.cursor.execute("SELECT * FROM car_listing LIMIT 1000")
-                    rows = self.cursor.fetchall()
-
-                carlistings = []
-                for row in rows:
-                    logging.info(f"Row data: {row}, Types: {[type(value) for value in row]}")
-                    try:    
-                        carlisting = CarListing(
-                            listingId=int(row[0]),
-                            carId=int(row[1]),
-                            userId=int(row[2]),
-                            type=CarListing.TypeEnum.Value(row[3]),
-                            description=row[4] if row[4] is not None else "",
-                            posting_date=row[5].isoformat() if row[5] is not None else "",
-                            sale_price=row[6] if row[6] is not None else 0.0,
-                            promoted=row[7] if row[7] is not None else False,
-                            status=CarListing.StatusEnum.Value(row[8])
-                        )
-                        carlistings.append(carlisting)
-                    except Exception as e:
-                        logging.error(f"Error processing row {row}: {e}")
-                        REQUEST_COUNT.labels(endpoint='CarlistingReadAll', status='row_error').inc()
-                
-                REQUEST_COUNT.labels(endpoint='CarlistingReadAll', status='success').inc()
-                return car_listing_service_pb2.CarlistingReadAllResponse(data=carlistings)
+            # Fetch one extra row to know whether another page exists
+            self.cursor.execute(query, (*after, page_size + 1))
+            rows = self.cursor.fetchall()
+
+            carlistings = []
+            response_bytes = 0
+            stopped_early = False
+            last_row = None
+            for row in rows[:page_size]:
+                logging.info(f"Row data: {row}, Types: {[type(value) for value in row]}")
+                try:    
+                    carlisting = listing_from_row(row, fields)
+                    # Stop early once the response would exceed the byte budget
+                    response_bytes += carlisting.ByteSize()
+                    if carlistings and response_bytes > MAX_RESPONSE_BYTES:
+                        stopped_early = True
+                        break
+                    carlistings.append(carlisting)
+                except Exception as e:
+                    logging.error(f"Error processing row {row}: {e}")
+                    ROW_ERRORS.labels(endpoint='CarlistingReadAll').inc()
+                last_row = row
+            
+            next_page_token = ""
+            if last_row and (stopped_early or len(rows) > page_size):
+                next_page_token = encode_page_token(request.orderBy, last_row[fields.index(order_field)], last_row[0])
+            
+            return car_listing_service_pb2.CarlistingReadAllResponse(data=carlistings, nextPageToken=next_page_token)
         except Exception as e:
             logging.error(f"Error in CarlistingReadAll: {e}")
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='CarlistingReadAll', status='error').inc()
             return car_listing_service_pb2.CarlistingReadAllResponse()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='CarlistingReadAll').dec()
 
     def CarlistingUpdate(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='CarlistingUpdate').inc()
-        
         try:
-            with REQUEST_LATENCY.labels(endpoint='CarlistingUpdate').time():
-                with DB_OPERATION_LATENCY.labels(operation='select').time():
-                    self.cursor.execute(
-                        "SELECT listing_status FROM car_listing WHERE listing_id = %s",
-                        (request.listingId,)
-                    )
-                    current_status_row = self.cursor.fetchone()
-                
-                if not current_status_row:
-                    context.set_code(grpc.StatusCode.NOT_FOUND)
-                    context.set_details("Car listing not found")
-                    REQUEST_COUNT.labels(endpoint='CarlistingUpdate', status='not_found').inc()
-                    return car_listing_service_pb2.CarListing()
-                
-                current_status = current_status_row[0]
-                
-                if hasattr(request.carListing.status, 'name'):
-                    new_status = request.carListing.status.name
-                else:
-                    new_status = car_listing_service_pb2.CarListing.StatusEnum.Name(request.carListing.status)
-                
-                with DB_OPERATION_LATENCY.labels(operation='update').time():
-                    self.cursor.execute(
-                        """
-                        UPDATE car_listing SET listing_car_id = %s, listing_user_id = %s, listing_type = %s,
-                                        listing_description = %s, listing_posting_date = %s,
-                                        listing_sale_price = %s, listing_promoted = %s, listing_status = %s
-                        WHERE listing_id = %s RETURNING listing_id
-                        """,
-                        (request.carListing.carId, request.carListing.userId, request.carListing.type,
-                        request.carListing.description, request.carListing.posting_date, request.carListing.sale_price,
-                        request.carListing.promoted, new_status, request.listingId)
-                    )
-                    updated_listing_id = self.cursor.fetchone()
-                
-                if updated_listing_id:
-                    self.conn.commit()
-                    
-                    logging.info(f"Updated car listing with ID: {updated_listing_id[0]}")
-                    
-                    # If status changed to SOLD, create a transaction
-                    if current_status != "StatusEnum_SOLD" and new_status == "StatusEnum_SOLD":
-                        try:
-                            with TRANSACTION_LATENCY.time():
-                                transaction = transaction_service_pb2.Transaction(
-                                    buyerId=request.carListing.userId,
-                                    carId=request.carListing.carId,
-                                    type=request.carListing.type,  
-                                    totalAmount=request.carListing.sale_price,
-                                    status=1,
-                                    transactionDate=datetime.now().isoformat(),
-                                )
-                                
-                                transaction_request = transaction_service_pb2.TransactionsCreateRequest(
-                                    transaction=transaction
-                                )
-                                
-                                try:
-                                    transaction_response = self.transaction_stub.TransactionsCreate(transaction_request)
-                                    logging.info(f"Created transaction with ID: {transaction_response.transactionId}")
-                                    REQUEST_COUNT.labels(endpoint='CarlistingUpdate_CreateTransaction', status='success').inc()
-                                except grpc.RpcError as rpc_error:
-                                    logging.error(f"Failed to create transaction: {rpc_error}")
-                                    REQUEST_COUNT.labels(endpoint='CarlistingUpdate_CreateTransaction', status='error').inc()
-                        
-                        except Exception as e:
-                            logging.error(f"Error creating transaction: {e}")
-                            REQUEST_COUNT.labels(endpoint='CarlistingUpdate_CreateTransaction', status='error').inc()
-                    
-                    REQUEST_COUNT.labels(endpoint='CarlistingUpdate', status='success').inc()
-                    return request.carListing
-                else:
-                    context.set_code(grpc.StatusCode.NOT_FOUND)
-                    context.set_details("Car listing not found")
-                    REQUEST_COUNT.labels(endpoint='CarlistingUpdate', status='not_found').inc()
-                    return car_listing_service_pb2.CarListing()
+            # Optimistic concurrency: only the writer holding the current version wins, no row lock is held.
+            # A move to SOLD is queued in listing_sale_outbox by a trigger in the same DB transaction.
+            if request.carListing.status == CarListing.StatusEnum.StatusEnum_SOLD:
+                self._tag_sale_trace()
+            self.cursor.execute(
+                """
+                UPDATE car_listing SET listing_car_id = %s, listing_user_id = %s, listing_type = %s,
+                                listing_description = %s, listing_posting_date = %s,
+                                listing_sale_price = %s, listing_promoted = %s, listing_status = %s,
+                                version = version + 1
+                WHERE listing_id = %s AND (%s = 0 OR version = %s) RETURNING version
+                """,
+                (request.carListing.carId, request.carListing.userId, CarListing.TypeEnum.Name(request.carListing.type),
+                request.carListing.description, request.carListing.posting_date, request.carListing.sale_price,
+                request.carListing.promoted, CarListing.StatusEnum.Name(request.carListing.status), request.listingId,
+                request.expectedVersion, request.expectedVersion)
+            )
+            updated_version = self.cursor.fetchone()
+        
+            if updated_version:
+                self.conn.commit()
+                logging.info(f"Updated car listing with ID: {request.listingId}")
+                response = CarListing()
+                response.CopyFrom(request.carListing)
+                response.version = updated_version[0]
+                return response
+            
+            self.cursor.execute("SELECT 1 FROM car_listing WHERE listing_id = %s", (request.listingId,))
+            if self.cursor.fetchone():
+                context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+                context.set_details(f"Car listing was modified since version {request.expectedVersion}")
+            else:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details("Car listing not found")
+            return car_listing_service_pb2.CarListing()
         except Exception as e:
             logging.error(f"Error in CarlistingUpdate: {e}")
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='CarlistingUpdate', status='error').inc()
             return car_listing_service_pb2.CarListing()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='CarlistingUpdate').dec()
-            
-    def CarlistingDelete(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='CarlistingDelete').inc()
+
+    def CarlistingPatch(self, request, context):
+        paths = list(request.updateMask.paths)
+        if not paths or any(path not in LISTING_PATCH_COLUMNS for path in paths):
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"updateMask must name one or more of: {', '.join(LISTING_PATCH_COLUMNS)}")
+            return CarListing()
         
+        # Only the masked columns are written; the sale outbox trigger still fires when listing_status moves to SOLD
+        assignments = ", ".join(f"{LISTING_PATCH_COLUMNS[path][0]} = %s" for path in paths)
+        params = [LISTING_PATCH_COLUMNS[path][1](request.carListing) for path in paths]
         try:
-            with REQUEST_LATENCY.labels(endpoint='CarlistingDelete').time():
-                with DB_OPERATION_LATENCY.labels(operation='delete').time():
-                    self.cursor.execute("DELETE FROM car_listing WHERE listing_id = %s RETURNING listing_id", (request.listingId,))
-                    deleted_listing_id = self.cursor.fetchone()
-                    
-                    if deleted_listing_id:
-                        self.conn.commit()
-                        logging.info(f"Deleted car listing with ID: {deleted_listing_id[0]}")
-                        REQUEST_COUNT.labels(endpoint='CarlistingDelete', status='success').inc()
-                        return empty_pb2.Empty()
-                    else:
-                        context.set_code(grpc.StatusCode.NOT_FOUND)
-                        context.set_details(f"Car listing with ID {request.listingId} not found")
-                        REQUEST_COUNT.labels(endpoint='CarlistingDelete', status='not_found').inc()
-                        return empty_pb2.Empty()
+            if "status" in paths and request.carListing.status == CarListing.StatusEnum.StatusEnum_SOLD:
+                self._tag_sale_trace()
+            self.cursor.execute(
+                f"UPDATE car_listing SET {assignments}, version = version + 1 "
+                f"WHERE listing_id = %s AND (%s = 0 OR version = %s) RETURNING {LISTING_COLUMNS}",
+                params + [request.listingId, request.expectedVersion, request.expectedVersion],
+            )
+            listing = self.cursor.fetchone()
         
+            if listing:
+                self.conn.commit()
+                logging.info(f"Patched car listing with ID: {request.listingId}")
+                return listing_from_row(listing)
+            
+            self.cursor.execute("SELECT 1 FROM car_listing WHERE listing_id = %s", (request.listingId,))
+            if self.cursor.fetchone():
+                context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+                context.set_details(f"Car listing was modified since version {request.expectedVersion}")
+            else:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details("Car listing not found")
+            return CarListing()
+        except Exception as e:
+            logging.error(f"Error in CarlistingPatch: {e}")
+            self.conn.rollback()
+            context.set_details(str(e))
+            context.set_code(grpc.StatusCode.INTERNAL)
+            return CarListing()
+            
+    def CarlistingDelete(self, request, context):
+        try:
+            self.cursor.execute("DELETE FROM car_listing WHERE listing_id = %s RETURNING listing_id", (request.listingId,))
+            deleted_listing_id = self.cursor.fetchone()
+            
+            if deleted_listing_id:
+                self.conn.commit()
+                logging.info(f"Deleted car listing with ID: {deleted_listing_id[0]}")
+                return empty_pb2.Empty()
+            else:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f"Car listing with ID {request.listingId} not found")
+                return empty_pb2.Empty()
+
         except Exception as e:
             logging.error(f"Error in CarlistingDelete: {e}")
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='CarlistingDelete', status='error').inc()
             return empty_pb2.Empty()
+
+    def CarlistingStats(self, request, context):
+        # Reads the trigger-maintained summary, so the cost is per group rather than per listing
+        group_column = "car_type" if request.byCarType else "car_manufacturer"
+        query = f"SELECT {group_column}, SUM(listing_count), SUM(price_sum) FROM listing_stats_by_manufacturer"
+        params = []
+        if request.status:
+            query += " WHERE listing_status = %s"
+            params.append(CarListing.StatusEnum.Name(request.status))
+        query += f" GROUP BY {group_column} HAVING SUM(listing_count) > 0 ORDER BY {group_column}"
+        
+        try:
+            self.cursor.execute(query, params)
+            rows = self.cursor.fetchall()
+        
+            return car_listing_service_pb2.CarlistingStatsResponse(data=[
+                car_listing_service_pb2.ListingStats(
+                    group=row[0], listings=int(row[1]), averagePrice=float(row[2] / row[1])
+                )
+                for row in rows
+            ])
+        except psycopg2.Error as e:
+            self.conn.rollback()
+            context.set_details(str(e))
+            context.set_code(grpc.StatusCode.INTERNAL)
+            return car_listing_service_pb2.CarlistingStatsResponse()
+
+    def CarlistingWatchStatus(self, request, context):
+        if self.listing_events is None:
+            context.set_code(grpc.StatusCode.UNAVAILABLE)
+            context.set_details("Listing status events are not being received")
+            return
+        if not self.watch_slots.acquire(blocking=False):
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(f"This replica already serves {MAX_WATCH_STREAMS} watch streams")
+            return
+        
+        after_event_id = request.afterEventId
+        try:
+            # The stream stays open until the caller goes away, or this replica shuts down and the caller resubscribes
+            # to another; events come from memory, so it holds no DB connection
+            while context.is_active() and not self.listing_events.stop_event.is_set():
+                events, resumed = self.listing_events.wait_after(after_event_id, LISTING_EVENT_WAIT)
+                if not resumed:
+                    # The caller's position is gone from the buffer: mark the gap and send everything still held
+                    yield car_listing_service_pb2.ListingStatusEvent(reset=True)
+                    after_event_id = 0
+                for event in events:
+                    yield event
+                    after_event_id = event.eventId
+        finally:
+            self.watch_slots.release()
+
+
+class SaleOutboxDispatcher(threading.Thread):
+    """Background thread creating the transactions for sales recorded in listing_sale_outbox"""
+    def __init__(self, transaction_stub):
+        super().__init__(daemon=True)
+        self.conn = psycopg2.connect(
+            dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT, cursor_factory=QUERY_METRICS.cursor_factory
+        )
+        self.transaction_stub = transaction_stub
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                dispatched = self.dispatch_batch()
+            except psycopg2.Error as e:
+                self.conn.rollback()
+                logging.error(f"Sale outbox dispatch failed: {e}")
+                dispatched = 0
+            # A full batch means more rows are probably waiting, so only sleep when caught up
+            if dispatched < OUTBOX_BATCH_SIZE:
+                self.stop_event.wait(OUTBOX_POLL_INTERVAL)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def dispatch_batch(self):
+        """Sends one batch of due outbox rows concurrently and records the outcome of each, returning the batch size"""
+        with self.conn.cursor() as cursor:
+            # SKIP LOCKED lets every replica's dispatcher claim a different batch
+            cursor.execute(
+                """
+                SELECT outbox_id, idempotency_key, buyer_id, car_id, transaction_type, total_amount, created_at, attempts,
+                       traceparent
+                FROM listing_sale_outbox
+                WHERE dispatched_at IS NULL AND next_attempt_at <= now()
+                ORDER BY outbox_id LIMIT %s FOR UPDATE SKIP LOCKED
+                """,
+                (OUTBOX_BATCH_SIZE,)
+            )
+            rows = cursor.fetchall()
+            
+            calls = []
+            for row in rows:
+                transaction_request = transaction_service_pb2.TransactionsCreateRequest(
+                    transaction=transaction_service_pb2.Transaction(
+                        buyerId=row[2],
+                        carId=row[3],
+                        type=transaction_service_pb2.Transaction.TypeEnum.Value(row[4]),
+                        totalAmount=row[5],
+                        status=transaction_service_pb2.Transaction.StatusEnum.StatusEnum_PENDING,
+                        transactionDate=row[6].isoformat(),
+                    )
+                )
+                # Continues the trace of the update that sold the listing, when it was traced
+                span = tracing.start_span(
+                    "TransactionService/TransactionsCreate", carrier={"traceparent": row[8]} if row[8] else {},
+                    kind=SpanKind.CLIENT, attributes={"outbox.id": row[0], "outbox.attempt": row[7] + 1},
+                )
+                # The key makes a retry after a lost response return the transaction created the first time
+                calls.append((row, span, self.transaction_stub.TransactionsCreate.future(
+                    transaction_request, timeout=OUTBOX_RPC_TIMEOUT,
+                    metadata=tracing.inject((("idempotency-key", str(row[1])),), span),
+                )))
+            
+            with TRANSACTION_LATENCY.time():
+                for row, span, call in calls:
+                    try:
+                        transaction_response = call.result()
+                        span.end()
+                        cursor.execute(
+                            "UPDATE listing_sale_outbox SET dispatched_at = now(), transaction_id = %s WHERE outbox_id = %s",
+                            (transaction_response.transactionId, row[0])
+                        )
+                        logging.info(f"Created transaction {transaction_response.transactionId} for listing sale {row[0]}")
+                        OUTBOX_DISPATCH_COUNT.labels(status='success').inc()
+                    except grpc.RpcError as rpc_error:
+                        span.set_status(Status(StatusCode.ERROR, str(rpc_error)))
+                        span.end()
+                        backoff = min(OUTBOX_BASE_BACKOFF * 2 ** row[7], OUTBOX_MAX_BACKOFF)
+                        cursor.execute(
+                            """
+                            UPDATE listing_sale_outbox SET attempts = attempts + 1, last_error = %s,
+                                   next_attempt_at = now() + %s * INTERVAL '1 second'
+                            WHERE outbox_id = %s
+                            """,
+                            (str(rpc_error), backoff, row[0])
+                        )
+                        logging.error(f"Failed to create transaction for listing sale {row[0]}, retrying in {backoff}s: {rpc_error}")
+                        OUTBOX_DISPATCH_COUNT.labels(status='error').inc()
+            
+            cursor.execute("SELECT COUNT(*) FROM listing_sale_outbox WHERE dispatched_at IS NULL")
+            OUTBOX_PENDING.set(cursor.fetchone()[0])
+        self.conn.commit()
+        return len(rows)
+
+
+class ListingEventBroker(EventBuffer, threading.Thread):
+    """Background thread LISTENing for listing status changes and buffering them for CarlistingWatchStatus streams"""
+    def __init__(self, buffer_size=LISTING_EVENT_BUFFER):
+        super().__init__(buffer_size, daemon=True)
+        self.stop_event = threading.Event()
+        # Written to by stop(), so the listener leaves its select at once rather than after LISTING_EVENT_WAIT
+        self.wake_reader, self.wake_writer = os.pipe()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.listen()
+            except psycopg2.Error as e:
+                logging.error(f"Listing status listener failed: {e}")
+                self.stop_event.wait(LISTING_EVENT_RECONNECT)
+
+    def stop(self):
+        self.stop_event.set()
+        os.write(self.wake_writer, b"\0")
+        # Wakes the streams waiting for events, so they end now
+        self.wake()
+
+    def listen(self):
+        conn = psycopg2.connect(
+            dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT
+        )
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("LISTEN listing_status")
+            # Anything sent while not listening is lost, so streams resuming from before now must be told
+            self.clear()
+            while not self.stop_event.is_set():
+                readable, _, _ = select.select([conn, self.wake_reader], [], [], LISTING_EVENT_WAIT)
+                if conn not in readable:
+                    continue
+                conn.poll()
+                events = [self.parse(notify.payload) for notify in conn.notifies]
+                conn.notifies.clear()
+                self.publish(events)
         finally:
-            ACTIVE_REQUESTS.labels(endpoint='CarlistingDelete').dec()
+            conn.close()
+
+    @staticmethod
+    def parse(payload):
+        event = json.loads(payload)
+        return car_listing_service_pb2.ListingStatusEvent(
+            eventId=event["eventId"],
+            listingId=event["listingId"],
+            status=CarListing.StatusEnum.Value(event["status"]),
+            version=event["version"],
+        )
 
 
 def serve():
     # Start Prometheus HTTP server on port 8000
-    start_http_server(8000)
-    print("Prometheus metrics server started on port 8000...")
+    profiling.start_http_server(METRICS_PORT)
+    print(f"Prometheus metrics server started on port {METRICS_PORT}...")
+    tracing.configure("car-listing")
+    
+    transaction_channel = grpc.insecure_channel(TRANSACTION_SERVICE_ADDRESS)
+    dispatcher = SaleOutboxDispatcher(TransactionServiceStub(transaction_channel))
+    dispatcher.start()
+    
+    listing_events = ListingEventBroker()
+    listing_events.start()
     
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    car_listing_service_pb2_grpc.add_CarListingServiceServicer_to_server(CarListingService(), server)
+    # Accept the gateway's keepalive pings, and recycle connections so its DNS round_robin picks up new replicas
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=RPC_WORKERS + MAX_WATCH_STREAMS),
+        interceptors=[SERVER_METRICS, tracing.ServerInterceptor()],
+        options=[
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.min_recv_ping_interval_without_data_ms", 10000),
+            ("grpc.max_connection_age_ms", 5 * 60 * 1000),
+            ("grpc.max_connection_age_grace_ms", 30 * 1000),
+        ],
+    )
+    servicer = CarListingService(listing_events)
+    car_listing_service_pb2_grpc.add_CarListingServiceServicer_to_server(servicer, server)
+    # Readiness ("" and the service name) and liveness ("liveness") follow the database connections
+    health = DatabaseHealth(QUERY_METRICS, servicer.conn, dispatcher.conn)
+    health.add_to_server(server, car_listing_service_pb2.DESCRIPTOR.services_by_name["CarListingService"].full_name)
     server.add_insecure_port("[::]:50009")
     print("Car Listing Service running on port 50009...")
     server.start()
-    server.wait_for_termination()
+    health.start()
+    shutdown.wait_for_signal()
+    shutdown.drain(server, health, listing_events, dispatcher)
 
 
 if __name__ == "__main__":
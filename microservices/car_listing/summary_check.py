@@ -0,0 +1,63 @@
+import logging
+import os
+import sys
+import psycopg2
+
+logging.basicConfig(level=logging.INFO)
+
+DB_HOST = os.getenv("DB_HOST")
+DB_PORT = os.getenv("DB_PORT")
+DB_NAME = os.getenv("DB_NAME")
+DB_USER = os.getenv("DB_USER")
+DB_PASS = os.getenv("DB_PASS")
+
+# Groups whose incremental counts differ from a full recomputation; both sides come from one snapshot
+DIFF_QUERY = """
+    SELECT car_manufacturer, car_type, listing_status,
+           COALESCE(s.listing_count, 0), COALESCE(e.listing_count, 0),
+           COALESCE(s.price_sum, 0), COALESCE(e.price_sum, 0)
+    FROM (SELECT * FROM listing_stats_by_manufacturer WHERE listing_count <> 0 OR price_sum <> 0) s
+    FULL JOIN listing_stats_by_manufacturer_expected e USING (car_manufacturer, car_type, listing_status)
+    WHERE s.listing_count IS DISTINCT FROM e.listing_count OR s.price_sum IS DISTINCT FROM e.price_sum
+    ORDER BY car_manufacturer, car_type, listing_status
+"""
+
+def check_listing_stats(conn, repair=False):
+    """Diffs listing_stats_by_manufacturer against a rebuild from car_listing, optionally replacing it with the rebuild"""
+    with conn.cursor() as cursor:
+        cursor.execute(DIFF_QUERY)
+        diffs = cursor.fetchall()
+        if diffs and repair:
+            # Blocks the triggers until the rebuilt rows are committed so no change is lost in between
+            cursor.execute("LOCK TABLE listing_stats_by_manufacturer IN EXCLUSIVE MODE")
+            cursor.execute("DELETE FROM listing_stats_by_manufacturer")
+            cursor.execute("INSERT INTO listing_stats_by_manufacturer SELECT * FROM listing_stats_by_manufacturer_expected")
+    conn.commit()
+    return diffs
+
+def main():
+    repair = "--repair" in sys.argv[1:]
+    conn = psycopg2.connect(
+        dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT
+    )
+    try:
+        diffs = check_listing_stats(conn, repair)
+    except psycopg2.Error as e:
+        conn.rollback()
+        logging.error(f"Listing stats check failed: {e}")
+        raise
+    finally:
+        conn.close()
+    
+    for manufacturer, car_type, status, count, expected_count, prices, expected_prices in diffs:
+        logging.warning(
+            f"Drift in {manufacturer}/{car_type or '-'}/{status}: "
+            f"count {count} != {expected_count}, price sum {prices} != {expected_prices}"
+        )
+    logging.info(f"listing_stats_by_manufacturer: {len(diffs)} drifted groups{', repaired' if diffs and repair else ''}")
+    # Fail the job on unrepaired drift so it shows up in the CronJob history
+    if diffs and not repair:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
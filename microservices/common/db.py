@@ -0,0 +1,233 @@
+"""
+Database instrumentation shared by the services. QueryMetrics("car").cursor_factory is passed to psycopg2.connect,
+so every statement a service runs is timed per normalized statement (its fingerprint), traced while serving a
+traced call, and logged when slow:
+
+    SLOW_QUERY_SECONDS        statements slower than this are logged with their parameters' shapes (default 0.5)
+    SLOW_QUERY_EXPLAIN_RATE   share of slow SELECTs re-run as EXPLAIN (ANALYZE, BUFFERS) for the log (default 0)
+    QUERY_BYTES_SAMPLE_RATE   share of statements whose fetched rows are sized for <prefix>_db_fetched_bytes (default 0.1)
+"""
+import functools
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+import weakref
+
+import psycopg2.extensions
+from opentelemetry.trace import SpanKind
+from prometheus_client import REGISTRY, Gauge, Histogram
+
+from microservices.common import tracing
+
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "0.5"))
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", "0"))
+QUERY_BYTES_SAMPLE_RATE = float(os.getenv("QUERY_BYTES_SAMPLE_RATE", "0.1"))
+
+# Statements are recorded without their parameters, and cut short so a huge IN list doesn't bloat the span
+MAX_STATEMENT_LENGTH = 2000
+
+# Distinct query strings remembered with their bound metrics; past this, new strings are fingerprinted on every run
+MAX_CACHED_STATEMENTS = 2000
+
+QUERY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+WAIT_BUCKETS = (.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5)
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000)
+BYTE_BUCKETS = tuple(64 * 4 ** power for power in range(9))
+
+_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+([a-z_][\w.]*)", re.IGNORECASE)
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_LITERALS = re.compile(r"'(?:[^']|'')*'|%\(\w+\)s|%s|\b\d+(?:\.\d+)?\b")
+# Runs of placeholders (VALUES and IN lists) and of columns, optionally assigned (select, RETURNING and SET lists)
+_PLACEHOLDER_LISTS = re.compile(r"\?(?:\s*,\s*\?)+")
+_NAME_LISTS = re.compile(r"[a-z_][\w.]*(?:\s*=\s*\?)?(?:\s*,\s*[a-z_][\w.]*(?:\s*=\s*\?)?)+")
+_WHITESPACE = re.compile(r"\s+")
+_LOCKING = re.compile(r"\bfor (?:update|no key update|share|key share)\b")
+
+
+@functools.lru_cache(maxsize=512)
+def statement_name(query):
+    """Span name for a statement: its command and the first table it touches, e.g. "UPDATE car_listing" """
+    words = query.split(None, 1)
+    if not words:
+        return "query"
+    table = _TABLE.search(query)
+    return f"{words[0].upper()} {table.group(1)}" if table else words[0].upper()
+
+
+def normalize(query):
+    """Statement text with literals, parameters and column lists folded, so the variants of one query compare equal"""
+    text = _WHITESPACE.sub(" ", _COMMENTS.sub(" ", query)).strip().lower()
+    text = _LITERALS.sub("?", text)
+    text = _PLACEHOLDER_LISTS.sub("...", text)
+    return _NAME_LISTS.sub("...", text)
+
+
+def fingerprint(normalized):
+    return hashlib.blake2s(normalized.encode(), digest_size=6).hexdigest()
+
+
+def param_shapes(params):
+    """Types and sizes of a statement's parameters, for logs that must not contain the values themselves"""
+    def shape(value):
+        if value is None:
+            return "None"
+        if isinstance(value, (str, bytes, list, tuple, dict)):
+            return f"{type(value).__name__}[{len(value)}]"
+        return type(value).__name__
+
+    if params is None:
+        return "()"
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{name}: {shape(value)}" for name, value in params.items()) + "}"
+    return "(" + ", ".join(shape(value) for value in params) + ")"
+
+
+def rows_size(rows):
+    """Approximate size of fetched rows: the length of text and binary values, 8 bytes for anything else"""
+    return sum(len(value) if isinstance(value, (str, bytes, memoryview)) else 8 for row in rows for value in row)
+
+
+class Statement:
+    """One normalized statement, with its metric children bound"""
+    __slots__ = ("name", "fingerprint", "text", "explainable", "duration", "rows", "fetched_bytes")
+
+    def __init__(self, metrics, query):
+        normalized = normalize(query)
+        self.name = statement_name(query)
+        self.fingerprint = fingerprint(normalized)
+        self.text = query
+        # EXPLAIN ANALYZE runs the statement again, so only plain reads are ever sampled
+        self.explainable = normalized.startswith("select") and not _LOCKING.search(normalized)
+        labels = {"statement": self.name, "fingerprint": self.fingerprint}
+        self.duration = metrics.duration.labels(**labels)
+        self.rows = metrics.rows.labels(**labels)
+        self.fetched_bytes = metrics.fetched_bytes.labels(**labels)
+        metrics.statements.labels(fingerprint=self.fingerprint, query=normalized[:MAX_STATEMENT_LENGTH]).set(1)
+
+
+class QueryMetrics:
+    """Per-statement database metrics of one service, and the cursor class recording them"""
+    def __init__(self, prefix, registry=REGISTRY):
+        self.prefix = prefix
+        self.duration = Histogram(f'{prefix}_db_query_duration_seconds', 'Statement execution time by statement fingerprint', ['statement', 'fingerprint'], buckets=QUERY_BUCKETS, registry=registry)
+        self.rows = Histogram(f'{prefix}_db_query_rows', 'Rows returned or affected per statement', ['statement', 'fingerprint'], buckets=ROW_BUCKETS, registry=registry)
+        self.fetched_bytes = Histogram(f'{prefix}_db_fetched_bytes', 'Approximate size of the rows fetched, for a sample of statements', ['statement', 'fingerprint'], buckets=BYTE_BUCKETS, registry=registry)
+        self.connection_wait = Histogram(f'{prefix}_db_connection_wait_seconds', 'Time statements waited for their connection to be free', buckets=WAIT_BUCKETS, registry=registry)
+        self.statements = Gauge(f'{prefix}_db_statement_info', 'Normalized text of each statement fingerprint', ['fingerprint', 'query'], registry=registry)
+        self.by_query = {}
+        self.locks = weakref.WeakKeyDictionary()
+        self.locks_lock = threading.Lock()
+        self.cursor_factory = type("InstrumentedCursor", (InstrumentedCursor,), {"query_metrics": self})
+
+    def statement(self, query):
+        statement = self.by_query.get(query)
+        if statement is None:
+            statement = Statement(self, query)
+            if len(self.by_query) < MAX_CACHED_STATEMENTS:
+                self.by_query[query] = statement
+        return statement
+
+    def lock(self, connection):
+        """The lock statements on connection take in turn; psycopg2 serializes them anyway, this makes the wait visible"""
+        lock = self.locks.get(connection)
+        if lock is None:
+            with self.locks_lock:
+                lock = self.locks.setdefault(connection, threading.Lock())
+        return lock
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Cursor timing, counting and tracing each statement; each service gets its own subclass from QueryMetrics"""
+    query_metrics = None
+    sized_statement = None
+
+    def execute(self, query, vars=None):
+        return self._run(super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._run(super().executemany, query, vars_list)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if self.sized_statement is not None and row is not None:
+            self.sized_statement.fetched_bytes.observe(rows_size((row,)))
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany() if size is None else super().fetchmany(size)
+        if self.sized_statement is not None:
+            self.sized_statement.fetched_bytes.observe(rows_size(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        if self.sized_statement is not None:
+            self.sized_statement.fetched_bytes.observe(rows_size(rows))
+        return rows
+
+    def _run(self, run, query, vars):
+        metrics = self.query_metrics
+        if isinstance(query, bytes):
+            query = query.decode(psycopg2.extensions.encodings[self.connection.encoding], "replace")
+        elif not isinstance(query, str):
+            query = query.as_string(self)
+        statement = metrics.statement(query)
+
+        lock = metrics.lock(self.connection)
+        waited_from = time.perf_counter()
+        with lock:
+            start = time.perf_counter()
+            metrics.connection_wait.observe(start - waited_from)
+            try:
+                if tracing.recording():
+                    with tracing.span(statement.name, kind=SpanKind.CLIENT, attributes={
+                        "db.system": "postgresql",
+                        "db.name": self.connection.info.dbname,
+                        "db.statement": query[:MAX_STATEMENT_LENGTH],
+                        "db.fingerprint": statement.fingerprint,
+                    }):
+                        result = run(query, vars)
+                else:
+                    result = run(query, vars)
+            finally:
+                elapsed = time.perf_counter() - start
+                statement.duration.observe(elapsed)
+
+        if self.rowcount >= 0:
+            statement.rows.observe(self.rowcount)
+        self.sized_statement = statement if random.random() < QUERY_BYTES_SAMPLE_RATE else None
+        if elapsed >= SLOW_QUERY_SECONDS:
+            self._log_slow(statement, query, vars, elapsed)
+        return result
+
+    def _log_slow(self, statement, query, vars, elapsed):
+        plan = ""
+        if statement.explainable and random.random() < SLOW_QUERY_EXPLAIN_RATE:
+            plan = "\n" + self._explain(query, vars)
+        logging.warning(
+            f"Slow query {statement.fingerprint} ({statement.name}) took {elapsed:.3f}s, {self.rowcount} rows, "
+            f"params {param_shapes(vars)}: {_WHITESPACE.sub(' ', statement.text).strip()}{plan}"
+        )
+
+    def _explain(self, query, vars):
+        """EXPLAIN (ANALYZE, BUFFERS) of a read; in a transaction, under a savepoint so a failure doesn't abort it"""
+        savepoint = not self.connection.autocommit
+        # Other threads share the connection's transaction; holding its lock keeps their statements out of the savepoint,
+        # where a rollback would undo them
+        with self.query_metrics.lock(self.connection), psycopg2.extensions.cursor(self.connection) as cursor:
+            try:
+                if savepoint:
+                    cursor.execute("SAVEPOINT slow_query_explain")
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, vars)
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+                if savepoint:
+                    cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+                return plan
+            except psycopg2.Error as e:
+                if savepoint:
+                    cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                return f"EXPLAIN failed: {e}"
@@ -0,0 +1,55 @@
+"""
+Buffers of listing status events. The car listing service keeps the events it is notified of for its
+CarlistingWatchStatus streams, and the gateway keeps the events of its one subscription for its SSE clients; both let
+a reader resume after the last event it received, as long as that event is still buffered.
+"""
+import collections
+import itertools
+import threading
+
+
+class EventBuffer:
+    """The latest events, each with an eventId, for readers waiting on new ones"""
+    def __init__(self, buffer_size, **kwargs):
+        super().__init__(**kwargs)
+        self.events = collections.deque(maxlen=buffer_size)
+        self.condition = threading.Condition()
+
+    def wake(self):
+        """Wakes every reader waiting for events, e.g. so they notice a shutdown"""
+        with self.condition:
+            self.condition.notify_all()
+
+    def last_event_id(self):
+        with self.condition:
+            return self.events[-1].eventId if self.events else 0
+
+    def publish(self, events):
+        with self.condition:
+            self.events.extend(events)
+            self.condition.notify_all()
+
+    def clear(self):
+        with self.condition:
+            self.events.clear()
+            self.condition.notify_all()
+
+    def events_after(self, after_event_id):
+        """Buffered events following after_event_id, and whether it was found; 0 means every buffered event"""
+        with self.condition:
+            if not after_event_id:
+                return list(self.events), True
+            # Event IDs come from a sequence but arrive in commit order, so the position is found by ID rather than compared
+            for position in range(len(self.events) - 1, -1, -1):
+                if self.events[position].eventId == after_event_id:
+                    return list(itertools.islice(self.events, position + 1, None)), True
+            return list(self.events), False
+
+    def wait_after(self, after_event_id, timeout):
+        """Like events_after, but waits up to timeout seconds for an event when there is none yet"""
+        with self.condition:
+            events, resumed = self.events_after(after_event_id)
+            if not events and resumed:
+                self.condition.wait(timeout)
+                events, resumed = self.events_after(after_event_id)
+            return events, resumed
@@ -0,0 +1,117 @@
+"""
+grpc.health.v1 for the services, with readiness following the state of their database connections.
+
+    health = DatabaseHealth(QUERY_METRICS, servicer.conn)
+    health.add_to_server(server, car_service_pb2.DESCRIPTOR.services_by_name["CarService"].full_name)
+    health.start()
+
+reports two things, checked every HEALTH_CHECK_INTERVAL seconds in the background:
+
+    ""  and the service's name   readiness: SERVING while every connection answers and a statement gets its connection
+                                 within HEALTH_MAX_CONNECTION_WAIT seconds, NOT_SERVING otherwise
+    "liveness"                   NOT_SERVING once a connection is closed, which the service never recovers from
+
+so a pod whose statements queue up behind a slow one stops getting new calls until it catches up, and a pod that
+lost Postgres is restarted.
+"""
+import logging
+import os
+import threading
+
+import psycopg2
+import psycopg2.extensions
+from grpc_health.v1 import health, health_pb2, health_pb2_grpc
+from prometheus_client import REGISTRY, Gauge
+
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "2"))
+HEALTH_MAX_CONNECTION_WAIT = float(os.getenv("HEALTH_MAX_CONNECTION_WAIT", "1"))
+
+LIVENESS = "liveness"
+
+SERVING = health_pb2.HealthCheckResponse.SERVING
+NOT_SERVING = health_pb2.HealthCheckResponse.NOT_SERVING
+
+
+class DatabaseHealth:
+    """The health servicer of a service, kept up to date with the state of the connections it runs statements on"""
+    def __init__(self, query_metrics, *connections, registry=REGISTRY):
+        self.query_metrics = query_metrics
+        self.connections = connections
+        self.servicer = health.HealthServicer()
+        self.services = ["", LIVENESS]
+        self.ready = Gauge(f'{query_metrics.prefix}_ready', 'Whether the service reports itself ready for calls', registry=registry)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="health-check", daemon=True)
+
+    def add_to_server(self, server, *service_names):
+        self.services.extend(service_names)
+        health_pb2_grpc.add_HealthServicer_to_server(self.servicer, server)
+        self.update()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """Reports every service NOT_SERVING from now on, e.g. while the server drains before shutting down"""
+        self.stop_event.set()
+        self.ready.set(0)
+        self.servicer.enter_graceful_shutdown()
+
+    def close_connections(self):
+        """Closes the connections once nothing uses them; a transaction still open belongs to a call that never finished"""
+        for connection in self.connections:
+            if connection.closed:
+                continue
+            if connection.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                logging.warning("Rolling back a transaction left open at shutdown")
+                connection.rollback()
+            connection.close()
+
+    def run(self):
+        while not self.stop_event.wait(HEALTH_CHECK_INTERVAL):
+            self.update()
+
+    def update(self):
+        alive, ready = self.check()
+        if self.stop_event.is_set():
+            return
+        self.servicer.set(LIVENESS, SERVING if alive else NOT_SERVING)
+        for service in self.services:
+            if service != LIVENESS:
+                self.servicer.set(service, SERVING if ready else NOT_SERVING)
+        self.ready.set(1 if ready else 0)
+
+    def check(self):
+        """(alive, ready) from every connection"""
+        for connection in self.connections:
+            if connection.closed:
+                logging.error("Health check: database connection closed")
+                return False, False
+            reason = self.check_connection(connection)
+            if reason is not None:
+                logging.warning(f"Health check: not ready, {reason}")
+                return True, False
+        return True, True
+
+    def check_connection(self, connection):
+        """Why connection can't take statements now, or None when it can"""
+        lock = self.query_metrics.lock(connection)
+        # Statements take the connection in turn; one that can't get it in time means calls are piling up behind it
+        if not lock.acquire(timeout=HEALTH_MAX_CONNECTION_WAIT):
+            return f"connection busy for over {HEALTH_MAX_CONNECTION_WAIT:g}s"
+        try:
+            # Only an idle connection is pinged: one in a transaction is in use, and the ping must not start one
+            if connection.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                return None
+            try:
+                with psycopg2.extensions.cursor(connection) as cursor:
+                    cursor.execute("SELECT 1")
+                connection.rollback()
+            except psycopg2.Error as e:
+                if not connection.closed:
+                    connection.rollback()
+                return f"ping failed: {e}"
+            return None
+        finally:
+            lock.release()
+
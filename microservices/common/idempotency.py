@@ -0,0 +1,76 @@
+"""
+Idempotency keys for the services' creates. The gateway forwards a POST's Idempotency-Key header as gRPC metadata; a
+create carrying one claims it in the service's <service>_idempotency table, in the same transaction as its insert, and
+a retry with the same key gets the response stored by the first attempt instead of inserting again:
+
+    IDEMPOTENCY_KEYS = IdempotencyKeys("car_idempotency")
+
+    idempotency_key = idempotency_key_of(context)
+    replayed = IDEMPOTENCY_KEYS.claim(self.cursor, idempotency_key, Car)
+    if replayed:
+        self.conn.commit()
+        return replayed
+    ...
+    IDEMPOTENCY_KEYS.store(self.cursor, idempotency_key, response)
+    self.conn.commit()
+
+    IDEMPOTENCY_TTL   seconds a key is remembered for (default one day)
+"""
+import os
+import time
+
+# gRPC metadata key callers set so a retried create returns the stored response instead of inserting again
+IDEMPOTENCY_KEY_HEADER = "idempotency-key"
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 60 * 60)))
+IDEMPOTENCY_PURGE_INTERVAL = 300
+
+
+class IdempotencyKeyInUse(Exception):
+    """The key is claimed by a request that hasn't committed yet; the caller should retry once it has"""
+
+
+def idempotency_key_of(context):
+    """The idempotency key the caller sent with this call, or None"""
+    return dict(context.invocation_metadata()).get(IDEMPOTENCY_KEY_HEADER)
+
+
+class IdempotencyKeys:
+    """The keys of one service's creates, with the response each one was answered with"""
+    def __init__(self, table):
+        self.table = table
+        self.purged_at = time.monotonic()
+
+    def claim(self, cursor, idempotency_key, response_cls):
+        """
+        Claims the key for this request and returns None, or returns the response stored by the request that used it
+        first. Raises IdempotencyKeyInUse while that request is still running.
+        """
+        if time.monotonic() - self.purged_at > IDEMPOTENCY_PURGE_INTERVAL:
+            cursor.execute(f"DELETE FROM {self.table} WHERE created_at < now() - %s * INTERVAL '1 second'", (IDEMPOTENCY_TTL,))
+            self.purged_at = time.monotonic()
+        # A request with the same key on another connection waits here until the first one commits; expired keys are
+        # reclaimed
+        cursor.execute(
+            f"""
+            INSERT INTO {self.table} AS i (idempotency_key) VALUES (%s)
+            ON CONFLICT (idempotency_key) DO UPDATE SET response = NULL, created_at = now()
+            WHERE i.created_at < now() - %s * INTERVAL '1 second'
+            RETURNING idempotency_key
+            """,
+            (idempotency_key, IDEMPOTENCY_TTL),
+        )
+        if cursor.fetchone():
+            return None
+        cursor.execute(f"SELECT response FROM {self.table} WHERE idempotency_key = %s", (idempotency_key,))
+        row = cursor.fetchone()
+        # One on the same connection shares the first one's transaction, so it sees the claim before its response
+        if row is None or row[0] is None:
+            raise IdempotencyKeyInUse(f"A request with idempotency key {idempotency_key} is still in progress")
+        return response_cls.FromString(bytes(row[0]))
+
+    def store(self, cursor, idempotency_key, response):
+        """Saves the response for a claimed key; must run in the same DB transaction as the insert"""
+        cursor.execute(
+            f"UPDATE {self.table} SET response = %s WHERE idempotency_key = %s",
+            (response.SerializeToString(), idempotency_key),
+        )
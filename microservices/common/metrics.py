@@ -0,0 +1,124 @@
+"""
+Per-RPC Prometheus metrics, recorded by a server interceptor rather than by hand in every servicer method.
+
+    server = grpc.server(executor, interceptors=[ServerMetricsInterceptor("car")])
+
+keeps <prefix>_request_count (by endpoint and status), <prefix>_request_latency_seconds, <prefix>_active_requests,
+<prefix>_request_bytes / <prefix>_response_bytes and <prefix>_exception_count for every method. The status is
+"success" for OK and the lowercased gRPC status code otherwise, e.g. "not_found" or "invalid_argument".
+"""
+import time
+
+import grpc
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+
+# Serialized message sizes, 64 bytes to 4 MiB
+BYTE_BUCKETS = tuple(64 * 4 ** power for power in range(9))
+
+_HANDLER_FACTORIES = {
+    (False, False): grpc.unary_unary_rpc_method_handler,
+    (False, True): grpc.unary_stream_rpc_method_handler,
+    (True, False): grpc.stream_unary_rpc_method_handler,
+    (True, True): grpc.stream_stream_rpc_method_handler,
+}
+
+
+def status_label(code):
+    return "success" if code is grpc.StatusCode.OK else code.name.lower()
+
+
+class MethodMetrics:
+    """The label children of one method, bound once so that a call does no label lookups"""
+    def __init__(self, interceptor, endpoint):
+        self.interceptor = interceptor
+        self.endpoint = endpoint
+        self.active = interceptor.active_requests.labels(endpoint=endpoint)
+        self.latency = interceptor.request_latency.labels(endpoint=endpoint)
+        self.request_bytes = interceptor.request_bytes.labels(endpoint=endpoint)
+        self.response_bytes = interceptor.response_bytes.labels(endpoint=endpoint)
+        # Bound on first use, so only the statuses a method actually returns become series
+        self.counts = {}
+
+    def finish(self, start, context, exception):
+        self.latency.observe(time.perf_counter() - start)
+        self.active.dec()
+        code = context.code() or (grpc.StatusCode.UNKNOWN if exception else grpc.StatusCode.OK)
+        count = self.counts.get(code)
+        if count is None:
+            count = self.counts[code] = self.interceptor.request_count.labels(endpoint=self.endpoint, status=status_label(code))
+        count.inc()
+        if exception is not None and not context.code():
+            self.interceptor.exceptions.labels(endpoint=self.endpoint, exception=type(exception).__name__).inc()
+
+
+class ServerMetricsInterceptor(grpc.ServerInterceptor):
+    """Records count, latency, in-flight calls, message sizes and exceptions of every method of a server"""
+    def __init__(self, prefix, registry=REGISTRY):
+        self.request_count = Counter(f'{prefix}_request_count', 'Total number of requests by endpoint', ['endpoint', 'status'], registry=registry)
+        self.request_latency = Histogram(f'{prefix}_request_latency_seconds', 'Request latency in seconds', ['endpoint'], registry=registry)
+        self.active_requests = Gauge(f'{prefix}_active_requests', 'Number of active requests', ['endpoint'], registry=registry)
+        self.request_bytes = Histogram(f'{prefix}_request_bytes', 'Serialized request size in bytes', ['endpoint'], buckets=BYTE_BUCKETS, registry=registry)
+        self.response_bytes = Histogram(f'{prefix}_response_bytes', 'Serialized response size in bytes', ['endpoint'], buckets=BYTE_BUCKETS, registry=registry)
+        self.exceptions = Counter(f'{prefix}_exception_count', 'Exceptions raised out of RPC methods', ['endpoint', 'exception'], registry=registry)
+        self.handlers = {}
+
+    def intercept_service(self, continuation, handler_call_details):
+        # The wrapped handler is built once per method; later calls only pay for this lookup
+        handler = self.handlers.get(handler_call_details.method)
+        if handler is None:
+            handler = continuation(handler_call_details)
+            if handler is not None:
+                endpoint = handler_call_details.method.rsplit("/", 1)[-1]
+                handler = self.handlers.setdefault(handler_call_details.method, self.wrap(endpoint, handler))
+        return handler
+
+    def wrap(self, endpoint, handler):
+        metrics = MethodMetrics(self, endpoint)
+        behavior = handler.unary_unary or handler.unary_stream or handler.stream_unary or handler.stream_stream
+
+        if handler.response_streaming:
+            def instrumented(request, context):
+                metrics.active.inc()
+                start = time.perf_counter()
+                exception = None
+                try:
+                    yield from behavior(request, context)
+                except Exception as e:
+                    exception = e
+                    raise
+                finally:
+                    metrics.finish(start, context, exception)
+        else:
+            def instrumented(request, context):
+                metrics.active.inc()
+                start = time.perf_counter()
+                exception = None
+                try:
+                    return behavior(request, context)
+                except Exception as e:
+                    exception = e
+                    raise
+                finally:
+                    metrics.finish(start, context, exception)
+
+        return _HANDLER_FACTORIES[handler.request_streaming, handler.response_streaming](
+            instrumented,
+            request_deserializer=sized(handler.request_deserializer, metrics.request_bytes, deserializer=True),
+            response_serializer=sized(handler.response_serializer, metrics.response_bytes, deserializer=False),
+        )
+
+
+def sized(convert, histogram, deserializer):
+    """Wraps a (de)serializer to observe the size of the bytes it reads or writes; the message is never re-encoded"""
+    if convert is None:
+        return None
+    if deserializer:
+        def measured(data):
+            histogram.observe(len(data))
+            return convert(data)
+    else:
+        def measured(message):
+            data = convert(message)
+            histogram.observe(len(data))
+            return data
+    return measured
@@ -0,0 +1,276 @@
+"""
+The Prometheus metrics server of the gateway and the services, with opt-in profiling of the running process.
+
+    profiling.start_http_server(METRICS_PORT)
+
+serves the metrics as prometheus_client.start_http_server does. With PROFILING_ENABLED=1 the same port also answers:
+
+    /debug/profile?seconds=10&mode=cpu   samples every thread's stack for that long; mode=wall also counts idle threads
+    /debug/threads                       current stack of every thread, e.g. the executor workers waiting on the cursor
+    /debug/heap?seconds=10&limit=25      what tracemalloc saw allocated, and not freed, during that time
+
+Profiles come as collapsed stacks ("thread;outer;inner count" lines), the input of flamegraph.pl, speedscope and
+inferno, or with format=top as the functions taking the most samples; format=collapsed does the same for threads
+and heap. Only one profile or heap diff runs at a time.
+
+    PROFILING_ENABLED     serve /debug/* (default off)
+    PROFILE_MAX_SECONDS   longest profile or heap diff accepted (default 60)
+    PROFILE_SAMPLE_HZ     stack samples per second while profiling (default 100)
+    PROFILE_HEAP_FRAMES   frames tracemalloc keeps per allocation (default 25)
+"""
+import collections
+import functools
+import os
+import socketserver
+import sys
+import textwrap
+import threading
+import time
+import tracemalloc
+import traceback
+from urllib.parse import parse_qs
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import prometheus_client
+from prometheus_client import REGISTRY
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0").lower() in ("1", "true", "yes")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_SAMPLE_HZ = float(os.getenv("PROFILE_SAMPLE_HZ", "100"))
+PROFILE_HEAP_FRAMES = int(os.getenv("PROFILE_HEAP_FRAMES", "25"))
+
+# Per-thread CPU time, in clock ticks, as the kernel reports it; cpu mode needs it to tell busy threads from idle ones
+_TASK_STAT = "/proc/self/task/{}/stat"
+
+# The routes, as listed in this module's docstring
+_INDEX = textwrap.dedent(__doc__.split("\n\n")[3]) + "\n"
+
+# Profiles and heap diffs would skew each other, and tracemalloc is process-wide, so they take turns
+_busy = threading.Lock()
+
+
+class ProfilingBusy(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=4096)
+def frame_label(code):
+    """"function (directory/file.py:line)" for a code object; the first line, so one function is one frame"""
+    path = code.co_filename.replace(os.sep, "/").rsplit("/", 2)[-2:]
+    return f"{code.co_name} ({'/'.join(path)}:{code.co_firstlineno})".replace(";", ":")
+
+
+def collapse(frame):
+    """The stack of frame, outermost first, joined by semicolons"""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def thread_names():
+    return {thread.ident: (thread.name, thread.native_id) for thread in threading.enumerate()}
+
+
+def cpu_ticks(native_id):
+    """User plus system CPU time of a thread of this process, or None if it has exited"""
+    try:
+        with open(_TASK_STAT.format(native_id)) as file:
+            fields = file.read().rsplit(")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    return int(fields[11]) + int(fields[12])
+
+
+def sample_stacks(seconds, mode="cpu", hz=PROFILE_SAMPLE_HZ):
+    """
+    Counts the stacks of the other threads, sampled hz times a second for seconds. In wall mode each sample counts 1;
+    in cpu mode a stack counts the clock ticks its thread spent on a CPU since the previous sample, so idle threads
+    drop out and the counts add up to the CPU time used.
+    """
+    if mode not in ("cpu", "wall"):
+        raise ValueError("mode must be cpu or wall")
+    if mode == "cpu" and not os.path.exists(_TASK_STAT.format(threading.get_native_id())):
+        raise ValueError("cpu mode needs /proc; use mode=wall")
+
+    counts = collections.Counter()
+    ticks = {}
+    me = threading.get_ident()
+    interval = 1 / hz
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = thread_names()
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            name, native_id = names.get(ident, (f"thread-{ident}", None))
+            weight = 1
+            if mode == "cpu":
+                now = cpu_ticks(native_id) if native_id is not None else None
+                before = ticks.get(ident)
+                ticks[ident] = now
+                if now is None or before is None or now <= before:
+                    continue
+                weight = now - before
+            counts[f"{name};{collapse(frame)}"] += weight
+        time.sleep(interval)
+    return counts
+
+
+def dump_threads():
+    """Every thread's name, ids and current stack, most recent call last"""
+    names = thread_names()
+    sections = []
+    for ident, frame in sys._current_frames().items():
+        name, native_id = names.get(ident, (f"thread-{ident}", None))
+        sections.append(f'Thread "{name}" (ident {ident}, native id {native_id}):\n' + "".join(traceback.format_stack(frame)))
+    return "\n".join(sections)
+
+
+def heap_diff(seconds, frames=PROFILE_HEAP_FRAMES):
+    """tracemalloc statistics of the memory allocated, and still held, over seconds, largest growth first"""
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(frames)
+    try:
+        before = tracemalloc.take_snapshot()
+        time.sleep(seconds)
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started:
+            tracemalloc.stop()
+    ignored = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen *>"),
+               tracemalloc.Filter(False, "<unknown>")]
+    return after.filter_traces(ignored).compare_to(before.filter_traces(ignored), "traceback")
+
+
+def format_counts(counts):
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+def format_top(counts, limit):
+    """The functions with the most samples, on top of the stack (self) and anywhere in it (total)"""
+    own, total = collections.Counter(), collections.Counter()
+    for stack, count in counts.items():
+        frames = stack.split(";")[1:]
+        if frames:
+            own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+    samples = sum(counts.values()) or 1
+    lines = [f"{'self':>7} {'total':>7}  function"]
+    for frame, count in own.most_common(limit):
+        lines.append(f"{count / samples:7.1%} {total[frame] / samples:7.1%}  {frame}")
+    return "\n".join(lines) + "\n"
+
+
+def format_heap(stats, limit):
+    lines = []
+    for stat in stats[:limit]:
+        lines.append(f"{stat.size_diff / 1024:+.1f} KiB ({stat.count_diff:+d} blocks), {stat.size / 1024:.1f} KiB held")
+        lines.extend(stat.traceback.format())
+        lines.append("")
+    return "\n".join(lines)
+
+
+def collapse_heap(stats):
+    counts = collections.Counter()
+    for stat in stats:
+        if stat.size_diff > 0:
+            counts[";".join(f"{frame.filename}:{frame.lineno}" for frame in stat.traceback)] += stat.size_diff
+    return counts
+
+
+def _seconds(query):
+    seconds = float(query.get("seconds", ["10"])[0])
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise ValueError(f"seconds must be above 0 and at most {PROFILE_MAX_SECONDS:g}")
+    return seconds
+
+
+def _exclusive(run, *args):
+    if not _busy.acquire(blocking=False):
+        raise ProfilingBusy()
+    try:
+        return run(*args)
+    finally:
+        _busy.release()
+
+
+def profile(query):
+    counts = _exclusive(sample_stacks, _seconds(query), query.get("mode", ["cpu"])[0])
+    if query.get("format", ["collapsed"])[0] == "top":
+        return format_top(counts, int(query.get("limit", ["25"])[0]))
+    return format_counts(counts)
+
+
+def threads(query):
+    if query.get("format", ["text"])[0] == "collapsed":
+        names = thread_names()
+        return "".join(
+            f"{names.get(ident, (f'thread-{ident}',))[0]};{collapse(frame)} 1\n"
+            for ident, frame in sys._current_frames().items()
+        )
+    return dump_threads()
+
+
+def heap(query):
+    stats = _exclusive(heap_diff, _seconds(query))
+    if query.get("format", ["text"])[0] == "collapsed":
+        return format_counts(collapse_heap(stats))
+    return format_heap(stats, int(query.get("limit", ["25"])[0]))
+
+
+_ROUTES = {
+    "/debug/": lambda query: _INDEX,
+    "/debug/profile": profile,
+    "/debug/threads": threads,
+    "/debug/heap": heap,
+}
+
+
+def make_wsgi_app(registry=REGISTRY):
+    """The metrics app of prometheus_client, with the /debug/ routes in front of it"""
+    metrics = prometheus_client.make_wsgi_app(registry)
+
+    def app(environ, start_response):
+        path = environ.get("PATH_INFO", "/")
+        if not path.startswith("/debug/"):
+            return metrics(environ, start_response)
+
+        route = _ROUTES.get(path)
+        if not PROFILING_ENABLED:
+            status, body = "404 Not Found", "Profiling is disabled; set PROFILING_ENABLED=1 to enable it\n"
+        elif route is None:
+            status, body = "404 Not Found", _INDEX
+        else:
+            try:
+                status, body = "200 OK", route(parse_qs(environ.get("QUERY_STRING", "")))
+            except ValueError as e:
+                status, body = "400 Bad Request", f"{e}\n"
+            except ProfilingBusy:
+                status, body = "409 Conflict", "Another profile or heap diff is running\n"
+        data = body.encode()
+        start_response(status, [("Content-Type", "text/plain; charset=utf-8"), ("Content-Length", str(len(data)))])
+        return [data]
+
+    return app
+
+
+class _ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    """A profile holds its request for its whole duration, so every request gets a thread and scrapes go on"""
+    daemon_threads = True
+
+
+class _SilentHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, addr="0.0.0.0", registry=REGISTRY):
+    """Serves metrics, and /debug/ when enabled, from a daemon thread; returns the server and its thread"""
+    server = make_server(addr, port, make_wsgi_app(registry), _ThreadingWSGIServer, handler_class=_SilentHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    return server, thread
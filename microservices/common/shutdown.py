@@ -0,0 +1,52 @@
+"""
+Graceful shutdown for the services and the gateway. Kubernetes sends SIGTERM before it kills a pod, e.g. during a
+rolling update, and waits terminationGracePeriodSeconds; serve() waits for it and then drains:
+
+    shutdown.wait_for_signal()
+    shutdown.drain(server, health, dispatcher)
+
+    SHUTDOWN_DELAY   seconds between reporting NOT_SERVING and refusing calls, for callers to move away (default 2)
+    SHUTDOWN_GRACE   seconds calls already running get to finish before they are cancelled (default 20)
+"""
+import logging
+import os
+import signal
+import threading
+import time
+
+SHUTDOWN_DELAY = float(os.getenv("SHUTDOWN_DELAY", "2"))
+SHUTDOWN_GRACE = float(os.getenv("SHUTDOWN_GRACE", "20"))
+
+
+def wait_for_signal(signals=(signal.SIGTERM, signal.SIGINT)):
+    """Blocks the main thread until one of signals arrives, and returns it"""
+    received = []
+    stop = threading.Event()
+
+    def handle(signum, frame):
+        received.append(signum)
+        stop.set()
+
+    for signum in signals:
+        signal.signal(signum, handle)
+    stop.wait()
+    logging.warning(f"Received {signal.Signals(received[0]).name}, shutting down")
+    return received[0]
+
+
+def drain(server, health, *background, delay=SHUTDOWN_DELAY, grace=SHUTDOWN_GRACE):
+    """
+    Takes a gRPC server out of rotation and stops it once its calls are done: reports NOT_SERVING, stops the
+    background threads, waits delay seconds for callers to notice, refuses new calls and gives the running ones grace
+    seconds, then closes the database connections, rolling back any transaction a cancelled call left open.
+    """
+    started = time.monotonic()
+    health.stop()
+    for thread in background:
+        thread.stop()
+    time.sleep(delay)
+    server.stop(grace).wait()
+    for thread in background:
+        thread.join(max(grace - (time.monotonic() - started), 0))
+    health.close_connections()
+    logging.warning(f"Shut down in {time.monotonic() - started:.1f}s")
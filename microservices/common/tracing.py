@@ -0,0 +1,170 @@
+"""
+Distributed tracing shared by the gateway and the services, built on the OpenTelemetry SDK.
+
+The gateway starts a span per HTTP request and sends its W3C traceparent with every gRPC call; the services continue
+it in a span per RPC (ServerInterceptor) and per statement (microservices.common.db.InstrumentedCursor), so one trace
+shows where a request spent its time. Tracing is off until configure() finds an exporter:
+
+    TRACES_EXPORTER       none (default), console, file, memory, otlp, or module:attribute of a SpanExporter factory
+    TRACES_FILE           where the file exporter appends spans as JSON lines (default traces.jsonl)
+    TRACES_SAMPLE_RATIO   share of new traces recorded (default 1.0); calls from a traced caller follow its decision
+"""
+import importlib
+import os
+import threading
+
+import grpc
+from opentelemetry import context as otel_context
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor, ConsoleSpanExporter, SimpleSpanProcessor, SpanExporter, SpanExportResult,
+)
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import SpanKind, Status, StatusCode
+
+TRACES_EXPORTER = os.getenv("TRACES_EXPORTER", "none")
+TRACES_FILE = os.getenv("TRACES_FILE", "traces.jsonl")
+TRACES_SAMPLE_RATIO = float(os.getenv("TRACES_SAMPLE_RATIO", "1.0"))
+
+_tracer = trace.NoOpTracer()
+_provider = None
+
+
+class JsonLinesSpanExporter(SpanExporter):
+    """Appends finished spans to a file, one JSON object per line, for analysing traces offline"""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, spans):
+        lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+        with self.lock, open(self.path, "a") as file:
+            file.write(lines)
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+
+def exporter_from_env(name=None):
+    """The exporter TRACES_EXPORTER names, or None when tracing is off"""
+    name = (name or TRACES_EXPORTER).strip()
+    if name in ("", "none"):
+        return None
+    if name == "console":
+        return ConsoleSpanExporter()
+    if name == "file":
+        return JsonLinesSpanExporter(TRACES_FILE)
+    if name == "memory":
+        return InMemorySpanExporter()
+    if name == "otlp":
+        # Optional dependency (opentelemetry-exporter-otlp-proto-http); reads the OTEL_EXPORTER_OTLP_* variables
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    if ":" in name:
+        module, attribute = name.split(":", 1)
+        return getattr(importlib.import_module(module), attribute)()
+    raise ValueError(f"Unknown TRACES_EXPORTER: {name}")
+
+
+def configure(service_name, exporter=None, sample_ratio=None):
+    """Sets up tracing for this process and returns the exporter in use, None when tracing stays off"""
+    global _tracer, _provider
+    if _provider is not None:
+        _provider.shutdown()
+        _provider = None
+    exporter = exporter if exporter is not None else exporter_from_env()
+    if exporter is None:
+        _tracer = trace.NoOpTracer()
+        return None
+
+    ratio = TRACES_SAMPLE_RATIO if sample_ratio is None else sample_ratio
+    _provider = TracerProvider(
+        resource=Resource.create({"service.name": service_name}),
+        sampler=ParentBased(TraceIdRatioBased(ratio)),
+    )
+    # In-memory spans are read back by the same process, so they are exported as soon as they end
+    if isinstance(exporter, InMemorySpanExporter):
+        _provider.add_span_processor(SimpleSpanProcessor(exporter))
+    else:
+        _provider.add_span_processor(BatchSpanProcessor(exporter))
+    _tracer = _provider.get_tracer("virtual-car-stand")
+    return exporter
+
+
+def enabled():
+    return _provider is not None
+
+
+def recording():
+    """Whether the current span is being recorded, i.e. work done now belongs to a sampled trace"""
+    return trace.get_current_span().is_recording()
+
+
+def span(name, kind=SpanKind.INTERNAL, attributes=None):
+    """Context manager running its block in a child span of the current one"""
+    return _tracer.start_as_current_span(name, kind=kind, attributes=attributes)
+
+
+def start_span(name, carrier=None, kind=SpanKind.INTERNAL, attributes=None):
+    """Starts a span without making it current, continuing the trace in carrier (headers or metadata) if given"""
+    parent = propagate.extract(carrier) if carrier is not None else None
+    return _tracer.start_span(name, context=parent, kind=kind, attributes=attributes)
+
+
+def attach(span):
+    """Makes span the current one until detach(token)"""
+    return otel_context.attach(trace.set_span_in_context(span))
+
+
+def detach(token):
+    otel_context.detach(token)
+
+
+def inject(metadata=None, span=None):
+    """gRPC metadata with the trace context of span (the current span by default) added"""
+    carrier = {}
+    propagate.inject(carrier, context=trace.set_span_in_context(span) if span is not None else None)
+    return tuple(metadata or ()) + tuple(carrier.items())
+
+
+def traceparent():
+    """The W3C traceparent of the current span, or None when it isn't being recorded"""
+    if not recording():
+        return None
+    carrier = {}
+    propagate.inject(carrier)
+    return carrier.get("traceparent")
+
+
+class ServerInterceptor(grpc.ServerInterceptor):
+    """Continues the caller's trace in a SERVER span around every unary RPC; streams are passed through"""
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if not enabled() or handler is None or handler.request_streaming or handler.response_streaming:
+            return handler
+
+        # "/package.CarService/CarsReadOne" -> "CarService/CarsReadOne"
+        service, method = handler_call_details.method.rsplit("/", 2)[-2:]
+        service = service.rsplit(".", 1)[-1]
+        name = f"{service}/{method}"
+        attributes = {"rpc.system": "grpc", "rpc.service": service, "rpc.method": method}
+        behavior = handler.unary_unary
+
+        def traced(request, context):
+            parent = propagate.extract(dict(context.invocation_metadata()))
+            with _tracer.start_as_current_span(name, context=parent, kind=SpanKind.SERVER, attributes=attributes) as current:
+                response = behavior(request, context)
+                code = context.code() or grpc.StatusCode.OK
+                current.set_attribute("rpc.grpc.status_code", code.value[0])
+                if code not in (grpc.StatusCode.OK, grpc.StatusCode.INVALID_ARGUMENT, grpc.StatusCode.NOT_FOUND,
+                                grpc.StatusCode.FAILED_PRECONDITION, grpc.StatusCode.ALREADY_EXISTS):
+                    current.set_status(Status(StatusCode.ERROR, context.details() or code.name))
+                return response
+
+        return grpc.unary_unary_rpc_method_handler(
+            traced, request_deserializer=handler.request_deserializer, response_serializer=handler.response_serializer
+        )
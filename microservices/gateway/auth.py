@@ -1,12 +1,16 @@
 import json
 import os
+import threading
+import time
 from functools import wraps
 from urllib.request import urlopen
 
-from flask import request, jsonify, _request_ctx_stack, session, redirect, url_for
+from flask import request, jsonify, _request_ctx_stack, session, redirect, url_for, g
 from jose import jwt
 from six.moves.urllib.parse import urlencode
 
+from microservices.common import tracing
+
 # Auth0 Configuration
 AUTH0_DOMAIN = os.environ.get("AUTH0_DOMAIN", "")
 AUTH0_CLIENT_ID = os.environ.get("AUTH0_CLIENT_ID", "")
@@ -16,6 +20,17 @@ AUTH0_AUDIENCE = os.environ.get("AUTH0_AUDIENCE", "")
 AUTH0_API_AUDIENCE = AUTH0_AUDIENCE
 ALGORITHMS = ["RS256"]
 
+# Where signing keys are fetched from; load tests point this at a local key set (file:// URLs work too)
+AUTH0_JWKS_URL = os.environ.get("AUTH0_JWKS_URL", f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
+
+# Auth0 signing keys rotate rarely; fetching them on every request put a round trip to Auth0 on each page load
+JWKS_TTL = int(os.environ.get("JWKS_TTL", "600"))
+# A token signed with a key the cached set doesn't have (a rotation) refetches it, at most every JWKS_MIN_REFRESH seconds
+# so tokens with made-up key IDs can't make every request download the set
+JWKS_MIN_REFRESH = int(os.environ.get("JWKS_MIN_REFRESH", "30"))
+_jwks = {"keys": None, "expires": 0.0, "refreshed": 0.0, "fetching": False}
+_jwks_lock = threading.Lock()
+
 # Error handler
 class AuthError(Exception):
     def __init__(self, error, status_code):
@@ -66,20 +81,51 @@ def check_permissions(permission, payload):
         }, 403)
     return True
 
-def verify_decode_jwt(token):
-    jsonurl = urlopen(f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
-    jwks = json.loads(jsonurl.read())
-    unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
+def get_jwks(refresh=False):
+    """
+    Returns the Auth0 JSON Web Key Set, refetched every JWKS_TTL seconds, or on refresh unless the last refresh was
+    under JWKS_MIN_REFRESH seconds ago
+    """
+    with _jwks_lock:
+        now = time.monotonic()
+        refresh = refresh and _jwks["refreshed"] + JWKS_MIN_REFRESH < now
+        stale = _jwks["expires"] < now or refresh
+        # While one request refetches the keys, the others keep using the cached ones
+        if not stale or (_jwks["fetching"] and _jwks["keys"] is not None):
+            return _jwks["keys"]
+        _jwks["fetching"] = True
+        if refresh:
+            _jwks["refreshed"] = now
+    # Fetched outside the lock, so a slow Auth0 doesn't hold up requests that can be verified with the cached keys
+    keys = None
+    try:
+        with urlopen(AUTH0_JWKS_URL) as jsonurl:
+            keys = json.loads(jsonurl.read())
+    finally:
+        with _jwks_lock:
+            _jwks["fetching"] = False
+            if keys is not None:
+                _jwks.update(keys=keys, expires=time.monotonic() + JWKS_TTL)
+    return keys
+
+def find_rsa_key(jwks, kid):
     for key in jwks["keys"]:
-        if key["kid"] == unverified_header["kid"]:
-            rsa_key = {
+        if key["kid"] == kid:
+            return {
                 "kty": key["kty"],
                 "kid": key["kid"],
                 "use": key["use"],
                 "n": key["n"],
                 "e": key["e"]
             }
+    return {}
+
+def verify_decode_jwt(token):
+    unverified_header = jwt.get_unverified_header(token)
+    rsa_key = find_rsa_key(get_jwks(), unverified_header["kid"])
+    if not rsa_key:
+        # Auth0 may have rotated its signing key since the set was cached
+        rsa_key = find_rsa_key(get_jwks(refresh=True), unverified_header["kid"])
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -107,13 +153,23 @@ def verify_decode_jwt(token):
     raise AuthError({"code": "invalid_header",
                     "description": "Unable to find appropriate key"}, 401)
 
+def verified_payload(token):
+    """Verifies the token once per request; later checks in the same request (or a batch sub-request) reuse the payload"""
+    cached = g.get("jwt_payload")
+    if cached and cached[0] == token:
+        return cached[1]
+    with tracing.span("verify_jwt"):
+        payload = verify_decode_jwt(token)
+    g.jwt_payload = (token, payload)
+    return payload
+
 def requires_auth(f):
     """Determines if the Access Token is valid"""
     @wraps(f)
     def decorated(*args, **kwargs):
         try:
             token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
+            payload = verified_payload(token)
             _request_ctx_stack.top.current_user = payload
             return f(*args, **kwargs)
         except AuthError as e:
@@ -125,7 +181,7 @@ def requires_permission(permission=''):
         @wraps(f)
         def decorated(*args, **kwargs):
             token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
+            payload = verified_payload(token)
             check_permissions(permission, payload)
             return f(*args, **kwargs)
         return decorated
@@ -0,0 +1,78 @@
+import itertools
+import json
+import os
+
+import grpc
+from grpc_health.v1 import health_pb2, health_pb2_grpc
+
+# Applied to every backend channel, in both directions
+MAX_MESSAGE_LENGTH = int(os.getenv("GRPC_MAX_MESSAGE_LENGTH", str(16 * 1024 * 1024)))
+
+# Idle connections are pinged so dead pods are noticed before a request is sent to them
+KEEPALIVE_TIME_MS = int(os.getenv("GRPC_KEEPALIVE_TIME_MS", "30000"))
+KEEPALIVE_TIMEOUT_MS = int(os.getenv("GRPC_KEEPALIVE_TIMEOUT_MS", "10000"))
+
+# Channels opened per backend; each keeps its own connection to every replica
+CHANNELS_PER_BACKEND = int(os.getenv("GRPC_CHANNELS_PER_BACKEND", "2"))
+
+# round_robin spreads calls over every address the target resolves to, i.e. one per pod behind a headless service.
+# Each connection also watches the pod's overall grpc.health.v1 status, and calls skip pods not SERVING; pods without
+# a health service count as serving
+SERVICE_CONFIG = json.dumps({"loadBalancingConfig": [{"round_robin": {}}], "healthCheckConfig": {"serviceName": ""}})
+
+def channel_options():
+    return [
+        ("grpc.max_send_message_length", MAX_MESSAGE_LENGTH),
+        ("grpc.max_receive_message_length", MAX_MESSAGE_LENGTH),
+        ("grpc.keepalive_time_ms", KEEPALIVE_TIME_MS),
+        ("grpc.keepalive_timeout_ms", KEEPALIVE_TIMEOUT_MS),
+        ("grpc.keepalive_permit_without_calls", 1),
+        ("grpc.http2.max_pings_without_data", 0),
+        ("grpc.service_config", SERVICE_CONFIG),
+        # Without this, channels to the same target share one process-wide set of connections
+        ("grpc.use_local_subchannel_pool", 1),
+    ]
+
+def backend_target(name, port):
+    """Target for a backend, overridable with <NAME>_SERVICE_TARGET; defaults to its headless service"""
+    return os.getenv(f"{name.upper().replace('-', '_')}_SERVICE_TARGET", f"dns:///{name}-service-headless:{port}")
+
+class PooledStub:
+    """Stub that hands out the per-channel stubs of one backend in turn, one per call"""
+    def __init__(self, stubs):
+        self._stubs = itertools.cycle(stubs)
+
+    def __getattr__(self, name):
+        return getattr(next(self._stubs), name)
+
+class ChannelManager:
+    """Owns the gateway's channels so they are created with the same options and closed together"""
+    def __init__(self, channels_per_backend=CHANNELS_PER_BACKEND):
+        self.channels_per_backend = channels_per_backend
+        self.channels = {}
+
+    def stub(self, target, stub_cls):
+        channels = [grpc.insecure_channel(target, options=channel_options()) for _ in range(self.channels_per_backend)]
+        self.channels.setdefault(target, []).extend(channels)
+        return PooledStub([stub_cls(channel) for channel in channels])
+
+    def check_health(self, timeout):
+        """Overall health status each backend reports, checked on all of them at once over one of their channels"""
+        request = health_pb2.HealthCheckRequest(service="")
+        calls = {
+            target: health_pb2_grpc.HealthStub(channels[0]).Check.future(request, timeout=timeout)
+            for target, channels in self.channels.items()
+        }
+        statuses = {}
+        for target, call in calls.items():
+            try:
+                statuses[target] = health_pb2.HealthCheckResponse.ServingStatus.Name(call.result().status)
+            except grpc.RpcError as e:
+                statuses[target] = e.code().name
+        return statuses
+
+    def close(self):
+        for channels in self.channels.values():
+            for channel in channels:
+                channel.close()
+        self.channels.clear()
@@ -1,60 +1,77 @@
 import os
 import json
-from flask import Flask, request, jsonify, render_template, session, redirect, url_for
+import hashlib
+from flask import (
+    Flask, request, jsonify, render_template, session, redirect, url_for, has_request_context, g,
+    make_response, send_from_directory, Response
+)
 from authlib.integrations.flask_client import OAuth
 from werkzeug.middleware.proxy_fix import ProxyFix
 from urllib.parse import urlencode
 from dotenv import load_dotenv
 import time
-from prometheus_client import Counter, Summary, Histogram, Gauge, start_http_server
+from prometheus_client import Counter, Summary, Histogram, Gauge
 import threading
+import logging
+from concurrent import futures
+from werkzeug.serving import make_server
 
 import grpc
 from google.protobuf.empty_pb2 import Empty
-from google.protobuf.json_format import MessageToDict, ParseDict
+from google.protobuf.field_mask_pb2 import FieldMask
+from google.protobuf.json_format import MessageToDict, ParseDict, ParseError
 from services.car_service_pb2 import (
     Car, CarsCreateRequest, CarsDeleteRequest,
-    CarsReadOneRequest, CarsUpdateRequest
+    CarsReadOneRequest, CarsUpdateRequest, CarsPatchRequest, CarsReadAllRequest
 )
 from services.car_service_pb2_grpc import CarServiceStub
 
 from services.user_service_pb2 import (
     User, UsersCreateRequest, UsersDeleteRequest,
-    UsersReadOneRequest, UsersUpdateRequest
+    UsersReadOneRequest, UsersUpdateRequest, UsersReadAllRequest
 )
 from services.user_service_pb2_grpc import UserServiceStub
 
 from services.maintenance_service_pb2 import (
     Maintenance, MaintenanceCreateRequest, MaintenanceDeleteRequest, 
-    MaintenanceReadOneRequest, MaintenanceUpdateRequest
+    MaintenanceReadOneRequest, MaintenanceUpdateRequest, MaintenanceReadAllRequest
 )
 from services.maintenance_service_pb2_grpc import MaintenanceServiceStub
 
 from services.inspection_service_pb2 import (
     Inspection, InspectionCreateRequest, InspectionDeleteRequest,
-    InspectionReadOneRequest, InspectionUpdateRequest
+    InspectionReadOneRequest, InspectionUpdateRequest, InspectionReadAllRequest
 )
 from services.inspection_service_pb2_grpc import InspectionServiceStub
 
 from services.transaction_service_pb2 import (
     Transaction, TransactionsCreateRequest, TransactionsDeleteRequest,
-    TransactionsReadOneRequest, TransactionsUpdateRequest
+    TransactionsReadOneRequest, TransactionsUpdateRequest, TransactionsReadAllRequest,
+    TransactionsReadRangeRequest, TransactionsReportRequest, TransactionsPatchRequest
 )
 from services.transaction_service_pb2_grpc import TransactionServiceStub
 
 from services.car_listing_service_pb2 import (
     CarListing, CarlistingCreateRequest, CarlistingDeleteRequest,
-    CarlistingReadOneRequest, CarlistingUpdateRequest
+    CarlistingReadOneRequest, CarlistingUpdateRequest, CarlistingStatsRequest,
+    CarlistingPatchRequest, CarlistingReadAllRequest
 )
 from services.car_listing_service_pb2_grpc import CarListingServiceStub
 
 from services.meeting_service_pb2 import (
     Meeting, MeetingsCreateRequest, MeetingsDeleteRequest,
-    MeetingsReadOneRequest, MeetingsUpdateRequest
+    MeetingsReadOneRequest, MeetingsUpdateRequest, MeetingsReadAllRequest,
+    MeetingsFindFreeSlotsRequest
 )
 from services.meeting_service_pb2_grpc import MeetingServiceStub
 
+from opentelemetry.trace import SpanKind, Status, StatusCode
+
+from microservices.common import profiling, shutdown, tracing
 from auth import requires_auth, requires_permission, AuthError
+from channels import ChannelManager, backend_target
+from listing_events import ListingEventHub
+from in_flight import InFlightRequests
 
 # Load environment variables
 load_dotenv()
@@ -62,10 +79,17 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", os.urandom(24))
 app.config["SESSION_TYPE"] = "filesystem"
+# Templates are compiled once and never re-checked on disk; a deploy restarts the process anyway
+app.config["TEMPLATES_AUTO_RELOAD"] = False
 
 # For running behind a proxy like Nginx in Kubernetes
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
+# Counts requests until their response is sent, so a shutdown lets them finish; set once SIGTERM is received
+IN_FLIGHT = InFlightRequests(app.wsgi_app)
+app.wsgi_app = IN_FLIGHT
+DRAINING = threading.Event()
+
 # Auth0 Config
 AUTH0_CLIENT_ID = os.environ.get("AUTH0_CLIENT_ID", "")
 AUTH0_CLIENT_SECRET = os.environ.get("AUTH0_CLIENT_SECRET", "")
@@ -100,20 +124,82 @@ REQUEST_COUNT = Counter('gateway_http_requests_total', 'Total HTTP requests coun
 REQUEST_LATENCY = Histogram('gateway_request_latency_seconds', 'Request latency in seconds', ['method', 'endpoint'])
 GRPC_REQUEST_LATENCY = Summary('gateway_grpc_request_latency_seconds', 'gRPC request latency in seconds', ['service', 'method'])
 ACTIVE_REQUESTS = Gauge('gateway_active_requests', 'Number of active HTTP requests', ['method', 'endpoint'])
+SSE_CLIENTS = Gauge('gateway_sse_clients', 'Open listing status event streams')
+
+# Prometheus and gateway ports; overridable so several processes can share one host
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
+GATEWAY_PORT = int(os.getenv("GATEWAY_PORT", "50000"))
 
 # Start Prometheus HTTP server on a separate thread
 def start_metrics_server():
-    start_http_server(8000)
-    print("Prometheus metrics server started on port 8000...")
+    profiling.start_http_server(METRICS_PORT)
+    print(f"Prometheus metrics server started on port {METRICS_PORT}...")
 
 threading.Thread(target=start_metrics_server).start()
 
+tracing.configure("gateway")
+
+# Clients may send this on POST so a retried create replays the first response instead of inserting twice
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+# POST /api/batch limits; sub-requests run on a shared pool of bounded size
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "20"))
+MAX_BATCH_RESPONSE_BYTES = int(os.getenv("MAX_BATCH_RESPONSE_BYTES", str(1024 * 1024)))
+BATCH_METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE"}
+BATCH_EXCLUDED_ENDPOINTS = {"batch", "stream_carlisting_events"}
+BATCH_EXECUTOR = futures.ThreadPoolExecutor(max_workers=int(os.getenv("BATCH_WORKERS", "16")))
+
+# Dashboard counts are the same for every user, so one cached copy serves everyone for DASHBOARD_SUMMARY_TTL seconds
+DASHBOARD_SUMMARY_TTL = float(os.getenv("DASHBOARD_SUMMARY_TTL", "30"))
+DASHBOARD_SUMMARY = {"expires": 0.0, "summary": None}
+DASHBOARD_SUMMARY_LOCK = threading.Lock()
+# The summary's calls get a pool of their own: a batch of summary requests fills BATCH_EXECUTOR, and the one building the
+# summary would then wait forever for calls queued behind it
+DASHBOARD_EXECUTOR = futures.ThreadPoolExecutor(max_workers=5)
+
+# /ready asks every backend's health service at once, each within READY_TIMEOUT seconds; the answer is reused for
+# READY_CACHE_TTL seconds so frequent probes from several sources don't each fan out to the backends
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", "1"))
+READY_CACHE_TTL = float(os.getenv("READY_CACHE_TTL", "2"))
+READY_STATUS = {"expires": 0.0, "backends": None}
+READY_STATUS_LOCK = threading.Lock()
+
+# Static assets are served under their content hash, so browsers may cache them forever
+STATIC_ASSET_MAX_AGE = 365 * 24 * 60 * 60
+ASSET_DIGESTS = {}
+for asset_name in os.listdir(app.static_folder):
+    with open(os.path.join(app.static_folder, asset_name), "rb") as asset:
+        ASSET_DIGESTS[asset_name] = hashlib.sha256(asset.read()).hexdigest()[:12]
+
+DASHBOARD_TEMPLATE = app.jinja_env.get_template("dashboard.html")
+
+# Listing status streams: each open stream holds a server thread, so their number is capped. An idle stream gets a
+# comment every SSE_HEARTBEAT seconds so proxies keep it open and closed clients are noticed; browsers reconnect after SSE_RETRY_MS
+MAX_SSE_CLIENTS = int(os.getenv("MAX_SSE_CLIENTS", "500"))
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "15"))
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", "3000"))
+SSE_CLIENT_SLOTS = threading.BoundedSemaphore(MAX_SSE_CLIENTS)
+
+@app.template_global()
+def asset_url(filename):
+    return url_for("hashed_asset", digest=ASSET_DIGESTS[filename], filename=filename)
+
 # Request monitoring middleware
 @app.before_request
 def before_request():
     request.start_time = time.time()
     endpoint = request.endpoint if request.endpoint else 'unknown'
     ACTIVE_REQUESTS.labels(method=request.method, endpoint=endpoint).inc()
+    # Continues a trace started by the caller (or the batch request) and is current for every gRPC call made below
+    route = request.url_rule.rule if request.url_rule else 'unknown'
+    request.trace_span = tracing.start_span(
+        f"{request.method} {route}", carrier=request.headers, kind=SpanKind.SERVER,
+        attributes={"http.method": request.method, "http.route": route, "http.target": request.full_path},
+    )
+    request.trace_token = tracing.attach(request.trace_span)
+    if len(request.headers.get(IDEMPOTENCY_KEY_HEADER, "")) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        return jsonify({"error": f"{IDEMPOTENCY_KEY_HEADER} must be at most {MAX_IDEMPOTENCY_KEY_LENGTH} characters"}), 400
 
 @app.after_request
 def after_request(response):
@@ -122,46 +208,97 @@ def after_request(response):
     REQUEST_LATENCY.labels(method=request.method, endpoint=endpoint).observe(resp_time)
     REQUEST_COUNT.labels(method=request.method, endpoint=endpoint, status=response.status_code).inc()
     ACTIVE_REQUESTS.labels(method=request.method, endpoint=endpoint).dec()
+    request.trace_span.set_attribute("http.status_code", response.status_code)
+    if response.status_code >= 500:
+        request.trace_span.set_status(Status(StatusCode.ERROR))
+    if DRAINING.is_set():
+        # Keep-alive connections would bring more requests to a gateway that is going away
+        response.headers["Connection"] = "close"
     return response
 
-MAX_MESSAGE_LENGTH = 16 * 1024 * 1024  
-
-# Set up gRPC channels and clients for each service
-CAR_CHANNEL = grpc.insecure_channel(
-    "car-service:50008",
-    options=[("grpc.max_receive_message_length", MAX_MESSAGE_LENGTH)]
-)
-CAR_CLIENT = CarServiceStub(CAR_CHANNEL)
-
-USER_CHANNEL = grpc.insecure_channel("user-service:50007")
-USER_CLIENT = UserServiceStub(USER_CHANNEL)
-
-MAINTENANCE_CHANNEL = grpc.insecure_channel("maintenance-service:50012")
-MAINTENANCE_CLIENT = MaintenanceServiceStub(MAINTENANCE_CHANNEL)
-
-INSPECTION_CHANNEL = grpc.insecure_channel("inspection-service:50011")
-INSPECTION_CLIENT = InspectionServiceStub(INSPECTION_CHANNEL)
-
-TRANSACTION_CHANNEL = grpc.insecure_channel("transaction-service:50010")
-TRANSACTION_CLIENT = TransactionServiceStub(TRANSACTION_CHANNEL)
-
-CARLISTING_CHANNEL = grpc.insecure_channel(
-    "car-listing-service:50009",
-    options=[("grpc.max_receive_message_length", MAX_MESSAGE_LENGTH)]
-)
-CARLISTING_CLIENT = CarListingServiceStub(CARLISTING_CHANNEL)
+# Ends the request span here rather than in after_request, which an unhandled exception skips
+@app.teardown_request
+def teardown_request(error):
+    span = getattr(request, "trace_span", None)
+    if span is None:
+        return
+    if error is not None:
+        span.record_exception(error)
+        span.set_status(Status(StatusCode.ERROR, str(error)))
+    tracing.detach(request.trace_token)
+    span.end()
+
+# Set up gRPC clients for each service; every backend gets pooled, round-robin channels with keepalive
+CHANNELS = ChannelManager()
+CAR_CLIENT = CHANNELS.stub(backend_target("car", 50008), CarServiceStub)
+USER_CLIENT = CHANNELS.stub(backend_target("user", 50007), UserServiceStub)
+MAINTENANCE_CLIENT = CHANNELS.stub(backend_target("maintenance", 50012), MaintenanceServiceStub)
+INSPECTION_CLIENT = CHANNELS.stub(backend_target("inspection", 50011), InspectionServiceStub)
+TRANSACTION_CLIENT = CHANNELS.stub(backend_target("transaction", 50010), TransactionServiceStub)
+CARLISTING_CLIENT = CHANNELS.stub(backend_target("car-listing", 50009), CarListingServiceStub)
+MEETING_CLIENT = CHANNELS.stub(backend_target("meeting", 50015), MeetingServiceStub)
+
+# One status subscription to the car listing service per gateway process, fanned out to every SSE client
+LISTING_EVENTS = ListingEventHub(CARLISTING_CLIENT)
+
+# Forwards the Idempotency-Key of the current POST request as gRPC metadata
+def idempotency_metadata():
+    if has_request_context() and request.method == "POST" and request.headers.get(IDEMPOTENCY_KEY_HEADER):
+        return (("idempotency-key", request.headers[IDEMPOTENCY_KEY_HEADER]),)
+    return None
+
+# A create retried while the attempt holding its Idempotency-Key is still running; the retry after it replays its response
+def idempotency_in_progress():
+    response = jsonify({"error": f"A request with this {IDEMPOTENCY_KEY_HEADER} is still in progress"})
+    response.headers["Retry-After"] = "1"
+    return response, 409
+
+# Row version from an If-Match header ("3", W/"3" or *) for optimistic concurrency, 0 when absent or *
+def if_match_version():
+    value = request.headers.get("If-Match", "").strip()
+    if not value or value == "*":
+        return 0
+    return int(value.removeprefix("W/").strip('"'))
+
+# JSON response for a versioned message, with its version as the ETag to send back in If-Match
+def versioned_response(message):
+    response = jsonify(MessageToDict(message))
+    response.headers["ETag"] = f'"{message.version}"'
+    return response
 
-MEETING_CHANNEL = grpc.insecure_channel("meeting-service:50015")
-MEETING_CLIENT = MeetingServiceStub(MEETING_CHANNEL)
+# Parses a PATCH body into a message plus a FieldMask naming only the fields the body contains
+def parse_patch(data, message_cls):
+    message = ParseDict(data, message_cls())
+    fields = message_cls.DESCRIPTOR
+    paths = [(fields.fields_by_camelcase_name.get(key) or fields.fields_by_name[key]).name for key in data]
+    return message, FieldMask(paths=paths)
+
+# FieldMask for the comma-separated `fields` query parameter (JSON or proto field names), raising ValueError on unknown fields
+def read_mask(message_cls):
+    fields = message_cls.DESCRIPTOR
+    paths = []
+    for name in filter(None, (name.strip() for name in request.args.get("fields", "").split(","))):
+        field = fields.fields_by_camelcase_name.get(name) or fields.fields_by_name.get(name)
+        if field is None:
+            raise ValueError(f"Unknown field: {name}")
+        paths.append(field.name)
+    return FieldMask(paths=paths)
 
 # Helper function to measure gRPC call latency
 def timed_grpc_call(service, method, call_fn, *args, **kwargs):
+    metadata = idempotency_metadata()
+    if metadata:
+        kwargs.setdefault("metadata", metadata)
     with GRPC_REQUEST_LATENCY.labels(service=service, method=method).time():
-        try:
-            result = call_fn(*args, **kwargs)
-            return result
-        except Exception as e:
-            raise e
+        with tracing.span(f"{service}/{method}", kind=SpanKind.CLIENT, attributes={"rpc.system": "grpc", "rpc.service": service, "rpc.method": method}):
+            # The service continues this span from the traceparent sent along with the call
+            if tracing.enabled():
+                kwargs["metadata"] = tracing.inject(kwargs.get("metadata"))
+            try:
+                result = call_fn(*args, **kwargs)
+                return result
+            except Exception as e:
+                raise e
 
 # Auth routes
 @app.route("/")
@@ -205,17 +342,23 @@ def callback_handling():
         # First check if user exists
         request_msg = UsersReadOneRequest(userId=0)  # Placeholder ID, we'll search by email
         
-        # We need to get all users and find by email (not optimal, but works for demo)
-        all_users_request = Empty()
-        all_users_response = USER_CLIENT.UsersReadAll(all_users_request)
-        
+        # We need to page through all users and find by email (not optimal, but works for demo)
         user_exists = False
         user_id = None
+        page_token = ""
         
-        for user in all_users_response.data:
-            if user.email == userinfo.get('email'):
-                user_exists = True
-                user_id = user.userId
+        while True:
+            all_users_request = UsersReadAllRequest(pageToken=page_token)
+            all_users_response = USER_CLIENT.UsersReadAll(all_users_request)
+            
+            for user in all_users_response.data:
+                if user.email == userinfo.get('email'):
+                    user_exists = True
+                    user_id = user.userId
+                    break
+            
+            page_token = all_users_response.nextPageToken
+            if user_exists or not page_token:
                 break
         
         if not user_exists:
@@ -263,15 +406,70 @@ def dashboard():
     if 'profile' not in session:
         return redirect('/')
     
-    userinfo = session.get('profile')
-    userinfo_json = session.get('jwt_payload')
-    userinfo_pretty = json.dumps(userinfo_json, indent=4)
-    
-    return render_template(
-        'dashboard.html',
-        userinfo=userinfo,
-        userinfo_pretty=userinfo_pretty
+    response = make_response(render_template(
+        DASHBOARD_TEMPLATE,
+        userinfo=session.get('profile'),
+        profile=session.get('jwt_payload')
+    ))
+    # Revalidated on every visit, but an unchanged page is answered with an empty 304
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route("/assets/<digest>/<path:filename>")
+def hashed_asset(digest, filename):
+    if ASSET_DIGESTS.get(filename) != digest:
+        return jsonify({"error": "Asset not found"}), 404
+    response = send_from_directory(app.static_folder, filename, max_age=STATIC_ASSET_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+def build_dashboard_summary():
+    """Collects the dashboard counts from the services' pre-aggregated summaries, concurrently"""
+    listing_jobs = {
+        status: DASHBOARD_EXECUTOR.submit(
+            timed_grpc_call, 'carlisting', 'CarlistingStats', CARLISTING_CLIENT.CarlistingStats,
+            CarlistingStatsRequest(status=status)
+        )
+        for status in ("StatusEnum_AVAILABLE", "StatusEnum_RESERVED", "StatusEnum_SOLD")
+    }
+    maintenance_job = DASHBOARD_EXECUTOR.submit(
+        timed_grpc_call, 'maintenance', 'MaintenanceOpenCounts', MAINTENANCE_CLIENT.MaintenanceOpenCounts, Empty()
     )
+    transactions_job = DASHBOARD_EXECUTOR.submit(
+        timed_grpc_call, 'transaction', 'TransactionsReportRentVsBuy', TRANSACTION_CLIENT.TransactionsReportRentVsBuy,
+        TransactionsReportRequest()
+    )
+    return {
+        "listings": {status: sum(group.listings for group in job.result().data) for status, job in listing_jobs.items()},
+        "openMaintenances": {
+            Maintenance.MaintenanceTypeEnum.Name(count.maintenanceType): count.openCount
+            for count in maintenance_job.result().data
+        },
+        "transactions": {
+            Transaction.TypeEnum.Name(split.type): {"transactions": split.transactions, "revenue": split.revenue}
+            for split in transactions_job.result().data
+        },
+    }
+
+@app.route("/api/dashboard/summary", methods=["GET"])
+@requires_auth
+@requires_permission('read:dashboard')
+def get_dashboard_summary():
+    try:
+        with DASHBOARD_SUMMARY_LOCK:
+            if DASHBOARD_SUMMARY["expires"] < time.monotonic():
+                DASHBOARD_SUMMARY["summary"] = build_dashboard_summary()
+                DASHBOARD_SUMMARY["expires"] = time.monotonic() + DASHBOARD_SUMMARY_TTL
+            summary = DASHBOARD_SUMMARY["summary"]
+    except grpc.RpcError as e:
+        return jsonify({"error": str(e)}), 500
+    response = jsonify(summary)
+    response.cache_control.private = True
+    response.cache_control.max_age = int(DASHBOARD_SUMMARY_TTL)
+    return response
 
 @app.route("/logout")
 def logout():
@@ -286,18 +484,29 @@ def logout():
 @app.route("/api/cars", methods=["GET"])
 def get_all_cars():
     try:
-        request = Empty()
-        response = timed_grpc_call('car', 'CarsReadAll', CAR_CLIENT.CarsReadAll, request)
+        request_msg = CarsReadAllRequest(
+            pageSize=request.args.get("pageSize", 0, type=int),
+            pageToken=request.args.get("pageToken", ""),
+            orderBy=request.args.get("orderBy", ""),
+            readMask=read_mask(Car)
+        )
+        response = timed_grpc_call('car', 'CarsReadAll', CAR_CLIENT.CarsReadAll, request_msg)
         return jsonify(MessageToDict(response))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
+            return jsonify({"error": "Invalid pagination or ordering parameters"}), 400
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/cars/<int:car_id>", methods=["GET"])
 def get_car(car_id):
     try:
-        request = CarsReadOneRequest(carId=car_id)
-        response = timed_grpc_call('car', 'CarsReadOne', CAR_CLIENT.CarsReadOne, request)
-        return jsonify(MessageToDict(response))
+        request_msg = CarsReadOneRequest(carId=car_id, readMask=read_mask(Car))
+        response = timed_grpc_call('car', 'CarsReadOne', CAR_CLIENT.CarsReadOne, request_msg)
+        return versioned_response(response)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except grpc.RpcError as e:
         if e.code() == grpc.StatusCode.NOT_FOUND:
             return jsonify({"error": "Car not found"}), 404
@@ -314,6 +523,8 @@ def create_car():
         response = timed_grpc_call('car', 'CarsCreate', CAR_CLIENT.CarsCreate, request_msg)
         return jsonify(MessageToDict(response)), 201
     except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.ABORTED:
+            return idempotency_in_progress()
         if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
             return jsonify({"error": "Invalid input"}), 400
         return jsonify({"error": str(e)}), 500
@@ -325,16 +536,42 @@ def update_car(car_id):
     try:
         car_data = request.json
         car = ParseDict(car_data, Car())
-        request_msg = CarsUpdateRequest(carId=car_id, car=car)
+        request_msg = CarsUpdateRequest(carId=car_id, car=car, expectedVersion=if_match_version())
         response = timed_grpc_call('car', 'CarsUpdate', CAR_CLIENT.CarsUpdate, request_msg)
-        return jsonify(MessageToDict(response))
+        return versioned_response(response)
+    except ValueError:
+        return jsonify({"error": "Invalid If-Match header"}), 400
     except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.FAILED_PRECONDITION:
+            return jsonify({"error": "Car was modified by another request"}), 412
         if e.code() == grpc.StatusCode.NOT_FOUND:
             return jsonify({"error": "Car not found"}), 404
         if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
             return jsonify({"error": "Invalid input"}), 400
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/cars/<int:car_id>", methods=["PATCH"])
+@requires_auth
+@requires_permission('update:car')
+def patch_car(car_id):
+    try:
+        car, update_mask = parse_patch(request.json, Car)
+        request_msg = CarsPatchRequest(carId=car_id, car=car, updateMask=update_mask, expectedVersion=if_match_version())
+        response = timed_grpc_call('car', 'CarsPatch', CAR_CLIENT.CarsPatch, request_msg)
+        return versioned_response(response)
+    except ParseError:
+        return jsonify({"error": "Invalid input"}), 400
+    except ValueError:
+        return jsonify({"error": "Invalid If-Match header"}), 400
+    except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.FAILED_PRECONDITION:
+            return jsonify({"error": "Car was modified by another request"}), 412
+        if e.code() == grpc.StatusCode.NOT_FOUND:
+            return jsonify({"error": "Car not found"}), 404
+        if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
+            return jsonify({"error": e.details()}), 400
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/api/cars/<int:car_id>", methods=["DELETE"])
 @requires_auth
 @requires_permission('delete:car')
@@ -352,18 +589,28 @@ def delete_car(car_id):
 @app.route("/api/users", methods=["GET"])
 def get_all_users():
     try:
-        request = Empty()
-        response = timed_grpc_call('user', 'UsersReadAll', USER_CLIENT.UsersReadAll, request)
+        request_msg = UsersReadAllRequest(
+            pageSize=request.args.get("pageSize", 0, type=int),
+            pageToken=request.args.get("pageToken", ""),
+            readMask=read_mask(User)
+        )
+        response = timed_grpc_call('user', 'UsersReadAll', USER_CLIENT.UsersReadAll, request_msg)
         return jsonify(MessageToDict(response))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
+            return jsonify({"error": "Invalid pagination parameters"}), 400
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/users/<int:user_id>", methods=["GET"])
 def get_user(user_id):
     try:
-        request = UsersReadOneRequest(userId=user_id)
-        response = timed_grpc_call('user', 'UsersReadOne', USER_CLIENT.UsersReadOne, request)
+        request_msg = UsersReadOneRequest(userId=user_id, readMask=read_mask(User))
+        response = timed_grpc_call('user', 'UsersReadOne', USER_CLIENT.UsersReadOne, request_msg)
         return jsonify(MessageToDict(response))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except grpc.RpcError as e:
         if e.code() == grpc.StatusCode.NOT_FOUND:
             return jsonify({"error": "User not found"}), 404
@@ -380,6 +627,8 @@ def create_user():
         response = timed_grpc_call('user', 'UsersCreate', USER_CLIENT.UsersCreate, request_msg)
         return jsonify(MessageToDict(response)), 201
     except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.ABORTED:
+            return idempotency_in_progress()
         if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
             return jsonify({"error": "Invalid input"}), 400
         return jsonify({"error": str(e)}), 500
@@ -415,21 +664,41 @@ def delete_user(user_id):
         return jsonify({"error": str(e)}), 500
 
 # Maintenance Service Routes
+@app.route("/api/maintenances/open-counts", methods=["GET"])
+@requires_auth
+@requires_permission('read:dashboard')
+def get_open_maintenance_counts():
+    try:
+        response = timed_grpc_call('maintenance', 'MaintenanceOpenCounts', MAINTENANCE_CLIENT.MaintenanceOpenCounts, Empty())
+        return jsonify(MessageToDict(response))
+    except grpc.RpcError as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/api/maintenances", methods=["GET"])
 def get_all_maintenances():
     try:
-        request = Empty()
-        response = timed_grpc_call('maintenance', 'MaintenanceReadAll', MAINTENANCE_CLIENT.MaintenanceReadAll, request)
+        request_msg = MaintenanceReadAllRequest(
+            pageSize=request.args.get("pageSize", 0, type=int),
+            pageToken=request.args.get("pageToken", ""),
+            readMask=read_mask(Maintenance)
+        )
+        response = timed_grpc_call('maintenance', 'MaintenanceReadAll', MAINTENANCE_CLIENT.MaintenanceReadAll, request_msg)
         return jsonify(MessageToDict(response))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
+            return jsonify({"error": "Invalid pagination parameters"}), 400
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/maintenances/<int:maintenance_id>", methods=["GET"])
 def get_maintenance(maintenance_id):
     try:
-        request = MaintenanceReadOneRequest(maintenanceId=maintenance_id)
-        response = timed_grpc_call('maintenance', 'MaintenanceReadOne', MAINTENANCE_CLIENT.MaintenanceReadOne, request)
+        request_msg = MaintenanceReadOneRequest(maintenanceId=maintenance_id, readMask=read_mask(Maintenance))
+        response = timed_grpc_call('maintenance', 'MaintenanceReadOne', MAINTENANCE_CLIENT.MaintenanceReadOne, request_msg)
         return jsonify(MessageToDict(response))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except grpc.RpcError as e:
         if e.code() == grpc.StatusCode.NOT_FOUND:
             return jsonify({"error": "Maintenance not found"}), 404
@@ -446,6 +715,8 @@ def create_maintenance():
         response = timed_grpc_call('maintenance', 'MaintenanceCreate', MAINTENANCE_CLIENT.MaintenanceCreate, request_msg)
         return jsonify(MessageToDict(response)), 201
     except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.ABORTED:
+            return idempotency_in_progress()
         if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
             return jsonify({"error": "Invalid input"}), 400
         return jsonify({"error": str(e)}), 500
@@ -484,18 +755,28 @@ def delete_maintenance(maintenance_id):
 @app.route("/api/inspections", methods=["GET"])
 def get_all_inspections():
     try:
-        request = Empty()
-        response = timed_grpc_call('inspection', 'InspectionReadAll', INSPECTION_CLIENT.InspectionReadAll, request)
+        request_msg = InspectionReadAllRequest(
+            pageSize=request.args.get("pageSize", 0, type=int),
+            pageToken=request.args.get("pageToken", ""),
+            readMask=read_mask(Inspection)
+        )
+        response = timed_grpc_call('inspection', 'InspectionReadAll', INSPECTION_CLIENT.InspectionReadAll, request_msg)
         return jsonify(MessageToDict(response))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
+            return jsonify({"error": "Invalid pagination parameters"}), 400
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/inspections/<int:inspection_id>", methods=["GET"])
 def get_inspection(inspection_id):
     try:
-        request = InspectionReadOneRequest(inspectionId=inspection_id)
-        response = timed_grpc_call('inspection', 'InspectionReadOne', INSPECTION_CLIENT.InspectionReadOne, request)
+        request_msg = InspectionReadOneRequest(inspectionId=inspection_id, readMask=read_mask(Inspection))
+        response = timed_grpc_call('inspection', 'InspectionReadOne', INSPECTION_CLIENT.InspectionReadOne, request_msg)
         return jsonify(MessageToDict(response))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except grpc.RpcError as e:
         if e.code() == grpc.StatusCode.NOT_FOUND:
             return jsonify({"error": "Inspection not found"}), 404
@@ -512,6 +793,8 @@ def create_inspection():
         response = timed_grpc_call('inspection', 'InspectionCreate', INSPECTION_CLIENT.InspectionCreate, request_msg)
         return jsonify(MessageToDict(response)), 201
     except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.ABORTED:
+            return idempotency_in_progress()
         if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
             return jsonify({"error": "Invalid input"}), 400
         return jsonify({"error": str(e)}), 500
@@ -550,18 +833,82 @@ def delete_inspection(inspection_id):
 @app.route("/api/transactions", methods=["GET"])
 def get_all_transactions():
     try:
-        request = Empty()
-        response = timed_grpc_call('transaction', 'TransactionsReadAll', TRANSACTION_CLIENT.TransactionsReadAll, request)
+        request_msg = TransactionsReadAllRequest(
+            pageSize=request.args.get("pageSize", 0, type=int),
+            pageToken=request.args.get("pageToken", ""),
+            readMask=read_mask(Transaction)
+        )
+        response = timed_grpc_call('transaction', 'TransactionsReadAll', TRANSACTION_CLIENT.TransactionsReadAll, request_msg)
         return jsonify(MessageToDict(response))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
+            return jsonify({"error": "Invalid pagination parameters"}), 400
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/transactions/range", methods=["GET"])
+def get_transactions_range():
+    try:
+        request_msg = TransactionsReadRangeRequest(
+            fromDate=request.args.get("from", ""),
+            toDate=request.args.get("to", ""),
+            status=request.args.get("status", "StatusEnum_UNKNOWN"),
+            type=request.args.get("type", "TypeEnum_UNKNOWN"),
+            pageSize=request.args.get("pageSize", 0, type=int),
+            pageToken=request.args.get("pageToken", ""),
+            readMask=read_mask(Transaction)
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid status, type or fields"}), 400
+    try:
+        response = timed_grpc_call('transaction', 'TransactionsReadRange', TRANSACTION_CLIENT.TransactionsReadRange, request_msg)
+        return jsonify(MessageToDict(response))
+    except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
+            return jsonify({"error": "Invalid input"}), 400
+        return jsonify({"error": str(e)}), 500
+
+def run_report(method):
+    request_msg = TransactionsReportRequest(
+        fromDate=request.args.get("from", ""),
+        toDate=request.args.get("to", ""),
+        limit=request.args.get("limit", 0, type=int)
+    )
+    try:
+        response = timed_grpc_call('transaction', method, getattr(TRANSACTION_CLIENT, method), request_msg)
+        return jsonify(MessageToDict(response))
+    except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
+            return jsonify({"error": "Invalid input"}), 400
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/reports/revenue-by-month", methods=["GET"])
+@requires_auth
+@requires_permission('read:dashboard')
+def get_revenue_by_month_report():
+    return run_report('TransactionsReportRevenueByMonth')
+
+@app.route("/api/reports/average-price", methods=["GET"])
+@requires_auth
+@requires_permission('read:dashboard')
+def get_average_price_report():
+    return run_report('TransactionsReportAveragePrice')
+
+@app.route("/api/reports/rent-vs-buy", methods=["GET"])
+@requires_auth
+@requires_permission('read:dashboard')
+def get_rent_vs_buy_report():
+    return run_report('TransactionsReportRentVsBuy')
+
 @app.route("/api/transactions/<int:transaction_id>", methods=["GET"])
 def get_transaction(transaction_id):
     try:
-        request = TransactionsReadOneRequest(transactionId=transaction_id)
-        response = timed_grpc_call('transaction', 'TransactionsReadOne', TRANSACTION_CLIENT.TransactionsReadOne, request)
-        return jsonify(MessageToDict(response))
+        request_msg = TransactionsReadOneRequest(transactionId=transaction_id, readMask=read_mask(Transaction))
+        response = timed_grpc_call('transaction', 'TransactionsReadOne', TRANSACTION_CLIENT.TransactionsReadOne, request_msg)
+        return versioned_response(response)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except grpc.RpcError as e:
         if e.code() == grpc.StatusCode.NOT_FOUND:
             return jsonify({"error": "Transaction not found"}), 404
@@ -578,6 +925,8 @@ def create_transaction():
         response = timed_grpc_call('transaction', 'TransactionsCreate', TRANSACTION_CLIENT.TransactionsCreate, request_msg)
         return jsonify(MessageToDict(response)), 201
     except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.ABORTED:
+            return idempotency_in_progress()
         if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
             return jsonify({"error": "Invalid input"}), 400
         return jsonify({"error": str(e)}), 500
@@ -590,16 +939,44 @@ def update_transaction(transaction_id):
         transaction_data = request.json
         transaction = ParseDict(transaction_data, Transaction())
         transaction.transactionId = transaction_id  
-        request_msg = TransactionsUpdateRequest(transactionId=transaction_id, transaction=transaction)
+        request_msg = TransactionsUpdateRequest(transactionId=transaction_id, transaction=transaction, expectedVersion=if_match_version())
         response = timed_grpc_call('transaction', 'TransactionsUpdate', TRANSACTION_CLIENT.TransactionsUpdate, request_msg)
-        return jsonify(MessageToDict(response))
+        return versioned_response(response)
+    except ValueError:
+        return jsonify({"error": "Invalid If-Match header"}), 400
     except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.FAILED_PRECONDITION:
+            return jsonify({"error": "Transaction was modified by another request"}), 412
         if e.code() == grpc.StatusCode.NOT_FOUND:
             return jsonify({"error": "Transaction not found"}), 404
         if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
             return jsonify({"error": "Invalid input"}), 400
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/transactions/<int:transaction_id>", methods=["PATCH"])
+@requires_auth
+@requires_permission('update:transaction')
+def patch_transaction(transaction_id):
+    try:
+        transaction, update_mask = parse_patch(request.json, Transaction)
+        request_msg = TransactionsPatchRequest(
+            transactionId=transaction_id, transaction=transaction, updateMask=update_mask, expectedVersion=if_match_version()
+        )
+        response = timed_grpc_call('transaction', 'TransactionsPatch', TRANSACTION_CLIENT.TransactionsPatch, request_msg)
+        return versioned_response(response)
+    except ParseError:
+        return jsonify({"error": "Invalid input"}), 400
+    except ValueError:
+        return jsonify({"error": "Invalid If-Match header"}), 400
+    except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.FAILED_PRECONDITION:
+            return jsonify({"error": "Transaction was modified by another request"}), 412
+        if e.code() == grpc.StatusCode.NOT_FOUND:
+            return jsonify({"error": "Transaction not found"}), 404
+        if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
+            return jsonify({"error": e.details()}), 400
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/api/transactions/<int:transaction_id>", methods=["DELETE"])
 @requires_auth
 @requires_permission('delete:transaction')
@@ -617,18 +994,96 @@ def delete_transaction(transaction_id):
 @app.route("/api/carlistings", methods=["GET"])
 def get_all_carlistings():
     try:
-        request = Empty()
-        response = timed_grpc_call('carlisting', 'CarlistingReadAll', CARLISTING_CLIENT.CarlistingReadAll, request)
+        request_msg = CarlistingReadAllRequest(
+            pageSize=request.args.get("pageSize", 0, type=int),
+            pageToken=request.args.get("pageToken", ""),
+            orderBy=request.args.get("orderBy", ""),
+            readMask=read_mask(CarListing)
+        )
+        response = timed_grpc_call('carlisting', 'CarlistingReadAll', CARLISTING_CLIENT.CarlistingReadAll, request_msg)
         return jsonify(MessageToDict(response))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
+            return jsonify({"error": "Invalid pagination or ordering parameters"}), 400
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/carlistings/stats", methods=["GET"])
+@requires_auth
+@requires_permission('read:dashboard')
+def get_carlisting_stats():
+    try:
+        request_msg = CarlistingStatsRequest(
+            status=request.args.get("status", "StatusEnum_UNKNOWN"),
+            byCarType=request.args.get("by") == "carType"
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid status"}), 400
+    try:
+        response = timed_grpc_call('carlisting', 'CarlistingStats', CARLISTING_CLIENT.CarlistingStats, request_msg)
+        return jsonify(MessageToDict(response))
+    except grpc.RpcError as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/carlistings/events", methods=["GET"])
+def stream_carlisting_events():
+    """Pushes listing status changes as Server-Sent Events; repeat ?listingId= to only receive those listings"""
+    try:
+        listing_ids = {int(listing_id) for listing_id in request.args.getlist("listingId")}
+        last_event_id = int(request.headers.get("Last-Event-ID") or 0)
+    except ValueError:
+        return jsonify({"error": "listingId and Last-Event-ID must be integers"}), 400
+    
+    if not SSE_CLIENT_SLOTS.acquire(blocking=False):
+        response = jsonify({"error": "Too many open event streams"})
+        response.headers["Retry-After"] = str(SSE_RETRY_MS // 1000 or 1)
+        return response, 503
+    LISTING_EVENTS.ensure_started()
+    # A new client starts from now; a reconnecting one resumes after the last event it received
+    after_event_id = last_event_id or LISTING_EVENTS.last_event_id()
+    
+    def generate(after_event_id):
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        # Ends when the gateway shuts down; the browser reconnects, to another replica, from the last event it got
+        while not DRAINING.is_set():
+            events, resumed = LISTING_EVENTS.wait_after(after_event_id, SSE_HEARTBEAT)
+            if not resumed:
+                # Events since Last-Event-ID are no longer buffered; the client should refetch the listings it shows
+                yield "event: reset\ndata: {}\n\n"
+                after_event_id = 0
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            for event in events:
+                if not listing_ids or event.listingId in listing_ids:
+                    yield f"id: {event.eventId}\ndata: {json.dumps(MessageToDict(event))}\n\n"
+            after_event_id = events[-1].eventId
+            if listing_ids:
+                # Moves the browser's Last-Event-ID past the events this client filtered out
+                yield f"id: {after_event_id}\n\n"
+    
+    def release_slot():
+        SSE_CLIENTS.dec()
+        SSE_CLIENT_SLOTS.release()
+    
+    SSE_CLIENTS.inc()
+    response = Response(generate(after_event_id), mimetype="text/event-stream")
+    # Runs when the server closes the stream, including when the client disconnects before the first event
+    response.call_on_close(release_slot)
+    response.headers["Cache-Control"] = "no-cache"
+    # Stops nginx ingress from buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
 @app.route("/api/carlistings/<int:listing_id>", methods=["GET"])
 def get_carlisting(listing_id):
     try:
-        request = CarlistingReadOneRequest(listingId=listing_id)
-        response = timed_grpc_call('carlisting', 'CarlistingReadOne', CARLISTING_CLIENT.CarlistingReadOne, request)
-        return jsonify(MessageToDict(response))
+        request_msg = CarlistingReadOneRequest(listingId=listing_id, readMask=read_mask(CarListing))
+        response = timed_grpc_call('carlisting', 'CarlistingReadOne', CARLISTING_CLIENT.CarlistingReadOne, request_msg)
+        return versioned_response(response)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except grpc.RpcError as e:
         if e.code() == grpc.StatusCode.NOT_FOUND:
             return jsonify({"error": "Car listing not found"}), 404
@@ -645,6 +1100,8 @@ def create_carlisting():
         response = timed_grpc_call('carlisting', 'CarlistingCreate', CARLISTING_CLIENT.CarlistingCreate, request_msg)
         return jsonify(MessageToDict(response)), 201
     except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.ABORTED:
+            return idempotency_in_progress()
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/carlistings/<int:listing_id>", methods=["PUT"])
@@ -655,14 +1112,42 @@ def update_carlisting(listing_id):
         carlisting_data = request.json
         carlisting = ParseDict(carlisting_data, CarListing())
         carlisting.listingId = listing_id
-        request_msg = CarlistingUpdateRequest(listingId=listing_id, carListing=carlisting)
+        request_msg = CarlistingUpdateRequest(listingId=listing_id, carListing=carlisting, expectedVersion=if_match_version())
         response = timed_grpc_call('carlisting', 'CarlistingUpdate', CARLISTING_CLIENT.CarlistingUpdate, request_msg)
-        return jsonify(MessageToDict(response))
+        return versioned_response(response)
+    except ValueError:
+        return jsonify({"error": "Invalid If-Match header"}), 400
     except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.FAILED_PRECONDITION:
+            return jsonify({"error": "Car listing was modified by another request"}), 412
         if e.code() == grpc.StatusCode.NOT_FOUND:
             return jsonify({"error": "Car listing not found"}), 404
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/carlistings/<int:listing_id>", methods=["PATCH"])
+@requires_auth
+@requires_permission('update:carlisting')
+def patch_carlisting(listing_id):
+    try:
+        carlisting, update_mask = parse_patch(request.json, CarListing)
+        request_msg = CarlistingPatchRequest(
+            listingId=listing_id, carListing=carlisting, updateMask=update_mask, expectedVersion=if_match_version()
+        )
+        response = timed_grpc_call('carlisting', 'CarlistingPatch', CARLISTING_CLIENT.CarlistingPatch, request_msg)
+        return versioned_response(response)
+    except ParseError:
+        return jsonify({"error": "Invalid input"}), 400
+    except ValueError:
+        return jsonify({"error": "Invalid If-Match header"}), 400
+    except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.FAILED_PRECONDITION:
+            return jsonify({"error": "Car listing was modified by another request"}), 412
+        if e.code() == grpc.StatusCode.NOT_FOUND:
+            return jsonify({"error": "Car listing not found"}), 404
+        if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
+            return jsonify({"error": e.details()}), 400
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/api/carlistings/<int:listing_id>", methods=["DELETE"])
 @requires_auth
 @requires_permission('delete:carlisting')
@@ -680,18 +1165,47 @@ def delete_carlisting(listing_id):
 @app.route("/api/meetings", methods=["GET"])
 def get_all_meetings():
     try:
-        request = Empty()
-        response = timed_grpc_call('meeting', 'MeetingsReadAll', MEETING_CLIENT.MeetingsReadAll, request)
+        request_msg = MeetingsReadAllRequest(
+            pageSize=request.args.get("pageSize", 0, type=int),
+            pageToken=request.args.get("pageToken", ""),
+            readMask=read_mask(Meeting)
+        )
+        response = timed_grpc_call('meeting', 'MeetingsReadAll', MEETING_CLIENT.MeetingsReadAll, request_msg)
         return jsonify(MessageToDict(response))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
+            return jsonify({"error": "Invalid pagination parameters"}), 400
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/meetings/free-slots", methods=["GET"])
+def get_meeting_free_slots():
+    try:
+        request_msg = MeetingsFindFreeSlotsRequest(
+            staffId=request.args.get("staffId", 0, type=int),
+            fromDate=request.args.get("from", ""),
+            toDate=request.args.get("to", ""),
+            slotMinutes=request.args.get("slotMinutes", 0, type=int),
+            # Left unset when absent, for the service's default working hours; 0 is midnight
+            dayStartHour=request.args.get("dayStartHour", type=int),
+            dayEndHour=request.args.get("dayEndHour", type=int)
+        )
+        response = timed_grpc_call('meeting', 'MeetingsFindFreeSlots', MEETING_CLIENT.MeetingsFindFreeSlots, request_msg)
+        return jsonify(MessageToDict(response))
+    except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
+            return jsonify({"error": "Invalid input"}), 400
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/meetings/<int:meeting_id>", methods=["GET"])
 def get_meeting(meeting_id):
     try:
-        request = MeetingsReadOneRequest(meetingId=meeting_id)
-        response = timed_grpc_call('meeting', 'MeetingsReadOne', MEETING_CLIENT.MeetingsReadOne, request)
+        request_msg = MeetingsReadOneRequest(meetingId=meeting_id, readMask=read_mask(Meeting))
+        response = timed_grpc_call('meeting', 'MeetingsReadOne', MEETING_CLIENT.MeetingsReadOne, request_msg)
         return jsonify(MessageToDict(response))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except grpc.RpcError as e:
         if e.code() == grpc.StatusCode.NOT_FOUND:
             return jsonify({"error": "Meeting not found"}), 404
@@ -708,6 +1222,10 @@ def create_meeting():
         response = timed_grpc_call('meeting', 'MeetingsCreate', MEETING_CLIENT.MeetingsCreate, request_msg)
         return jsonify(MessageToDict(response)), 201
     except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.ABORTED:
+            return idempotency_in_progress()
+        if e.code() == grpc.StatusCode.ALREADY_EXISTS:
+            return jsonify({"error": "Meeting overlaps an existing meeting"}), 409
         if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
             return jsonify({"error": "Invalid input"}), 400
         return jsonify({"error": str(e)}), 500
@@ -726,6 +1244,8 @@ def update_meeting(meeting_id):
     except grpc.RpcError as e:
         if e.code() == grpc.StatusCode.NOT_FOUND:
             return jsonify({"error": "Meeting not found"}), 404
+        if e.code() == grpc.StatusCode.ALREADY_EXISTS:
+            return jsonify({"error": "Meeting overlaps an existing meeting"}), 409
         if e.code() == grpc.StatusCode.INVALID_ARGUMENT:
             return jsonify({"error": "Invalid input"}), 400
         return jsonify({"error": str(e)}), 500
@@ -743,9 +1263,97 @@ def delete_meeting(meeting_id):
             return jsonify({"error": "Meeting not found"}), 404
         return jsonify({"error": str(e)}), 500
 
+# Batch Route
+def run_batch_item(item, headers, jwt_payload):
+    """Dispatches one sub-request through the normal routes, reusing the JWT already verified for the batch"""
+    if not isinstance(item, dict) or not str(item.get("path", "")).startswith("/api/"):
+        return 400, {"error": "Each item needs a path under /api/"}, {}
+    method = str(item.get("method", "GET")).upper()
+    if method not in BATCH_METHODS:
+        return 400, {"error": f"Unsupported method: {method}"}, {}
+    item_headers = item.get("headers") or {}
+    if not isinstance(item_headers, dict):
+        return 400, {"error": "headers must be an object"}, {}
+    
+    with app.test_request_context(item["path"], method=method, json=item.get("body"), headers={**headers, **item_headers}):
+        # Streams never end, and would hold a batch worker for as long as the client stays connected
+        if request.url_rule is not None and request.url_rule.endpoint in BATCH_EXCLUDED_ENDPOINTS:
+            return 400, {"error": f"{item['path']} can't be part of a batch"}, {}
+        g.jwt_payload = jwt_payload
+        try:
+            response = app.full_dispatch_request()
+        except Exception as e:
+            return 500, {"error": str(e)}, {}
+        if response.is_streamed or response.mimetype == "text/event-stream":
+            response.close()
+            return 400, {"error": f"{item['path']} can't be part of a batch"}, {}
+        etag = response.headers.get("ETag")
+        return response.status_code, response.get_json(silent=True), {"ETag": etag} if etag else {}
+
+@app.route("/api/batch", methods=["POST"])
+@requires_auth
+def batch():
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Expected a non-empty JSON array of requests"}), 400
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"A batch may contain at most {MAX_BATCH_SIZE} requests"}), 413
+    
+    # Sub-requests see the caller's credentials, and the token checked by requires_auth is not verified again
+    headers = {name: request.headers[name] for name in ("Authorization", "Cookie") if name in request.headers}
+    headers.update(tracing.inject())
+    jobs = [BATCH_EXECUTOR.submit(run_batch_item, item, headers, g.get("jwt_payload")) for item in items]
+    
+    results = []
+    response_bytes = 0
+    for job in jobs:
+        status, body, response_headers = job.result()
+        result = {"status": status, "headers": response_headers, "body": body}
+        # Every item has run, so its status always stands; only bodies past the byte budget are left out, and the
+        # client reads those with a GET of their own instead of repeating the request
+        response_bytes += len(json.dumps(body))
+        if response_bytes > MAX_BATCH_RESPONSE_BYTES:
+            result["body"] = None
+            result["truncated"] = True
+        results.append(result)
+    return jsonify(results)
+
 @app.route("/health")
 def health_check():
     return jsonify({"status": "ok"}), 200
 
+@app.route("/ready")
+def readiness_check():
+    if DRAINING.is_set():
+        return jsonify({"status": "draining"}), 503
+    with READY_STATUS_LOCK:
+        if READY_STATUS["expires"] < time.monotonic():
+            READY_STATUS["backends"] = CHANNELS.check_health(READY_TIMEOUT)
+            READY_STATUS["expires"] = time.monotonic() + READY_CACHE_TTL
+        backends = READY_STATUS["backends"]
+    ready = all(status == "SERVING" for status in backends.values())
+    return jsonify({"status": "ready" if ready else "unavailable", "backends": backends}), 200 if ready else 503
+
+def drain(server, delay=shutdown.SHUTDOWN_DELAY, grace=shutdown.SHUTDOWN_GRACE):
+    """
+    Takes the gateway out of rotation and stops it once its requests are done: /ready fails and event streams end,
+    then after delay seconds new connections are refused and running requests get grace seconds to finish
+    """
+    started = time.monotonic()
+    DRAINING.set()
+    LISTING_EVENTS.stop()
+    time.sleep(delay)
+    server.shutdown()
+    if not IN_FLIGHT.wait_idle(grace):
+        logging.warning(f"Shutting down with {IN_FLIGHT.count} requests still running")
+    server.server_close()
+    CHANNELS.close()
+    logging.warning(f"Shut down in {time.monotonic() - started:.1f}s")
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=50000)
\ No newline at end of file
+    server = make_server("0.0.0.0", GATEWAY_PORT, app, threaded=True)
+    # drain() waits for requests itself, with a time limit; by default closing the server would wait for them forever
+    server.block_on_close = False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    shutdown.wait_for_signal()
+    drain(server)
\ No newline at end of file
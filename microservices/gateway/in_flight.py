@@ -0,0 +1,31 @@
+import threading
+
+from werkzeug.wsgi import ClosingIterator
+
+class InFlightRequests:
+    """WSGI middleware counting the requests whose response hasn't been sent yet, so a shutdown can wait for them"""
+    def __init__(self, app):
+        self.app = app
+        self.count = 0
+        self.condition = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        with self.condition:
+            self.count += 1
+        try:
+            response = self.app(environ, start_response)
+        except BaseException:
+            self.finished()
+            raise
+        # The server closes the response once it has been written, streamed ones included
+        return ClosingIterator(response, self.finished)
+
+    def finished(self):
+        with self.condition:
+            self.count -= 1
+            self.condition.notify_all()
+
+    def wait_idle(self, timeout):
+        """Waits up to timeout seconds for every request to finish; False if some are still running"""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.count == 0, timeout)
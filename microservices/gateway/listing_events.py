@@ -0,0 +1,50 @@
+import logging
+import os
+import threading
+
+import grpc
+
+from microservices.common.events import EventBuffer
+from services.car_listing_service_pb2 import CarlistingWatchStatusRequest
+
+# Events kept so a reconnecting browser can resume from its Last-Event-ID
+REPLAY_BUFFER = int(os.getenv("LISTING_EVENTS_REPLAY_BUFFER", "1000"))
+
+# Delay before resubscribing once the stream from the car listing service ends or fails, in seconds
+RESUBSCRIBE_DELAY = float(os.getenv("LISTING_EVENTS_RESUBSCRIBE_DELAY", "1"))
+
+class ListingEventHub(EventBuffer):
+    """Holds the gateway's single CarlistingWatchStatus subscription and shares its events with every SSE client"""
+    def __init__(self, stub, buffer_size=REPLAY_BUFFER):
+        super().__init__(buffer_size)
+        self.stub = stub
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def ensure_started(self):
+        """Subscribes on first use, so gateways nobody streams from don't hold a stream open"""
+        with self.condition:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                # Resuming after the last event received means a reconnect, even to another replica, misses nothing
+                for event in self.stub.CarlistingWatchStatus(CarlistingWatchStatusRequest(afterEventId=self.last_event_id())):
+                    if event.reset:
+                        self.clear()
+                    else:
+                        self.publish([event])
+            except grpc.RpcError as e:
+                logging.warning(f"Listing status subscription failed: {e}")
+            except Exception:
+                # Anything else would end the thread, and every SSE stream would stop receiving events for good
+                logging.exception("Listing status subscription failed unexpectedly")
+            self.stop_event.wait(RESUBSCRIBE_DELAY)
+
+    def stop(self):
+        self.stop_event.set()
+        # Wakes the SSE streams waiting for events, so they see the gateway is shutting down
+        self.wake()
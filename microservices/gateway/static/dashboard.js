@@ -0,0 +1,211 @@
+// Turns enum names such as StatusEnum_AVAILABLE into "available"
+function enumLabel(name) {
+    return name.replace(/^[A-Za-z]*Enum_/, '').toLowerCase();
+}
+
+function summaryTile(title, entries) {
+    const tile = document.createElement('div');
+    tile.className = 'summary-tile';
+    const heading = document.createElement('h3');
+    heading.textContent = title;
+    const list = document.createElement('dl');
+    for (const [name, value] of entries) {
+        const term = document.createElement('dt');
+        term.textContent = enumLabel(name);
+        const count = document.createElement('dd');
+        count.textContent = value;
+        list.append(term, count);
+    }
+    tile.append(heading, list);
+    return tile;
+}
+
+// Loads the pre-aggregated counts instead of the full collections
+async function loadSummary() {
+    const grid = document.getElementById('summary');
+    try {
+        const response = await fetch('/api/dashboard/summary', { credentials: 'same-origin' });
+        if (!response.ok) {
+            grid.textContent = `Error ${response.status}: ${response.statusText}`;
+            return;
+        }
+        const summary = await response.json();
+        grid.replaceChildren(
+            summaryTile('Car Listings', Object.entries(summary.listings)),
+            summaryTile('Open Maintenance', Object.entries(summary.openMaintenances)),
+            summaryTile('Transactions', Object.entries(summary.transactions).map(
+                ([type, totals]) => [type, `${totals.transactions} (${totals.revenue.toFixed(2)})`]
+            ))
+        );
+    } catch (error) {
+        console.error('Summary request failed:', error);
+        grid.textContent = 'Failed to load summary: ' + error.message;
+    }
+}
+
+// The profile is embedded compact and only pretty-printed in the browser
+function showProfile() {
+    const profile = JSON.parse(document.getElementById('profile-data').textContent);
+    document.getElementById('profile').textContent = JSON.stringify(profile, null, 4);
+}
+
+// Columns shown per collection, as the JSON keys the gateway answers with; `sortable` maps a column to the
+// orderBy value the backend accepts for it (the proto field name, which isn't always the JSON key).
+// Every collection is asked for just the shown columns
+const COLLECTIONS = {
+    cars: {
+        path: '/api/cars',
+        columns: ['carId', 'year', 'manufacturer', 'model', 'condition', 'fuel', 'odometer'],
+        sortable: { carId: 'carId', year: 'year', manufacturer: 'manufacturer', model: 'model' },
+    },
+    carlistings: {
+        path: '/api/carlistings',
+        columns: ['listingId', 'carId', 'type', 'status', 'salePrice', 'postingDate', 'promoted'],
+        sortable: { listingId: 'listingId', postingDate: 'posting_date', salePrice: 'sale_price' },
+    },
+    transactions: {
+        path: '/api/transactions',
+        columns: ['transactionId', 'buyerId', 'carId', 'type', 'status', 'totalAmount', 'transactionDate'],
+        sortable: {},
+    },
+    users: {
+        path: '/api/users',
+        columns: ['userId', 'firstName', 'lastName', 'email'],
+        sortable: {},
+    },
+    maintenances: {
+        path: '/api/maintenances',
+        columns: ['maintenanceId', 'maintenanceCarId', 'maintenanceType', 'maintenanceStatus', 'maintenanceCost', 'maintenanceStartDate'],
+        sortable: {},
+    },
+    inspections: {
+        path: '/api/inspections',
+        columns: ['inspectionId', 'inspectionCarId', 'inspectionStatus', 'inspectionCost', 'inspectionStartDate'],
+        sortable: {},
+    },
+    meetings: {
+        path: '/api/meetings',
+        columns: ['meetingId', 'clientId', 'staffId', 'scheduleDate', 'durationMinutes', 'status'],
+        sortable: {},
+    },
+};
+
+// Must match .table-row height in dashboard.css
+const ROW_HEIGHT = 32;
+const PAGE_SIZE = 100;
+// Extra rows rendered above and below the viewport so fast scrolling does not show gaps
+const OVERSCAN_ROWS = 10;
+// The next page is requested once the viewport gets this close to the last loaded row
+const PREFETCH_ROWS = 50;
+
+// Only the loaded rows are kept; the DOM holds just the visible window of them
+const table = { collection: null, orderBy: '', rows: [], nextPageToken: '', loading: false, done: false, generation: 0 };
+
+function cellText(value) {
+    if (value === undefined || value === null) return '';
+    return typeof value === 'string' ? value.replace(/^[A-Za-z]*Enum_/, '') : String(value);
+}
+
+function renderHeader() {
+    const { columns, sortable } = COLLECTIONS[table.collection];
+    const header = document.getElementById('table-header');
+    header.replaceChildren(...columns.map(column => {
+        const cell = document.createElement('span');
+        cell.textContent = column;
+        const orderBy = sortable[column];
+        if (orderBy) {
+            cell.className = 'sortable';
+            if (table.orderBy === orderBy) cell.textContent += ' \u25B2';
+            if (table.orderBy === '-' + orderBy) cell.textContent += ' \u25BC';
+            cell.addEventListener('click', () => {
+                openTable(table.collection, table.orderBy === orderBy ? '-' + orderBy : orderBy);
+            });
+        }
+        return cell;
+    }));
+}
+
+function renderRows() {
+    const { columns } = COLLECTIONS[table.collection];
+    const viewport = document.getElementById('table-viewport');
+    const first = Math.max(0, Math.floor(viewport.scrollTop / ROW_HEIGHT) - OVERSCAN_ROWS);
+    const last = Math.min(table.rows.length, Math.ceil((viewport.scrollTop + viewport.clientHeight) / ROW_HEIGHT) + OVERSCAN_ROWS);
+
+    document.getElementById('table-spacer').style.height = `${table.rows.length * ROW_HEIGHT}px`;
+    const rows = document.getElementById('table-rows');
+    rows.style.top = `${first * ROW_HEIGHT}px`;
+    rows.replaceChildren(...table.rows.slice(first, last).map(item => {
+        const row = document.createElement('div');
+        row.className = 'table-row';
+        row.append(...columns.map(column => {
+            const cell = document.createElement('span');
+            cell.textContent = cellText(item[column]);
+            return cell;
+        }));
+        return row;
+    }));
+
+    if (!table.done && last + PREFETCH_ROWS >= table.rows.length) loadNextPage();
+}
+
+async function loadNextPage() {
+    if (table.loading || table.done) return;
+    table.loading = true;
+    const generation = table.generation;
+    const { path, columns } = COLLECTIONS[table.collection];
+    const params = new URLSearchParams({ pageSize: PAGE_SIZE });
+    if (table.nextPageToken) params.set('pageToken', table.nextPageToken);
+    if (table.orderBy) params.set('orderBy', table.orderBy);
+    params.set('fields', columns.join(','));
+    const status = document.getElementById('table-status');
+    status.textContent = 'Loading...';
+    try {
+        const response = await fetch(`${path}?${params}`, { credentials: 'same-origin' });
+        // The user switched tables or sort order while this page was in flight
+        if (generation !== table.generation) return;
+        if (!response.ok) {
+            status.textContent = `Error ${response.status}: ${response.statusText}`;
+            table.done = true;
+            return;
+        }
+        const page = await response.json();
+        if (generation !== table.generation) return;
+        table.rows.push(...(page.data || []));
+        table.nextPageToken = page.nextPageToken || '';
+        table.done = !table.nextPageToken;
+        status.textContent = `${table.rows.length} rows loaded${table.done ? '' : ', scroll for more'}`;
+    } catch (error) {
+        if (generation !== table.generation) return;
+        console.error('Table request failed:', error);
+        status.textContent = 'Failed to load rows: ' + error.message;
+        table.done = true;
+    } finally {
+        if (generation === table.generation) {
+            table.loading = false;
+            renderRows();
+        }
+    }
+}
+
+function openTable(collection, orderBy = '') {
+    Object.assign(table, { collection, orderBy, rows: [], nextPageToken: '', loading: false, done: false });
+    table.generation += 1;
+    for (const tab of document.querySelectorAll('#table-tabs [data-collection]')) {
+        tab.classList.toggle('active', tab.dataset.collection === collection);
+    }
+    document.getElementById('table-viewport').scrollTop = 0;
+    renderHeader();
+    renderRows();
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    loadSummary();
+    showProfile();
+    for (const tab of document.querySelectorAll('#table-tabs [data-collection]')) {
+        tab.addEventListener('click', () => openTable(tab.dataset.collection));
+    }
+    document.getElementById('table-viewport').addEventListener('scroll', () => {
+        if (table.collection) requestAnimationFrame(renderRows);
+    }, { passive: true });
+    openTable('cars');
+});
@@ -4,7 +4,13 @@ import grpc
 import psycopg2
 from concurrent import futures
 from google.protobuf import empty_pb2
-from prometheus_client import start_http_server, Counter, Summary, Histogram, Gauge
+from prometheus_client import Counter
+
+from microservices.common import profiling, shutdown, tracing
+from microservices.common.metrics import ServerMetricsInterceptor
+from microservices.common.db import QueryMetrics
+from microservices.common.health import DatabaseHealth
+from microservices.common.idempotency import IdempotencyKeyInUse, IdempotencyKeys, idempotency_key_of
 
 from services import inspection_service_pb2_grpc
 from services import inspection_service_pb2
@@ -16,241 +22,285 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 
-# Prometheus metrics
-REQUEST_COUNT = Counter('inspection_request_count', 'Total number of requests by endpoint', ['endpoint', 'status'])
-REQUEST_LATENCY = Histogram('inspection_request_latency_seconds', 'Request latency in seconds', ['endpoint'])
-ACTIVE_REQUESTS = Gauge('inspection_active_requests', 'Number of active requests', ['endpoint'])
-DB_OPERATION_LATENCY = Summary('inspection_db_operation_latency_seconds', 'Database operation latency', ['operation'])
+# Prometheus port; overridable so several services can share one host
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
+
+# Prometheus metrics; every RPC is recorded by SERVER_METRICS and every statement by QUERY_METRICS
+SERVER_METRICS = ServerMetricsInterceptor('inspection')
+IDEMPOTENT_REPLAYS = Counter('inspection_idempotent_replay_count', 'Creates answered with the response stored by an earlier attempt', ['endpoint'])
+ROW_ERRORS = Counter('inspection_row_error_count', 'Rows a ReadAll skipped because they could not be converted', ['endpoint'])
+QUERY_METRICS = QueryMetrics('inspection')
+
+# Creates retried with the same idempotency key get the response stored by the first attempt
+IDEMPOTENCY_KEYS = IdempotencyKeys("inspection_idempotency")
+
+# ReadAll paging limits
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+MAX_RESPONSE_BYTES = int(os.getenv("MAX_RESPONSE_BYTES", str(3 * 1024 * 1024)))
+
+# Column behind each Inspection field and how to convert its value; reads select only the fields in the request's readMask
+INSPECTION_FIELDS = {
+    "inspectionId": ("inspection_id", int),
+    "inspectionCarId": ("inspection_car_id", int),
+    "inspectionStatus": ("inspection_status", Inspection.InspectionStatusEnum.Value),
+    "inspectionClientNotes": ("inspection_client_notes", lambda notes: notes if notes is not None else ""),
+    "inspectionStaffNotes": ("inspection_staff_notes", lambda notes: notes if notes is not None else ""),
+    "inspectionCost": ("inspection_cost", lambda cost: cost if cost is not None else 0.0),
+    "inspectionStartDate": ("inspection_start_date", lambda start_date: start_date.isoformat() if start_date is not None else ""),
+    "inspectionEndDate": ("inspection_end_date", lambda end_date: end_date.isoformat() if end_date is not None else ""),
+}
+
+def inspection_from_row(row, fields=tuple(INSPECTION_FIELDS)):
+    """Maps a row selected with the columns of `fields` to a Inspection, leaving the other fields unset"""
+    return Inspection(**{field: INSPECTION_FIELDS[field][1](value) for field, value in zip(fields, row)})
+
+def read_mask_fields(read_mask):
+    """Inspection fields to select for a readMask, in column order; None when the mask names an unknown field"""
+    paths = set(read_mask.paths)
+    if not paths:
+        return tuple(INSPECTION_FIELDS)
+    if not paths <= INSPECTION_FIELDS.keys():
+        return None
+    return tuple(field for field in INSPECTION_FIELDS if field in paths or field == "inspectionId")
+
+def select_columns(fields):
+    """Column list for a SELECT of the given Inspection fields"""
+    return ", ".join(INSPECTION_FIELDS[field][0] for field in fields)
 
 class InspectionService(inspection_service_pb2_grpc.InspectionServiceServicer):
     def __init__(self):
         self.conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT
+            dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT, cursor_factory=QUERY_METRICS.cursor_factory
         )
         self.cursor = self.conn.cursor()
 
     def InspectionCreate(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='InspectionCreate').inc()
-        
+        idempotency_key = idempotency_key_of(context)
         try:
-            with REQUEST_LATENCY.labels(endpoint='InspectionCreate').time():
-                with DB_OPERATION_LATENCY.labels(operation='insert').time():
-                    query = """
-                    INSERT INTO inspection (
-                        inspection_car_id,
-                        inspection_status,
-                        inspection_client_notes,
-                        inspection_staff_notes,
-                        inspection_cost,
-                        inspection_start_date,
-                        inspection_end_date
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-                    RETURNING inspection_id;
-                    """
-                    self.cursor.execute(
-                    query,
-                    (
-                        request.inspection.inspectionCarId,
-                        Inspection.InspectionStatusEnum.Name(request.inspection.inspectionStatus),
-                        request.inspection.inspectionClientNotes,
-                        request.inspection.inspectionStaffNotes,
-                        request.inspection.inspectionCost,
-                        request.inspection.inspectionStartDate,
-                        request.inspection.inspectionEndDate,
-                    ),
-                    )
-                    inspection_id = self.cursor.fetchone()[0]
+            if idempotency_key:
+                replayed = IDEMPOTENCY_KEYS.claim(self.cursor, idempotency_key, Inspection)
+                if replayed:
                     self.conn.commit()
-                
-                REQUEST_COUNT.labels(endpoint='InspectionCreate', status='success').inc()
-                return Inspection(
-                    inspectionId=inspection_id,
-                    inspectionCarId=request.inspection.inspectionCarId,
-                    inspectionStatus=request.inspection.inspectionStatus,
-                    inspectionClientNotes=request.inspection.inspectionClientNotes,
-                    inspectionStaffNotes=request.inspection.inspectionStaffNotes,
-                    inspectionCost=request.inspection.inspectionCost,
-                    inspectionStartDate=request.inspection.inspectionStartDate,
-                    inspectionEndDate=request.inspection.inspectionEndDate,
-                )
+                    IDEMPOTENT_REPLAYS.labels(endpoint='InspectionCreate').inc()
+                    return replayed
+            
+            query = """
+            INSERT INTO inspection (
+                inspection_car_id,
+                inspection_status,
+                inspection_client_notes,
+                inspection_staff_notes,
+                inspection_cost,
+                inspection_start_date,
+                inspection_end_date
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+            RETURNING inspection_id;
+            """
+            self.cursor.execute(
+            query,
+            (
+                request.inspection.inspectionCarId,
+                Inspection.InspectionStatusEnum.Name(request.inspection.inspectionStatus),
+                request.inspection.inspectionClientNotes,
+                request.inspection.inspectionStaffNotes,
+                request.inspection.inspectionCost,
+                request.inspection.inspectionStartDate,
+                request.inspection.inspectionEndDate,
+            ),
+            )
+            inspection_id = self.cursor.fetchone()[0]
+        
+            response = Inspection(
+                inspectionId=inspection_id,
+                inspectionCarId=request.inspection.inspectionCarId,
+                inspectionStatus=request.inspection.inspectionStatus,
+                inspectionClientNotes=request.inspection.inspectionClientNotes,
+                inspectionStaffNotes=request.inspection.inspectionStaffNotes,
+                inspectionCost=request.inspection.inspectionCost,
+                inspectionStartDate=request.inspection.inspectionStartDate,
+                inspectionEndDate=request.inspection.inspectionEndDate,
+            )
+            if idempotency_key:
+                IDEMPOTENCY_KEYS.store(self.cursor, idempotency_key, response)
+            self.conn.commit()
+            
+            return response
+        except IdempotencyKeyInUse as e:
+            # The open transaction is the one holding the key, so it is left for that request to commit
+            context.set_details(str(e))
+            context.set_code(grpc.StatusCode.ABORTED)
+            return Inspection()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='InspectionCreate', status='error').inc()
             return Inspection()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='InspectionCreate').dec()
         
     def InspectionDelete(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='InspectionDelete').inc()
-        
         try:
-            with REQUEST_LATENCY.labels(endpoint='InspectionDelete').time():
-                with DB_OPERATION_LATENCY.labels(operation='delete').time():
-                    self.cursor.execute("DELETE FROM inspection WHERE inspection_id = %s RETURNING inspection_id", (request.inspectionId,))
-                    deleted_inspection_id = self.cursor.fetchone()
-                
+            self.cursor.execute("DELETE FROM inspection WHERE inspection_id = %s RETURNING inspection_id", (request.inspectionId,))
+            deleted_inspection_id = self.cursor.fetchone()
+        
             if deleted_inspection_id:
                 self.conn.commit()
-                REQUEST_COUNT.labels(endpoint='InspectionDelete', status='success').inc()
                 return empty_pb2.Empty()
             else:
                 context.set_code(grpc.StatusCode.NOT_FOUND)
                 context.set_details("Inspection not found")
-                REQUEST_COUNT.labels(endpoint='InspectionDelete', status='not_found').inc()
                 return empty_pb2.Empty()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='InspectionDelete', status='error').inc()
             return empty_pb2.Empty()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='InspectionDelete').dec()
         
     def InspectionReadAll(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='InspectionReadAll').inc()
+        page_size = min(request.pageSize or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        try:
+            after_id = int(request.pageToken) if request.pageToken else 0
+        except ValueError:
+            after_id = None
+        fields = read_mask_fields(request.readMask)
+        if page_size < 1 or after_id is None or fields is None:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details("Invalid pageSize, pageToken or readMask")
+            return inspection_service_pb2.InspectionReadAllResponse()
         
         try:
-            with REQUEST_LATENCY.labels(endpoint='InspectionReadAll').time():
-                with DB_OPERATION_LATENCY.labels(operation='select_all').time():
-                    self.cursor.execute("SELECT * FROM inspection")
-                    rows = self.cursor.fetchall()
+            # Fetch one extra row to know whether another page exists
+            self.cursor.execute(
+                f"SELECT {select_columns(fields)} FROM inspection WHERE inspection_id > %s ORDER BY inspection_id LIMIT %s",
+                (after_id, page_size + 1)
+            )
+            rows = self.cursor.fetchall()
 
-                inspections = []
-                for row in rows:
-                    logging.info(f"Row data: {row}, Types: {[type(value) for value in row]}")
-                    try:
-                        inspection = Inspection(
-                            inspectionId=int(row[0]),
-                            inspectionCarId=int(row[1]),
-                            inspectionStatus=Inspection.InspectionStatusEnum.Value(row[2]),
-                            inspectionClientNotes=row[3] if row[3] is not None else "",
-                            inspectionStaffNotes=row[4] if row[4] is not None else "",
-                            inspectionCost=row[5] if row[5] is not None else 0.0,
-                            inspectionStartDate=row[6].isoformat() if row[6] is not None else "",
-                            inspectionEndDate=row[7].isoformat() if row[7] is not None else "",
-                        )
-                        inspections.append(inspection)
-                    except Exception as e:
-                        logging.info(f"Error processing row: {row}, Error: {e}")
-                        REQUEST_COUNT.labels(endpoint='InspectionReadAll', status='row_error').inc()
-                
-                REQUEST_COUNT.labels(endpoint='InspectionReadAll', status='success').inc()
-                return inspection_service_pb2.InspectionReadAllResponse(data=inspections)
+            inspections = []
+            response_bytes = 0
+            next_page_token = ""
+            last_id = after_id
+            for row in rows[:page_size]:
+                logging.info(f"Row data: {row}, Types: {[type(value) for value in row]}")
+                try:
+                    inspection = inspection_from_row(row, fields)
+                    # Stop early once the response would exceed the byte budget
+                    response_bytes += inspection.ByteSize()
+                    if inspections and response_bytes > MAX_RESPONSE_BYTES:
+                        next_page_token = str(last_id)
+                        break
+                    inspections.append(inspection)
+                except Exception as e:
+                    logging.info(f"Error processing row: {row}, Error: {e}")
+                    ROW_ERRORS.labels(endpoint='InspectionReadAll').inc()
+                last_id = row[0]
+            
+            if not next_page_token and len(rows) > page_size:
+                next_page_token = str(last_id)
+            
+            return inspection_service_pb2.InspectionReadAllResponse(data=inspections, nextPageToken=next_page_token)
         except Exception as e:
             logging.error(f"Error in InspectionReadAll: {e}")
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='InspectionReadAll', status='error').inc()
             return inspection_service_pb2.InspectionReadAllResponse()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='InspectionReadAll').dec()
     
     def InspectionReadOne(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='InspectionReadOne').inc()
+        fields = read_mask_fields(request.readMask)
+        if fields is None:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"readMask may only name: {', '.join(INSPECTION_FIELDS)}")
+            return Inspection()
         
         try:
-            with REQUEST_LATENCY.labels(endpoint='InspectionReadOne').time():
-                with DB_OPERATION_LATENCY.labels(operation='select').time():
-                    self.cursor.execute("SELECT * FROM inspection WHERE inspection_id = %s", (request.inspectionId,))
-                    inspection = self.cursor.fetchone()
-                
+            self.cursor.execute(f"SELECT {select_columns(fields)} FROM inspection WHERE inspection_id = %s", (request.inspectionId,))
+            inspection = self.cursor.fetchone()
+        
             if inspection:
-                REQUEST_COUNT.labels(endpoint='InspectionReadOne', status='success').inc()
-                return Inspection(
-                    inspectionId=int(inspection[0]),
-                        inspectionCarId=int(inspection[1]),
-                        inspectionStatus=Inspection.InspectionStatusEnum.Value(inspection[2]),
-                        inspectionClientNotes=inspection[3] if inspection[3] is not None else "",
-                        inspectionStaffNotes=inspection[4] if inspection[4] is not None else "",
-                        inspectionCost=inspection[5] if inspection[5] is not None else 0.0,
-                        inspectionStartDate=inspection[6].isoformat() if inspection[6] is not None else "",
-                        inspectionEndDate=inspection[7].isoformat() if inspection[7] is not None else "",
-                )
+                return inspection_from_row(inspection, fields)
             else:
                 context.set_code(grpc.StatusCode.NOT_FOUND)
                 context.set_details(f"Inspection with ID {request.inspectionId} not found.")
-                REQUEST_COUNT.labels(endpoint='InspectionReadOne', status='not_found').inc()
                 return Inspection()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='InspectionReadOne', status='error').inc()
             return Inspection()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='InspectionReadOne').dec()
         
     def InspectionUpdate(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='InspectionUpdate').inc()
-        
         if (request.inspectionId != request.inspection.inspectionId):
             context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
             context.set_details("Inspection ID mismatch")
-            REQUEST_COUNT.labels(endpoint='InspectionUpdate', status='invalid_argument').inc()
-            ACTIVE_REQUESTS.labels(endpoint='InspectionUpdate').dec()
             return Inspection()
         
         try:
-            with REQUEST_LATENCY.labels(endpoint='InspectionUpdate').time():
-                with DB_OPERATION_LATENCY.labels(operation='update').time():
-                    self.cursor.execute(
-                        """
-                        UPDATE inspection SET
-                        inspection_car_id = %s,
-                        inspection_status = %s,
-                        inspection_client_notes = %s,
-                        inspection_staff_notes = %s,
-                        inspection_cost = %s,
-                        inspection_start_date = %s,
-                        inspection_end_date = %s
-                        WHERE inspection_id = %s
-                        RETURNING inspection_id;
-                        """,
-                        (
-                            request.inspection.inspectionCarId,
-                            Inspection.InspectionStatusEnum.Name(request.inspection.inspectionStatus),
-                            request.inspection.inspectionClientNotes,
-                            request.inspection.inspectionStaffNotes,
-                            request.inspection.inspectionCost,
-                            request.inspection.inspectionStartDate,
-                            request.inspection.inspectionEndDate,
-                            request.inspection.inspectionId,
-                        )
-                    )
-                    updated_inspection_id = self.cursor.fetchone()
-                
+            self.cursor.execute(
+                """
+                UPDATE inspection SET
+                inspection_car_id = %s,
+                inspection_status = %s,
+                inspection_client_notes = %s,
+                inspection_staff_notes = %s,
+                inspection_cost = %s,
+                inspection_start_date = %s,
+                inspection_end_date = %s
+                WHERE inspection_id = %s
+                RETURNING inspection_id;
+                """,
+                (
+                    request.inspection.inspectionCarId,
+                    Inspection.InspectionStatusEnum.Name(request.inspection.inspectionStatus),
+                    request.inspection.inspectionClientNotes,
+                    request.inspection.inspectionStaffNotes,
+                    request.inspection.inspectionCost,
+                    request.inspection.inspectionStartDate,
+                    request.inspection.inspectionEndDate,
+                    request.inspection.inspectionId,
+                )
+            )
+            updated_inspection_id = self.cursor.fetchone()
+        
             if updated_inspection_id:
                 self.conn.commit()
-                REQUEST_COUNT.labels(endpoint='InspectionUpdate', status='success').inc()
                 return request.inspection
             else:
                 context.set_code(grpc.StatusCode.NOT_FOUND)
                 context.set_details(f"Inspection with ID {request.inspectionId} not found.")
-                REQUEST_COUNT.labels(endpoint='InspectionUpdate', status='not_found').inc()
                 return Inspection()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='InspectionUpdate', status='error').inc()
             return Inspection()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='InspectionUpdate').dec()
         
 def serve():
     # Start Prometheus HTTP server on port 8000
-    start_http_server(8000)
-    print("Prometheus metrics server started on port 8000...")
+    profiling.start_http_server(METRICS_PORT)
+    print(f"Prometheus metrics server started on port {METRICS_PORT}...")
+    tracing.configure("inspection")
     
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    inspection_service_pb2_grpc.add_InspectionServiceServicer_to_server(InspectionService(), server)
+    # Accept the gateway's keepalive pings, and recycle connections so its DNS round_robin picks up new replicas
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=10),
+        interceptors=[SERVER_METRICS, tracing.ServerInterceptor()],
+        options=[
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.min_recv_ping_interval_without_data_ms", 10000),
+            ("grpc.max_connection_age_ms", 5 * 60 * 1000),
+            ("grpc.max_connection_age_grace_ms", 30 * 1000),
+        ],
+    )
+    servicer = InspectionService()
+    inspection_service_pb2_grpc.add_InspectionServiceServicer_to_server(servicer, server)
+    # Readiness ("" and the service name) and liveness ("liveness") follow the database connections
+    health = DatabaseHealth(QUERY_METRICS, servicer.conn)
+    health.add_to_server(server, inspection_service_pb2.DESCRIPTOR.services_by_name["InspectionService"].full_name)
     server.add_insecure_port("[::]:50011")
     print("Inspection service running on port 50011...")
     server.start()
-    server.wait_for_termination()
+    health.start()
+    shutdown.wait_for_signal()
+    shutdown.drain(server, health)
 
 if __name__ == "__main__":
     serve()
\ No newline at end of file
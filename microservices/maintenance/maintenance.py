@@ -3,7 +3,13 @@ import grpc
 import psycopg2
 from concurrent import futures
 from google.protobuf import empty_pb2
-from prometheus_client import start_http_server, Counter, Summary, Histogram, Gauge
+from prometheus_client import Counter
+
+from microservices.common import profiling, shutdown, tracing
+from microservices.common.metrics import ServerMetricsInterceptor
+from microservices.common.db import QueryMetrics
+from microservices.common.health import DatabaseHealth
+from microservices.common.idempotency import IdempotencyKeyInUse, IdempotencyKeys, idempotency_key_of
 
 from services import maintenance_service_pb2_grpc
 from services import maintenance_service_pb2
@@ -18,244 +24,307 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 
-# Prometheus metrics
-REQUEST_COUNT = Counter('maintenance_request_count', 'Total number of requests by endpoint', ['endpoint', 'status'])
-REQUEST_LATENCY = Histogram('maintenance_request_latency_seconds', 'Request latency in seconds', ['endpoint'])
-ACTIVE_REQUESTS = Gauge('maintenance_active_requests', 'Number of active requests', ['endpoint'])
-DB_OPERATION_LATENCY = Summary('maintenance_db_operation_latency_seconds', 'Database operation latency', ['operation'])
+# Prometheus port; overridable so several services can share one host
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
+
+# Prometheus metrics; every RPC is recorded by SERVER_METRICS and every statement by QUERY_METRICS
+SERVER_METRICS = ServerMetricsInterceptor('maintenance')
+IDEMPOTENT_REPLAYS = Counter('maintenance_idempotent_replay_count', 'Creates answered with the response stored by an earlier attempt', ['endpoint'])
+ROW_ERRORS = Counter('maintenance_row_error_count', 'Rows a ReadAll skipped because they could not be converted', ['endpoint'])
+QUERY_METRICS = QueryMetrics('maintenance')
+
+# Creates retried with the same idempotency key get the response stored by the first attempt
+IDEMPOTENCY_KEYS = IdempotencyKeys("maintenance_idempotency")
+
+# ReadAll paging limits
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+MAX_RESPONSE_BYTES = int(os.getenv("MAX_RESPONSE_BYTES", str(3 * 1024 * 1024)))
+
+# Column behind each Maintenance field and how to convert its value; reads select only the fields in the request's readMask
+MAINTENANCE_FIELDS = {
+    "maintenanceId": ("maintenance_id", int),
+    "maintenanceCarId": ("maintenance_car_id", int),
+    "maintenanceType": ("maintenance_type", Maintenance.MaintenanceTypeEnum.Value),
+    "maintenanceStatus": ("maintenance_status", Maintenance.MaintenanceStatusEnum.Value),
+    "maintenanceClientNotes": ("maintenance_client_notes", lambda notes: notes if notes is not None else ""),
+    "maintenanceStaffNotes": ("maintenance_staff_notes", lambda notes: notes if notes is not None else ""),
+    "maintenanceCost": ("maintenance_cost", lambda cost: cost if cost is not None else 0.0),
+    "maintenanceStartDate": ("maintenance_start_date", lambda start_date: start_date.isoformat() if start_date is not None else ""),
+    "maintenanceEndDate": ("maintenance_end_date", lambda end_date: end_date.isoformat() if end_date is not None else ""),
+}
+
+def maintenance_from_row(row, fields=tuple(MAINTENANCE_FIELDS)):
+    """Maps a row selected with the columns of `fields` to a Maintenance, leaving the other fields unset"""
+    return Maintenance(**{field: MAINTENANCE_FIELDS[field][1](value) for field, value in zip(fields, row)})
+
+def read_mask_fields(read_mask):
+    """Maintenance fields to select for a readMask, in column order; None when the mask names an unknown field"""
+    paths = set(read_mask.paths)
+    if not paths:
+        return tuple(MAINTENANCE_FIELDS)
+    if not paths <= MAINTENANCE_FIELDS.keys():
+        return None
+    return tuple(field for field in MAINTENANCE_FIELDS if field in paths or field == "maintenanceId")
+
+def select_columns(fields):
+    """Column list for a SELECT of the given Maintenance fields"""
+    return ", ".join(MAINTENANCE_FIELDS[field][0] for field in fields)
 
 class MaintenanceService(maintenance_service_pb2_grpc.MaintenanceServiceServicer):
     def __init__(self):
         self.conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT
+            dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT, cursor_factory=QUERY_METRICS.cursor_factory
         )
         self.cursor = self.conn.cursor()
 
     def MaintenanceCreate(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='MaintenanceCreate').inc()
-        
+        idempotency_key = idempotency_key_of(context)
         try:
-            with REQUEST_LATENCY.labels(endpoint='MaintenanceCreate').time():
-                with DB_OPERATION_LATENCY.labels(operation='insert').time():
-                    query = """
-                    INSERT INTO maintenance (
-                        maintenance_car_id, maintenance_type, 
-                        maintenance_status, maintenance_client_notes, 
-                        maintenance_staff_notes, maintenance_cost, 
-                        maintenance_start_date, maintenance_end_date
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING maintenance_id;
-                    """
-                    self.cursor.execute(
-                    query,
-                    (
-                        request.maintenance.maintenanceCarId,
-                        Maintenance.MaintenanceTypeEnum.Name(request.maintenance.maintenanceType),
-                        Maintenance.MaintenanceStatusEnum.Name(request.maintenance.maintenanceStatus),
-                        request.maintenance.maintenanceClientNotes,
-                        request.maintenance.maintenanceStaffNotes,
-                        request.maintenance.maintenanceCost,
-                        request.maintenance.maintenanceStartDate,
-                        request.maintenance.maintenanceEndDate,
-                    ),
-                    )
-                    maintenance_id=self.cursor.fetchone()[0]
+            if idempotency_key:
+                replayed = IDEMPOTENCY_KEYS.claim(self.cursor, idempotency_key, Maintenance)
+                if replayed:
                     self.conn.commit()
-                
-                REQUEST_COUNT.labels(endpoint='MaintenanceCreate', status='success').inc()
-                return Maintenance(
-                    maintenanceId=maintenance_id,
-                    maintenanceCarId=request.maintenance.maintenanceCarId,
-                    maintenanceType=request.maintenance.maintenanceType,
-                    maintenanceStatus=request.maintenance.maintenanceStatus,
-                    maintenanceClientNotes=request.maintenance.maintenanceClientNotes,
-                    maintenanceStaffNotes=request.maintenance.maintenanceStaffNotes,
-                    maintenanceCost=request.maintenance.maintenanceCost,
-                    maintenanceStartDate=request.maintenance.maintenanceStartDate,
-                    maintenanceEndDate=request.maintenance.maintenanceEndDate
-                )
+                    IDEMPOTENT_REPLAYS.labels(endpoint='MaintenanceCreate').inc()
+                    return replayed
+            
+            query = """
+            INSERT INTO maintenance (
+                maintenance_car_id, maintenance_type, 
+                maintenance_status, maintenance_client_notes, 
+                maintenance_staff_notes, maintenance_cost, 
+                maintenance_start_date, maintenance_end_date
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING maintenance_id;
+            """
+            self.cursor.execute(
+            query,
+            (
+                request.maintenance.maintenanceCarId,
+                Maintenance.MaintenanceTypeEnum.Name(request.maintenance.maintenanceType),
+                Maintenance.MaintenanceStatusEnum.Name(request.maintenance.maintenanceStatus),
+                request.maintenance.maintenanceClientNotes,
+                request.maintenance.maintenanceStaffNotes,
+                request.maintenance.maintenanceCost,
+                request.maintenance.maintenanceStartDate,
+                request.maintenance.maintenanceEndDate,
+            ),
+            )
+            maintenance_id=self.cursor.fetchone()[0]
+        
+            response = Maintenance(
+                maintenanceId=maintenance_id,
+                maintenanceCarId=request.maintenance.maintenanceCarId,
+                maintenanceType=request.maintenance.maintenanceType,
+                maintenanceStatus=request.maintenance.maintenanceStatus,
+                maintenanceClientNotes=request.maintenance.maintenanceClientNotes,
+                maintenanceStaffNotes=request.maintenance.maintenanceStaffNotes,
+                maintenanceCost=request.maintenance.maintenanceCost,
+                maintenanceStartDate=request.maintenance.maintenanceStartDate,
+                maintenanceEndDate=request.maintenance.maintenanceEndDate
+            )
+            if idempotency_key:
+                IDEMPOTENCY_KEYS.store(self.cursor, idempotency_key, response)
+            self.conn.commit()
+            
+            return response
+        except IdempotencyKeyInUse as e:
+            # The open transaction is the one holding the key, so it is left for that request to commit
+            context.set_details(str(e))
+            context.set_code(grpc.StatusCode.ABORTED)
+            return Maintenance()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='MaintenanceCreate', status='error').inc()
             return Maintenance()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='MaintenanceCreate').dec()
         
     def MaintenanceDelete(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='MaintenanceDelete').inc()
-        
         try:
-            with REQUEST_LATENCY.labels(endpoint='MaintenanceDelete').time():
-                with DB_OPERATION_LATENCY.labels(operation='delete').time():
-                    self.cursor.execute("DELETE FROM maintenance WHERE maintenance_id = %s RETURNING maintenance_id", (request.maintenanceId,))
-                    deleted_maintenance_id = self.cursor.fetchone()
-                
+            self.cursor.execute("DELETE FROM maintenance WHERE maintenance_id = %s RETURNING maintenance_id", (request.maintenanceId,))
+            deleted_maintenance_id = self.cursor.fetchone()
+        
             if deleted_maintenance_id:
                 self.conn.commit()
-                REQUEST_COUNT.labels(endpoint='MaintenanceDelete', status='success').inc()
                 return empty_pb2.Empty()
             else:
                 context.set_code(grpc.StatusCode.NOT_FOUND)
                 context.set_details("Maintenance ID not found")
-                REQUEST_COUNT.labels(endpoint='MaintenanceDelete', status='not_found').inc()
                 return empty_pb2.Empty()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='MaintenanceDelete', status='error').inc()
             return empty_pb2.Empty()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='MaintenanceDelete').dec()
         
     def MaintenanceReadAll(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='MaintenanceReadAll').inc()
+        page_size = min(request.pageSize or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        try:
+            after_id = int(request.pageToken) if request.pageToken else 0
+        except ValueError:
+            after_id = None
+        fields = read_mask_fields(request.readMask)
+        if page_size < 1 or after_id is None or fields is None:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details("Invalid pageSize, pageToken or readMask")
+            return maintenance_service_pb2.MaintenanceReadAllResponse()
         
         try:
-            with REQUEST_LATENCY.labels(endpoint='MaintenanceReadAll').time():
-                with DB_OPERATION_LATENCY.labels(operation='select_all').time():
-                    self.cursor.execute("SELECT * FROM maintenance")
-                    rows = self.cursor.fetchall()
+            # Fetch one extra row to know whether another page exists
+            self.cursor.execute(
+                f"SELECT {select_columns(fields)} FROM maintenance WHERE maintenance_id > %s ORDER BY maintenance_id LIMIT %s",
+                (after_id, page_size + 1)
+            )
+            rows = self.cursor.fetchall()
 
-                maintenances = []
-                for row in rows:
-                    logging.info(f"Row data: {row}, Types: {[type(value) for value in row]}")
-                    try:
-                        maintenance = Maintenance(
-                            maintenanceId=int(row[0]),
-                            maintenanceCarId=int(row[1]),
-                            maintenanceType=Maintenance.MaintenanceTypeEnum.Value(row[2]),
-                            maintenanceStatus=Maintenance.MaintenanceStatusEnum.Value(row[3]),
-                            maintenanceClientNotes=row[4] if row[4] is not None else "",
-                            maintenanceStaffNotes=row[5] if row[5] is not None else "",
-                            maintenanceCost=row[6] if row[6] is not None else 0.0,
-                            maintenanceStartDate=row[7].isoformat() if row[7] is not None else "",
-                            maintenanceEndDate=row[8].isoformat() if row[8] is not None else "",
-                        )
-                        maintenances.append(maintenance)
-                    except Exception as e:
-                        logging.info(f"Error processing row: {row}, Error: {e}")
-                        REQUEST_COUNT.labels(endpoint='MaintenanceReadAll', status='row_error').inc()
-                
-                REQUEST_COUNT.labels(endpoint='MaintenanceReadAll', status='success').inc()
-                return maintenance_service_pb2.MaintenanceReadAllResponse(data=maintenances)
+            maintenances = []
+            response_bytes = 0
+            next_page_token = ""
+            last_id = after_id
+            for row in rows[:page_size]:
+                logging.info(f"Row data: {row}, Types: {[type(value) for value in row]}")
+                try:
+                    maintenance = maintenance_from_row(row, fields)
+                    # Stop early once the response would exceed the byte budget
+                    response_bytes += maintenance.ByteSize()
+                    if maintenances and response_bytes > MAX_RESPONSE_BYTES:
+                        next_page_token = str(last_id)
+                        break
+                    maintenances.append(maintenance)
+                except Exception as e:
+                    logging.info(f"Error processing row: {row}, Error: {e}")
+                    ROW_ERRORS.labels(endpoint='MaintenanceReadAll').inc()
+                last_id = row[0]
+            
+            if not next_page_token and len(rows) > page_size:
+                next_page_token = str(last_id)
+            
+            return maintenance_service_pb2.MaintenanceReadAllResponse(data=maintenances, nextPageToken=next_page_token)
         except Exception as e:
             logging.error(f"Error in MaintenanceReadAll: {e}")
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='MaintenanceReadAll', status='error').inc()
             return maintenance_service_pb2.MaintenanceReadAllResponse()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='MaintenanceReadAll').dec()
     
     def MaintenanceReadOne(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='MaintenanceReadOne').inc()
+        fields = read_mask_fields(request.readMask)
+        if fields is None:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"readMask may only name: {', '.join(MAINTENANCE_FIELDS)}")
+            return Maintenance()
         
         try:
-            with REQUEST_LATENCY.labels(endpoint='MaintenanceReadOne').time():
-                with DB_OPERATION_LATENCY.labels(operation='select').time():
-                    self.cursor.execute("SELECT * FROM maintenance WHERE maintenance_id = %s", (request.maintenanceId,))
-                    maintenance = self.cursor.fetchone()
-                
+            self.cursor.execute(f"SELECT {select_columns(fields)} FROM maintenance WHERE maintenance_id = %s", (request.maintenanceId,))
+            maintenance = self.cursor.fetchone()
+        
             if maintenance:
-                REQUEST_COUNT.labels(endpoint='MaintenanceReadOne', status='success').inc()
-                return Maintenance(
-                        maintenanceId=int(maintenance[0]),
-                        maintenanceCarId=int(maintenance[1]),
-                        maintenanceType=Maintenance.MaintenanceTypeEnum.Value(maintenance[2]),
-                        maintenanceStatus=Maintenance.MaintenanceStatusEnum.Value(maintenance[3]),
-                        maintenanceClientNotes=maintenance[4] if maintenance[4] is not None else "",
-                        maintenanceStaffNotes=maintenance[5] if maintenance[5] is not None else "",
-                        maintenanceCost=maintenance[6] if maintenance[6] is not None else 0.0,
-                        maintenanceStartDate=maintenance[7].isoformat() if maintenance[7] is not None else "",
-                        maintenanceEndDate=maintenance[8].isoformat() if maintenance[8] is not None else "",
-                    )
+                return maintenance_from_row(maintenance, fields)
             else:
                 context.set_code(grpc.StatusCode.NOT_FOUND)
                 context.set_details(f"Maintenance with ID {request.maintenanceId} not found.")
-                REQUEST_COUNT.labels(endpoint='MaintenanceReadOne', status='not_found').inc()
                 return Maintenance()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='MaintenanceReadOne', status='error').inc()
             return Maintenance()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='MaintenanceReadOne').dec()
         
     def MaintenanceUpdate(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='MaintenanceUpdate').inc()
-        
         if (request.maintenanceId != request.maintenance.maintenanceId):
             context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
             context.set_details("Maintenance ID in path and body do not match")
-            REQUEST_COUNT.labels(endpoint='MaintenanceUpdate', status='invalid_argument').inc()
-            ACTIVE_REQUESTS.labels(endpoint='MaintenanceUpdate').dec()
             return Maintenance()
         
         try:
-            with REQUEST_LATENCY.labels(endpoint='MaintenanceUpdate').time():
-                with DB_OPERATION_LATENCY.labels(operation='update').time():
-                    self.cursor.execute(
-                        """
-                        UPDATE maintenance SET
-                        maintenance_car_id = %s,
-                        maintenance_type = %s,
-                        maintenance_status = %s,
-                        maintenance_client_notes = %s,
-                        maintenance_staff_notes = %s,
-                        maintenance_cost = %s,
-                        maintenance_start_date = %s,
-                        maintenance_end_date = %s
-                        WHERE maintenance_id = %s
-                        RETURNING maintenance_id;
-                        """,
-                        (
-                            request.maintenance.maintenanceCarId,
-                            Maintenance.MaintenanceTypeEnum.Name(request.maintenance.maintenanceType),
-                            Maintenance.MaintenanceStatusEnum.Name(request.maintenance.maintenanceStatus),
-                            request.maintenance.maintenanceClientNotes,
-                            request.maintenance.maintenanceStaffNotes,
-                            request.maintenance.maintenanceCost,
-                            request.maintenance.maintenanceStartDate,
-                            request.maintenance.maintenanceEndDate,
-                            request.maintenance.maintenanceId,
-                        )
-                    )
-                    updated_maintenance_id = self.cursor.fetchone()
-                
-                if updated_maintenance_id:
-                    self.conn.commit()
-                    REQUEST_COUNT.labels(endpoint='MaintenanceUpdate', status='success').inc()
-                    return request.maintenance
-                else:
-                    context.set_code(grpc.StatusCode.NOT_FOUND)
-                    context.set_details(f"Maintenance with ID {request.maintenanceId} not found.")
-                    REQUEST_COUNT.labels(endpoint='MaintenanceUpdate', status='not_found').inc()
-                    return Maintenance()
+            self.cursor.execute(
+                """
+                UPDATE maintenance SET
+                maintenance_car_id = %s,
+                maintenance_type = %s,
+                maintenance_status = %s,
+                maintenance_client_notes = %s,
+                maintenance_staff_notes = %s,
+                maintenance_cost = %s,
+                maintenance_start_date = %s,
+                maintenance_end_date = %s
+                WHERE maintenance_id = %s
+                RETURNING maintenance_id;
+                """,
+                (
+                    request.maintenance.maintenanceCarId,
+                    Maintenance.MaintenanceTypeEnum.Name(request.maintenance.maintenanceType),
+                    Maintenance.MaintenanceStatusEnum.Name(request.maintenance.maintenanceStatus),
+                    request.maintenance.maintenanceClientNotes,
+                    request.maintenance.maintenanceStaffNotes,
+                    request.maintenance.maintenanceCost,
+                    request.maintenance.maintenanceStartDate,
+                    request.maintenance.maintenanceEndDate,
+                    request.maintenance.maintenanceId,
+                )
+            )
+            updated_maintenance_id = self.cursor.fetchone()
+        
+            if updated_maintenance_id:
+                self.conn.commit()
+                return request.maintenance
+            else:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f"Maintenance with ID {request.maintenanceId} not found.")
+                return Maintenance()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='MaintenanceUpdate', status='error').inc()
             return Maintenance()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='MaintenanceUpdate').dec()
+
+    def MaintenanceOpenCounts(self, request, context):
+        try:
+            # Trigger-maintained summary, one row per maintenance type
+            self.cursor.execute(
+                "SELECT maintenance_type, open_count FROM maintenance_open_counts WHERE open_count > 0 ORDER BY maintenance_type"
+            )
+            rows = self.cursor.fetchall()
+        
+            return maintenance_service_pb2.MaintenanceOpenCountsResponse(data=[
+                maintenance_service_pb2.MaintenanceOpenCount(
+                    maintenanceType=Maintenance.MaintenanceTypeEnum.Value(row[0]), openCount=int(row[1])
+                )
+                for row in rows
+            ])
+        except psycopg2.Error as e:
+            self.conn.rollback()
+            context.set_details(str(e))
+            context.set_code(grpc.StatusCode.INTERNAL)
+            return maintenance_service_pb2.MaintenanceOpenCountsResponse()
         
 def serve():
     # Start Prometheus HTTP server on port 8000
-    start_http_server(8000)
-    print("Prometheus metrics server started on port 8000...")
+    profiling.start_http_server(METRICS_PORT)
+    print(f"Prometheus metrics server started on port {METRICS_PORT}...")
+    tracing.configure("maintenance")
     
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    maintenance_service_pb2_grpc.add_MaintenanceServiceServicer_to_server(MaintenanceService(), server)
+    # Accept the gateway's keepalive pings, and recycle connections so its DNS round_robin picks up new replicas
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=10),
+        interceptors=[SERVER_METRICS, tracing.ServerInterceptor()],
+        options=[
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.min_recv_ping_interval_without_data_ms", 10000),
+            ("grpc.max_connection_age_ms", 5 * 60 * 1000),
+            ("grpc.max_connection_age_grace_ms", 30 * 1000),
+        ],
+    )
+    servicer = MaintenanceService()
+    maintenance_service_pb2_grpc.add_MaintenanceServiceServicer_to_server(servicer, server)
+    # Readiness ("" and the service name) and liveness ("liveness") follow the database connections
+    health = DatabaseHealth(QUERY_METRICS, servicer.conn)
+    health.add_to_server(server, maintenance_service_pb2.DESCRIPTOR.services_by_name["MaintenanceService"].full_name)
     server.add_insecure_port("[::]:50012")
     print("Maintenance service running on port 50012...")
     server.start()
-    server.wait_for_termination()
+    health.start()
+    shutdown.wait_for_signal()
+    shutdown.drain(server, health)
 
 if __name__ == "__main__":
     serve()
\ No newline at end of file
@@ -0,0 +1,58 @@
+import logging
+import os
+import sys
+import psycopg2
+
+logging.basicConfig(level=logging.INFO)
+
+DB_HOST = os.getenv("DB_HOST")
+DB_PORT = os.getenv("DB_PORT")
+DB_NAME = os.getenv("DB_NAME")
+DB_USER = os.getenv("DB_USER")
+DB_PASS = os.getenv("DB_PASS")
+
+# Types whose incremental count differs from a full recomputation; both sides come from one snapshot
+DIFF_QUERY = """
+    SELECT maintenance_type, COALESCE(s.open_count, 0), COALESCE(e.open_count, 0)
+    FROM (SELECT * FROM maintenance_open_counts WHERE open_count <> 0) s
+    FULL JOIN maintenance_open_counts_expected e USING (maintenance_type)
+    WHERE s.open_count IS DISTINCT FROM e.open_count
+    ORDER BY maintenance_type
+"""
+
+def check_open_counts(conn, repair=False):
+    """Diffs maintenance_open_counts against a rebuild from maintenance, optionally replacing it with the rebuild"""
+    with conn.cursor() as cursor:
+        cursor.execute(DIFF_QUERY)
+        diffs = cursor.fetchall()
+        if diffs and repair:
+            # Blocks the triggers until the rebuilt rows are committed so no change is lost in between
+            cursor.execute("LOCK TABLE maintenance_open_counts IN EXCLUSIVE MODE")
+            cursor.execute("DELETE FROM maintenance_open_counts")
+            cursor.execute("INSERT INTO maintenance_open_counts SELECT * FROM maintenance_open_counts_expected")
+    conn.commit()
+    return diffs
+
+def main():
+    repair = "--repair" in sys.argv[1:]
+    conn = psycopg2.connect(
+        dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT
+    )
+    try:
+        diffs = check_open_counts(conn, repair)
+    except psycopg2.Error as e:
+        conn.rollback()
+        logging.error(f"Open maintenance count check failed: {e}")
+        raise
+    finally:
+        conn.close()
+    
+    for maintenance_type, count, expected_count in diffs:
+        logging.warning(f"Drift in {maintenance_type}: open count {count} != {expected_count}")
+    logging.info(f"maintenance_open_counts: {len(diffs)} drifted types{', repaired' if diffs and repair else ''}")
+    # Fail the job on unrepaired drift so it shows up in the CronJob history
+    if diffs and not repair:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,16 @@ import logging
 import os
 import grpc
 import psycopg2
+from psycopg2 import errors
 from concurrent import futures
-from prometheus_client import start_http_server, Counter, Summary, Histogram, Gauge
+from datetime import date
+from prometheus_client import Counter
+
+from microservices.common import profiling, shutdown, tracing
+from microservices.common.metrics import ServerMetricsInterceptor
+from microservices.common.db import QueryMetrics
+from microservices.common.health import DatabaseHealth
+from microservices.common.idempotency import IdempotencyKeyInUse, IdempotencyKeys, idempotency_key_of
 
 from services import meeting_service_pb2_grpc
 from services import meeting_service_pb2
@@ -16,200 +24,327 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 
-# Prometheus metrics
-REQUEST_COUNT = Counter('meeting_request_count', 'Total number of requests by endpoint', ['endpoint', 'status'])
-REQUEST_LATENCY = Histogram('meeting_request_latency_seconds', 'Request latency in seconds', ['endpoint'])
-ACTIVE_REQUESTS = Gauge('meeting_active_requests', 'Number of active requests', ['endpoint'])
-DB_OPERATION_LATENCY = Summary('meeting_db_operation_latency_seconds', 'Database operation latency', ['operation'])
+# Prometheus port; overridable so several services can share one host
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
+
+# Prometheus metrics; every RPC is recorded by SERVER_METRICS and every statement by QUERY_METRICS
+SERVER_METRICS = ServerMetricsInterceptor('meeting')
+IDEMPOTENT_REPLAYS = Counter('meeting_idempotent_replay_count', 'Creates answered with the response stored by an earlier attempt', ['endpoint'])
+ROW_ERRORS = Counter('meeting_row_error_count', 'Rows a ReadAll skipped because they could not be converted', ['endpoint'])
+QUERY_METRICS = QueryMetrics('meeting')
+
+# Creates retried with the same idempotency key get the response stored by the first attempt
+IDEMPOTENCY_KEYS = IdempotencyKeys("meeting_idempotency")
+
+# ReadAll paging limits
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+MAX_RESPONSE_BYTES = int(os.getenv("MAX_RESPONSE_BYTES", str(3 * 1024 * 1024)))
+
+# Scheduling defaults
+DEFAULT_MEETING_DURATION = 60
+DEFAULT_DAY_START_HOUR = 9
+DEFAULT_DAY_END_HOUR = 18
+MAX_FREE_SLOT_DAYS = 31
+
+# Column behind each Meeting field and how to convert its value; reads select only the fields in the request's readMask
+MEETING_FIELDS = {
+    "meetingId": ("meeting_id", int),
+    "clientId": ("client_id", int),
+    "scheduleDate": ("schedule_date", lambda schedule_date: schedule_date.isoformat() if schedule_date else ""),
+    "status": ("meeting_status", Meeting.StatusEnum.Value),
+    "durationMinutes": ("duration_minutes", int),
+    "staffId": ("staff_id", lambda staff_id: int(staff_id) if staff_id is not None else 0),
+}
+
+def meeting_from_row(row, fields=tuple(MEETING_FIELDS)):
+    """Maps a row selected with the columns of `fields` to a Meeting, leaving the other fields unset"""
+    return Meeting(**{field: MEETING_FIELDS[field][1](value) for field, value in zip(fields, row)})
+
+def read_mask_fields(read_mask):
+    """Meeting fields to select for a readMask, in column order; None when the mask names an unknown field"""
+    paths = set(read_mask.paths)
+    if not paths:
+        return tuple(MEETING_FIELDS)
+    if not paths <= MEETING_FIELDS.keys():
+        return None
+    return tuple(field for field in MEETING_FIELDS if field in paths or field == "meetingId")
+
+def select_columns(fields):
+    """Column list for a SELECT of the given Meeting fields"""
+    return ", ".join(MEETING_FIELDS[field][0] for field in fields)
 
 class MeetingService(meeting_service_pb2_grpc.MeetingServiceServicer):
     def __init__(self):
         self.conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT
+            dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT, cursor_factory=QUERY_METRICS.cursor_factory
         )
         self.cursor = self.conn.cursor()
 
     def MeetingsCreate(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='MeetingsCreate').inc()
-        
+        idempotency_key = idempotency_key_of(context)
         try:
-            with REQUEST_LATENCY.labels(endpoint='MeetingsCreate').time():
-                with DB_OPERATION_LATENCY.labels(operation='insert').time():
-                    self.cursor.execute(
-                        """
-                        INSERT INTO meeting (client_id, schedule_date, meeting_status)
-                        VALUES (%s, %s, %s) RETURNING meeting_id
-                        """,
-                        (request.meeting.clientId, request.meeting.scheduleDate, Meeting.StatusEnum.Name(request.meeting.status))
-                    )
-                    meeting_id = self.cursor.fetchone()[0]
+            if idempotency_key:
+                replayed = IDEMPOTENCY_KEYS.claim(self.cursor, idempotency_key, Meeting)
+                if replayed:
                     self.conn.commit()
-                
-                REQUEST_COUNT.labels(endpoint='MeetingsCreate', status='success').inc()
-                return Meeting(
-                    meetingId=meeting_id,
-                    clientId=request.meeting.clientId,
-                    scheduleDate=request.meeting.scheduleDate,
-                    status=request.meeting.status,
-                )
+                    IDEMPOTENT_REPLAYS.labels(endpoint='MeetingsCreate').inc()
+                    return replayed
+            
+            self.cursor.execute(
+                """
+                INSERT INTO meeting (client_id, schedule_date, meeting_status, duration_minutes, staff_id)
+                VALUES (%s, %s, %s, %s, %s) RETURNING meeting_id
+                """,
+                (request.meeting.clientId, request.meeting.scheduleDate, Meeting.StatusEnum.Name(request.meeting.status),
+                 request.meeting.durationMinutes or DEFAULT_MEETING_DURATION, request.meeting.staffId or None)
+            )
+            meeting_id = self.cursor.fetchone()[0]
+        
+            response = Meeting(
+                meetingId=meeting_id,
+                clientId=request.meeting.clientId,
+                scheduleDate=request.meeting.scheduleDate,
+                status=request.meeting.status,
+                durationMinutes=request.meeting.durationMinutes or DEFAULT_MEETING_DURATION,
+                staffId=request.meeting.staffId,
+            )
+            if idempotency_key:
+                IDEMPOTENCY_KEYS.store(self.cursor, idempotency_key, response)
+            self.conn.commit()
+            
+            return response
+        except IdempotencyKeyInUse as e:
+            # The open transaction is the one holding the key, so it is left for that request to commit
+            context.set_details(str(e))
+            context.set_code(grpc.StatusCode.ABORTED)
+            return Meeting()
+        except errors.ExclusionViolation:
+            self.conn.rollback()
+            context.set_details("Meeting overlaps another scheduled meeting for this staff member")
+            context.set_code(grpc.StatusCode.ALREADY_EXISTS)
+            return Meeting()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='MeetingsCreate', status='error').inc()
             return Meeting()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='MeetingsCreate').dec()
 
     def MeetingsReadOne(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='MeetingsReadOne').inc()
+        fields = read_mask_fields(request.readMask)
+        if fields is None:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"readMask may only name: {', '.join(MEETING_FIELDS)}")
+            return Meeting()
         
         try:
-            with REQUEST_LATENCY.labels(endpoint='MeetingsReadOne').time():
-                with DB_OPERATION_LATENCY.labels(operation='select').time():
-                    self.cursor.execute("SELECT * FROM meeting WHERE meeting_id = %s", (request.meetingId,))
-                    meeting = self.cursor.fetchone()
-                
-                if meeting:
-                    REQUEST_COUNT.labels(endpoint='MeetingsReadOne', status='success').inc()
-                    return Meeting(
-                        meetingId=int(meeting[0]),
-                        clientId=int(meeting[1]),
-                        scheduleDate=meeting[2].isoformat() if meeting[2] else "",
-                        status=Meeting.StatusEnum.Value(meeting[3]),
-                    )
-                else:
-                    context.set_code(grpc.StatusCode.NOT_FOUND)
-                    context.set_details(f"Meeting with ID {request.meetingId} not found.")
-                    REQUEST_COUNT.labels(endpoint='MeetingsReadOne', status='not_found').inc()
-                    return Meeting()
+            self.cursor.execute(f"SELECT {select_columns(fields)} FROM meeting WHERE meeting_id = %s", (request.meetingId,))
+            meeting = self.cursor.fetchone()
+        
+            if meeting:
+                return meeting_from_row(meeting, fields)
+            else:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f"Meeting with ID {request.meetingId} not found.")
+                return Meeting()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='MeetingsReadOne', status='error').inc()
             return Meeting()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='MeetingsReadOne').dec()
 
     def MeetingsReadAll(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='MeetingsReadAll').inc()
+        page_size = min(request.pageSize or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        try:
+            after_id = int(request.pageToken) if request.pageToken else 0
+        except ValueError:
+            after_id = None
+        fields = read_mask_fields(request.readMask)
+        if page_size < 1 or after_id is None or fields is None:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details("Invalid pageSize, pageToken or readMask")
+            return meeting_service_pb2.MeetingsReadAllResponse()
         
         try:
-            with REQUEST_LATENCY.labels(endpoint='MeetingsReadAll').time():
-                with DB_OPERATION_LATENCY.labels(operation='select_all').time():
-                    self.cursor.execute("SELECT * FROM meeting")
-                    rows = self.cursor.fetchall()
-
-                meetings = []
-                for row in rows:
-                    logging.info(f"Row data: {row}, Types: {[type(value) for value in row]}")
-                    try:
-                        meeting = Meeting(
-                            meetingId=int(row[0]),
-                            clientId=int(row[1]),
-                            scheduleDate=row[2].isoformat() if row[2] else "",
-                            status=Meeting.StatusEnum.Value(row[3]),
-                        )
-                        meetings.append(meeting)
-                    except Exception as e:
-                        logging.info(f"Error processing row: {row}, Error: {e}")
-                        REQUEST_COUNT.labels(endpoint='MeetingsReadAll', status='row_error').inc()
-                
-                REQUEST_COUNT.labels(endpoint='MeetingsReadAll', status='success').inc()
-                return meeting_service_pb2.MeetingsReadAllResponse(data=meetings)
+            # Fetch one extra row to know whether another page exists
+            self.cursor.execute(
+                f"SELECT {select_columns(fields)} FROM meeting WHERE meeting_id > %s ORDER BY meeting_id LIMIT %s",
+                (after_id, page_size + 1)
+            )
+            rows = self.cursor.fetchall()
+
+            meetings = []
+            response_bytes = 0
+            next_page_token = ""
+            last_id = after_id
+            for row in rows[:page_size]:
+                logging.info(f"Row data: {row}, Types: {[type(value) for value in row]}")
+                try:
+                    meeting = meeting_from_row(row, fields)
+                    # Stop early once the response would exceed the byte budget
+                    response_bytes += meeting.ByteSize()
+                    if meetings and response_bytes > MAX_RESPONSE_BYTES:
+                        next_page_token = str(last_id)
+                        break
+                    meetings.append(meeting)
+                except Exception as e:
+                    logging.info(f"Error processing row: {row}, Error: {e}")
+                    ROW_ERRORS.labels(endpoint='MeetingsReadAll').inc()
+                last_id = row[0]
+            
+            if not next_page_token and len(rows) > page_size:
+                next_page_token = str(last_id)
+            
+            return meeting_service_pb2.MeetingsReadAllResponse(data=meetings, nextPageToken=next_page_token)
         except Exception as e:
             logging.error(f"Error in MeetingsReadAll: {e}")
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='MeetingsReadAll', status='error').inc()
             return meeting_service_pb2.MeetingsReadAllResponse()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='MeetingsReadAll').dec()
 
     def MeetingsUpdate(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='MeetingsUpdate').inc()
-        
         if (request.meetingId != request.meeting.meetingId):
             context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
             context.set_details("meetingId in URL and body must match")
-            REQUEST_COUNT.labels(endpoint='MeetingsUpdate', status='invalid_argument').inc()
-            ACTIVE_REQUESTS.labels(endpoint='MeetingsUpdate').dec()
             return Meeting()
         
         try:
-            with REQUEST_LATENCY.labels(endpoint='MeetingsUpdate').time():
-                with DB_OPERATION_LATENCY.labels(operation='update').time():
-                    self.cursor.execute(
-                        """
-                        UPDATE meeting SET client_id = %s, schedule_date = %s, meeting_status = %s
-                        WHERE meeting_id = %s RETURNING meeting_id
-                        """,
-                        (request.meeting.clientId, request.meeting.scheduleDate,  Meeting.StatusEnum.Name(request.meeting.status), request.meetingId),
-                    )
-                    updated_meeting_id = self.cursor.fetchone()
-                
-                if updated_meeting_id:
-                    self.conn.commit()
-                    REQUEST_COUNT.labels(endpoint='MeetingsUpdate', status='success').inc()
-                    return Meeting(
-                        meetingId=request.meetingId,
-                        clientId=request.meeting.clientId,
-                        scheduleDate=request.meeting.scheduleDate,
-                        status=request.meeting.status,
-                    )
-                else:
-                    context.set_code(grpc.StatusCode.NOT_FOUND)
-                    context.set_details(f"Meeting with ID {request.meetingId} not found.")
-                    REQUEST_COUNT.labels(endpoint='MeetingsUpdate', status='not_found').inc()
-                    return Meeting()
+            self.cursor.execute(
+                """
+                UPDATE meeting SET client_id = %s, schedule_date = %s, meeting_status = %s,
+                                   duration_minutes = %s, staff_id = %s
+                WHERE meeting_id = %s RETURNING meeting_id
+                """,
+                (request.meeting.clientId, request.meeting.scheduleDate,  Meeting.StatusEnum.Name(request.meeting.status),
+                 request.meeting.durationMinutes or DEFAULT_MEETING_DURATION, request.meeting.staffId or None, request.meetingId),
+            )
+            updated_meeting_id = self.cursor.fetchone()
+        
+            if updated_meeting_id:
+                self.conn.commit()
+                return Meeting(
+                    meetingId=request.meetingId,
+                    clientId=request.meeting.clientId,
+                    scheduleDate=request.meeting.scheduleDate,
+                    status=request.meeting.status,
+                    durationMinutes=request.meeting.durationMinutes or DEFAULT_MEETING_DURATION,
+                    staffId=request.meeting.staffId,
+                )
+            else:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f"Meeting with ID {request.meetingId} not found.")
+                return Meeting()
+        except errors.ExclusionViolation:
+            self.conn.rollback()
+            context.set_details("Meeting overlaps another scheduled meeting for this staff member")
+            context.set_code(grpc.StatusCode.ALREADY_EXISTS)
+            return Meeting()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='MeetingsUpdate', status='error').inc()
             return Meeting()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='MeetingsUpdate').dec()
 
     def MeetingsDelete(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='MeetingsDelete').inc()
-        
         try:
-            with REQUEST_LATENCY.labels(endpoint='MeetingsDelete').time():
-                with DB_OPERATION_LATENCY.labels(operation='delete').time():
-                    self.cursor.execute("DELETE FROM meeting WHERE meeting_id = %s RETURNING meeting_id", (request.meetingId,))
-                    deleted_meeting_id = self.cursor.fetchone()
-                
-                if deleted_meeting_id:
-                    self.conn.commit()
-                    REQUEST_COUNT.labels(endpoint='MeetingsDelete', status='success').inc()
-                    return empty_pb2.Empty()
-                else:
-                    context.set_code(grpc.StatusCode.NOT_FOUND)
-                    context.set_details(f"Meeting with ID {request.meetingId} not found.")
-                    REQUEST_COUNT.labels(endpoint='MeetingsDelete', status='not_found').inc()
-                    return empty_pb2.Empty()
+            self.cursor.execute("DELETE FROM meeting WHERE meeting_id = %s RETURNING meeting_id", (request.meetingId,))
+            deleted_meeting_id = self.cursor.fetchone()
+        
+            if deleted_meeting_id:
+                self.conn.commit()
+                return empty_pb2.Empty()
+            else:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f"Meeting with ID {request.meetingId} not found.")
+                return empty_pb2.Empty()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='MeetingsDelete', status='error').inc()
             return empty_pb2.Empty()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='MeetingsDelete').dec()
+
+    def MeetingsFindFreeSlots(self, request, context):
+        day_start_hour = request.dayStartHour if request.HasField("dayStartHour") else DEFAULT_DAY_START_HOUR
+        day_end_hour = request.dayEndHour if request.HasField("dayEndHour") else DEFAULT_DAY_END_HOUR
+        slot_minutes = request.slotMinutes or DEFAULT_MEETING_DURATION
+        try:
+            from_date = date.fromisoformat(request.fromDate)
+            to_date = date.fromisoformat(request.toDate) if request.toDate else from_date
+        except ValueError:
+            from_date = to_date = None
+        if (request.staffId <= 0 or from_date is None or to_date < from_date
+                or (to_date - from_date).days >= MAX_FREE_SLOT_DAYS
+                or not 0 <= day_start_hour < day_end_hour <= 24 or slot_minutes < 1):
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details("Invalid staffId, date range, working hours or slot length")
+            return meeting_service_pb2.MeetingsFindFreeSlotsResponse()
+        
+        try:
+            # Working hours minus the staff member's scheduled meetings, in one statement.
+            # The overlap filter matches the meeting_staff_no_overlap GiST index expression.
+            self.cursor.execute(
+                """
+                WITH days AS (
+                    SELECT tsrange(day + make_interval(hours => %s), day + make_interval(hours => %s)) AS period
+                    FROM generate_series(%s::timestamp, %s::timestamp, INTERVAL '1 day') AS day
+                ),
+                busy AS (
+                    SELECT tsrange(schedule_date, schedule_date + duration_minutes * INTERVAL '1 minute') AS period
+                    FROM meeting
+                    WHERE staff_id = %s
+                      AND meeting_status = 'StatusEnum_SCHEDULED'
+                      AND tsrange(schedule_date, schedule_date + duration_minutes * INTERVAL '1 minute')
+                          && tsrange(%s::timestamp, %s::timestamp + INTERVAL '1 day')
+                )
+                SELECT lower(free), upper(free)
+                FROM unnest(
+                    (SELECT range_agg(period) FROM days)
+                    - COALESCE((SELECT range_agg(period) FROM busy), '{}'::tsmultirange)
+                ) AS free
+                WHERE upper(free) - lower(free) >= make_interval(mins => %s)
+                ORDER BY 1
+                """,
+                (day_start_hour, day_end_hour, from_date, to_date,
+                 request.staffId, from_date, to_date, slot_minutes)
+            )
+            rows = self.cursor.fetchall()
+        
+            slots = [meeting_service_pb2.FreeSlot(start=row[0].isoformat(), end=row[1].isoformat()) for row in rows]
+            return meeting_service_pb2.MeetingsFindFreeSlotsResponse(data=slots)
+        except psycopg2.Error as e:
+            self.conn.rollback()
+            context.set_details(str(e))
+            context.set_code(grpc.StatusCode.INTERNAL)
+            return meeting_service_pb2.MeetingsFindFreeSlotsResponse()
 
 def serve():
     # Start Prometheus HTTP server on port 8000
-    start_http_server(8000)
-    print("Prometheus metrics server started on port 8000...")
+    profiling.start_http_server(METRICS_PORT)
+    print(f"Prometheus metrics server started on port {METRICS_PORT}...")
+    tracing.configure("meeting")
     
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    meeting_service_pb2_grpc.add_MeetingServiceServicer_to_server(MeetingService(), server)
+    # Accept the gateway's keepalive pings, and recycle connections so its DNS round_robin picks up new replicas
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=10),
+        interceptors=[SERVER_METRICS, tracing.ServerInterceptor()],
+        options=[
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.min_recv_ping_interval_without_data_ms", 10000),
+            ("grpc.max_connection_age_ms", 5 * 60 * 1000),
+            ("grpc.max_connection_age_grace_ms", 30 * 1000),
+        ],
+    )
+    servicer = MeetingService()
+    meeting_service_pb2_grpc.add_MeetingServiceServicer_to_server(servicer, server)
+    # Readiness ("" and the service name) and liveness ("liveness") follow the database connections
+    health = DatabaseHealth(QUERY_METRICS, servicer.conn)
+    health.add_to_server(server, meeting_service_pb2.DESCRIPTOR.services_by_name["MeetingService"].full_name)
     server.add_insecure_port("[::]:50015")
     print("Meeting service running on port 50015...")
     server.start()
-    server.wait_for_termination()
+    health.start()
+    shutdown.wait_for_signal()
+    shutdown.drain(server, health)
 
 if __name__ == "__main__":
     serve()
@@ -0,0 +1,47 @@
+import logging
+import os
+import psycopg2
+
+logging.basicConfig(level=logging.INFO)
+
+DB_HOST = os.getenv("DB_HOST")
+DB_PORT = os.getenv("DB_PORT")
+DB_NAME = os.getenv("DB_NAME")
+DB_USER = os.getenv("DB_USER")
+DB_PASS = os.getenv("DB_PASS")
+
+# How many months of empty partitions to keep ahead, and how many months of history stay attached
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+PARTITION_RETAIN_MONTHS = int(os.getenv("PARTITION_RETAIN_MONTHS", "36"))
+
+def maintain_partitions(conn, months_ahead, retain_months):
+    """Creates upcoming monthly transaction partitions and detaches expired ones"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT create_transaction_partitions(CURRENT_DATE, %s)", (months_ahead,))
+        created = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT detach_old_transaction_partitions(%s)", (retain_months,))
+        detached = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+    # Rows moved out of transaction_default mean inserts ran past the months created ahead
+    for notice in conn.notices:
+        logging.warning(f"Partition maintenance: {notice.strip()}")
+    conn.notices.clear()
+    return created, detached
+
+def main():
+    conn = psycopg2.connect(
+        dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT
+    )
+    try:
+        created, detached = maintain_partitions(conn, PARTITION_MONTHS_AHEAD, PARTITION_RETAIN_MONTHS)
+        logging.info(f"Created transaction partitions: {created or 'none'}")
+        logging.info(f"Detached transaction partitions: {detached or 'none'}")
+    except psycopg2.Error as e:
+        conn.rollback()
+        logging.error(f"Partition maintenance failed: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
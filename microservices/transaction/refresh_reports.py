@@ -0,0 +1,34 @@
+import logging
+import os
+import psycopg2
+
+logging.basicConfig(level=logging.INFO)
+
+DB_HOST = os.getenv("DB_HOST")
+DB_PORT = os.getenv("DB_PORT")
+DB_NAME = os.getenv("DB_NAME")
+DB_USER = os.getenv("DB_USER")
+DB_PASS = os.getenv("DB_PASS")
+
+def refresh_reports(conn):
+    """Rebuilds the sales summary behind the report RPCs without blocking readers"""
+    with conn.cursor() as cursor:
+        cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY transaction_monthly_summary")
+    conn.commit()
+
+def main():
+    conn = psycopg2.connect(
+        dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT
+    )
+    try:
+        refresh_reports(conn)
+        logging.info("Refreshed transaction_monthly_summary")
+    except psycopg2.Error as e:
+        conn.rollback()
+        logging.error(f"Report refresh failed: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,17 @@ import logging
 import os
 import grpc
 import psycopg2
+import threading
+import time
 from concurrent import futures
-from prometheus_client import start_http_server, Counter, Summary, Histogram, Gauge
+from datetime import date, datetime
+from prometheus_client import Counter
+
+from microservices.common import profiling, shutdown, tracing
+from microservices.common.metrics import ServerMetricsInterceptor
+from microservices.common.db import QueryMetrics
+from microservices.common.health import DatabaseHealth
+from microservices.common.idempotency import IdempotencyKeyInUse, IdempotencyKeys, idempotency_key_of
 
 from services import transaction_service_pb2_grpc
 from services import transaction_service_pb2
@@ -17,246 +26,498 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 
-# Prometheus metrics
-REQUEST_COUNT = Counter('transaction_request_count', 'Total number of requests by endpoint', ['endpoint', 'status'])
-REQUEST_LATENCY = Histogram('transaction_request_latency_seconds', 'Request latency in seconds', ['endpoint'])
-ACTIVE_REQUESTS = Gauge('transaction_active_requests', 'Number of active requests', ['endpoint'])
-DB_OPERATION_LATENCY = Summary('transaction_db_operation_latency_seconds', 'Database operation latency', ['operation'])
+# Prometheus port; overridable so several services can share one host
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
+
+# Prometheus metrics; every RPC is recorded by SERVER_METRICS and every statement by QUERY_METRICS
+SERVER_METRICS = ServerMetricsInterceptor('transaction')
+IDEMPOTENT_REPLAYS = Counter('transaction_idempotent_replay_count', 'Creates answered with the response stored by an earlier attempt', ['endpoint'])
+ROW_ERRORS = Counter('transaction_row_error_count', 'Rows a ReadAll skipped because they could not be converted', ['endpoint'])
+QUERY_METRICS = QueryMetrics('transaction')
+
+# Creates retried with the same idempotency key get the response stored by the first attempt
+IDEMPOTENCY_KEYS = IdempotencyKeys("transaction_idempotency")
+
+# ReadAll paging limits
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+MAX_RESPONSE_BYTES = int(os.getenv("MAX_RESPONSE_BYTES", str(3 * 1024 * 1024)))
+
+# Report results are served from memory for REPORT_CACHE_TTL seconds; the summary behind them is refreshed by a job
+REPORT_CACHE_TTL = float(os.getenv("REPORT_CACHE_TTL", "300"))
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "256"))
+DEFAULT_REPORT_LIMIT = 100
+
+# Column behind each Transaction field and how its value maps to the message; reads select only the readMask fields
+TRANSACTION_FIELDS = {
+    "transactionId": ("transaction_id", int),
+    "buyerId": ("buyer_id", int),
+    "carId": ("car_id", int),
+    "type": ("transaction_type", Transaction.TypeEnum.Value),
+    "totalAmount": ("total_amount", lambda total_amount: total_amount),
+    "status": ("transaction_status", Transaction.StatusEnum.Value),
+    "transactionDate": ("transaction_date", lambda transaction_date: transaction_date.isoformat() if transaction_date else None),
+    "endDate": ("end_date", lambda end_date: end_date.isoformat() if end_date else None),
+    "version": ("version", lambda version: version),
+}
+TRANSACTION_COLUMNS = ", ".join(column for column, _ in TRANSACTION_FIELDS.values())
+
+# Transaction fields TransactionsPatch may change, with their column and how to read the value from the message
+TRANSACTION_PATCH_COLUMNS = {
+    "buyerId": ("buyer_id", lambda transaction: transaction.buyerId),
+    "carId": ("car_id", lambda transaction: transaction.carId),
+    "type": ("transaction_type", lambda transaction: Transaction.TypeEnum.Name(transaction.type)),
+    "totalAmount": ("total_amount", lambda transaction: transaction.totalAmount),
+    "status": ("transaction_status", lambda transaction: Transaction.StatusEnum.Name(transaction.status)),
+    "transactionDate": ("transaction_date", lambda transaction: transaction.transactionDate),
+    "endDate": ("end_date", lambda transaction: transaction.endDate if transaction.endDate else None),
+}
+
+def transaction_from_row(transaction, fields=tuple(TRANSACTION_FIELDS)):
+    """Maps a row selected with the columns of `fields` to a Transaction, leaving the other fields unset"""
+    return Transaction(**{field: TRANSACTION_FIELDS[field][1](value) for field, value in zip(fields, transaction)})
+
+def read_mask_fields(read_mask):
+    """Transaction fields to select for a readMask, in column order; None when the mask names an unknown field"""
+    paths = set(read_mask.paths)
+    if not paths:
+        return tuple(TRANSACTION_FIELDS)
+    if not paths <= TRANSACTION_FIELDS.keys():
+        return None
+    return tuple(field for field in TRANSACTION_FIELDS if field in paths or field in ("transactionId", "version"))
+
+def select_columns(fields):
+    """Column list for a SELECT of the given Transaction fields"""
+    return ", ".join(TRANSACTION_FIELDS[field][0] for field in fields)
+
+# Canceled transactions never count towards sales figures
+REVENUE_BY_MONTH_QUERY = """
+    SELECT month, SUM(transaction_count), SUM(total_amount)
+    FROM transaction_monthly_summary
+    WHERE transaction_status <> 'StatusEnum_CANCELED' AND month >= %s AND month < %s
+    GROUP BY month ORDER BY month LIMIT %s
+"""
+AVERAGE_PRICE_QUERY = """
+    SELECT car_manufacturer, car_model, car_year, SUM(transaction_count), SUM(total_amount) / SUM(transaction_count)
+    FROM transaction_monthly_summary
+    WHERE transaction_type = 'TypeEnum_BUY' AND transaction_status <> 'StatusEnum_CANCELED'
+      AND month >= %s AND month < %s
+    GROUP BY car_manufacturer, car_model, car_year
+    ORDER BY 4 DESC, car_manufacturer, car_model, car_year LIMIT %s
+"""
+RENT_VS_BUY_QUERY = """
+    SELECT transaction_type, SUM(transaction_count), SUM(total_amount)
+    FROM transaction_monthly_summary
+    WHERE transaction_status <> 'StatusEnum_CANCELED' AND month >= %s AND month < %s
+    GROUP BY transaction_type ORDER BY transaction_type LIMIT %s
+"""
 
 class TransactionService(transaction_service_pb2_grpc.TransactionServiceServicer):
     def __init__(self):
         self.conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT
+            dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT, cursor_factory=QUERY_METRICS.cursor_factory
         )
         self.cursor = self.conn.cursor()
+        self.report_cache = {}
+        self.report_cache_lock = threading.Lock()
 
     def TransactionsCreate(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='TransactionsCreate').inc()
-        
+        idempotency_key = idempotency_key_of(context)
         try:
-            with REQUEST_LATENCY.labels(endpoint='TransactionsCreate').time():
-                with DB_OPERATION_LATENCY.labels(operation='insert').time():
-                    self.cursor.execute(
-                        """
-                        INSERT INTO transaction (buyer_id, car_id, transaction_type, total_amount, transaction_status, transaction_date, end_date) 
-                        VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING transaction_id
-                        """,
-                        (
-                            request.transaction.buyerId,
-                            request.transaction.carId,
-                            Transaction.TypeEnum.Name(request.transaction.type),
-                            request.transaction.totalAmount,
-                            Transaction.StatusEnum.Name(request.transaction.status),
-                            request.transaction.transactionDate,
-                            request.transaction.endDate if request.transaction.endDate else None,
-                        ),
-                    )
-                    transaction_id = self.cursor.fetchone()[0]
+            if idempotency_key:
+                replayed = IDEMPOTENCY_KEYS.claim(self.cursor, idempotency_key, Transaction)
+                if replayed:
                     self.conn.commit()
-                
-                REQUEST_COUNT.labels(endpoint='TransactionsCreate', status='success').inc()
-                return Transaction(
-                    transactionId=transaction_id,
-                    buyerId=request.transaction.buyerId,
-                    carId=request.transaction.carId,
-                    type=request.transaction.type,
-                    totalAmount=request.transaction.totalAmount,
-                    status=request.transaction.status,
-                    transactionDate=request.transaction.transactionDate,
-                    endDate=request.transaction.endDate,
-                )
+                    IDEMPOTENT_REPLAYS.labels(endpoint='TransactionsCreate').inc()
+                    return replayed
+            
+            self.cursor.execute(
+                """
+                INSERT INTO transaction (buyer_id, car_id, transaction_type, total_amount, transaction_status, transaction_date, end_date) 
+                VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING transaction_id
+                """,
+                (
+                    request.transaction.buyerId,
+                    request.transaction.carId,
+                    Transaction.TypeEnum.Name(request.transaction.type),
+                    request.transaction.totalAmount,
+                    Transaction.StatusEnum.Name(request.transaction.status),
+                    request.transaction.transactionDate,
+                    request.transaction.endDate if request.transaction.endDate else None,
+                ),
+            )
+            transaction_id = self.cursor.fetchone()[0]
+        
+            response = Transaction(
+                transactionId=transaction_id,
+                buyerId=request.transaction.buyerId,
+                carId=request.transaction.carId,
+                type=request.transaction.type,
+                totalAmount=request.transaction.totalAmount,
+                status=request.transaction.status,
+                transactionDate=request.transaction.transactionDate,
+                endDate=request.transaction.endDate,
+            )
+            if idempotency_key:
+                IDEMPOTENCY_KEYS.store(self.cursor, idempotency_key, response)
+            self.conn.commit()
+            
+            return response
+        except IdempotencyKeyInUse as e:
+            # The open transaction is the one holding the key, so it is left for that request to commit
+            context.set_details(str(e))
+            context.set_code(grpc.StatusCode.ABORTED)
+            return Transaction()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='TransactionsCreate', status='error').inc()
             return Transaction()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='TransactionsCreate').dec()
 
     def TransactionsReadOne(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='TransactionsReadOne').inc()
+        fields = read_mask_fields(request.readMask)
+        if fields is None:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"readMask may only name: {', '.join(TRANSACTION_FIELDS)}")
+            return Transaction()
         
         try:
-            with REQUEST_LATENCY.labels(endpoint='TransactionsReadOne').time():
-                with DB_OPERATION_LATENCY.labels(operation='select').time():
-                    self.cursor.execute(
-                        """
-                        SELECT transaction_id, buyer_id, car_id, transaction_type, total_amount, transaction_status, transaction_date, end_date 
-                        FROM transaction WHERE transaction_id = %s
-                        """,
-                        (request.transactionId,),
-                    )
-                    transaction = self.cursor.fetchone()
-                
-                if transaction:
-                    REQUEST_COUNT.labels(endpoint='TransactionsReadOne', status='success').inc()
-                    return Transaction(
-                        transactionId=int(transaction[0]),
-                        buyerId=int(transaction[1]),
-                        carId=int(transaction[2]),
-                        type=Transaction.TypeEnum.Value(transaction[3]),
-                        totalAmount=transaction[4] if transaction[4] is not None else 0.0,
-                        status=Transaction.StatusEnum.Value(transaction[5]),
-                        transactionDate=transaction[6].isoformat() if transaction[6] else "",
-                        endDate=transaction[7].isoformat() if transaction[7] else ""
-                    )
-                else:
-                    context.set_code(grpc.StatusCode.NOT_FOUND)
-                    context.set_details(f"Transaction with ID {request.transactionId} not found.")
-                    REQUEST_COUNT.labels(endpoint='TransactionsReadOne', status='not_found').inc()
-                    return Transaction()
+            self.cursor.execute(
+                f"SELECT {select_columns(fields)} FROM transaction WHERE transaction_id = %s", (request.transactionId,)
+            )
+            transaction = self.cursor.fetchone()
+        
+            if transaction:
+                return transaction_from_row(transaction, fields)
+            else:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f"Transaction with ID {request.transactionId} not found.")
+                return Transaction()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='TransactionsReadOne', status='error').inc()
             return Transaction()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='TransactionsReadOne').dec()
+
+    def _build_page(self, rows, page_size, after_id, endpoint, fields):
+        """Maps up to page_size rows to a response, stopping at MAX_RESPONSE_BYTES"""
+        transactions = []
+        response_bytes = 0
+        next_page_token = ""
+        last_id = after_id
+        for row in rows[:page_size]:
+            logging.info(f"Row data: {row}, Types: {[type(value) for value in row]}")
+            try:
+                transaction = transaction_from_row(row, fields)
+                # Stop early once the response would exceed the byte budget
+                response_bytes += transaction.ByteSize()
+                if transactions and response_bytes > MAX_RESPONSE_BYTES:
+                    next_page_token = str(last_id)
+                    break
+                transactions.append(transaction)
+            except Exception as e:
+                logging.info(f"Error processing row: {row}, Error: {e}")
+                ROW_ERRORS.labels(endpoint=endpoint).inc()
+            last_id = row[0]
+        
+        if not next_page_token and len(rows) > page_size:
+            next_page_token = str(last_id)
+        
+        return transaction_service_pb2.TransactionsReadAllResponse(data=transactions, nextPageToken=next_page_token)
 
     def TransactionsReadAll(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='TransactionsReadAll').inc()
+        page_size = min(request.pageSize or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        try:
+            after_id = int(request.pageToken) if request.pageToken else 0
+        except ValueError:
+            after_id = None
+        fields = read_mask_fields(request.readMask)
+        if page_size < 1 or after_id is None or fields is None:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details("Invalid pageSize, pageToken or readMask")
+            return transaction_service_pb2.TransactionsReadAllResponse()
         
         try:
-            with REQUEST_LATENCY.labels(endpoint='TransactionsReadAll').time():
-                with DB_OPERATION_LATENCY.labels(operation='select_all').time():
-                    self.cursor.execute(
-                        """
-                        SELECT * FROM transaction
-                        """
-                    )
-                    rows = self.cursor.fetchall()
-
-                transactions = []
-                for row in rows:
-                    logging.info(f"Row data: {row}, Types: {[type(value) for value in row]}")
-                    try:
-                        transaction = Transaction(
-                            transactionId=int(row[0]),
-                            buyerId=int(row[1]),
-                            carId=int(row[2]),
-                            type=Transaction.TypeEnum.Value(row[3]),
-                            totalAmount=row[4] if row[4] is not None else 0.0,
-                            status=Transaction.StatusEnum.Value(row[5]),
-                            transactionDate=row[6].isoformat() if row[6] else "",
-                            endDate=row[7].isoformat() if row[7] else ""
-                        )
-                        transactions.append(transaction)
-                    except Exception as e:
-                        logging.info(f"Error processing row: {row}, Error: {e}")
-                        REQUEST_COUNT.labels(endpoint='TransactionsReadAll', status='row_error').inc()
-                
-                REQUEST_COUNT.labels(endpoint='TransactionsReadAll', status='success').inc()
-                return transaction_service_pb2.TransactionsReadAllResponse(data=transactions)
+            # Fetch one extra row to know whether another page exists
+            self.cursor.execute(
+                f"SELECT {select_columns(fields)} FROM transaction WHERE transaction_id > %s ORDER BY transaction_id LIMIT %s",
+                (after_id, page_size + 1)
+            )
+            rows = self.cursor.fetchall()
+
+            return self._build_page(rows, page_size, after_id, 'TransactionsReadAll', fields)
         except Exception as e:
             logging.error(f"Error in TransactionsReadAll: {e}")
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='TransactionsReadAll', status='error').inc()
             return transaction_service_pb2.TransactionsReadAllResponse()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='TransactionsReadAll').dec()
 
-    def TransactionsUpdate(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='TransactionsUpdate').inc()
+    def TransactionsReadRange(self, request, context):
+        page_size = min(request.pageSize or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        try:
+            from_date = datetime.fromisoformat(request.fromDate)
+            to_date = datetime.fromisoformat(request.toDate)
+            after_id = int(request.pageToken) if request.pageToken else 0
+            valid_range = from_date < to_date
+        except (ValueError, TypeError):
+            valid_range = False
+        fields = read_mask_fields(request.readMask)
+        if page_size < 1 or not valid_range or fields is None:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details("Invalid date range, pageSize, pageToken or readMask")
+            return transaction_service_pb2.TransactionsReadAllResponse()
+        
+        # Literal bounds on transaction_date let the planner prune to the months in range
+        query = f"SELECT {select_columns(fields)} FROM transaction WHERE transaction_date >= %s AND transaction_date < %s AND transaction_id > %s"
+        params = [from_date, to_date, after_id]
+        if request.status:
+            query += " AND transaction_status = %s"
+            params.append(Transaction.StatusEnum.Name(request.status))
+        if request.type:
+            query += " AND transaction_type = %s"
+            params.append(Transaction.TypeEnum.Name(request.type))
+        query += " ORDER BY transaction_id LIMIT %s"
+        params.append(page_size + 1)
+        
+        try:
+            self.cursor.execute(query, params)
+            rows = self.cursor.fetchall()
+        
+            return self._build_page(rows, page_size, after_id, 'TransactionsReadRange', fields)
+        except Exception as e:
+            logging.error(f"Error in TransactionsReadRange: {e}")
+            self.conn.rollback()
+            context.set_details(str(e))
+            context.set_code(grpc.StatusCode.INTERNAL)
+            return transaction_service_pb2.TransactionsReadAllResponse()
+
+    def _cached_report(self, key, build):
+        """Returns the cached response for key, calling build() when it is missing or older than REPORT_CACHE_TTL"""
+        now = time.monotonic()
+        with self.report_cache_lock:
+            cached = self.report_cache.get(key)
+            if cached and cached[0] > now:
+                return cached[1]
         
+        response = build()
+        with self.report_cache_lock:
+            if len(self.report_cache) >= REPORT_CACHE_MAX_ENTRIES:
+                self.report_cache = {k: v for k, v in self.report_cache.items() if v[0] > now}
+            if len(self.report_cache) >= REPORT_CACHE_MAX_ENTRIES:
+                self.report_cache.pop(next(iter(self.report_cache)))
+            self.report_cache[key] = (now + REPORT_CACHE_TTL, response)
+        return response
+
+    def _run_report(self, endpoint, request, context, response_cls, query, to_message, finish=None):
+        """
+        Validates the month range, then runs query against the summary view through the report cache; finish, if
+        given, completes the built response before it is cached, since cached responses are shared and never modified
+        """
+        
+        limit = min(request.limit or DEFAULT_REPORT_LIMIT, MAX_PAGE_SIZE)
+        try:
+            from_month = datetime.fromisoformat(request.fromDate).date().replace(day=1) if request.fromDate else date.min
+            to_month = datetime.fromisoformat(request.toDate).date().replace(day=1) if request.toDate else date.max
+            valid_range = from_month < to_month
+        except ValueError:
+            valid_range = False
+        if limit < 1 or not valid_range:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details("Invalid date range or limit")
+            return response_cls()
+        
+        def build():
+            self.cursor.execute(query, (from_month, to_month, limit))
+            rows = self.cursor.fetchall()
+            response = response_cls(data=[to_message(row) for row in rows])
+            if finish:
+                finish(response)
+            return response
+        
+        try:
+            response = self._cached_report((endpoint, from_month, to_month, limit), build)
+            return response
+        except psycopg2.Error as e:
+            self.conn.rollback()
+            context.set_details(str(e))
+            context.set_code(grpc.StatusCode.INTERNAL)
+            return response_cls()
+
+    def TransactionsReportRevenueByMonth(self, request, context):
+        return self._run_report(
+            'TransactionsReportRevenueByMonth', request, context,
+            transaction_service_pb2.TransactionsReportRevenueByMonthResponse, REVENUE_BY_MONTH_QUERY,
+            lambda row: transaction_service_pb2.MonthRevenue(
+                month=row[0].isoformat(), transactions=int(row[1]), revenue=float(row[2] or 0)
+            ),
+        )
+
+    def TransactionsReportAveragePrice(self, request, context):
+        return self._run_report(
+            'TransactionsReportAveragePrice', request, context,
+            transaction_service_pb2.TransactionsReportAveragePriceResponse, AVERAGE_PRICE_QUERY,
+            lambda row: transaction_service_pb2.AveragePrice(
+                manufacturer=row[0], model=row[1], year=int(row[2]), sales=int(row[3]), averagePrice=float(row[4] or 0)
+            ),
+        )
+
+    def TransactionsReportRentVsBuy(self, request, context):
+        def add_shares(response):
+            total = sum(split.transactions for split in response.data)
+            for split in response.data:
+                split.share = split.transactions / total
+        
+        return self._run_report(
+            'TransactionsReportRentVsBuy', request, context,
+            transaction_service_pb2.TransactionsReportRentVsBuyResponse, RENT_VS_BUY_QUERY,
+            lambda row: transaction_service_pb2.TypeSplit(
+                type=Transaction.TypeEnum.Value(row[0]), transactions=int(row[1]), revenue=float(row[2] or 0)
+            ),
+            finish=add_shares,
+        )
+
+    def TransactionsUpdate(self, request, context):
         if (request.transactionId != request.transaction.transactionId):
             context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
             context.set_details("Transaction ID mismatch")
-            REQUEST_COUNT.labels(endpoint='TransactionsUpdate', status='invalid_argument').inc()
-            ACTIVE_REQUESTS.labels(endpoint='TransactionsUpdate').dec()
             return Transaction()
         
         try:
-            with REQUEST_LATENCY.labels(endpoint='TransactionsUpdate').time():
-                with DB_OPERATION_LATENCY.labels(operation='update').time():
-                    self.cursor.execute(
-                        """
-                        UPDATE transaction SET buyer_id = %s, car_id = %s, transaction_type = %s, total_amount = %s, transaction_status = %s, transaction_date = %s, end_date = %s
-                        WHERE transaction_id = %s RETURNING transaction_id
-                        """,
-                        (
-                            request.transaction.buyerId,
-                            request.transaction.carId,
-                            Transaction.TypeEnum.Name(request.transaction.type),
-                            request.transaction.totalAmount,
-                            Transaction.StatusEnum.Name(request.transaction.status),
-                            request.transaction.transactionDate,
-                            request.transaction.endDate if request.transaction.endDate else None,
-                            request.transactionId,
-                        ),
-                    )
-                    updated_transaction_id = self.cursor.fetchone()
-                
-                if updated_transaction_id:
-                    self.conn.commit()
-                    REQUEST_COUNT.labels(endpoint='TransactionsUpdate', status='success').inc()
-                    return Transaction(
-                        transactionId=request.transactionId,
-                        buyerId=request.transaction.buyerId,
-                        carId=request.transaction.carId,
-                        type=request.transaction.type,
-                        totalAmount=request.transaction.totalAmount,
-                        status=request.transaction.status,
-                        transactionDate=request.transaction.transactionDate,
-                        endDate=request.transaction.endDate,
-                    )
-                else:
-                    context.set_code(grpc.StatusCode.NOT_FOUND)
-                    context.set_details(f"Transaction with ID {request.transactionId} not found.")
-                    REQUEST_COUNT.labels(endpoint='TransactionsUpdate', status='not_found').inc()
-                    return Transaction()     
+            # Optimistic concurrency: only the writer holding the current version wins, no row lock is held
+            self.cursor.execute(
+                """
+                UPDATE transaction SET buyer_id = %s, car_id = %s, transaction_type = %s, total_amount = %s, transaction_status = %s, transaction_date = %s, end_date = %s,
+                                       version = version + 1
+                WHERE transaction_id = %s AND (%s = 0 OR version = %s) RETURNING version
+                """,
+                (
+                    request.transaction.buyerId,
+                    request.transaction.carId,
+                    Transaction.TypeEnum.Name(request.transaction.type),
+                    request.transaction.totalAmount,
+                    Transaction.StatusEnum.Name(request.transaction.status),
+                    request.transaction.transactionDate,
+                    request.transaction.endDate if request.transaction.endDate else None,
+                    request.transactionId,
+                    request.expectedVersion,
+                    request.expectedVersion,
+                ),
+            )
+            updated_version = self.cursor.fetchone()
+        
+            if updated_version:
+                self.conn.commit()
+                return Transaction(
+                    transactionId=request.transactionId,
+                    buyerId=request.transaction.buyerId,
+                    carId=request.transaction.carId,
+                    type=request.transaction.type,
+                    totalAmount=request.transaction.totalAmount,
+                    status=request.transaction.status,
+                    transactionDate=request.transaction.transactionDate,
+                    endDate=request.transaction.endDate,
+                    version=updated_version[0],
+                )
+            
+            self.cursor.execute("SELECT 1 FROM transaction WHERE transaction_id = %s", (request.transactionId,))
+            if self.cursor.fetchone():
+                context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+                context.set_details(f"Transaction with ID {request.transactionId} was modified since version {request.expectedVersion}.")
+            else:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f"Transaction with ID {request.transactionId} not found.")
+            return Transaction()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='TransactionsUpdate', status='error').inc()
             return Transaction()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='TransactionsUpdate').dec()
 
-    def TransactionsDelete(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='TransactionsDelete').inc()
+    def TransactionsPatch(self, request, context):
+        paths = list(request.updateMask.paths)
+        if not paths or any(path not in TRANSACTION_PATCH_COLUMNS for path in paths):
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"updateMask must name one or more of: {', '.join(TRANSACTION_PATCH_COLUMNS)}")
+            return Transaction()
         
+        # Only the masked columns are written; transaction_date (the partition key) is left alone unless it is in the mask
+        assignments = ", ".join(f"{TRANSACTION_PATCH_COLUMNS[path][0]} = %s" for path in paths)
+        params = [TRANSACTION_PATCH_COLUMNS[path][1](request.transaction) for path in paths]
         try:
-            with REQUEST_LATENCY.labels(endpoint='TransactionsDelete').time():
-                with DB_OPERATION_LATENCY.labels(operation='delete').time():
-                    self.cursor.execute(
-                        "DELETE FROM transaction WHERE transaction_id = %s RETURNING transaction_id",
-                        (request.transactionId,),
-                    )
-                    deleted_transaction_id = self.cursor.fetchone()
-                
-                if deleted_transaction_id:
-                    self.conn.commit()
-                    REQUEST_COUNT.labels(endpoint='TransactionsDelete', status='success').inc()
-                    return empty_pb2.Empty()
-                else:
-                    context.set_code(grpc.StatusCode.NOT_FOUND)
-                    context.set_details(f"Transaction with ID {request.transactionId} not found.")
-                    REQUEST_COUNT.labels(endpoint='TransactionsDelete', status='not_found').inc()
-                    return empty_pb2.Empty()
+            self.cursor.execute(
+                f"UPDATE transaction SET {assignments}, version = version + 1 "
+                f"WHERE transaction_id = %s AND (%s = 0 OR version = %s) RETURNING {TRANSACTION_COLUMNS}",
+                params + [request.transactionId, request.expectedVersion, request.expectedVersion],
+            )
+            transaction = self.cursor.fetchone()
+        
+            if transaction:
+                self.conn.commit()
+                return transaction_from_row(transaction)
+            
+            self.cursor.execute("SELECT 1 FROM transaction WHERE transaction_id = %s", (request.transactionId,))
+            if self.cursor.fetchone():
+                context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+                context.set_details(f"Transaction with ID {request.transactionId} was modified since version {request.expectedVersion}.")
+            else:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f"Transaction with ID {request.transactionId} not found.")
+            return Transaction()
+        except psycopg2.Error as e:
+            self.conn.rollback()
+            context.set_details(str(e))
+            context.set_code(grpc.StatusCode.INTERNAL)
+            return Transaction()
+
+    def TransactionsDelete(self, request, context):
+        try:
+            self.cursor.execute(
+                "DELETE FROM transaction WHERE transaction_id = %s RETURNING transaction_id",
+                (request.transactionId,),
+            )
+            deleted_transaction_id = self.cursor.fetchone()
+        
+            if deleted_transaction_id:
+                self.conn.commit()
+                return empty_pb2.Empty()
+            else:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f"Transaction with ID {request.transactionId} not found.")
+                return empty_pb2.Empty()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='TransactionsDelete', status='error').inc()
             return empty_pb2.Empty()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='TransactionsDelete').dec()
 
 def serve():
     # Start Prometheus HTTP server on port 8000
-    start_http_server(8000)
-    print("Prometheus metrics server started on port 8000...")
+    profiling.start_http_server(METRICS_PORT)
+    print(f"Prometheus metrics server started on port {METRICS_PORT}...")
+    tracing.configure("transaction")
     
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    transaction_service_pb2_grpc.add_TransactionServiceServicer_to_server(TransactionService(), server)
+    # Accept the gateway's keepalive pings, and recycle connections so its DNS round_robin picks up new replicas
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=10),
+        interceptors=[SERVER_METRICS, tracing.ServerInterceptor()],
+        options=[
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.min_recv_ping_interval_without_data_ms", 10000),
+            ("grpc.max_connection_age_ms", 5 * 60 * 1000),
+            ("grpc.max_connection_age_grace_ms", 30 * 1000),
+        ],
+    )
+    servicer = TransactionService()
+    transaction_service_pb2_grpc.add_TransactionServiceServicer_to_server(servicer, server)
+    # Readiness ("" and the service name) and liveness ("liveness") follow the database connections
+    health = DatabaseHealth(QUERY_METRICS, servicer.conn)
+    health.add_to_server(server, transaction_service_pb2.DESCRIPTOR.services_by_name["TransactionService"].full_name)
     server.add_insecure_port("[::]:50010")
     print("Transaction service running on port 50010...")
     server.start()
-    server.wait_for_termination()
+    health.start()
+    shutdown.wait_for_signal()
+    shutdown.drain(server, health)
 
 if __name__ == "__main__":
     serve()
@@ -3,7 +3,13 @@ import grpc
 import psycopg2
 from concurrent import futures
 from google.protobuf import empty_pb2
-from prometheus_client import start_http_server, Counter, Summary, Histogram, Gauge
+from prometheus_client import Counter
+
+from microservices.common import profiling, shutdown, tracing
+from microservices.common.metrics import ServerMetricsInterceptor
+from microservices.common.db import QueryMetrics
+from microservices.common.health import DatabaseHealth
+from microservices.common.idempotency import IdempotencyKeyInUse, IdempotencyKeys, idempotency_key_of
 
 from services import user_service_pb2_grpc
 from services import user_service_pb2
@@ -15,178 +21,234 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 
-# Prometheus metrics
-REQUEST_COUNT = Counter('user_request_count', 'Total number of requests by endpoint', ['endpoint', 'status'])
-REQUEST_LATENCY = Histogram('user_request_latency_seconds', 'Request latency in seconds', ['endpoint'])
-ACTIVE_REQUESTS = Gauge('user_active_requests', 'Number of active requests', ['endpoint'])
-DB_OPERATION_LATENCY = Summary('user_db_operation_latency_seconds', 'Database operation latency', ['operation'])
+# Prometheus port; overridable so several services can share one host
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8000"))
+
+# Prometheus metrics; every RPC is recorded by SERVER_METRICS and every statement by QUERY_METRICS
+SERVER_METRICS = ServerMetricsInterceptor('user')
+IDEMPOTENT_REPLAYS = Counter('user_idempotent_replay_count', 'Creates answered with the response stored by an earlier attempt', ['endpoint'])
+QUERY_METRICS = QueryMetrics('user')
+
+# Creates retried with the same idempotency key get the response stored by the first attempt
+IDEMPOTENCY_KEYS = IdempotencyKeys("user_idempotency")
+
+# ReadAll paging limits
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+MAX_RESPONSE_BYTES = int(os.getenv("MAX_RESPONSE_BYTES", str(3 * 1024 * 1024)))
+
+# Column behind each User field; reads select only the fields in the request's readMask
+USER_FIELDS = {
+    "userId": "user_id",
+    "firstName": "first_name",
+    "lastName": "last_name",
+    "email": "email",
+}
+
+def user_from_row(row, fields=tuple(USER_FIELDS)):
+    """Maps a row selected with the columns of `fields` to a User, leaving the other fields unset"""
+    return User(**dict(zip(fields, row)))
+
+def read_mask_fields(read_mask):
+    """User fields to select for a readMask, in column order; None when the mask names an unknown field"""
+    paths = set(read_mask.paths)
+    if not paths:
+        return tuple(USER_FIELDS)
+    if not paths <= USER_FIELDS.keys():
+        return None
+    return tuple(field for field in USER_FIELDS if field in paths or field == "userId")
+
+def select_columns(fields):
+    """Column list for a SELECT of the given User fields"""
+    return ", ".join(USER_FIELDS[field] for field in fields)
 
 class UserService(user_service_pb2_grpc.UserServiceServicer):
     def __init__(self):
         self.conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT
+            dbname=DB_NAME, user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT, cursor_factory=QUERY_METRICS.cursor_factory
         )
         self.cursor = self.conn.cursor()
 
     # Create a new user -- seems to be working
     def UsersCreate(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='UsersCreate').inc()
-        
+        idempotency_key = idempotency_key_of(context)
         try:
-            with REQUEST_LATENCY.labels(endpoint='UsersCreate').time():
-                with DB_OPERATION_LATENCY.labels(operation='insert').time():
-                    self.cursor.execute(
-                        "INSERT INTO users (first_name, last_name, email) VALUES (%s, %s, %s) RETURNING user_id",
-                        (request.user.firstName, request.user.lastName, request.user.email),
-                    )
-                    user_id = self.cursor.fetchone()[0]
+            if idempotency_key:
+                replayed = IDEMPOTENCY_KEYS.claim(self.cursor, idempotency_key, User)
+                if replayed:
                     self.conn.commit()
-                
-                REQUEST_COUNT.labels(endpoint='UsersCreate', status='success').inc()
-                return User(
-                    userId=user_id,
-                    firstName=request.user.firstName,
-                    lastName=request.user.lastName,
-                    email=request.user.email,
-                )
+                    IDEMPOTENT_REPLAYS.labels(endpoint='UsersCreate').inc()
+                    return replayed
+            
+            self.cursor.execute(
+                "INSERT INTO users (first_name, last_name, email) VALUES (%s, %s, %s) RETURNING user_id",
+                (request.user.firstName, request.user.lastName, request.user.email),
+            )
+            user_id = self.cursor.fetchone()[0]
+        
+            response = User(
+                userId=user_id,
+                firstName=request.user.firstName,
+                lastName=request.user.lastName,
+                email=request.user.email,
+            )
+            if idempotency_key:
+                IDEMPOTENCY_KEYS.store(self.cursor, idempotency_key, response)
+            self.conn.commit()
+            
+            return response
+        except IdempotencyKeyInUse as e:
+            # The open transaction is the one holding the key, so it is left for that request to commit
+            context.set_details(str(e))
+            context.set_code(grpc.StatusCode.ABORTED)
+            return User()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='UsersCreate', status='error').inc()
             return User()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='UsersCreate').dec()
 
     #  Reads 1 user -- seems to be working
     def UsersReadOne(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='UsersReadOne').inc()
+        fields = read_mask_fields(request.readMask)
+        if fields is None:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"readMask may only name: {', '.join(USER_FIELDS)}")
+            return User()
         
         try:
-            with REQUEST_LATENCY.labels(endpoint='UsersReadOne').time():
-                with DB_OPERATION_LATENCY.labels(operation='select').time():
-                    self.cursor.execute("SELECT * FROM users WHERE user_id = %s", (request.userId,))
-                    user = self.cursor.fetchone()
-                
-                if user:
-                    REQUEST_COUNT.labels(endpoint='UsersReadOne', status='success').inc()
-                    return User(userId=user[0], firstName=user[1], lastName=user[2], email=user[3])
-                else:
-                    context.set_code(grpc.StatusCode.NOT_FOUND)
-                    context.set_details("User not found")
-                    REQUEST_COUNT.labels(endpoint='UsersReadOne', status='not_found').inc()
-                    return User()
+            self.cursor.execute(f"SELECT {select_columns(fields)} FROM users WHERE user_id = %s", (request.userId,))
+            user = self.cursor.fetchone()
+        
+            if user:
+                return user_from_row(user, fields)
+            else:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details("User not found")
+                return User()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='UsersReadOne', status='error').inc()
             return User()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='UsersReadOne').dec()
 
     def UsersReadAll(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='UsersReadAll').inc()
-        
+        page_size = min(request.pageSize or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        try:
+            after_id = int(request.pageToken) if request.pageToken else 0
+        except ValueError:
+            after_id = None
+        fields = read_mask_fields(request.readMask)
+        if page_size < 1 or after_id is None or fields is None:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details("Invalid pageSize, pageToken or readMask")
+            return user_service_pb2.UsersReadAllResponse()
+
         try:
-            with REQUEST_LATENCY.labels(endpoint='UsersReadAll').time():
-                with DB_OPERATION_LATENCY.labels(operation='select_all').time():
-                    self.cursor.execute("SELECT * FROM users")
-                    users = [
-                        User(userId=row[0], firstName=row[1], lastName=row[2], email=row[3])
-                        for row in self.cursor.fetchall()
-                    ]
-                
-                REQUEST_COUNT.labels(endpoint='UsersReadAll', status='success').inc()
-                return user_service_pb2.UsersReadAllResponse(data=users)
+            # Fetch one extra row to know whether another page exists
+            self.cursor.execute(
+                f"SELECT {select_columns(fields)} FROM users WHERE user_id > %s ORDER BY user_id LIMIT %s",
+                (after_id, page_size + 1)
+            )
+            rows = self.cursor.fetchall()
+
+            users = []
+            response_bytes = 0
+            next_page_token = ""
+            for row in rows[:page_size]:
+                user = user_from_row(row, fields)
+                # Stop early once the response would exceed the byte budget
+                response_bytes += user.ByteSize()
+                if users and response_bytes > MAX_RESPONSE_BYTES:
+                    break
+                users.append(user)
+
+            if len(users) < len(rows):
+                next_page_token = str(users[-1].userId)
+
+            return user_service_pb2.UsersReadAllResponse(data=users, nextPageToken=next_page_token)
         except Exception as e:
-            REQUEST_COUNT.labels(endpoint='UsersReadAll', status='error').inc()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
             return user_service_pb2.UsersReadAllResponse()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='UsersReadAll').dec()
 
     def UsersUpdate(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='UsersUpdate').inc()
-        
         if (request.userId != request.user.userId):
             context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
             context.set_details("User ID in path and body do not match")
-            REQUEST_COUNT.labels(endpoint='UsersUpdate', status='invalid_argument').inc()
-            ACTIVE_REQUESTS.labels(endpoint='UsersUpdate').dec()
             return User()
         
         try:
-            with REQUEST_LATENCY.labels(endpoint='UsersUpdate').time():
-                with DB_OPERATION_LATENCY.labels(operation='update').time():
-                    self.cursor.execute(
-                        "UPDATE users SET first_name = %s, last_name = %s, email = %s WHERE user_id = %s RETURNING user_id",
-                        (request.user.firstName, request.user.lastName, request.user.email, request.userId),
-                    )
-                    updated_user_id = self.cursor.fetchone()
-                
-                if updated_user_id:
-                    self.conn.commit()
-                    REQUEST_COUNT.labels(endpoint='UsersUpdate', status='success').inc()
-                    return User(
-                        userId=request.userId,
-                        firstName=request.user.firstName,
-                        lastName=request.user.lastName,
-                        email=request.user.email,
-                    )
-                else:
-                    context.set_code(grpc.StatusCode.NOT_FOUND)
-                    context.set_details(f"User with ID {request.userId} not found.")
-                    REQUEST_COUNT.labels(endpoint='UsersUpdate', status='not_found').inc()
-                    return User()
+            self.cursor.execute(
+                "UPDATE users SET first_name = %s, last_name = %s, email = %s WHERE user_id = %s RETURNING user_id",
+                (request.user.firstName, request.user.lastName, request.user.email, request.userId),
+            )
+            updated_user_id = self.cursor.fetchone()
+        
+            if updated_user_id:
+                self.conn.commit()
+                return User(
+                    userId=request.userId,
+                    firstName=request.user.firstName,
+                    lastName=request.user.lastName,
+                    email=request.user.email,
+                )
+            else:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details(f"User with ID {request.userId} not found.")
+                return User()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='UsersUpdate', status='error').inc()
             return User()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='UsersUpdate').dec()
 
     def UsersDelete(self, request, context):
-        ACTIVE_REQUESTS.labels(endpoint='UsersDelete').inc()
-        
         try:
-            with REQUEST_LATENCY.labels(endpoint='UsersDelete').time():
-                with DB_OPERATION_LATENCY.labels(operation='delete').time():
-                    self.cursor.execute("DELETE FROM users WHERE user_id = %s RETURNING user_id", (request.userId,))
-                    deleted_user_id = self.cursor.fetchone()
-                
-                if deleted_user_id:
-                    self.conn.commit()
-                    REQUEST_COUNT.labels(endpoint='UsersDelete', status='success').inc()
-                    return empty_pb2.Empty()
-                else:
-                    context.set_code(grpc.StatusCode.NOT_FOUND)
-                    context.set_details("User not found")
-                    REQUEST_COUNT.labels(endpoint='UsersDelete', status='not_found').inc()
-                    return empty_pb2.Empty()
+            self.cursor.execute("DELETE FROM users WHERE user_id = %s RETURNING user_id", (request.userId,))
+            deleted_user_id = self.cursor.fetchone()
+        
+            if deleted_user_id:
+                self.conn.commit()
+                return empty_pb2.Empty()
+            else:
+                context.set_code(grpc.StatusCode.NOT_FOUND)
+                context.set_details("User not found")
+                return empty_pb2.Empty()
         except psycopg2.Error as e:
             self.conn.rollback()
             context.set_details(str(e))
             context.set_code(grpc.StatusCode.INTERNAL)
-            REQUEST_COUNT.labels(endpoint='UsersDelete', status='error').inc()
             return empty_pb2.Empty()
-        finally:
-            ACTIVE_REQUESTS.labels(endpoint='UsersDelete').dec()
 
 def serve():
     # Start Prometheus HTTP server on port 8000
-    start_http_server(8000)
-    print("Prometheus metrics server started on port 8000...")
+    profiling.start_http_server(METRICS_PORT)
+    print(f"Prometheus metrics server started on port {METRICS_PORT}...")
+    tracing.configure("user")
     
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    user_service_pb2_grpc.add_UserServiceServicer_to_server(UserService(), server)
+    # Accept the gateway's keepalive pings, and recycle connections so its DNS round_robin picks up new replicas
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=10),
+        interceptors=[SERVER_METRICS, tracing.ServerInterceptor()],
+        options=[
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.min_recv_ping_interval_without_data_ms", 10000),
+            ("grpc.max_connection_age_ms", 5 * 60 * 1000),
+            ("grpc.max_connection_age_grace_ms", 30 * 1000),
+        ],
+    )
+    servicer = UserService()
+    user_service_pb2_grpc.add_UserServiceServicer_to_server(servicer, server)
+    # Readiness ("" and the service name) and liveness ("liveness") follow the database connections
+    health = DatabaseHealth(QUERY_METRICS, servicer.conn)
+    health.add_to_server(server, user_service_pb2.DESCRIPTOR.services_by_name["UserService"].full_name)
     server.add_insecure_port("[::]:50007")
     print("User service running on port 50007...")
     server.start()
-    server.wait_for_termination()
+    health.start()
+    shutdown.wait_for_signal()
+    shutdown.drain(server, health)
 
 if __name__ == "__main__":
     serve()
\ No newline at end of file
@@ -0,0 +1,455 @@
+"""
+Fills a database created from databases/init.sql with synthetic users, cars, listings and transactions, from a few
+thousand rows up to hundreds of millions. Rows are generated in chunks by a pool of worker processes, each streaming
+its chunks into Postgres with COPY over its own connection.
+
+    DB_HOST=localhost DB_PORT=5432 DB_NAME=stand DB_USER=postgres DB_PASS=... \\
+        python perf/generate_data.py --scale 10000000 --workers 8
+
+The data is correlated the way the real inventory is: a few manufacturers and models make up most cars, most cars
+are a few years old, mileage and condition follow age, prices follow brand, age and mileage, old listings are
+mostly sold, a small share of users post and buy most of the listings and transactions, and sales peak in spring.
+
+Every chunk has its own random generator seeded from --seed, so the same seed, --as-of date, row counts and
+--chunk-rows produce the same rows whatever the number of workers. Rows are appended after the existing ones.
+Meant for an idle database: the listing stats trigger is disabled during the load and the stats are rebuilt after.
+"""
+import argparse
+import bisect
+import csv
+import io
+import logging
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import psycopg2
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "microservices" / "car_listing"))
+
+from summary_check import check_listing_stats  # noqa: E402
+
+logging.basicConfig(level=logging.INFO)
+
+# Share of --scale that goes to each table
+SCALE_SHARES = {"users": 0.05, "cars": 0.30, "listings": 0.30, "transactions": 0.35}
+
+CHUNK_ROWS = 50000
+HISTORY_MONTHS = 36
+# Listings are posted at most this many days before --as-of
+LISTING_MAX_AGE_DAYS = 730
+
+# Higher values concentrate more listings and transactions on fewer users
+SELLER_SKEW = 3.0
+BUYER_SKEW = 2.0
+
+# Ordered by popularity; each manufacturer has the price of an average new car and its models with
+# (model, type, size, cylinders, fuel), also ordered by popularity
+MANUFACTURERS = [
+    ("Ford", 34000, [
+        ("F-150", "pickup", "full-size", "6 cylinders", "gas"), ("Escape", "SUV", "mid-size", "4 cylinders", "gas"),
+        ("Focus", "sedan", "compact", "4 cylinders", "gas"), ("Explorer", "SUV", "full-size", "6 cylinders", "gas"),
+        ("Mustang", "coupe", "mid-size", "8 cylinders", "gas"),
+    ]),
+    ("Chevrolet", 33000, [
+        ("Silverado 1500", "pickup", "full-size", "8 cylinders", "gas"), ("Malibu", "sedan", "mid-size", "4 cylinders", "gas"),
+        ("Equinox", "SUV", "mid-size", "4 cylinders", "gas"), ("Tahoe", "SUV", "full-size", "8 cylinders", "gas"),
+        ("Camaro", "coupe", "mid-size", "6 cylinders", "gas"),
+    ]),
+    ("Toyota", 31000, [
+        ("Camry", "sedan", "mid-size", "4 cylinders", "gas"), ("Corolla", "sedan", "compact", "4 cylinders", "gas"),
+        ("RAV4", "SUV", "mid-size", "4 cylinders", "gas"), ("Tacoma", "pickup", "mid-size", "6 cylinders", "gas"),
+        ("Prius", "hatchback", "compact", "4 cylinders", "hybrid"),
+    ]),
+    ("Honda", 29000, [
+        ("Civic", "sedan", "compact", "4 cylinders", "gas"), ("Accord", "sedan", "mid-size", "4 cylinders", "gas"),
+        ("CR-V", "SUV", "mid-size", "4 cylinders", "gas"), ("Odyssey", "mini-van", "full-size", "6 cylinders", "gas"),
+    ]),
+    ("Nissan", 27000, [
+        ("Altima", "sedan", "mid-size", "4 cylinders", "gas"), ("Rogue", "SUV", "mid-size", "4 cylinders", "gas"),
+        ("Sentra", "sedan", "compact", "4 cylinders", "gas"), ("Leaf", "hatchback", "compact", None, "electric"),
+    ]),
+    ("Jeep", 36000, [
+        ("Wrangler", "offroad", "mid-size", "6 cylinders", "gas"), ("Grand Cherokee", "SUV", "full-size", "6 cylinders", "gas"),
+        ("Cherokee", "SUV", "mid-size", "4 cylinders", "gas"),
+    ]),
+    ("Ram", 42000, [
+        ("1500", "pickup", "full-size", "8 cylinders", "gas"), ("2500", "pickup", "full-size", "6 cylinders", "diesel"),
+    ]),
+    ("Volkswagen", 28000, [
+        ("Jetta", "sedan", "compact", "4 cylinders", "gas"), ("Golf", "hatchback", "compact", "4 cylinders", "gas"),
+        ("Tiguan", "SUV", "mid-size", "4 cylinders", "gas"), ("Passat", "sedan", "mid-size", "4 cylinders", "diesel"),
+    ]),
+    ("Hyundai", 25000, [
+        ("Elantra", "sedan", "compact", "4 cylinders", "gas"), ("Tucson", "SUV", "mid-size", "4 cylinders", "gas"),
+        ("Sonata", "sedan", "mid-size", "4 cylinders", "gas"),
+    ]),
+    ("BMW", 50000, [
+        ("3 Series", "sedan", "mid-size", "4 cylinders", "gas"), ("X5", "SUV", "full-size", "6 cylinders", "gas"),
+        ("5 Series", "sedan", "full-size", "6 cylinders", "gas"),
+    ]),
+    ("Subaru", 30000, [
+        ("Outback", "wagon", "mid-size", "4 cylinders", "gas"), ("Forester", "SUV", "mid-size", "4 cylinders", "gas"),
+        ("Impreza", "hatchback", "compact", "4 cylinders", "gas"),
+    ]),
+    ("Mercedes-Benz", 55000, [
+        ("C-Class", "sedan", "mid-size", "4 cylinders", "gas"), ("E-Class", "sedan", "full-size", "6 cylinders", "gas"),
+        ("GLC", "SUV", "mid-size", "4 cylinders", "gas"),
+    ]),
+    ("Kia", 24000, [
+        ("Sorento", "SUV", "mid-size", "4 cylinders", "gas"), ("Optima", "sedan", "mid-size", "4 cylinders", "gas"),
+        ("Soul", "hatchback", "compact", "4 cylinders", "gas"),
+    ]),
+    ("Audi", 48000, [
+        ("A4", "sedan", "mid-size", "4 cylinders", "gas"), ("Q5", "SUV", "mid-size", "4 cylinders", "gas"),
+    ]),
+    ("Tesla", 52000, [
+        ("Model 3", "sedan", "mid-size", None, "electric"), ("Model Y", "SUV", "mid-size", None, "electric"),
+    ]),
+]
+# World manufacturer identifiers, the first three characters of every VIN
+WMI = {
+    "Ford": "1FT", "Chevrolet": "1GC", "Toyota": "4T1", "Honda": "1HG", "Nissan": "1N4", "Jeep": "1C4", "Ram": "3C6",
+    "Volkswagen": "3VW", "Hyundai": "5NP", "BMW": "WBA", "Subaru": "4S4", "Mercedes-Benz": "WDD", "Kia": "KNA",
+    "Audi": "WAU", "Tesla": "5YJ",
+}
+VIN_CHARS = "ABCDEFGHJKLMNPRSTUVWXYZ0123456789"
+# Newer body styles hold their value better than sedans
+TYPE_PRICE_FACTOR = {"pickup": 1.15, "offroad": 1.1, "SUV": 1.05, "mini-van": 0.95, "wagon": 0.95, "coupe": 1.0,
+                     "sedan": 0.9, "hatchback": 0.85}
+DRIVES = {"pickup": ["4wd", "4wd", "rwd"], "offroad": ["4wd"], "SUV": ["4wd", "fwd"], "coupe": ["rwd"], "wagon": ["4wd", "fwd"]}
+CONDITION_FACTOR = {"new": 1.1, "like new": 1.0, "excellent": 0.95, "good": 0.88, "fair": 0.7, "salvage": 0.35}
+PAINT_COLORS = ["white", "black", "silver", "grey", "blue", "red", "green", "brown", "custom"]
+PAINT_WEIGHTS = [25, 20, 15, 12, 10, 10, 3, 3, 2]
+# Relative sales per calendar month, peaking with tax refunds in spring and dipping over the holidays
+MONTH_WEIGHTS = [0.85, 0.9, 1.2, 1.15, 1.1, 1.05, 1.0, 1.0, 0.95, 0.9, 0.85, 0.8]
+FIRST_NAMES = ["James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "David", "Elizabeth", "William",
+               "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Carlos", "Ana", "Miguel", "Sofia",
+               "Jose", "Maria", "Luis", "Beatriz", "Pedro", "Ines", "Tiago", "Joana", "Wei", "Mei", "Raj", "Priya"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+              "Hernandez", "Lopez", "Wilson", "Anderson", "Silva", "Santos", "Ferreira", "Pereira", "Costa", "Oliveira",
+              "Almeida", "Sousa", "Campos", "Henriques", "Chen", "Wang", "Patel", "Kim", "Nguyen", "Muller"]
+
+COPY_COLUMNS = {
+    "users": "user_id, first_name, last_name, email",
+    "car": "car_id, car_year, car_manufacturer, car_model, car_condition, car_cylinders, car_fuel, car_odometer, "
+           "car_transmission, car_vin, car_drive, car_size, car_type, car_paint_color",
+    "car_listing": "listing_id, listing_car_id, listing_user_id, listing_type, listing_description, listing_posting_date, "
+                   "listing_sale_price, listing_promoted, listing_status",
+    "transaction": "transaction_id, buyer_id, car_id, transaction_type, total_amount, transaction_status, transaction_date, end_date",
+}
+ID_COLUMNS = {"users": "user_id", "car": "car_id", "car_listing": "listing_id", "transaction": "transaction_id"}
+
+def zipf_cumulative(count, exponent=1.0):
+    """Cumulative weights for rank 1..count under a Zipf distribution, for random.choices"""
+    total, weights = 0.0, []
+    for rank in range(1, count + 1):
+        total += 1 / rank ** exponent
+        weights.append(total)
+    return weights
+
+MANUFACTURER_WEIGHTS = zipf_cumulative(len(MANUFACTURERS), 0.9)
+MODEL_WEIGHTS = {name: zipf_cumulative(len(models)) for name, _, models in MANUFACTURERS}
+
+class Plan:
+    """Row counts, the first ID of every table and the fixed inputs every chunk is generated from"""
+    def __init__(self, seed, as_of, counts, first_ids, user_ids, chunk_rows):
+        self.seed = seed
+        self.as_of = datetime.combine(as_of, datetime.min.time())
+        self.counts = counts
+        self.first_ids = first_ids
+        # Existing user IDs, used as sellers and buyers when no users are generated
+        self.user_ids = user_ids
+        self.user_count = counts["users"] or len(user_ids)
+        self.chunk_rows = chunk_rows
+        # Multiplying a rank by a number coprime with the user count spreads the busiest users over the ID range
+        self.user_stride = 2654435761 % self.user_count if self.user_count > 1 else 1
+        while math.gcd(self.user_stride, self.user_count) != 1:
+            self.user_stride += 1
+        self.months = []
+        month = (self.as_of.replace(day=1) - timedelta(days=31 * (HISTORY_MONTHS - 1))).replace(day=1)
+        while month <= self.as_of:
+            self.months.append(month)
+            month = (month + timedelta(days=32)).replace(day=1)
+        # Seasonal, with business growing over the covered period
+        total, self.month_weights = 0.0, []
+        for index, month in enumerate(self.months):
+            total += MONTH_WEIGHTS[month.month - 1] * (1 + 0.5 * index / len(self.months))
+            self.month_weights.append(total)
+
+    @property
+    def history_start(self):
+        return self.months[0]
+
+    def chunks(self, table, count):
+        return [(table, index) for index in range(math.ceil(count / self.chunk_rows))]
+
+    def rng(self, table, index):
+        # String seeds are hashed with SHA-512, so the generator is the same in every process
+        return random.Random(f"{self.seed}:{table}:{index}")
+
+    def user(self, rng, skew):
+        """A user ID, most often one of the few busiest users"""
+        rank = int(self.user_count * rng.random() ** skew)
+        index = rank * self.user_stride % self.user_count
+        return self.user_ids[index] if not self.counts["users"] else self.first_ids["users"] + index
+
+    def date_in_history(self, rng):
+        """A timestamp in the covered months, weighted by season"""
+        month = self.months[bisect.bisect(self.month_weights, rng.random() * self.month_weights[-1])]
+        moment = month + timedelta(seconds=rng.randrange(31 * 86400))
+        if moment.month != month.month or moment > self.as_of:
+            moment = month + timedelta(seconds=rng.randrange(28 * 86400))
+        return min(moment, self.as_of)
+
+def apportion(total, start, end, whole):
+    """The [first, last) slice of total rows that belongs to rows start..end out of whole"""
+    return total * start // whole, total * end // whole
+
+def generate_users(plan, index):
+    rng = plan.rng("users", index)
+    start = index * plan.chunk_rows
+    rows = []
+    for offset in range(start, min(start + plan.chunk_rows, plan.counts["users"])):
+        user_id = plan.first_ids["users"] + offset
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        # The ID keeps emails unique however many users share a name
+        email = f"{first_name}.{last_name}.{user_id}@example.com".lower()
+        rows.append((user_id, first_name, last_name if rng.random() > 0.02 else None, email))
+    return {"users": rows}
+
+def random_car(plan, rng, car_id):
+    """A car row and its market value, with age, mileage, condition and price following each other"""
+    manufacturer, base_price, models = MANUFACTURERS[bisect.bisect(MANUFACTURER_WEIGHTS, rng.random() * MANUFACTURER_WEIGHTS[-1])]
+    weights = MODEL_WEIGHTS[manufacturer]
+    model, car_type, size, cylinders, fuel = models[bisect.bisect(weights, rng.random() * weights[-1])]
+    age = min(int(rng.gammavariate(2.0, 3.0)), 30)
+    if fuel == "electric":
+        age = min(age, 10)
+    elif fuel == "gas" and rng.random() < 0.04:
+        fuel = "hybrid"
+    odometer = 0 if age == 0 and rng.random() < 0.5 else max(0, int(rng.gauss(12000, 4000) * (age + rng.random())))
+    wear = age + odometer / 40000 + rng.gauss(0, 1.5)
+    if age == 0 and odometer < 1000:
+        condition = "new"
+    elif wear < 3:
+        condition = "like new"
+    elif wear < 8:
+        condition = "excellent" if rng.random() < 0.4 else "good"
+    elif wear < 18:
+        condition = "good" if rng.random() < 0.6 else "fair"
+    else:
+        condition = "salvage" if rng.random() < 0.1 else "fair"
+    value = (base_price * TYPE_PRICE_FACTOR[car_type] * 0.86 ** age * max(0.3, 1 - odometer / 400000)
+             * CONDITION_FACTOR[condition] * rng.lognormvariate(0, 0.12))
+    transmission = "manual" if rng.random() < 0.03 + 0.01 * age else "automatic"
+    vin_suffix = ""
+    number = car_id
+    for _ in range(9):
+        number, digit = divmod(number, len(VIN_CHARS))
+        vin_suffix = VIN_CHARS[digit] + vin_suffix
+    # The car ID in the last nine characters keeps VINs unique
+    vin = WMI[manufacturer] + "".join(rng.choice(VIN_CHARS) for _ in range(4)) + VIN_CHARS[(plan.as_of.year - age) % 30] + vin_suffix
+    row = (
+        car_id, plan.as_of.year - age, manufacturer, model, condition, cylinders, fuel, odometer, transmission, vin,
+        rng.choice(DRIVES.get(car_type, ["fwd"])), size, car_type, rng.choices(PAINT_COLORS, PAINT_WEIGHTS)[0],
+    )
+    return row, max(500.0, value)
+
+def random_listing(plan, rng, listing_id, car, value):
+    """A listing of car at about its value; old listings are mostly sold, rentals are priced per day"""
+    age_days = int(LISTING_MAX_AGE_DAYS * rng.random() ** 2)
+    posted = plan.as_of - timedelta(days=age_days, seconds=rng.randrange(86400))
+    listing_type = "TypeEnum_RENT" if rng.random() < 0.2 else "TypeEnum_BUY"
+    roll = rng.random()
+    if listing_type == "TypeEnum_BUY" and roll < min(0.85, age_days / 200):
+        status = "StatusEnum_SOLD"
+    elif roll > 0.95:
+        status = "StatusEnum_RESERVED"
+    else:
+        status = "StatusEnum_AVAILABLE"
+    if listing_type == "TypeEnum_RENT":
+        price = round(max(15.0, value / 450 * rng.lognormvariate(0, 0.1)), 2)
+    else:
+        price = round(value * rng.lognormvariate(0.05, 0.08) / 50) * 50
+    description = f"{car[1]} {car[2]} {car[3]}, {car[7]:,} miles, {car[4]}"
+    return (listing_id, car[0], plan.user(rng, SELLER_SKEW), listing_type, description, posted,
+            price, rng.random() < 0.08, status)
+
+def random_transaction(plan, rng, transaction_id, car, value):
+    """A rental or a sale outside the listings; recent ones are often still pending"""
+    moment = plan.date_in_history(rng)
+    if rng.random() < 0.7:
+        days = min(1 + int(rng.expovariate(1 / 4)), 60)
+        transaction_type, end_date = "TypeEnum_RENT", moment + timedelta(days=days)
+        amount = round(max(15.0, value / 450) * days, 2)
+    else:
+        transaction_type, end_date = "TypeEnum_BUY", None
+        amount = round(value * rng.uniform(0.9, 1.05), 2)
+    if plan.as_of - moment < timedelta(days=14) and rng.random() < 0.6:
+        status = "StatusEnum_PENDING"
+    else:
+        status = "StatusEnum_CANCELED" if rng.random() < 0.08 else "StatusEnum_COMPLETED"
+    return (transaction_id, plan.user(rng, BUYER_SKEW), car[0], transaction_type, amount, status, moment, end_date)
+
+def generate_inventory(plan, index):
+    """One chunk of cars with the share of listings and transactions that belongs to them"""
+    rng = plan.rng("cars", index)
+    start = index * plan.chunk_rows
+    end = min(start + plan.chunk_rows, plan.counts["cars"])
+    cars, values = [], []
+    for offset in range(start, end):
+        row, value = random_car(plan, rng, plan.first_ids["car"] + offset)
+        cars.append(row)
+        values.append(value)
+
+    listings = []
+    first, last = apportion(plan.counts["listings"], start, end, plan.counts["cars"])
+    for offset in range(first, last):
+        car_index = rng.randrange(len(cars))
+        listings.append(random_listing(plan, rng, plan.first_ids["car_listing"] + offset, cars[car_index], values[car_index]))
+
+    transactions = []
+    first, last = apportion(plan.counts["transactions"], start, end, plan.counts["cars"])
+    transaction_id = plan.first_ids["transaction"] + first
+    # Sold listings were bought shortly after they were posted, for a little under the asking price
+    for listing in listings:
+        if len(transactions) == last - first:
+            break
+        if listing[8] == "StatusEnum_SOLD":
+            moment = min(listing[5] + timedelta(days=rng.randint(1, 60), seconds=rng.randrange(86400)), plan.as_of)
+            transactions.append((transaction_id, plan.user(rng, BUYER_SKEW), listing[1], "TypeEnum_BUY",
+                                 round(listing[6] * rng.uniform(0.9, 1.0), 2), "StatusEnum_COMPLETED", moment, None))
+            transaction_id += 1
+    while len(transactions) < last - first:
+        car_index = rng.randrange(len(cars))
+        transactions.append(random_transaction(plan, rng, transaction_id, cars[car_index], values[car_index]))
+        transaction_id += 1
+    return {"car": cars, "car_listing": listings, "transaction": transactions}
+
+GENERATORS = {"users": generate_users, "cars": generate_inventory}
+
+_connection = None
+_plan = None
+
+def init_worker(connect_kwargs, plan):
+    global _connection, _plan
+    _connection = psycopg2.connect(**connect_kwargs)
+    _plan = plan
+
+def load_chunk(chunk):
+    """Generates one chunk and COPYs its tables in one transaction, so cars land together with their listings"""
+    table, index = chunk
+    rows_by_table = GENERATORS[table](_plan, index)
+    with _connection.cursor() as cursor:
+        for name, rows in rows_by_table.items():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            # None becomes an unquoted empty field, which COPY reads as NULL
+            writer.writerows(rows)
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY {name} ({COPY_COLUMNS[name]}) FROM STDIN WITH (FORMAT csv)", buffer)
+    _connection.commit()
+    return {name: len(rows) for name, rows in rows_by_table.items()}
+
+def scaled_counts(scale, overrides):
+    counts = {table: int(scale * share) for table, share in SCALE_SHARES.items()}
+    counts.update({table: count for table, count in overrides.items() if count is not None})
+    return counts
+
+def run_phase(pool, plan, chunks, label):
+    started = time.monotonic()
+    loaded = {}
+    for counts in pool.imap_unordered(load_chunk, chunks):
+        for name, count in counts.items():
+            loaded[name] = loaded.get(name, 0) + count
+    elapsed = time.monotonic() - started
+    total = sum(loaded.values())
+    logging.info(f"Loaded {label}: {', '.join(f'{count} {name}' for name, count in loaded.items())} "
+                 f"in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} rows/s)")
+
+def generate(connect_kwargs, counts, seed=0, as_of=None, workers=None, chunk_rows=CHUNK_ROWS):
+    """Appends counts["users"|"cars"|"listings"|"transactions"] synthetic rows and brings the derived tables up to date"""
+    if counts["cars"] == 0 and (counts["listings"] or counts["transactions"]):
+        raise ValueError("Listings and transactions need cars to refer to")
+    conn = psycopg2.connect(**connect_kwargs)
+    try:
+        with conn.cursor() as cursor:
+            first_ids = {}
+            for table, column in ID_COLUMNS.items():
+                cursor.execute(f"SELECT COALESCE(MAX({column}), 0) + 1 FROM {table}")
+                first_ids[table] = cursor.fetchone()[0]
+            user_ids = []
+            if not counts["users"]:
+                cursor.execute("SELECT user_id FROM users ORDER BY user_id")
+                user_ids = [row[0] for row in cursor.fetchall()]
+                if not user_ids and counts["cars"]:
+                    raise ValueError("No users to own the listings; generate some with --users")
+        plan = Plan(seed, as_of or date.today(), counts, first_ids, user_ids, chunk_rows)
+
+        with conn.cursor() as cursor:
+            # Transactions before the first monthly partition would all land in the default one
+            cursor.execute("SELECT create_transaction_partitions(%s, 3)", (plan.history_start.date(),))
+            # The per-row stats trigger would serialise the COPY streams on a handful of stats rows
+            cursor.execute("ALTER TABLE car_listing DISABLE TRIGGER car_listing_stats")
+        conn.commit()
+        try:
+            with multiprocessing.Pool(workers or os.cpu_count(), init_worker, (connect_kwargs, plan)) as pool:
+                # Listings and transactions reference users, so all users are committed first
+                run_phase(pool, plan, plan.chunks("users", counts["users"]), "users")
+                run_phase(pool, plan, plan.chunks("cars", counts["cars"]), "cars, listings and transactions")
+        finally:
+            with conn.cursor() as cursor:
+                cursor.execute("ALTER TABLE car_listing ENABLE TRIGGER car_listing_stats")
+            conn.commit()
+
+        with conn.cursor() as cursor:
+            # COPY with explicit IDs leaves the SERIAL sequences behind, as in init.sql
+            for table, column in ID_COLUMNS.items():
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), COALESCE(MAX({column}), 0) + 1, false) FROM {table}"
+                )
+        conn.commit()
+        drifted = check_listing_stats(conn, repair=True)
+        logging.info(f"Rebuilt {len(drifted)} listing stats groups")
+        with conn.cursor() as cursor:
+            cursor.execute("REFRESH MATERIALIZED VIEW transaction_monthly_summary")
+        conn.commit()
+        # Autovacuum would get there eventually; the planner needs the new row counts before the first test
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("ANALYZE users, car, car_listing, transaction")
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Appends synthetic users, cars, listings and transactions to the database")
+    parser.add_argument("--scale", type=int, default=10000, help="total rows, split over the tables by SCALE_SHARES")
+    for table in SCALE_SHARES:
+        parser.add_argument(f"--{table}", type=int, help=f"rows of {table}, instead of its share of --scale")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--as-of", type=date.fromisoformat, help="date the history ends at (default: today)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="rows generated and copied per transaction")
+    args = parser.parse_args()
+
+    counts = scaled_counts(args.scale, {table: getattr(args, table) for table in SCALE_SHARES})
+    connect_kwargs = {
+        "dbname": os.getenv("DB_NAME"), "user": os.getenv("DB_USER"), "password": os.getenv("DB_PASS"),
+        "host": os.getenv("DB_HOST"), "port": os.getenv("DB_PORT"),
+    }
+    started = time.monotonic()
+    try:
+        generate(connect_kwargs, counts, args.seed, args.as_of, args.workers, args.chunk_rows)
+    except ValueError as e:
+        parser.error(str(e))
+    logging.info(f"Generated {sum(counts.values())} rows in {time.monotonic() - started:.1f}s")
+
+if __name__ == "__main__":
+    main()
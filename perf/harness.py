@@ -0,0 +1,307 @@
+"""
+Runs the benchmark and load suites. The microbenchmarks in benchmarks/ run in-process first, while nothing else
+competes for the CPU. The Locust load suite then runs against a complete local stack: a throwaway Postgres loaded from
+databases/init.sql and filled with --scale rows of synthetic data by generate_data.py, every gRPC service and the
+gateway as subprocesses, and a local JWKS for the load-test signing key. Needs neither network access nor Auth0, only
+a Postgres installation (initdb, pg_ctl and psql on PATH, or --pg-bin) and the Python requirements of the services,
+the gateway, locust and benchmarks/requirements.txt.
+
+    python perf/harness.py --users 100 --spawn-rate 20 --run-time 2m --report perf-report.json
+
+The report holds the median, IQR and ops of every microbenchmark, and the throughput, failures and latency
+percentiles of every route plus the SLO verdict. Use benchmarks/compare.py to compare benchmarks with a baseline.
+"""
+import argparse
+import csv
+import http.server
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "locust_tests"))
+
+from seed import random_car, random_listing  # noqa: E402
+from tokens import AUTH0_DOMAIN, AUTH0_AUDIENCE, LOADTEST_JWKS, signing_key  # noqa: E402
+from generate_data import generate, scaled_counts  # noqa: E402
+
+# gRPC port of every service, as hard-wired in its serve()
+SERVICES = {
+    "user": 50007,
+    "car": 50008,
+    "car_listing": 50009,
+    "transaction": 50010,
+    "inspection": 50011,
+    "maintenance": 50012,
+    "meeting": 50015,
+}
+GATEWAY_PORT = 50000
+DB_NAME = "stand"
+DB_USER = "postgres"
+
+# Rows in the cars.csv and listings.csv init.sql COPYs; its sample maintenance, inspection and transaction rows refer
+# to cars 1-3. The bulk of the data is appended by generate_data.py
+SEED_CSV_ROWS = 10
+
+STARTUP_TIMEOUT = 60
+PERCENTILES = ["50%", "90%", "95%", "99%"]
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, process, name, timeout=STARTUP_TIMEOUT):
+    """Blocks until something accepts connections on port, failing early if process exits"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{name} exited with code {process.returncode} during startup")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{name} did not listen on port {port} within {timeout}s")
+
+class EphemeralPostgres:
+    """A Postgres cluster in a temporary directory, reachable only through a Unix socket in that directory"""
+    def __init__(self, pg_bin, workdir):
+        self.pg_bin = Path(pg_bin)
+        self.data_dir = workdir / "pgdata"
+        self.socket_dir = workdir
+        self.port = free_port()
+        self.log = workdir / "postgres.log"
+
+    def run(self, tool, *args):
+        subprocess.run([str(self.pg_bin / tool), *args], check=True, stdout=subprocess.DEVNULL)
+
+    def start(self):
+        self.run("initdb", "-D", str(self.data_dir), "-U", DB_USER, "--auth=trust", "--no-sync")
+        self.run(
+            "pg_ctl", "start", "-w", "-D", str(self.data_dir), "-l", str(self.log),
+            "-o", f"-p {self.port} -k {self.socket_dir} -c listen_addresses='' -c fsync=off -c max_connections=200",
+        )
+        self.psql("postgres", "-c", f"CREATE DATABASE {DB_NAME}")
+
+    def stop(self):
+        self.run("pg_ctl", "stop", "-D", str(self.data_dir), "-m", "fast")
+
+    def psql(self, database, *args):
+        self.run("psql", "-h", str(self.socket_dir), "-p", str(self.port), "-U", DB_USER, "-d", database,
+                 "-q", "-v", "ON_ERROR_STOP=1", *args)
+
+    def load(self, init_sql, csv_dir):
+        """Applies init.sql, reading the CSV files it COPYs from csv_dir instead of the Docker init directory"""
+        schema = Path(init_sql).read_text().replace("/docker-entrypoint-initdb.d/", f"{csv_dir}/")
+        schema_file = csv_dir / "init.sql"
+        schema_file.write_text(schema)
+        self.psql(DB_NAME, "-f", str(schema_file))
+
+    def connect_kwargs(self):
+        return {"dbname": DB_NAME, "user": DB_USER, "host": str(self.socket_dir), "port": self.port}
+
+    def env(self):
+        return {"DB_HOST": str(self.socket_dir), "DB_PORT": str(self.port), "DB_NAME": DB_NAME, "DB_USER": DB_USER, "DB_PASS": ""}
+
+def write_seed_csvs(csv_dir, cars, listings, seed_value):
+    """The cars.csv and listings.csv init.sql loads; listings belong to the four users init.sql creates"""
+    rng = random.Random(seed_value)
+    with open(csv_dir / "cars.csv", "w", newline="") as cars_file:
+        writer = csv.writer(cars_file)
+        writer.writerow(["car_id", "car_year", "car_manufacturer", "car_model", "car_condition", "car_cylinders", "car_fuel",
+                         "car_odometer", "car_transmission", "car_vin", "car_drive", "car_size", "car_type", "car_paint_color"])
+        for car_id in range(1, cars + 1):
+            car = random_car(rng)
+            writer.writerow([car_id, car["year"], car["manufacturer"], car["model"], car["condition"], car["cylinders"], car["fuel"],
+                             car["odometer"], car["transmission"], car["VIN"], car["drive"], car["size"], car["type"], car["paint_color"]])
+    with open(csv_dir / "listings.csv", "w", newline="") as listings_file:
+        writer = csv.writer(listings_file)
+        writer.writerow(["listing_id", "listing_car_id", "listing_user_id", "listing_type", "listing_description",
+                         "listing_posting_date", "listing_sale_price", "listing_promoted", "listing_status"])
+        for listing_id in range(1, listings + 1):
+            listing = random_listing(rng, rng.randint(1, cars), rng.randint(1, 4))
+            writer.writerow([listing_id, listing["carId"], listing["userId"], listing["type"], listing["description"],
+                             listing["posting_date"], listing["sale_price"], listing["promoted"], listing["status"]])
+
+def serve_jwks(jwks_path):
+    """Serves the load-test key set over HTTP the way Auth0 serves its own, returning the JWKS URL"""
+    body = Path(jwks_path).read_bytes()
+
+    class JWKSHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200 if self.path == "/.well-known/jwks.json" else 404)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), JWKSHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/.well-known/jwks.json"
+
+def start_process(stack, name, script, env, port, workdir):
+    """Starts script with its output in <workdir>/<name>.log and waits for it to listen on port"""
+    log_path = workdir / f"{name}.log"
+    with open(log_path, "w") as log:
+        process = subprocess.Popen([sys.executable, str(script)], cwd=script.parent, env=env, stdout=log, stderr=subprocess.STDOUT)
+    stack.callback(stop_process, process)
+    try:
+        wait_for_port(port, process, name)
+    except RuntimeError as e:
+        log_tail = "".join(log_path.read_text().splitlines(keepends=True)[-20:])
+        raise RuntimeError(f"{e}; last lines of its log:\n{log_tail}") from None
+
+def stop_process(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def start_stack(stack, postgres, jwks_url, workdir):
+    """Starts every service and then the gateway, returning the gateway URL once all of them accept connections"""
+    base_env = dict(os.environ, PYTHONPATH=str(ROOT), PYTHONUNBUFFERED="1", **postgres.env())
+    for name, port in SERVICES.items():
+        env = dict(base_env, METRICS_PORT=str(free_port()), TRANSACTION_SERVICE_ADDRESS=f"127.0.0.1:{SERVICES['transaction']}")
+        start_process(stack, name, ROOT / "microservices" / name / f"{name}.py", env, port, workdir)
+
+    env = dict(
+        base_env,
+        METRICS_PORT=str(free_port()),
+        GATEWAY_PORT=str(GATEWAY_PORT),
+        AUTH0_DOMAIN=AUTH0_DOMAIN,
+        AUTH0_AUDIENCE=AUTH0_AUDIENCE,
+        AUTH0_JWKS_URL=jwks_url,
+        FLASK_SECRET_KEY="perf-harness",
+        **{f"{name.upper()}_SERVICE_TARGET": f"127.0.0.1:{port}" for name, port in SERVICES.items()},
+    )
+    start_process(stack, "gateway", ROOT / "microservices" / "gateway" / "gateway.py", env, GATEWAY_PORT, workdir)
+    return f"http://127.0.0.1:{GATEWAY_PORT}"
+
+def run_locust(host, args, workdir):
+    """Runs locust_tests/master_test.py headless, returning its exit code and the path prefix of its CSV stats"""
+    csv_prefix = workdir / "locust"
+    command = [
+        sys.executable, "-m", "locust", "-f", str(ROOT / "locust_tests" / "master_test.py"), "--host", host,
+        "--headless", "--users", str(args.users), "--spawn-rate", str(args.spawn_rate), "--run-time", args.run_time,
+        "--csv", str(csv_prefix), "--only-summary",
+    ]
+    with open(workdir / "locust.log", "w") as log:
+        result = subprocess.run(command, cwd=ROOT / "locust_tests", stdout=log, stderr=subprocess.STDOUT)
+    return result.returncode, csv_prefix
+
+def run_benchmarks(workdir):
+    """Runs the microbenchmarks, returning pytest's exit code and the median, IQR and ops of each benchmark"""
+    json_path = workdir / "benchmarks.json"
+    command = [
+        sys.executable, "-m", "pytest", str(ROOT / "benchmarks"), "-q", "--benchmark-only",
+        f"--benchmark-json={json_path}", "--benchmark-warmup=on",
+        # The same minimum round time as benchmarks/compare.py, so the numbers are comparable with its baselines
+        "--benchmark-min-time=0.0002",
+    ]
+    with open(workdir / "benchmarks.log", "w") as log:
+        result = subprocess.run(command, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+    benchmarks = {}
+    if json_path.exists():
+        for benchmark in json.loads(json_path.read_text())["benchmarks"]:
+            stats = benchmark["stats"]
+            benchmarks[benchmark["fullname"]] = {
+                "medianUs": stats["median"] * 1e6,
+                "iqrUs": stats["iqr"] * 1e6,
+                "opsPerSecond": stats["ops"],
+                "rounds": stats["rounds"],
+            }
+    return result.returncode, benchmarks
+
+def route_report(csv_prefix):
+    """Per-route throughput, failures and latency percentiles from Locust's CSV stats"""
+    routes = {}
+    with open(f"{csv_prefix}_stats.csv", newline="") as stats_file:
+        for row in csv.DictReader(stats_file):
+            key = row["Name"] if row["Name"] == "Aggregated" else f"{row['Type']} {row['Name']}"
+            routes[key] = {
+                "requests": int(row["Request Count"]),
+                "failures": int(row["Failure Count"]),
+                "requestsPerSecond": float(row["Requests/s"]),
+                "averageMs": float(row["Average Response Time"]),
+                "maxMs": float(row["Max Response Time"]),
+                **{f"p{percentile.rstrip('%')}Ms": float(row[percentile]) for percentile in PERCENTILES},
+            }
+    return routes
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the load suite against a throwaway local stack and writes a JSON report")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--spawn-rate", type=float, default=10)
+    parser.add_argument("--run-time", default="1m")
+    parser.add_argument("--report", default="perf-report.json")
+    parser.add_argument("--scale", type=int, default=5000, help="synthetic rows loaded before the run, see generate_data.py")
+    parser.add_argument("--cars", type=int, help="cars, instead of their share of --scale")
+    parser.add_argument("--listings", type=int, help="listings, instead of their share of --scale")
+    parser.add_argument("--transactions", type=int, help="transactions, instead of their share of --scale")
+    parser.add_argument("--data-workers", type=int, default=4, help="processes generating the data")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--init-sql", default=str(ROOT / "databases" / "init.sql"))
+    parser.add_argument("--pg-bin", default=os.getenv("PG_BIN") or os.path.dirname(shutil.which("pg_ctl") or ""),
+                        help="directory holding initdb, pg_ctl and psql")
+    parser.add_argument("--keep", action="store_true", help="keep the working directory with the database and logs")
+    parser.add_argument("--skip-benchmarks", action="store_true", help="only run the load suite")
+    args = parser.parse_args()
+    if not args.pg_bin:
+        parser.error("pg_ctl not found on PATH; pass --pg-bin")
+
+    if not (ROOT / "services").is_dir():
+        subprocess.run([sys.executable, str(ROOT / "generate_grpc_tests.py")], cwd=ROOT, check=True)
+    signing_key()
+
+    workdir = Path(tempfile.mkdtemp(prefix="standfcool-perf-"))
+    started = datetime.now(timezone.utc)
+    with ExitStack() as stack:
+        if not args.keep:
+            stack.callback(shutil.rmtree, workdir, ignore_errors=True)
+        benchmarks_exit_code, benchmarks = (0, {}) if args.skip_benchmarks else run_benchmarks(workdir)
+        postgres = EphemeralPostgres(args.pg_bin, workdir)
+        postgres.start()
+        stack.callback(postgres.stop)
+        write_seed_csvs(workdir, SEED_CSV_ROWS, SEED_CSV_ROWS, args.seed)
+        postgres.load(args.init_sql, workdir)
+        counts = scaled_counts(args.scale, {table: getattr(args, table) for table in ["cars", "listings", "transactions"]})
+        generate(postgres.connect_kwargs(), counts, args.seed, workers=args.data_workers)
+
+        jwks_server, jwks_url = serve_jwks(LOADTEST_JWKS)
+        stack.callback(jwks_server.shutdown)
+        host = start_stack(stack, postgres, jwks_url, workdir)
+        exit_code, csv_prefix = run_locust(host, args, workdir)
+        report = {
+            "startedAt": started.isoformat(),
+            "config": {"users": args.users, "spawnRate": args.spawn_rate, "runTime": args.run_time,
+                       "rows": counts, "seed": args.seed},
+            "benchmarksPassed": benchmarks_exit_code == 0,
+            "benchmarks": benchmarks,
+            "slosMet": exit_code == 0,
+            "routes": route_report(csv_prefix),
+        }
+    Path(args.report).write_text(json.dumps(report, indent=2))
+    aggregated = report["routes"].get("Aggregated", {})
+    print(f"{len(benchmarks)} benchmarks{'' if report['benchmarksPassed'] else ' (some failed)'}, "
+          f"{aggregated.get('requestsPerSecond', 0):.1f} req/s, p95 {aggregated.get('p95Ms', 0):.0f} ms, "
+          f"SLOs {'met' if report['slosMet'] else 'missed'}; report written to {args.report}")
+    if args.keep:
+        print(f"Database and logs kept in {workdir}")
+    sys.exit(exit_code or benchmarks_exit_code)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import json
+import os
+import sys
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+GATEWAY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "microservices", "gateway")
+
+@pytest.fixture(scope="session")
+def gateway():
+    """The gateway module, imported the way its container runs it, with the metrics server on a free port"""
+    os.environ.setdefault("METRICS_PORT", "0")
+    if GATEWAY_DIR not in sys.path:
+        sys.path.insert(0, GATEWAY_DIR)
+    import gateway
+    return gateway
+
+@pytest.fixture
+def issue_token(gateway, tmp_path, monkeypatch):
+    """Signs access tokens with a test key whose JWKS the gateway reads from a file; call it with the permissions"""
+    import auth
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                            serialization.NoEncryption())
+    public_pem = private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                       serialization.PublicFormat.SubjectPublicKeyInfo)
+    jwks_file = tmp_path / "jwks.json"
+    jwks_file.write_text(json.dumps({"keys": [{**jwk.construct(public_pem, "RS256").to_dict(), "kid": "test", "use": "sig"}]}))
+    monkeypatch.setattr(auth, "AUTH0_JWKS_URL", jwks_file.as_uri())
+    monkeypatch.setattr(auth, "AUTH0_DOMAIN", "stand.test")
+    monkeypatch.setattr(auth, "AUTH0_API_AUDIENCE", "https://api.stand.test")
+    monkeypatch.setattr(auth, "_jwks", dict(auth._jwks, keys=None, expires=0.0, refreshed=0.0))
+
+    def issue(*permissions, kid="test"):
+        claims = {"iss": "https://stand.test/", "aud": "https://api.stand.test", "sub": "auth0|tester",
+                  "permissions": list(permissions)}
+        return jwt.encode(claims, private_pem.decode(), algorithm="RS256", headers={"kid": kid})
+    return issue
@@ -1,7 +1,8 @@
+import grpc
 import pytest
 from unittest.mock import Mock, patch
 from services import car_service_pb2
-from microservices.car.car import CarService
+from microservices.car.car import CarService, encode_page_token
 
 @pytest.fixture
 def mock_db_connection():
@@ -17,6 +18,7 @@ def mock_context():
     context = Mock()
     context.set_code = Mock()
     context.set_details = Mock()
+    context.invocation_metadata = Mock(return_value=())
     return context
 
 @pytest.fixture
@@ -76,7 +78,7 @@ def test_car_creation_and_retrieval(car_service, mock_db_connection, mock_contex
     mock_conn, mock_cursor = mock_db_connection
     mock_cursor.fetchone.side_effect = [
         (1,),
-        (1, 2024, "Toyota", "Camry", "New", "4", "Gasoline", 0, "Automatic", "1HGCM82633A123456", "FWD", "Midsize", "Sedan", "Silver")
+        (1, 2024, "Toyota", "Camry", "New", "4", "Gasoline", 0, "Automatic", "1HGCM82633A123456", "FWD", "Midsize", "Sedan", "Silver", 1)
     ]
     
     # Create and then read car
@@ -122,7 +124,7 @@ def test_car_update(car_service, mock_db_connection, mock_context):
     mock_cursor.fetchone.side_effect = [
         (1,),
         (1,),
-        (1, 2024, "Toyota", "Camry", "Used", "4", "Gasoline", 5000, "Automatic", "1HGCM82633A123456", "FWD", "Midsize", "Sedan", "Silver")
+        (1, 2024, "Toyota", "Camry", "Used", "4", "Gasoline", 5000, "Automatic", "1HGCM82633A123456", "FWD", "Midsize", "Sedan", "Silver", 1)
     ]
     
     # Create car
@@ -179,11 +181,126 @@ def test_car_read_all(car_service, mock_db_connection, mock_context):
         (2, 2023, "Honda", "Civic", "Used", "4", "Gasoline", 10000, "Automatic", "2HGCM82633B123456", "FWD", "Compact", "Sedan", "Blue")
     ]
     
-    request = car_service_pb2.google_dot_protobuf_dot_empty__pb2.Empty()
+    request = car_service_pb2.CarsReadAllRequest()
     response = car_service.CarsReadAll(request, mock_context)
     
     assert len(response.data) == 2
     assert response.data[0].carId == 1
     assert response.data[0].manufacturer == "Toyota"
     assert response.data[1].carId == 2
-    assert response.data[1].manufacturer == "Honda" 
\ No newline at end of file
+    assert response.data[1].manufacturer == "Honda" 
+
+def test_car_update_version_conflict(car_service, mock_db_connection, mock_context):
+    """Test an update carrying a stale version is rejected as a failed precondition"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchone.side_effect = [None, (1,)]
+    
+    request = car_service_pb2.CarsUpdateRequest(
+        carId=1,
+        car=car_service_pb2.Car(carId=1, year=2024, manufacturer="Toyota", model="Camry", VIN="1HGCM82633A123456"),
+        expectedVersion=3
+    )
+    response = car_service.CarsUpdate(request, mock_context)
+    
+    update_params = mock_cursor.execute.call_args_list[0][0][1]
+    assert update_params[-2:] == (3, 3)
+    assert response == car_service_pb2.Car()
+    assert not mock_conn.commit.called
+    mock_context.set_code.assert_called_once_with(grpc.StatusCode.FAILED_PRECONDITION)
+
+def test_car_patch_updates_masked_columns(car_service, mock_db_connection, mock_context):
+    """Test a patch only writes the columns named in the update mask"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchone.return_value = (
+        1, 2024, "Toyota", "Camry", "Used", "4", "Gasoline", 12000, "Automatic", "1HGCM82633A123456", "FWD", "Midsize", "Sedan", "Red", 4
+    )
+    
+    request = car_service_pb2.CarsPatchRequest(
+        carId=1,
+        car=car_service_pb2.Car(odometer=12000, paint_color="Red", manufacturer="Ignored"),
+        expectedVersion=3
+    )
+    request.updateMask.paths.extend(["odometer", "paint_color"])
+    response = car_service.CarsPatch(request, mock_context)
+    
+    query, params = mock_cursor.execute.call_args[0]
+    assert query.startswith("UPDATE car SET car_odometer = %s, car_paint_color = %s, version = version + 1 WHERE")
+    assert "car_manufacturer =" not in query
+    assert params == [12000, "Red", 1, 3, 3]
+    assert response.manufacturer == "Toyota"
+    assert response.version == 4
+    mock_conn.commit.assert_called_once()
+
+def test_car_patch_rejects_unknown_mask_path(car_service, mock_db_connection, mock_context):
+    """Test a mask naming a field that cannot be patched is an invalid argument"""
+    mock_conn, mock_cursor = mock_db_connection
+    
+    request = car_service_pb2.CarsPatchRequest(carId=1, car=car_service_pb2.Car(carId=2))
+    request.updateMask.paths.append("carId")
+    response = car_service.CarsPatch(request, mock_context)
+    
+    assert response == car_service_pb2.Car()
+    assert not mock_cursor.execute.called
+    mock_context.set_code.assert_called_once_with(grpc.StatusCode.INVALID_ARGUMENT)
+
+def test_car_read_all_with_read_mask(car_service, mock_db_connection, mock_context):
+    """Test a read mask selects only the requested columns and returns sparse cars"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = [(1, 2024, "Toyota", "Camry", 3)]
+    
+    request = car_service_pb2.CarsReadAllRequest()
+    request.readMask.paths.extend(["manufacturer", "model", "year"])
+    response = car_service.CarsReadAll(request, mock_context)
+    
+    query, params = mock_cursor.execute.call_args[0]
+    assert query == "SELECT car_id, car_year, car_manufacturer, car_model, version FROM car ORDER BY car_id ASC LIMIT %s"
+    assert params == (101,)
+    assert response.data[0] == car_service_pb2.Car(carId=1, year=2024, manufacturer="Toyota", model="Camry", version=3)
+
+def test_car_read_all_order_by_pages_with_token(car_service, mock_db_connection, mock_context):
+    """Test ordering by a non-key field pages with a keyset token carrying the last sort value"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = [(7, 2024, 1), (3, 2023, 1), (9, 2023, 1)]
+    
+    request = car_service_pb2.CarsReadAllRequest(pageSize=2, orderBy="-year")
+    request.readMask.paths.append("carId")
+    response = car_service.CarsReadAll(request, mock_context)
+    
+    query, params = mock_cursor.execute.call_args[0]
+    assert query == "SELECT car_id, car_year, version FROM car ORDER BY car_year DESC, car_id DESC LIMIT %s"
+    assert params == (3,)
+    assert [car.carId for car in response.data] == [7, 3]
+    assert response.nextPageToken
+    
+    request = car_service_pb2.CarsReadAllRequest(pageSize=2, orderBy="-year", pageToken=response.nextPageToken)
+    car_service.CarsReadAll(request, mock_context)
+    
+    query, params = mock_cursor.execute.call_args[0]
+    assert "WHERE (car_year, car_id) < (%s, %s) ORDER BY car_year DESC, car_id DESC" in query
+    assert params == (2023, 3, 3)
+
+def test_car_read_all_rejects_unsupported_order(car_service, mock_db_connection, mock_context):
+    """Test ordering by an unindexed field, or reusing a token across orders, is rejected"""
+    mock_conn, mock_cursor = mock_db_connection
+    
+    car_service.CarsReadAll(car_service_pb2.CarsReadAllRequest(orderBy="odometer"), mock_context)
+    car_service.CarsReadAll(car_service_pb2.CarsReadAllRequest(orderBy="model", pageToken=encode_page_token("year", 2023, 3)), mock_context)
+    
+    assert not mock_cursor.execute.called
+    assert mock_context.set_code.call_args_list == [((grpc.StatusCode.INVALID_ARGUMENT,),)] * 2
+
+def test_car_create_duplicate_key_in_progress(car_service, mock_db_connection, mock_context):
+    """Test a create whose idempotency key is claimed by a request still running is aborted, leaving its transaction"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_context.invocation_metadata.return_value = (("idempotency-key", "double-click"),)
+    # The first request's claim is visible on the shared connection before its response is stored
+    mock_cursor.fetchone.side_effect = [None, (None,)]
+    
+    request = car_service_pb2.CarsCreateRequest(car=car_service_pb2.Car(manufacturer="Toyota"))
+    response = car_service.CarsCreate(request, mock_context)
+    
+    assert response == car_service_pb2.Car()
+    mock_context.set_code.assert_called_once_with(grpc.StatusCode.ABORTED)
+    assert not any("INSERT INTO car " in call[0][0] for call in mock_cursor.execute.call_args_list)
+    assert not mock_conn.rollback.called
+    assert not mock_conn.commit.called
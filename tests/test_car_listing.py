@@ -1,8 +1,11 @@
+import grpc
 import pytest
-from unittest.mock import Mock, patch
+from unittest.mock import Mock, MagicMock, patch
 from datetime import datetime
+from decimal import Decimal
 from services import car_listing_service_pb2
-from microservices.car_listing.car_listing import CarListingService
+from microservices.car_listing.car_listing import CarListingService, SaleOutboxDispatcher, ListingEventBroker
+from microservices.car_listing.summary_check import check_listing_stats
 
 @pytest.fixture
 def mock_db_connection():
@@ -18,6 +21,7 @@ def mock_context():
     context = Mock()
     context.set_code = Mock()
     context.set_details = Mock()
+    context.invocation_metadata = Mock(return_value=())
     return context
 
 @pytest.fixture
@@ -36,7 +40,6 @@ def car_listing_service(mock_db_connection, mock_transaction_stub):
         'DB_PASS': 'test_pass'
     }):
         service = CarListingService()
-        service.transaction_stub = mock_transaction_stub
         return service
 
 def test_car_listing_create_success(car_listing_service, mock_db_connection, mock_context):
@@ -75,7 +78,7 @@ def test_car_listing_creation_and_retrieval(car_listing_service, mock_db_connect
     posting_date = datetime(2024, 3, 20, 10, 0, 0)
     mock_cursor.fetchone.side_effect = [
         (1,),
-        (1, 1, 1, "TypeEnum_BUY", "Has wheels, nice", posting_date, 25000.00, False, "StatusEnum_AVAILABLE")
+        (1, 1, 1, "TypeEnum_BUY", "Has wheels, nice", posting_date, 25000.00, False, "StatusEnum_AVAILABLE", 1)
     ]
     
     # Create and then read car listing
@@ -105,14 +108,12 @@ def test_car_listing_creation_and_retrieval(car_listing_service, mock_db_connect
     assert retrieved_listing.status == created_listing.status
 
 def test_car_listing_mark_as_sold(car_listing_service, mock_db_connection, mock_context, mock_transaction_stub):
-    """Test marking a car listing as sold and creating a transaction"""
+    """Test marking a car listing as sold is a single versioned update that leaves the sale to the outbox trigger"""
     mock_conn, mock_cursor = mock_db_connection
     posting_date = datetime(2024, 3, 20, 10, 0, 0)
     mock_cursor.fetchone.side_effect = [
         (1,),
-        ("StatusEnum_AVAILABLE",),
-        (1,),
-        (1, 1, 1, "TypeEnum_BUY", "Has wheels, nice", posting_date, 25000.00, False, "StatusEnum_SOLD")
+        (2,)
     ]
     
     # Create car listing
@@ -149,4 +150,189 @@ def test_car_listing_mark_as_sold(car_listing_service, mock_db_connection, mock_
     
     assert updated_listing.listingId == created_listing.listingId
     assert updated_listing.status == car_listing_service_pb2.CarListing.StatusEnum.StatusEnum_SOLD
-    mock_transaction_stub.TransactionsCreate.assert_called_once() 
\ No newline at end of file
+    assert updated_listing.version == 2
+    update_query, update_params = mock_cursor.execute.call_args_list[-1][0]
+    assert update_query.strip().startswith("UPDATE car_listing")
+    assert update_params[7] == "StatusEnum_SOLD"
+    assert mock_conn.commit.call_count == 2
+    mock_transaction_stub.TransactionsCreate.assert_not_called()
+
+def test_car_listing_patch_sold_tags_sale_trace(car_listing_service, mock_db_connection, mock_context, mock_transaction_stub):
+    """Test patching the status to sold writes only that column and hands the trace to the sale outbox trigger"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchone.return_value = (
+        7, 1, 1, "TypeEnum_BUY", "Has wheels, nice", datetime(2024, 3, 20, 10, 0, 0), Decimal("25000.00"), False, "StatusEnum_SOLD", 4
+    )
+    
+    request = car_listing_service_pb2.CarlistingPatchRequest(
+        listingId=7,
+        carListing=car_listing_service_pb2.CarListing(
+            status=car_listing_service_pb2.CarListing.StatusEnum.StatusEnum_SOLD, description="Ignored"
+        ),
+        expectedVersion=3
+    )
+    request.updateMask.paths.append("status")
+    with patch('microservices.car_listing.car_listing.tracing.traceparent', return_value="00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"):
+        response = car_listing_service.CarlistingPatch(request, mock_context)
+    
+    (trace_query, trace_params), (update_query, update_params) = [call[0] for call in mock_cursor.execute.call_args_list]
+    assert "set_config('app.traceparent'" in trace_query
+    assert trace_params == ("00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01",)
+    assert update_query.startswith("UPDATE car_listing SET listing_status = %s, version = version + 1 WHERE")
+    assert "listing_description =" not in update_query
+    assert update_params == ["StatusEnum_SOLD", 7, 3, 3]
+    assert response.status == car_listing_service_pb2.CarListing.StatusEnum.StatusEnum_SOLD
+    assert response.version == 4
+    mock_conn.commit.assert_called_once()
+    mock_transaction_stub.TransactionsCreate.assert_not_called()
+
+def test_car_listing_patch_without_sale_skips_trace(car_listing_service, mock_db_connection, mock_context):
+    """Test a patch that doesn't sell the listing leaves the trace alone and writes the masked columns"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchone.return_value = (
+        7, 1, 1, "TypeEnum_BUY", "Has wheels, nice", datetime(2024, 3, 20, 10, 0, 0), Decimal("23000.00"), True, "StatusEnum_AVAILABLE", 2
+    )
+    
+    request = car_listing_service_pb2.CarlistingPatchRequest(
+        listingId=7, carListing=car_listing_service_pb2.CarListing(sale_price=23000.00, promoted=True)
+    )
+    request.updateMask.paths.extend(["sale_price", "promoted"])
+    with patch('microservices.car_listing.car_listing.tracing.traceparent', return_value="00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"):
+        response = car_listing_service.CarlistingPatch(request, mock_context)
+    
+    query, params = mock_cursor.execute.call_args[0]
+    assert mock_cursor.execute.call_count == 1
+    assert query.startswith("UPDATE car_listing SET listing_sale_price = %s, listing_promoted = %s, version = version + 1 WHERE")
+    assert params == [23000.00, True, 7, 0, 0]
+    assert response.promoted
+    mock_conn.commit.assert_called_once()
+
+def test_car_listing_patch_conflicts(car_listing_service, mock_db_connection, mock_context):
+    """Test a stale version fails its precondition, a missing listing is not found, and an unknown path is invalid"""
+    mock_conn, mock_cursor = mock_db_connection
+    request = car_listing_service_pb2.CarlistingPatchRequest(
+        listingId=7, carListing=car_listing_service_pb2.CarListing(promoted=True), expectedVersion=3
+    )
+    request.updateMask.paths.append("promoted")
+    
+    mock_cursor.fetchone.side_effect = [None, (1,)]
+    assert car_listing_service.CarlistingPatch(request, mock_context) == car_listing_service_pb2.CarListing()
+    mock_context.set_code.assert_called_with(grpc.StatusCode.FAILED_PRECONDITION)
+    
+    mock_cursor.fetchone.side_effect = [None, None]
+    assert car_listing_service.CarlistingPatch(request, mock_context) == car_listing_service_pb2.CarListing()
+    mock_context.set_code.assert_called_with(grpc.StatusCode.NOT_FOUND)
+    assert not mock_conn.commit.called
+    
+    mock_cursor.execute.reset_mock()
+    request.updateMask.paths.append("listingId")
+    assert car_listing_service.CarlistingPatch(request, mock_context) == car_listing_service_pb2.CarListing()
+    mock_context.set_code.assert_called_with(grpc.StatusCode.INVALID_ARGUMENT)
+    assert not mock_cursor.execute.called
+
+def test_sale_outbox_dispatch_batch(mock_db_connection, mock_transaction_stub):
+    """Test a dispatched batch marks successes and schedules a retry with backoff for failures"""
+    mock_conn, _ = mock_db_connection
+    mock_conn.cursor.return_value = MagicMock()
+    mock_cursor = mock_conn.cursor.return_value.__enter__.return_value
+    created_at = datetime(2024, 3, 20, 10, 0, 0)
+    mock_cursor.fetchall.return_value = [
+        (1, "key-1", 1, 1, "TypeEnum_BUY", 25000.00, created_at, 0, None),
+        (2, "key-2", 2, 2, "TypeEnum_RENT", 500.00, created_at, 3, None)
+    ]
+    mock_cursor.fetchone.return_value = (1,)
+    failed_call = Mock()
+    failed_call.result.side_effect = grpc.RpcError("unavailable")
+    mock_transaction_stub.TransactionsCreate.future.side_effect = [
+        Mock(result=Mock(return_value=Mock(transactionId=7))),
+        failed_call
+    ]
+    
+    dispatcher = SaleOutboxDispatcher(mock_transaction_stub)
+    assert dispatcher.dispatch_batch() == 2
+    
+    first_call = mock_transaction_stub.TransactionsCreate.future.call_args_list[0]
+    assert first_call[1]["metadata"] == (("idempotency-key", "key-1"),)
+    assert first_call[0][0].transaction.transactionDate == created_at.isoformat()
+    updates = [call[0] for call in mock_cursor.execute.call_args_list[1:3]]
+    assert "dispatched_at = now()" in updates[0][0] and updates[0][1] == (7, 1)
+    assert "attempts = attempts + 1" in updates[1][0] and updates[1][1][1:] == (16.0, 2)
+    assert mock_conn.commit.called
+
+def test_car_listing_stats(car_listing_service, mock_db_connection, mock_context):
+    """Test available listings per manufacturer are read from the summary table"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = [
+        ("Honda", Decimal(2), Decimal("30000.00")),
+        ("Toyota", Decimal(1), Decimal("20000.00"))
+    ]
+    
+    request = car_listing_service_pb2.CarlistingStatsRequest(status="StatusEnum_AVAILABLE")
+    response = car_listing_service.CarlistingStats(request, mock_context)
+    
+    query, params = mock_cursor.execute.call_args[0]
+    assert "FROM listing_stats_by_manufacturer" in query
+    assert "GROUP BY car_manufacturer" in query
+    assert params == ["StatusEnum_AVAILABLE"]
+    assert response.data[0].group == "Honda"
+    assert response.data[0].listings == 2
+    assert response.data[0].averagePrice == 15000.0
+    assert not mock_context.set_code.called
+
+def test_listing_stats_check_repairs_drift():
+    """Test the consistency checker reports drifted groups and rebuilds the summary when asked"""
+    mock_conn = MagicMock()
+    mock_cursor = mock_conn.cursor.return_value.__enter__.return_value
+    drift = [("Honda", "sedan", "StatusEnum_AVAILABLE", 3, 2, Decimal("45000"), Decimal("30000"))]
+    mock_cursor.fetchall.return_value = drift
+    
+    assert check_listing_stats(mock_conn) == drift
+    assert mock_cursor.execute.call_count == 1
+    
+    check_listing_stats(mock_conn, repair=True)
+    
+    statements = [call[0][0] for call in mock_cursor.execute.call_args_list[2:]]
+    assert statements[0].startswith("LOCK TABLE listing_stats_by_manufacturer")
+    assert "FROM listing_stats_by_manufacturer_expected" in statements[-1]
+    assert mock_conn.commit.called
+
+def test_watch_status_resumes_after_event_id(mock_db_connection, mock_context):
+    """Test a watch stream replays the buffered events after the caller's last one, then marks a gap with a reset"""
+    broker = ListingEventBroker()
+    broker.publish([
+        ListingEventBroker.parse('{"eventId": %d, "listingId": %d, "status": "StatusEnum_RESERVED", "version": 2}' % (event_id, event_id))
+        for event_id in (5, 4, 6)
+    ])
+    service = CarListingService(broker)
+    mock_context.is_active.side_effect = [True, False]
+    
+    events = list(service.CarlistingWatchStatus(car_listing_service_pb2.CarlistingWatchStatusRequest(afterEventId=5), mock_context))
+    
+    assert [event.eventId for event in events] == [4, 6]
+    assert events[0].status == car_listing_service_pb2.CarListing.StatusEnum.StatusEnum_RESERVED
+    
+    mock_context.is_active.side_effect = [True, False]
+    events = list(service.CarlistingWatchStatus(car_listing_service_pb2.CarlistingWatchStatusRequest(afterEventId=3), mock_context))
+    
+    assert events[0].reset
+    assert [event.eventId for event in events[1:]] == [5, 4, 6]
+
+def test_watch_streams_capped(mock_db_connection, mock_context):
+    """Test streams past MAX_WATCH_STREAMS are refused, so the unary calls keep their workers, and a closed stream frees its slot"""
+    broker = ListingEventBroker()
+    broker.publish([ListingEventBroker.parse('{"eventId": 1, "listingId": 1, "status": "StatusEnum_SOLD", "version": 2}')])
+    with patch('microservices.car_listing.car_listing.MAX_WATCH_STREAMS', 1):
+        service = CarListingService(broker)
+    mock_context.is_active.return_value = True
+    
+    stream = service.CarlistingWatchStatus(car_listing_service_pb2.CarlistingWatchStatusRequest(), mock_context)
+    assert next(stream).eventId == 1
+    
+    assert list(service.CarlistingWatchStatus(car_listing_service_pb2.CarlistingWatchStatusRequest(), mock_context)) == []
+    mock_context.set_code.assert_called_once_with(grpc.StatusCode.RESOURCE_EXHAUSTED)
+    
+    # The caller went away
+    stream.close()
+    mock_context.is_active.side_effect = [True, False]
+    events = list(service.CarlistingWatchStatus(car_listing_service_pb2.CarlistingWatchStatusRequest(), mock_context))
+    assert [event.eventId for event in events] == [1]
@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+import psycopg2
+import pytest
+from prometheus_client import CollectorRegistry
+from microservices.common import db
+from microservices.common.db import QueryMetrics, fingerprint, normalize, param_shapes, rows_size
+
+@pytest.fixture
+def registry():
+    return CollectorRegistry()
+
+@pytest.fixture
+def connection(registry):
+    """A connection through the instrumented cursor, to the Postgres at TEST_DATABASE_URL"""
+    dsn = os.getenv("TEST_DATABASE_URL")
+    if not dsn:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    connection = psycopg2.connect(dsn, cursor_factory=QueryMetrics("test", registry=registry).cursor_factory)
+    yield connection
+    connection.close()
+
+def statement_sample(registry, name, statement, suffix):
+    return registry.get_sample_value(f"test_db_{name}_{suffix}", {"statement": statement.name, "fingerprint": statement.fingerprint})
+
+def test_normalize_folds_literals_and_lists():
+    """Test the variants of one query (masks, literals, IN lists, whitespace) normalize to the same text"""
+    first = normalize("SELECT carId, brand, model FROM car WHERE carId IN (%s, %s) AND brand = 'Toyota'")
+    second = normalize("select carId,brand\n  FROM car   WHERE carId IN (%s, %s, %s) AND brand = 'Ford' -- by id")
+    assert first == second
+    assert first == "select ... from car where carid in (...) and brand = ?"
+    assert fingerprint(first) == fingerprint(second)
+    assert fingerprint(first) != fingerprint(normalize("SELECT carId FROM car_listing WHERE carId = %s"))
+
+def test_param_shapes_hide_values():
+    """Test parameter shapes name types and sizes but never the values"""
+    assert param_shapes(None) == "()"
+    assert param_shapes((42, "secret", None, [1, 2])) == "(int, str[6], None, list[2])"
+    assert param_shapes({"email": "a@b.c"}) == "{email: str[5]}"
+
+def test_rows_size():
+    """Test fetched rows are sized by their text and binary values, 8 bytes for anything else"""
+    assert rows_size([]) == 0
+    assert rows_size([(1, "abc"), (None, b"xy")]) == 8 + 3 + 8 + 2
+
+def test_statements_are_cached_with_their_metrics():
+    """Test a query string is fingerprinted once and its variants share one series and info entry"""
+    registry = CollectorRegistry()
+    metrics = QueryMetrics("test", registry=registry)
+    statement = metrics.statement("SELECT * FROM car WHERE carId = %s")
+    assert metrics.statement("SELECT * FROM car WHERE carId = %s") is statement
+    assert metrics.statement("SELECT * FROM car WHERE carId = 7").fingerprint == statement.fingerprint
+    assert statement.name == "SELECT car"
+    assert statement.explainable
+    assert not metrics.statement("SELECT * FROM car WHERE carId = %s FOR UPDATE").explainable
+    assert not metrics.statement("UPDATE car SET brand = %s WHERE carId = %s").explainable
+    assert registry.get_sample_value(
+        "test_db_statement_info", {"fingerprint": statement.fingerprint, "query": "select * from car where carid = ?"}
+    ) == 1
+
+def test_cursor_records_duration_rows_and_bytes(monkeypatch, registry, connection):
+    """Test a statement is timed, its rows counted and, when sampled, the size of what was fetched recorded"""
+    monkeypatch.setattr(db, "QUERY_BYTES_SAMPLE_RATE", 1)
+    query = "SELECT n, 'abc'::text FROM generate_series(1, %s) AS n"
+    with connection.cursor() as cursor:
+        cursor.execute(query, (3,))
+        assert len(cursor.fetchall()) == 3
+    statement = connection.cursor_factory.query_metrics.statement(query)
+    
+    assert statement_sample(registry, "query_duration_seconds", statement, "count") == 1
+    assert statement_sample(registry, "query_duration_seconds", statement, "sum") > 0
+    assert statement_sample(registry, "query_rows", statement, "sum") == 3
+    assert statement_sample(registry, "fetched_bytes", statement, "sum") == 3 * (8 + 3)
+    assert registry.get_sample_value("test_db_connection_wait_seconds_count") == 1
+
+def test_cursor_records_connection_wait(registry, connection):
+    """Test the time a statement waits for another thread's statement on the same connection is recorded"""
+    lock = connection.cursor_factory.query_metrics.lock(connection)
+    with lock:
+        waiting = threading.Thread(target=lambda: connection.cursor().execute("SELECT 1"))
+        waiting.start()
+        time.sleep(0.2)
+    waiting.join()
+    assert registry.get_sample_value("test_db_connection_wait_seconds_sum") >= 0.2
+
+def test_slow_query_logged_with_plan(monkeypatch, caplog, connection):
+    """Test a slow read is logged with its fingerprint, parameter shapes (not values) and EXPLAIN ANALYZE plan"""
+    monkeypatch.setattr(db, "SLOW_QUERY_SECONDS", 0.05)
+    monkeypatch.setattr(db, "SLOW_QUERY_EXPLAIN_RATE", 1)
+    query = "SELECT pg_sleep(0.06), %s::text AS secret"
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+        cursor.execute(query, ("hunter2",))
+        assert cursor.fetchone()[1] == "hunter2"
+    statement = connection.cursor_factory.query_metrics.statement(query)
+    
+    [record] = caplog.records
+    assert record.levelname == "WARNING"
+    assert f"Slow query {statement.fingerprint} (SELECT)" in record.message
+    assert "params (str[7])" in record.message
+    assert "actual time=" in record.message
+    assert "hunter2" not in record.message
+    # The plan ran under a savepoint, so the transaction it shared is still usable
+    assert connection.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    connection.cursor().execute("SELECT 1")
+
+def test_explain_waits_for_connection(connection):
+    """Test EXPLAIN ANALYZE runs only once no other statement holds the connection, so its savepoint can't undo theirs"""
+    lock = connection.cursor_factory.query_metrics.lock(connection)
+    plans = []
+    with lock:
+        explaining = threading.Thread(target=lambda: plans.append(connection.cursor()._explain("SELECT 1", None)))
+        explaining.start()
+        explaining.join(0.2)
+        assert plans == []
+    explaining.join()
+    assert "actual time=" in plans[0]
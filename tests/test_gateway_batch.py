@@ -0,0 +1,80 @@
+import grpc
+import pytest
+from unittest.mock import Mock, patch
+from services.car_service_pb2 import Car
+
+class CarNotFound(grpc.RpcError):
+    def code(self):
+        return grpc.StatusCode.NOT_FOUND
+
+def read_car(request, **kwargs):
+    if request.carId == 404:
+        raise CarNotFound()
+    return Car(carId=request.carId, manufacturer="Toyota", version=2)
+
+@pytest.fixture
+def car_client(gateway, monkeypatch):
+    client = Mock()
+    client.CarsReadOne.side_effect = read_car
+    client.CarsCreate.side_effect = lambda request, **kwargs: request.car
+    monkeypatch.setattr(gateway, "CAR_CLIENT", client)
+    return client
+
+@pytest.fixture
+def post_batch(gateway, issue_token):
+    token = issue_token("create:car")
+    client = gateway.app.test_client()
+    return lambda items: client.post("/api/batch", json=items, headers={"Authorization": f"Bearer {token}"})
+
+def test_batch_size_limits(gateway, post_batch):
+    """Test an empty batch is rejected, and one over MAX_BATCH_SIZE is refused before any item runs"""
+    assert post_batch([]).status_code == 400
+    assert post_batch({"path": "/api/cars/1"}).status_code == 400
+    response = post_batch([{"path": "/api/cars/1"}] * (gateway.MAX_BATCH_SIZE + 1))
+    assert response.status_code == 413
+
+def test_each_item_keeps_its_status(car_client, post_batch):
+    """Test every item reports the status and ETag its route answered with, in the order the items were sent"""
+    response = post_batch([
+        {"path": "/api/cars/1"},
+        {"path": "/api/cars/404"},
+        {"method": "POST", "path": "/api/cars", "body": {"manufacturer": "Honda"}},
+        {"method": "TRACE", "path": "/api/cars/1"},
+        {"path": "/health"},
+    ])
+    assert response.status_code == 200
+    results = response.get_json()
+    assert [result["status"] for result in results] == [200, 404, 201, 400, 400]
+    assert results[0]["headers"] == {"ETag": '"2"'}
+    assert results[0]["body"]["manufacturer"] == "Toyota"
+    assert results[2]["body"] == {"manufacturer": "Honda"}
+
+def test_bodies_past_byte_budget_keep_status(gateway, monkeypatch, car_client, post_batch):
+    """Test items past MAX_BATCH_RESPONSE_BYTES still report the write they made, without their body"""
+    monkeypatch.setattr(gateway, "MAX_BATCH_RESPONSE_BYTES", 60)
+    response = post_batch([
+        {"path": "/api/cars/1"},
+        {"method": "POST", "path": "/api/cars", "body": {"manufacturer": "Honda"}},
+        {"method": "POST", "path": "/api/cars", "body": {"manufacturer": "Mazda"}},
+    ])
+    results = response.get_json()
+    assert [result["status"] for result in results] == [200, 201, 201]
+    assert "truncated" not in results[0]
+    assert results[1]["truncated"] and results[1]["body"] is None
+    assert results[2]["truncated"] and results[2]["body"] is None
+    assert car_client.CarsCreate.call_count == 2
+
+def test_streaming_routes_are_rejected(gateway, post_batch):
+    """Test an event stream or a nested batch is refused without running, so no batch worker is held by it"""
+    with patch.object(gateway, "LISTING_EVENTS") as listing_events:
+        response = post_batch([{"path": "/api/carlistings/events"}, {"method": "POST", "path": "/api/batch", "body": []}])
+    assert [result["status"] for result in response.get_json()] == [400, 400]
+    listing_events.ensure_started.assert_not_called()
+
+def test_token_verified_once_per_batch(car_client, post_batch):
+    """Test sub-requests reuse the JWT the batch verified, instead of verifying it once per item"""
+    import auth
+    with patch.object(auth, "verify_decode_jwt", wraps=auth.verify_decode_jwt) as verify:
+        response = post_batch([{"method": "POST", "path": "/api/cars", "body": {"manufacturer": "Honda"}}] * 3)
+    assert [result["status"] for result in response.get_json()] == [201, 201, 201]
+    assert verify.call_count == 1
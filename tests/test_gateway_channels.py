@@ -0,0 +1,70 @@
+import grpc
+import pytest
+import time
+from concurrent import futures
+from grpc_health.v1 import health, health_pb2, health_pb2_grpc
+from services import user_service_pb2, user_service_pb2_grpc
+from microservices.gateway.channels import ChannelManager
+
+class FakeUserService(user_service_pb2_grpc.UserServiceServicer):
+    """Stands in for one user-service replica and counts the calls it receives"""
+    def __init__(self):
+        self.calls = 0
+        self.health = health.HealthServicer()
+
+    def UsersReadOne(self, request, context):
+        self.calls += 1
+        return user_service_pb2.User(userId=request.userId)
+
+@pytest.fixture
+def replicas():
+    servers = []
+    services = []
+    ports = []
+    for _ in range(3):
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+        service = FakeUserService()
+        user_service_pb2_grpc.add_UserServiceServicer_to_server(service, server)
+        health_pb2_grpc.add_HealthServicer_to_server(service.health, server)
+        ports.append(server.add_insecure_port("127.0.0.1:0"))
+        server.start()
+        servers.append(server)
+        services.append(service)
+    yield services, ports
+    for server in servers:
+        server.stop(None)
+
+def test_round_robin_spreads_calls_across_replicas(replicas):
+    """Calls through a pooled stub reach every address the target resolves to"""
+    services, ports = replicas
+    manager = ChannelManager(channels_per_backend=2)
+    client = manager.stub("ipv4:" + ",".join(f"127.0.0.1:{port}" for port in ports), user_service_pb2_grpc.UserServiceStub)
+    
+    try:
+        for user_id in range(1, 61):
+            response = client.UsersReadOne(user_service_pb2.UsersReadOneRequest(userId=user_id), timeout=5)
+            assert response.userId == user_id
+    finally:
+        manager.close()
+    
+    assert sum(service.calls for service in services) == 60
+    assert all(service.calls >= 10 for service in services)
+
+def test_round_robin_skips_replicas_not_serving(replicas):
+    """Calls stop reaching a replica as soon as its health service reports NOT_SERVING"""
+    services, ports = replicas
+    manager = ChannelManager(channels_per_backend=1)
+    client = manager.stub("ipv4:" + ",".join(f"127.0.0.1:{port}" for port in ports), user_service_pb2_grpc.UserServiceStub)
+    
+    try:
+        client.UsersReadOne(user_service_pb2.UsersReadOneRequest(userId=1), timeout=5)
+        services[0].health.set("", health_pb2.HealthCheckResponse.NOT_SERVING)
+        time.sleep(0.5)
+        calls = services[0].calls
+        for user_id in range(1, 31):
+            client.UsersReadOne(user_service_pb2.UsersReadOneRequest(userId=user_id), timeout=5)
+    finally:
+        manager.close()
+    
+    assert services[0].calls == calls
+    assert services[1].calls + services[2].calls >= 30
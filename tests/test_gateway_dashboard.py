@@ -0,0 +1,163 @@
+import json
+import os
+import re
+import threading
+import time
+import pytest
+from unittest.mock import Mock, patch
+from google.protobuf.descriptor import FieldDescriptor
+from services import (car_listing_service_pb2, car_service_pb2, inspection_service_pb2, maintenance_service_pb2,
+                      meeting_service_pb2, transaction_service_pb2, user_service_pb2)
+
+def table_columns(gateway, collection):
+    """The path dashboard.js reads a collection from, and the JSON keys its table shows"""
+    with open(os.path.join(os.path.dirname(gateway.__file__), "static", "dashboard.js")) as script:
+        definition = re.search(rf"\n    {collection}: {{(.*?)\n    }},", script.read(), re.DOTALL).group(1)
+    path = re.search(r"path: '([^']+)'", definition).group(1)
+    return path, re.findall(r"'(\w+)'", re.search(r"columns: \[(.*?)\]", definition).group(1))
+
+def filled(message_cls):
+    """A message with every scalar field set to a value MessageToDict doesn't leave out"""
+    values = {FieldDescriptor.TYPE_STRING: "2024-03-20T10:00:00", FieldDescriptor.TYPE_BOOL: True,
+              FieldDescriptor.TYPE_DOUBLE: 1.5, FieldDescriptor.TYPE_FLOAT: 1.5, FieldDescriptor.TYPE_ENUM: 1}
+    return message_cls(**{field.name: values.get(field.type, 1) for field in message_cls.DESCRIPTOR.fields
+                          if field.type != FieldDescriptor.TYPE_MESSAGE})
+
+def listing_stats(request, **kwargs):
+    listings = {"StatusEnum_AVAILABLE": 3, "StatusEnum_RESERVED": 1, "StatusEnum_SOLD": 2}
+    count = listings[car_listing_service_pb2.CarListing.StatusEnum.Name(request.status)]
+    return car_listing_service_pb2.CarlistingStatsResponse(data=[
+        car_listing_service_pb2.ListingStats(group="Toyota", listings=count),
+        car_listing_service_pb2.ListingStats(group="Honda", listings=count),
+    ])
+
+@pytest.fixture
+def backends(gateway, monkeypatch):
+    """Backends answering the summary's calls, each after a short delay so concurrent requests overlap"""
+    carlisting, maintenance, transaction = Mock(), Mock(), Mock()
+    carlisting.CarlistingStats.side_effect = lambda request, **kwargs: time.sleep(0.01) or listing_stats(request)
+    maintenance.MaintenanceOpenCounts.return_value = maintenance_service_pb2.MaintenanceOpenCountsResponse(data=[
+        maintenance_service_pb2.MaintenanceOpenCount(maintenanceType=1, openCount=4),
+    ])
+    transaction.TransactionsReportRentVsBuy.return_value = transaction_service_pb2.TransactionsReportRentVsBuyResponse(data=[
+        transaction_service_pb2.TypeSplit(type=1, transactions=5, revenue=1500.0, share=0.5),
+        transaction_service_pb2.TypeSplit(type=2, transactions=5, revenue=90000.0, share=0.5),
+    ])
+    monkeypatch.setattr(gateway, "CARLISTING_CLIENT", carlisting)
+    monkeypatch.setattr(gateway, "MAINTENANCE_CLIENT", maintenance)
+    monkeypatch.setattr(gateway, "TRANSACTION_CLIENT", transaction)
+    monkeypatch.setattr(gateway, "DASHBOARD_SUMMARY", {"expires": 0.0, "summary": None})
+    return carlisting
+
+@pytest.fixture
+def client(gateway, issue_token):
+    client = gateway.app.test_client()
+    client.environ_base["HTTP_AUTHORIZATION"] = f"Bearer {issue_token('read:dashboard')}"
+    return client
+
+def test_summary_is_built_once_per_ttl(backends, client):
+    """Test the summary adds up every backend's counts and is served from the cache until it expires"""
+    response = client.get("/api/dashboard/summary")
+    assert response.status_code == 200
+    assert response.get_json() == {
+        "listings": {"StatusEnum_AVAILABLE": 6, "StatusEnum_RESERVED": 2, "StatusEnum_SOLD": 4},
+        "openMaintenances": {"MaintenanceTypeEnum_BASIC": 4},
+        "transactions": {"TypeEnum_RENT": {"transactions": 5, "revenue": 1500.0},
+                         "TypeEnum_BUY": {"transactions": 5, "revenue": 90000.0}},
+    }
+    assert "private" in response.headers["Cache-Control"]
+
+    assert client.get("/api/dashboard/summary").get_json() == response.get_json()
+    assert backends.CarlistingStats.call_count == 3
+
+def test_summary_in_full_batch_completes(gateway, backends, client):
+    """Test a batch of summaries filling every batch worker still finishes, since the summary's calls have their own pool"""
+    batch = [{"path": "/api/dashboard/summary"}] * gateway.MAX_BATCH_SIZE
+    responses = []
+    request = threading.Thread(target=lambda: responses.append(client.post("/api/batch", json=batch)), daemon=True)
+    # Every item is queued or waiting on the summary before the first one gets to build it
+    with gateway.DASHBOARD_SUMMARY_LOCK:
+        request.start()
+        time.sleep(0.2)
+    request.join(10)
+    assert responses, "batch of dashboard summaries deadlocked"
+    assert [result["status"] for result in responses[0].get_json()] == [200] * gateway.MAX_BATCH_SIZE
+
+def test_dashboard_revalidates_with_etag(client):
+    """Test the dashboard page carries an ETag, and an unchanged page is answered 304 without a body"""
+    with client.session_transaction() as session:
+        session["profile"] = {"name": "Tester", "picture": ""}
+    response = client.get("/dashboard")
+    assert response.status_code == 200
+    assert "no-cache" in response.headers["Cache-Control"]
+    etag = response.headers["ETag"]
+
+    revalidated = client.get("/dashboard", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b""
+
+def test_hashed_assets_are_immutable(gateway):
+    """Test an asset is served under its current hash with a year-long immutable lifetime, and not under a stale one"""
+    client = gateway.app.test_client()
+    with gateway.app.test_request_context():
+        url = gateway.asset_url("dashboard.css")
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.cache_control.max_age == gateway.STATIC_ASSET_MAX_AGE
+    assert response.cache_control.public and response.cache_control.immutable
+    response.close()
+
+    assert client.get("/assets/000000000000/dashboard.css").status_code == 404
+
+def test_jwks_refetched_for_unknown_kid(gateway, issue_token, tmp_path):
+    """Test a token signed with a key added after the set was cached is accepted, after one refetch of the set"""
+    import auth
+    auth.get_jwks()
+    jwks_file = tmp_path / "jwks.json"
+    jwks = json.loads(jwks_file.read_text())
+    jwks["keys"].append(dict(jwks["keys"][0], kid="rotated"))
+    jwks_file.write_text(json.dumps(jwks))
+    with patch.object(auth, "urlopen", wraps=auth.urlopen) as urlopen:
+        token = issue_token("read:dashboard", kid="rotated")
+        with gateway.app.test_request_context():
+            assert auth.verify_decode_jwt(token)["sub"] == "auth0|tester"
+            # Within JWKS_MIN_REFRESH, another unknown key doesn't fetch the set again
+            with pytest.raises(auth.AuthError):
+                auth.verify_decode_jwt(issue_token("read:dashboard", kid="unknown"))
+    assert urlopen.call_count == 1
+
+def test_jwks_fetched_outside_lock(issue_token, monkeypatch):
+    """Test the key set is downloaded without holding the lock other requests take to read the cached keys"""
+    import auth
+    lock_held = []
+    fetch = auth.urlopen
+
+    def urlopen(url):
+        lock_held.append(auth._jwks_lock.locked())
+        return fetch(url)
+
+    monkeypatch.setattr(auth, "urlopen", urlopen)
+    assert auth.get_jwks()["keys"]
+    assert lock_held == [False]
+
+@pytest.mark.parametrize("collection, client, method, messages, message", [
+    ("cars", "CAR_CLIENT", "CarsReadAll", car_service_pb2, "Car"),
+    ("carlistings", "CARLISTING_CLIENT", "CarlistingReadAll", car_listing_service_pb2, "CarListing"),
+    ("transactions", "TRANSACTION_CLIENT", "TransactionsReadAll", transaction_service_pb2, "Transaction"),
+    ("users", "USER_CLIENT", "UsersReadAll", user_service_pb2, "User"),
+    ("maintenances", "MAINTENANCE_CLIENT", "MaintenanceReadAll", maintenance_service_pb2, "Maintenance"),
+    ("inspections", "INSPECTION_CLIENT", "InspectionReadAll", inspection_service_pb2, "Inspection"),
+    ("meetings", "MEETING_CLIENT", "MeetingsReadAll", meeting_service_pb2, "Meeting"),
+])
+def test_table_reads_served_keys(gateway, monkeypatch, collection, client, method, messages, message):
+    """Test a row of every dashboard table has each key the table shows, and the backend is asked for just those"""
+    path, columns = table_columns(gateway, collection)
+    backend = Mock()
+    getattr(backend, method).return_value = getattr(messages, f"{method}Response")(data=[filled(getattr(messages, message))])
+    monkeypatch.setattr(gateway, client, backend)
+    response = gateway.app.test_client().get(f"{path}?fields={','.join(columns)}")
+    assert response.status_code == 200
+    row = response.get_json()["data"][0]
+    assert [column for column in columns if column not in row] == []
+    mask = getattr(backend, method).call_args[0][0].readMask
+    assert len(mask.paths) == len(columns)
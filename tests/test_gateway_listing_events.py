@@ -0,0 +1,54 @@
+import grpc
+from unittest.mock import Mock
+from services import car_listing_service_pb2
+from microservices.gateway.listing_events import ListingEventHub
+
+def status_event(event_id, listing_id):
+    return car_listing_service_pb2.ListingStatusEvent(
+        eventId=event_id, listingId=listing_id, status=car_listing_service_pb2.CarListing.StatusEnum.StatusEnum_SOLD
+    )
+
+class BrokenStream(grpc.RpcError):
+    pass
+
+def test_hub_resubscribes_after_last_event():
+    """Test the hub buffers streamed events, drops them on a reset and resumes after the last one it kept"""
+    hub = ListingEventHub(Mock())
+    requests = []
+    
+    def watch(request):
+        requests.append(request.afterEventId)
+        if len(requests) == 1:
+            yield status_event(1, 10)
+            yield car_listing_service_pb2.ListingStatusEvent(reset=True)
+            yield status_event(3, 11)
+            raise BrokenStream()
+        hub.stop()
+        yield status_event(4, 10)
+    
+    hub.stub.CarlistingWatchStatus.side_effect = watch
+    hub.run()
+    
+    assert requests == [0, 3]
+    assert [event.eventId for event in hub.events] == [3, 4]
+    assert hub.wait_after(3, timeout=0) == ([status_event(4, 10)], True)
+    assert hub.wait_after(1, timeout=0) == ([status_event(3, 11), status_event(4, 10)], False)
+
+def test_hub_survives_unexpected_errors():
+    """Test an error other than a failed RPC is logged and the subscription resumed, instead of ending the thread"""
+    hub = ListingEventHub(Mock())
+    requests = []
+    
+    def watch(request):
+        requests.append(request.afterEventId)
+        if len(requests) == 1:
+            yield status_event(1, 10)
+            raise ValueError("malformed event")
+        hub.stop()
+        yield status_event(2, 10)
+    
+    hub.stub.CarlistingWatchStatus.side_effect = watch
+    hub.run()
+    
+    assert requests == [0, 1]
+    assert hub.last_event_id() == 2
@@ -0,0 +1,18 @@
+from unittest.mock import Mock
+from services.meeting_service_pb2 import MeetingsFindFreeSlotsResponse
+
+def test_free_slots_forwards_only_given_hours(gateway, monkeypatch):
+    """Test working hours missing from the query stay unset for the service's defaults, and 0 is forwarded as set"""
+    meeting = Mock()
+    meeting.MeetingsFindFreeSlots.return_value = MeetingsFindFreeSlotsResponse()
+    monkeypatch.setattr(gateway, "MEETING_CLIENT", meeting)
+    client = gateway.app.test_client()
+
+    assert client.get("/api/meetings/free-slots?staffId=2&from=2024-03-20").status_code == 200
+    request = meeting.MeetingsFindFreeSlots.call_args[0][0]
+    assert not request.HasField("dayStartHour") and not request.HasField("dayEndHour")
+
+    client.get("/api/meetings/free-slots?staffId=2&from=2024-03-20&dayStartHour=0&dayEndHour=12")
+    request = meeting.MeetingsFindFreeSlots.call_args[0][0]
+    assert request.HasField("dayStartHour") and request.dayStartHour == 0
+    assert request.dayEndHour == 12
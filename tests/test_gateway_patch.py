@@ -0,0 +1,82 @@
+import grpc
+import pytest
+from unittest.mock import Mock
+from services.car_listing_service_pb2 import CarListing
+from services.transaction_service_pb2 import Transaction
+
+class PreconditionFailed(grpc.RpcError):
+    def code(self):
+        return grpc.StatusCode.FAILED_PRECONDITION
+
+@pytest.fixture
+def backends(gateway, monkeypatch):
+    carlisting, transaction = Mock(), Mock()
+    carlisting.CarlistingPatch.side_effect = lambda request, **kwargs: CarListing(
+        listingId=request.listingId, promoted=request.carListing.promoted, version=4
+    )
+    transaction.TransactionsPatch.side_effect = lambda request, **kwargs: Transaction(
+        transactionId=request.transactionId, status=request.transaction.status, version=4
+    )
+    monkeypatch.setattr(gateway, "CARLISTING_CLIENT", carlisting)
+    monkeypatch.setattr(gateway, "TRANSACTION_CLIENT", transaction)
+    return carlisting, transaction
+
+@pytest.fixture
+def patch_json(gateway, issue_token):
+    token = issue_token("update:carlisting", "update:transaction")
+    client = gateway.app.test_client()
+
+    def patch_json(path, body, if_match=None):
+        headers = {"Authorization": f"Bearer {token}"}
+        if if_match is not None:
+            headers["If-Match"] = if_match
+        return client.patch(path, json=body, headers=headers)
+    return patch_json
+
+def test_patch_mask_from_body_keys(gateway):
+    """Test the update mask names exactly the body's keys, as proto field names whether sent camelCase or not"""
+    listing, mask = gateway.parse_patch({"salePrice": 23000, "promoted": True, "posting_date": "2024-03-20"}, CarListing)
+    assert list(mask.paths) == ["sale_price", "promoted", "posting_date"]
+    assert listing.sale_price == 23000 and listing.promoted
+
+    transaction, mask = gateway.parse_patch({"endDate": None, "status": "StatusEnum_COMPLETED"}, Transaction)
+    assert list(mask.paths) == ["endDate", "status"]
+    assert transaction.endDate == ""
+
+def test_patch_carlisting_sends_mask_and_version(backends, patch_json):
+    """Test a listing patch forwards the body's fields, the If-Match version, and answers with the new version as ETag"""
+    carlisting, _ = backends
+    response = patch_json("/api/carlistings/7", {"promoted": True}, if_match='W/"3"')
+    assert response.status_code == 200
+    assert response.headers["ETag"] == '"4"'
+    assert response.get_json()["promoted"] is True
+
+    request = carlisting.CarlistingPatch.call_args[0][0]
+    assert request.listingId == 7
+    assert list(request.updateMask.paths) == ["promoted"]
+    assert request.expectedVersion == 3
+
+def test_patch_transaction_clears_end_date(backends, patch_json):
+    """Test a null endDate stays in the mask, so the service sets it to NULL, and a missing If-Match sends version 0"""
+    _, transaction = backends
+    response = patch_json("/api/transactions/5", {"endDate": None, "status": "StatusEnum_COMPLETED"})
+    assert response.status_code == 200
+
+    request = transaction.TransactionsPatch.call_args[0][0]
+    assert list(request.updateMask.paths) == ["endDate", "status"]
+    assert request.transaction.endDate == ""
+    assert request.expectedVersion == 0
+
+    patch_json("/api/transactions/5", {"status": "StatusEnum_COMPLETED"}, if_match='"3"')
+    assert transaction.TransactionsPatch.call_args[0][0].expectedVersion == 3
+
+def test_patch_rejections(backends, patch_json):
+    """Test a malformed If-Match or an unknown field is a 400 before any call, and a stale version is a 412"""
+    carlisting, transaction = backends
+    assert patch_json("/api/carlistings/7", {"promoted": True}, if_match="three").status_code == 400
+    assert patch_json("/api/transactions/5", {"colour": "red"}).status_code == 400
+    carlisting.CarlistingPatch.assert_not_called()
+    transaction.TransactionsPatch.assert_not_called()
+
+    carlisting.CarlistingPatch.side_effect = PreconditionFailed()
+    assert patch_json("/api/carlistings/7", {"promoted": True}, if_match='"3"').status_code == 412
@@ -0,0 +1,39 @@
+import multiprocessing
+from datetime import date
+from perf.generate_data import GENERATORS, Plan
+
+COUNTS = {"users": 250, "cars": 300, "listings": 300, "transactions": 350}
+FIRST_IDS = {"users": 1, "car": 1, "car_listing": 1, "transaction": 1}
+
+def generate_chunk(plan, chunk):
+    table, index = chunk
+    return chunk, GENERATORS[table](plan, index)
+
+def generate_all(seed, workers, chunk_rows=64):
+    """Every generated row by table, from chunks handed out to workers processes in whatever order they finish"""
+    plan = Plan(seed, date(2024, 6, 30), COUNTS, FIRST_IDS, [], chunk_rows)
+    chunks = plan.chunks("users", COUNTS["users"]) + plan.chunks("cars", COUNTS["cars"])
+    # Spawned workers start with their own hash seed, as they may on another machine
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        results = dict(pool.starmap(generate_chunk, [(plan, chunk) for chunk in chunks]))
+    rows = {}
+    for chunk in chunks:
+        for table, table_rows in results[chunk].items():
+            rows.setdefault(table, []).extend(table_rows)
+    return rows
+
+def test_same_seed_same_rows_for_any_worker_count():
+    """Test a seed generates the same rows whether one worker or several generate the chunks"""
+    rows = generate_all(seed=7, workers=1)
+    assert {table: len(table_rows) for table, table_rows in rows.items()} == {
+        "users": 250, "car": 300, "car_listing": 300, "transaction": 350
+    }
+    assert [row[0] for row in rows["transaction"]] == list(range(1, 351))
+    assert generate_all(seed=7, workers=3) == rows
+
+def test_other_seed_other_rows():
+    """Test another seed generates different rows, with the same IDs"""
+    rows, other = generate_all(seed=7, workers=2), generate_all(seed=8, workers=2)
+    for table in rows:
+        assert [row[0] for row in rows[table]] == [row[0] for row in other[table]]
+        assert rows[table] != other[table]
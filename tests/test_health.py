@@ -0,0 +1,108 @@
+import grpc
+import psycopg2
+import pytest
+from concurrent import futures
+from unittest.mock import Mock, patch
+from grpc_health.v1 import health_pb2, health_pb2_grpc
+from prometheus_client import CollectorRegistry
+from microservices.common import health
+from microservices.common.db import QueryMetrics
+from microservices.gateway.channels import ChannelManager
+
+SERVICE = "openapitools.services.carservice.CarService"
+SERVING = health_pb2.HealthCheckResponse.SERVING
+NOT_SERVING = health_pb2.HealthCheckResponse.NOT_SERVING
+
+@pytest.fixture
+def registry():
+    return CollectorRegistry()
+
+@pytest.fixture
+def connection():
+    connection = Mock(closed=0)
+    connection.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    with patch("psycopg2.extensions.cursor") as cursor:
+        connection.ping = cursor.return_value.__enter__.return_value.execute
+        yield connection
+
+@pytest.fixture
+def database_health(registry, connection):
+    return health.DatabaseHealth(QueryMetrics("test_health", registry=registry), connection, registry=registry)
+
+@pytest.fixture
+def health_port(database_health):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    database_health.add_to_server(server, SERVICE)
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    yield port
+    server.stop(None)
+
+@pytest.fixture
+def health_client(health_port):
+    channel = grpc.insecure_channel(f"127.0.0.1:{health_port}")
+    stub = health_pb2_grpc.HealthStub(channel)
+    yield lambda service: stub.Check(health_pb2.HealthCheckRequest(service=service), timeout=5).status
+    channel.close()
+
+def test_serving_while_connection_answers(registry, connection, health_client):
+    """Test an idle connection is pinged, and readiness and liveness are reported SERVING"""
+    assert health_client("") == SERVING
+    assert health_client(SERVICE) == SERVING
+    assert health_client(health.LIVENESS) == SERVING
+    connection.ping.assert_called_with("SELECT 1")
+    connection.rollback.assert_called()
+    assert registry.get_sample_value("test_health_ready") == 1
+
+def test_failed_ping_is_not_ready(connection, database_health, health_client):
+    """Test a connection whose ping fails takes the service out of rotation without failing liveness"""
+    connection.ping.side_effect = psycopg2.OperationalError("server closed the connection unexpectedly")
+    database_health.update()
+    assert health_client(SERVICE) == NOT_SERVING
+    assert health_client(health.LIVENESS) == SERVING
+
+    connection.closed = 2
+    database_health.update()
+    assert health_client("") == NOT_SERVING
+    assert health_client(health.LIVENESS) == NOT_SERVING
+
+def test_busy_connection_is_not_ready(monkeypatch, connection, database_health, health_client):
+    """Test a connection held past HEALTH_MAX_CONNECTION_WAIT reports saturation, and readiness returns after"""
+    monkeypatch.setattr(health, "HEALTH_MAX_CONNECTION_WAIT", 0.05)
+    with database_health.query_metrics.lock(connection):
+        database_health.update()
+    assert health_client(SERVICE) == NOT_SERVING
+    assert health_client(health.LIVENESS) == SERVING
+
+    database_health.update()
+    assert health_client(SERVICE) == SERVING
+
+def test_connection_in_transaction_is_not_pinged(connection, database_health, health_client):
+    """Test a connection in use by a transaction is left alone"""
+    connection.ping.reset_mock()
+    connection.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    database_health.update()
+    connection.ping.assert_not_called()
+    assert health_client(SERVICE) == SERVING
+
+def test_stop_reports_not_serving(database_health, health_client):
+    """Test stopping reports every service NOT_SERVING, whatever later checks find"""
+    database_health.stop()
+    database_health.update()
+    assert health_client("") == NOT_SERVING
+    assert health_client(SERVICE) == NOT_SERVING
+
+def test_gateway_checks_backends_at_once(health_port):
+    """Test the gateway reports each backend's status, and the error code of one it can't reach"""
+    closed = grpc.server(futures.ThreadPoolExecutor(max_workers=1))
+    closed_port = closed.add_insecure_port("127.0.0.1:0")
+    manager = ChannelManager(channels_per_backend=1)
+    manager.stub(f"127.0.0.1:{health_port}", health_pb2_grpc.HealthStub)
+    manager.stub(f"127.0.0.1:{closed_port}", health_pb2_grpc.HealthStub)
+    try:
+        statuses = manager.check_health(timeout=1)
+    finally:
+        manager.close()
+
+    assert statuses[f"127.0.0.1:{health_port}"] == "SERVING"
+    assert statuses[f"127.0.0.1:{closed_port}"] in ("UNAVAILABLE", "DEADLINE_EXCEEDED")
@@ -0,0 +1,48 @@
+import pytest
+from unittest.mock import Mock
+from services.car_service_pb2 import Car
+from microservices.common import idempotency
+from microservices.common.idempotency import IdempotencyKeyInUse, IdempotencyKeys, idempotency_key_of
+
+@pytest.fixture
+def cursor():
+    return Mock()
+
+def test_new_key_is_claimed(cursor):
+    """Test a key nobody used yet is claimed for the caller, who goes on to create"""
+    cursor.fetchone.return_value = ("key-1",)
+    assert IdempotencyKeys("car_idempotency").claim(cursor, "key-1", Car) is None
+    assert "INSERT INTO car_idempotency" in cursor.execute.call_args[0][0]
+
+def test_used_key_replays_stored_response(cursor):
+    """Test a key whose create has committed returns the response stored for it"""
+    stored = Car(carId=7, manufacturer="Toyota")
+    cursor.fetchone.side_effect = [None, (memoryview(stored.SerializeToString()),)]
+    assert IdempotencyKeys("car_idempotency").claim(cursor, "key-1", Car) == stored
+
+def test_key_without_response_is_in_use(cursor):
+    """Test a claim whose response isn't stored yet raises instead of failing to parse NULL"""
+    cursor.fetchone.side_effect = [None, (None,)]
+    with pytest.raises(IdempotencyKeyInUse):
+        IdempotencyKeys("car_idempotency").claim(cursor, "key-1", Car)
+
+def test_expired_keys_purged_periodically(cursor, monkeypatch):
+    """Test expired keys are deleted at most once every IDEMPOTENCY_PURGE_INTERVAL seconds"""
+    keys = IdempotencyKeys("user_idempotency")
+    cursor.fetchone.return_value = ("key-1",)
+    keys.claim(cursor, "key-1", Car)
+    assert not any("DELETE" in call[0][0] for call in cursor.execute.call_args_list)
+    
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_PURGE_INTERVAL", -1)
+    keys.claim(cursor, "key-2", Car)
+    assert cursor.execute.call_args_list[1][0] == (
+        "DELETE FROM user_idempotency WHERE created_at < now() - %s * INTERVAL '1 second'", (idempotency.IDEMPOTENCY_TTL,)
+    )
+
+def test_key_read_from_metadata():
+    """Test the key comes from the idempotency-key metadata, and is None without it"""
+    context = Mock()
+    context.invocation_metadata.return_value = (("traceparent", "00-ab-cd-01"), ("idempotency-key", "key-1"))
+    assert idempotency_key_of(context) == "key-1"
+    context.invocation_metadata.return_value = ()
+    assert idempotency_key_of(context) is None
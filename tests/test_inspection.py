@@ -18,6 +18,7 @@ def mock_context():
     context = Mock()
     context.set_code = Mock()
     context.set_details = Mock()
+    context.invocation_metadata = Mock(return_value=())
     return context
 
 @pytest.fixture
@@ -137,4 +138,18 @@ def test_inspection_completion(inspection_service, mock_db_connection, mock_cont
     assert updated_inspection.inspectionId == created_inspection.inspectionId
     assert updated_inspection.inspectionStatus == inspection_service_pb2.Inspection.InspectionStatusEnum.InspectionStatusEnum_FINISHED
     assert updated_inspection.inspectionStaffNotes == "Inspection completed"
-    assert updated_inspection.inspectionEndDate == end_date.isoformat() 
\ No newline at end of file
+    assert updated_inspection.inspectionEndDate == end_date.isoformat() 
+
+def test_inspection_read_all_with_read_mask(inspection_service, mock_db_connection, mock_context):
+    """Test a read mask selects only the requested columns, and pages on the ID it always includes"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = [(3, datetime(2024, 3, 20, 10, 0)), (5, datetime(2024, 3, 21, 10, 0))]
+    
+    request = inspection_service_pb2.InspectionReadAllRequest(pageSize=1)
+    request.readMask.paths.append("inspectionStartDate")
+    response = inspection_service.InspectionReadAll(request, mock_context)
+    
+    query, params = mock_cursor.execute.call_args[0]
+    assert query == "SELECT inspection_id, inspection_start_date FROM inspection WHERE inspection_id > %s ORDER BY inspection_id LIMIT %s"
+    assert list(response.data) == [inspection_service_pb2.Inspection(inspectionId=3, inspectionStartDate="2024-03-20T10:00:00")]
+    assert response.nextPageToken == "3"
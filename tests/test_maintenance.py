@@ -1,7 +1,9 @@
 import pytest
-from unittest.mock import Mock, patch
+from unittest.mock import Mock, MagicMock, patch
+from google.protobuf import empty_pb2
 from services import maintenance_service_pb2
 from microservices.maintenance.maintenance import MaintenanceService
+from microservices.maintenance.summary_check import check_open_counts
 
 @pytest.fixture
 def mock_db_connection():
@@ -17,6 +19,7 @@ def mock_context():
     context = Mock()
     context.set_code = Mock()
     context.set_details = Mock()
+    context.invocation_metadata = Mock(return_value=())
     return context
 
 @pytest.fixture
@@ -129,4 +132,40 @@ def test_maintenance_completion(maintenance_service, mock_db_connection, mock_co
     assert updated_maintenance.maintenanceId == created_maintenance.maintenanceId
     assert updated_maintenance.maintenanceStatus == maintenance_service_pb2.Maintenance.MaintenanceStatusEnum.MaintenanceStatusEnum_FINISHED
     assert updated_maintenance.maintenanceStaffNotes == "Completed"
-    assert updated_maintenance.maintenanceEndDate == "2024-03-20T11:30:00Z" 
\ No newline at end of file
+    assert updated_maintenance.maintenanceEndDate == "2024-03-20T11:30:00Z" 
+
+def test_maintenance_open_counts(maintenance_service, mock_db_connection, mock_context):
+    """Test open maintenance counts are read from the summary table"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = [("MaintenanceTypeEnum_BASIC", 4), ("MaintenanceTypeEnum_FULL", 1)]
+    
+    response = maintenance_service.MaintenanceOpenCounts(empty_pb2.Empty(), mock_context)
+    
+    assert "FROM maintenance_open_counts" in mock_cursor.execute.call_args[0][0]
+    assert response.data[0].maintenanceType == maintenance_service_pb2.Maintenance.MaintenanceTypeEnum.MaintenanceTypeEnum_BASIC
+    assert response.data[0].openCount == 4
+    assert not mock_context.set_code.called
+
+def test_open_counts_check_without_drift():
+    """Test the consistency checker leaves a matching summary untouched"""
+    mock_conn = MagicMock()
+    mock_cursor = mock_conn.cursor.return_value.__enter__.return_value
+    mock_cursor.fetchall.return_value = []
+    
+    assert check_open_counts(mock_conn, repair=True) == []
+    assert mock_cursor.execute.call_count == 1
+
+def test_maintenance_read_with_read_mask(maintenance_service, mock_db_connection, mock_context):
+    """Test a read mask selects only the requested columns and the ID, converting just those values"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchone.return_value = (4, "MaintenanceStatusEnum_ONGOING", None)
+    
+    request = maintenance_service_pb2.MaintenanceReadOneRequest(maintenanceId=4)
+    request.readMask.paths.extend(["maintenanceCost", "maintenanceStatus"])
+    response = maintenance_service.MaintenanceReadOne(request, mock_context)
+    
+    query, params = mock_cursor.execute.call_args[0]
+    assert query == "SELECT maintenance_id, maintenance_status, maintenance_cost FROM maintenance WHERE maintenance_id = %s"
+    assert response == maintenance_service_pb2.Maintenance(
+        maintenanceId=4, maintenanceStatus=maintenance_service_pb2.Maintenance.MaintenanceStatusEnum.MaintenanceStatusEnum_ONGOING
+    )
@@ -1,5 +1,8 @@
 import pytest
 from unittest.mock import Mock, patch
+from datetime import datetime
+import grpc
+from psycopg2 import errors
 from services import meeting_service_pb2
 from microservices.meeting.meeting import MeetingService
 
@@ -17,6 +20,7 @@ def mock_context():
     context = Mock()
     context.set_code = Mock()
     context.set_details = Mock()
+    context.invocation_metadata = Mock(return_value=())
     return context
 
 @pytest.fixture
@@ -102,4 +106,91 @@ def test_meeting_cancellation(meeting_service, mock_db_connection, mock_context)
     response = meeting_service.MeetingsCreate(request, mock_context)
     
     assert response.meetingId == 1
-    assert response.status == meeting_service_pb2.Meeting.StatusEnum.StatusEnum_CANCELED 
\ No newline at end of file
+    assert response.status == meeting_service_pb2.Meeting.StatusEnum.StatusEnum_CANCELED 
+
+def test_meeting_overlap_rejected(meeting_service, mock_db_connection, mock_context):
+    """Test that an overlapping booking for the same staff member is reported as a conflict"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.execute.side_effect = errors.ExclusionViolation("conflicting key value")
+    
+    request = meeting_service_pb2.MeetingsCreateRequest(
+        meeting=meeting_service_pb2.Meeting(
+            clientId=1,
+            scheduleDate="2024-03-20T10:00:00Z",
+            status=meeting_service_pb2.Meeting.StatusEnum.StatusEnum_SCHEDULED,
+            durationMinutes=30,
+            staffId=2
+        )
+    )
+    
+    response = meeting_service.MeetingsCreate(request, mock_context)
+    
+    assert response.meetingId == 0
+    assert mock_conn.rollback.called
+    mock_context.set_code.assert_called_with(grpc.StatusCode.ALREADY_EXISTS)
+
+def test_meeting_find_free_slots(meeting_service, mock_db_connection, mock_context):
+    """Test that free slots are computed by a single query and mapped to the response"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = [
+        (datetime(2024, 3, 20, 9, 0), datetime(2024, 3, 20, 10, 0)),
+        (datetime(2024, 3, 20, 11, 0), datetime(2024, 3, 20, 18, 0))
+    ]
+    
+    request = meeting_service_pb2.MeetingsFindFreeSlotsRequest(staffId=2, fromDate="2024-03-20", toDate="2024-03-20")
+    response = meeting_service.MeetingsFindFreeSlots(request, mock_context)
+    
+    assert mock_cursor.execute.call_count == 1
+    assert len(response.data) == 2
+    assert response.data[0].start == "2024-03-20T09:00:00"
+    assert response.data[1].end == "2024-03-20T18:00:00"
+
+def test_meeting_find_free_slots_working_hours(meeting_service, mock_db_connection, mock_context):
+    """Test unset working hours default to 9 to 18, while an explicit 0 starts the day at midnight"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = []
+    
+    request = meeting_service_pb2.MeetingsFindFreeSlotsRequest(staffId=2, fromDate="2024-03-20")
+    meeting_service.MeetingsFindFreeSlots(request, mock_context)
+    assert mock_cursor.execute.call_args[0][1][:2] == (9, 18)
+    
+    request.dayStartHour = 0
+    request.dayEndHour = 24
+    meeting_service.MeetingsFindFreeSlots(request, mock_context)
+    assert mock_cursor.execute.call_args[0][1][:2] == (0, 24)
+    
+    request.dayEndHour = 0
+    meeting_service.MeetingsFindFreeSlots(request, mock_context)
+    assert mock_cursor.execute.call_count == 2
+    mock_context.set_code.assert_called_with(grpc.StatusCode.INVALID_ARGUMENT)
+
+def test_meeting_find_free_slots_invalid_range(meeting_service, mock_db_connection, mock_context):
+    """Test that an inverted or oversized date range is rejected before querying"""
+    mock_conn, mock_cursor = mock_db_connection
+    
+    request = meeting_service_pb2.MeetingsFindFreeSlotsRequest(staffId=2, fromDate="2024-03-20", toDate="2024-03-01")
+    response = meeting_service.MeetingsFindFreeSlots(request, mock_context)
+    
+    assert len(response.data) == 0
+    assert not mock_cursor.execute.called
+    mock_context.set_code.assert_called_with(grpc.StatusCode.INVALID_ARGUMENT)
+
+def test_meeting_read_with_read_mask(meeting_service, mock_db_connection, mock_context):
+    """Test a read mask selects only the requested columns and the ID, and an unknown field is rejected unread"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchone.return_value = (8, None)
+    
+    request = meeting_service_pb2.MeetingsReadOneRequest(meetingId=8)
+    request.readMask.paths.append("staffId")
+    response = meeting_service.MeetingsReadOne(request, mock_context)
+    
+    query, params = mock_cursor.execute.call_args[0]
+    assert query == "SELECT meeting_id, staff_id FROM meeting WHERE meeting_id = %s"
+    assert response == meeting_service_pb2.Meeting(meetingId=8)
+    
+    mock_cursor.execute.reset_mock()
+    request = meeting_service_pb2.MeetingsReadAllRequest()
+    request.readMask.paths.append("room")
+    assert len(meeting_service.MeetingsReadAll(request, mock_context).data) == 0
+    assert not mock_cursor.execute.called
+    mock_context.set_code.assert_called_with(grpc.StatusCode.INVALID_ARGUMENT)
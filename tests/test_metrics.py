@@ -0,0 +1,70 @@
+import grpc
+import pytest
+from concurrent import futures
+from unittest.mock import Mock, patch
+from prometheus_client import CollectorRegistry
+from services import car_service_pb2, car_service_pb2_grpc
+from microservices.car.car import CarService
+from microservices.common.metrics import ServerMetricsInterceptor
+
+CAR_ROW = (42, 2016, "Toyota", "Corolla", "good", "4 cylinders", "gas", 85000, "automatic", "4T1BF1FK5GU123456",
+           "fwd", "compact", "sedan", "silver", 3)
+
+@pytest.fixture
+def registry():
+    return CollectorRegistry()
+
+@pytest.fixture
+def mock_cursor():
+    with patch('psycopg2.connect') as mock_connect:
+        mock_cursor = Mock()
+        mock_connect.return_value.cursor.return_value = mock_cursor
+        yield mock_cursor
+
+@pytest.fixture
+def car_client(registry, mock_cursor):
+    interceptor = ServerMetricsInterceptor("test_car", registry=registry)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2), interceptors=[interceptor])
+    car_service_pb2_grpc.add_CarServiceServicer_to_server(CarService(), server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    channel = grpc.insecure_channel(f"127.0.0.1:{port}")
+    yield car_service_pb2_grpc.CarServiceStub(channel)
+    channel.close()
+    server.stop(None)
+
+def sample(registry, name, **labels):
+    return registry.get_sample_value(f"test_car_{name}", {"endpoint": "CarsReadOne", **labels})
+
+def test_successful_call_metrics(registry, mock_cursor, car_client):
+    """Test a successful call is counted, timed and sized, and leaves nothing in flight"""
+    mock_cursor.fetchone.return_value = CAR_ROW
+    request = car_service_pb2.CarsReadOneRequest(carId=42)
+    car = car_client.CarsReadOne(request)
+    car_client.CarsReadOne(request)
+
+    assert sample(registry, "request_count_total", status="success") == 2
+    assert sample(registry, "request_latency_seconds_count") == 2
+    assert sample(registry, "active_requests") == 0
+    assert sample(registry, "request_bytes_sum") == 2 * request.ByteSize()
+    assert sample(registry, "response_bytes_sum") == 2 * car.ByteSize()
+
+def test_status_codes_are_counted(registry, mock_cursor, car_client):
+    """Test calls the servicer fails are counted under their status code"""
+    mock_cursor.fetchone.return_value = None
+    with pytest.raises(grpc.RpcError):
+        car_client.CarsReadOne(car_service_pb2.CarsReadOneRequest(carId=42))
+
+    assert sample(registry, "request_count_total", status="not_found") == 1
+    assert sample(registry, "request_count_total", status="success") is None
+
+def test_exceptions_are_counted(registry, mock_cursor, car_client):
+    """Test an exception escaping the servicer is counted by type and as an UNKNOWN status"""
+    mock_cursor.execute.side_effect = RuntimeError("boom")
+    with pytest.raises(grpc.RpcError) as error:
+        car_client.CarsReadOne(car_service_pb2.CarsReadOneRequest(carId=42))
+    assert error.value.code() == grpc.StatusCode.UNKNOWN
+
+    assert sample(registry, "exception_count_total", exception="RuntimeError") == 1
+    assert sample(registry, "request_count_total", status="unknown") == 1
+    assert sample(registry, "active_requests") == 0
@@ -0,0 +1,101 @@
+import threading
+import time
+import pytest
+from urllib.error import HTTPError
+from urllib.request import urlopen
+from prometheus_client import CollectorRegistry, Counter
+from microservices.common import profiling
+
+@pytest.fixture
+def registry():
+    registry = CollectorRegistry()
+    Counter('test_profiled_requests', 'Requests', registry=registry).inc()
+    return registry
+
+@pytest.fixture
+def metrics_url(registry):
+    server, thread = profiling.start_http_server(0, addr="127.0.0.1", registry=registry)
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_ENABLED", True)
+
+def get(url):
+    with urlopen(url, timeout=10) as response:
+        return response.read().decode()
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+@pytest.fixture
+def busy_thread():
+    stop = threading.Event()
+    thread = threading.Thread(target=spin, args=(stop,), name="busy-worker")
+    thread.start()
+    yield thread
+    stop.set()
+    thread.join()
+
+def test_metrics_served_and_profiling_off_by_default(metrics_url):
+    """Test the port still serves metrics, and /debug/ only once profiling is enabled"""
+    assert "test_profiled_requests_total 1.0" in get(f"{metrics_url}/metrics")
+    with pytest.raises(HTTPError) as error:
+        get(f"{metrics_url}/debug/threads")
+    assert error.value.code == 404
+
+def test_thread_dump_shows_blocked_thread(enabled, metrics_url):
+    """Test the thread dump names each thread and shows where it is waiting"""
+    lock = threading.Lock()
+    lock.acquire()
+    waiter = threading.Thread(target=lambda: lock.acquire(timeout=5), name="stuck-worker")
+    waiter.start()
+    try:
+        dump = get(f"{metrics_url}/debug/threads")
+        collapsed = get(f"{metrics_url}/debug/threads?format=collapsed")
+    finally:
+        lock.release()
+        waiter.join()
+    assert 'Thread "stuck-worker"' in dump
+    assert any(line.startswith("stuck-worker;") and "<lambda> (tests/test_profiling.py:" in line
+               for line in collapsed.splitlines())
+
+@pytest.mark.parametrize("mode", ["cpu", "wall"])
+def test_profile_finds_busy_thread(enabled, metrics_url, busy_thread, mode):
+    """Test a profile returns collapsed stacks that attribute samples to the busy function"""
+    collapsed = get(f"{metrics_url}/debug/profile?seconds=0.5&mode={mode}")
+    busy = [line for line in collapsed.splitlines() if line.startswith("busy-worker;")]
+    assert busy and all("spin (tests/test_profiling.py:" in line for line in busy)
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in collapsed.splitlines())
+
+    top = get(f"{metrics_url}/debug/profile?seconds=0.3&mode={mode}&format=top")
+    assert "spin (tests/test_profiling.py:" in top
+
+def test_profile_rejects_bad_requests(enabled, metrics_url):
+    """Test out-of-range durations and overlapping profiles are refused"""
+    with pytest.raises(HTTPError) as error:
+        get(f"{metrics_url}/debug/profile?seconds=3600")
+    assert error.value.code == 400
+
+    with profiling._busy:
+        with pytest.raises(HTTPError) as error:
+            get(f"{metrics_url}/debug/heap?seconds=0.1")
+    assert error.value.code == 409
+
+def test_heap_diff_shows_growth(enabled):
+    """Test the heap diff attributes memory kept during the window to the code that allocated it"""
+    kept = []
+    def allocate():
+        time.sleep(0.05)
+        kept.append([bytearray(1024) for _ in range(200)])
+    thread = threading.Thread(target=allocate)
+    thread.start()
+    stats = profiling.heap_diff(0.3)
+    thread.join()
+
+    assert any("test_profiling.py" in frame.filename and stat.size_diff >= 200 * 1024
+               for stat in stats for frame in stat.traceback)
+    assert "test_profiling.py" in profiling.format_heap(stats, 5)
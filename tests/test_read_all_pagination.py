@@ -0,0 +1,133 @@
+import tracemalloc
+import pytest
+from unittest.mock import Mock, patch
+from datetime import datetime
+from services import maintenance_service_pb2, inspection_service_pb2, meeting_service_pb2
+from services import transaction_service_pb2, user_service_pb2
+from microservices.maintenance import maintenance
+from microservices.inspection import inspection
+from microservices.meeting import meeting
+from microservices.transaction import transaction
+from microservices.user import user
+
+MILLION = 1_000_000
+ROW_DATE = datetime(2024, 3, 20, 10, 0, 0)
+
+class FakeTableCursor:
+    """Cursor over a virtual table of `row_count` rows that honours the keyset paging parameters"""
+    def __init__(self, row_count, make_row):
+        self.row_count = row_count
+        self.make_row = make_row
+        self.executed = []
+        self._rows = []
+
+    def execute(self, query, params=None):
+        self.executed.append((query, params))
+        after_id, limit = params
+        last_id = min(after_id + limit, self.row_count)
+        self._rows = [self.make_row(row_id) for row_id in range(after_id + 1, last_id + 1)]
+
+    def fetchall(self):
+        return self._rows
+
+SERVICES = {
+    "maintenance": (
+        maintenance, maintenance.MaintenanceService, "MaintenanceReadAll",
+        maintenance_service_pb2.MaintenanceReadAllRequest,
+        lambda i: (i, 1, "MaintenanceTypeEnum_BASIC", "MaintenanceStatusEnum_ONGOING", "Oil change needed",
+                   "Parts ordered", 50.0, ROW_DATE, None),
+    ),
+    "inspection": (
+        inspection, inspection.InspectionService, "InspectionReadAll",
+        inspection_service_pb2.InspectionReadAllRequest,
+        lambda i: (i, 1, "InspectionStatusEnum_ONGOING", "Check engine light on", "Diagnosing issue",
+                   100.0, ROW_DATE, None),
+    ),
+    "meeting": (
+        meeting, meeting.MeetingService, "MeetingsReadAll",
+        meeting_service_pb2.MeetingsReadAllRequest,
+        lambda i: (i, 1, ROW_DATE, "StatusEnum_SCHEDULED", 60, None),
+    ),
+    "transaction": (
+        transaction, transaction.TransactionService, "TransactionsReadAll",
+        transaction_service_pb2.TransactionsReadAllRequest,
+        lambda i: (i, 1, 1, "TypeEnum_BUY", 25000.0, "StatusEnum_COMPLETED", ROW_DATE, None),
+    ),
+    "user": (
+        user, user.UserService, "UsersReadAll",
+        user_service_pb2.UsersReadAllRequest,
+        lambda i: (i, "John", "Fortnite", f"john{i}@example.com"),
+    ),
+}
+
+@pytest.fixture
+def mock_context():
+    context = Mock()
+    context.set_code = Mock()
+    context.set_details = Mock()
+    return context
+
+def make_service(name, row_count):
+    module, service_cls, method, request_cls, make_row = SERVICES[name]
+    cursor = FakeTableCursor(row_count, make_row)
+    with patch('psycopg2.connect') as mock_connect:
+        mock_connect.return_value.cursor.return_value = cursor
+        service = service_cls()
+    return module, getattr(service, method), request_cls, cursor
+
+@pytest.mark.parametrize("name", list(SERVICES))
+def test_read_all_bounded_on_million_rows(name, mock_context):
+    """A single ReadAll over 1M rows returns a capped page with bounded memory"""
+    module, read_all, request_cls, cursor = make_service(name, MILLION)
+
+    tracemalloc.start()
+    try:
+        response = read_all(request_cls(pageSize=MILLION), mock_context)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert len(response.data) <= module.MAX_PAGE_SIZE
+    assert response.ByteSize() <= module.MAX_RESPONSE_BYTES
+    assert response.nextPageToken == str(len(response.data))
+    assert cursor.executed[0][1] == (0, module.MAX_PAGE_SIZE + 1)
+    assert peak < 16 * 1024 * 1024
+    assert not mock_context.set_code.called
+
+@pytest.mark.parametrize("name", list(SERVICES))
+def test_read_all_follows_page_tokens(name, mock_context):
+    """Walking nextPageToken visits every row exactly once"""
+    _, read_all, request_cls, _ = make_service(name, 5)
+
+    pages = []
+    token = ""
+    while True:
+        response = read_all(request_cls(pageSize=2, pageToken=token), mock_context)
+        pages.append(len(response.data))
+        token = response.nextPageToken
+        if not token:
+            break
+
+    assert pages == [2, 2, 1]
+
+@pytest.mark.parametrize("name", list(SERVICES))
+def test_read_all_respects_byte_budget(name, mock_context):
+    """The response stops at the byte budget and resumes after the last returned row"""
+    module, read_all, request_cls, _ = make_service(name, 50)
+
+    with patch.object(module, 'MAX_RESPONSE_BYTES', 1):
+        response = read_all(request_cls(pageSize=10), mock_context)
+
+    assert len(response.data) == 1
+    assert response.nextPageToken == "1"
+
+@pytest.mark.parametrize("name", list(SERVICES))
+def test_read_all_rejects_invalid_page_token(name, mock_context):
+    """A malformed pageToken is an invalid argument, not a full scan"""
+    _, read_all, request_cls, cursor = make_service(name, 5)
+
+    response = read_all(request_cls(pageToken="not-a-token"), mock_context)
+
+    assert len(response.data) == 0
+    assert not cursor.executed
+    mock_context.set_code.assert_called_once()
@@ -0,0 +1,151 @@
+import grpc
+import os
+import psycopg2
+import pytest
+import signal
+import threading
+import time
+from concurrent import futures
+from unittest.mock import Mock, patch
+from urllib.request import urlopen
+from flask import Flask
+from prometheus_client import CollectorRegistry
+from werkzeug.serving import make_server
+from services import car_service_pb2, car_service_pb2_grpc
+from microservices.car.car import CarService
+from microservices.common import shutdown
+from microservices.common.db import QueryMetrics
+from microservices.common.health import DatabaseHealth
+from microservices.gateway.channels import ChannelManager
+from microservices.gateway.in_flight import InFlightRequests
+
+CAR_ROW = (42, 2016, "Toyota", "Corolla", "good", "4 cylinders", "gas", 85000, "automatic", "4T1BF1FK5GU123456",
+           "fwd", "compact", "sedan", "silver", 3)
+
+class Replica:
+    """A car service pod as serve() runs it: its own connection, health service and gRPC server"""
+    def __init__(self):
+        self.connection = Mock(closed=0)
+        self.connection.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        self.calls = 0
+        self.calls_lock = threading.Lock()
+        cursor = self.connection.cursor.return_value
+        cursor.fetchone.side_effect = self.read_row
+        with patch("psycopg2.connect", return_value=self.connection):
+            servicer = CarService()
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+        car_service_pb2_grpc.add_CarServiceServicer_to_server(servicer, self.server)
+        registry = CollectorRegistry()
+        self.health = DatabaseHealth(QueryMetrics("test_rollout", registry=registry), self.connection, registry=registry)
+        self.health.add_to_server(self.server, "openapitools.services.carservice.CarService")
+        self.port = self.server.add_insecure_port("127.0.0.1:0")
+
+    def read_row(self):
+        # Slow enough that a drain always finds calls running
+        time.sleep(0.02)
+        with self.calls_lock:
+            self.calls += 1
+        return CAR_ROW
+
+    def start(self):
+        self.server.start()
+        self.health.start()
+
+@pytest.fixture(autouse=True)
+def ping():
+    with patch("psycopg2.extensions.cursor"):
+        yield
+
+def test_rolling_update_fails_no_requests():
+    """Test replacing every replica while clients keep calling, one drained pod at a time, fails no call"""
+    old, older, new = Replica(), Replica(), Replica()
+    old.start()
+    older.start()
+    manager = ChannelManager(channels_per_backend=1)
+    # The target lists the new pod from the start; it is skipped until it accepts connections
+    client = manager.stub("ipv4:" + ",".join(f"127.0.0.1:{replica.port}" for replica in (old, older, new)),
+                          car_service_pb2_grpc.CarServiceStub)
+    stop = threading.Event()
+    results = []
+    errors = []
+
+    def call():
+        while not stop.is_set():
+            try:
+                results.append(client.CarsReadOne(car_service_pb2.CarsReadOneRequest(carId=42), timeout=5).carId)
+            except grpc.RpcError as e:
+                errors.append(e.code())
+
+    callers = [threading.Thread(target=call) for _ in range(4)]
+    for caller in callers:
+        caller.start()
+    try:
+        time.sleep(0.3)
+        new.start()
+        time.sleep(0.3)
+        shutdown.drain(old.server, old.health, delay=0.3, grace=2)
+        shutdown.drain(older.server, older.health, delay=0.3, grace=2)
+        time.sleep(0.3)
+    finally:
+        stop.set()
+        for caller in callers:
+            caller.join()
+        new.server.stop(None)
+        manager.close()
+
+    assert errors == []
+    assert len(results) == old.calls + older.calls + new.calls
+    assert old.calls and older.calls and new.calls
+    old.connection.close.assert_called_once()
+    old.connection.rollback.assert_called()
+
+def test_drain_rolls_back_unfinished_transaction():
+    """Test closing the connections at shutdown rolls back a transaction a cancelled call left open"""
+    replica = Replica()
+    replica.start()
+    replica.connection.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INERROR
+    replica.connection.rollback.reset_mock()
+    shutdown.drain(replica.server, replica.health, delay=0, grace=0)
+    replica.connection.rollback.assert_called_once()
+    replica.connection.close.assert_called_once()
+
+def test_wait_for_signal_returns_on_sigterm():
+    """Test the main thread is woken by SIGTERM instead of being killed by it"""
+    previous = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGINT)}
+    timer = threading.Timer(0.1, os.kill, (os.getpid(), signal.SIGTERM))
+    timer.start()
+    try:
+        assert shutdown.wait_for_signal() == signal.SIGTERM
+    finally:
+        timer.join()
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+def test_gateway_requests_finish_after_shutdown():
+    """Test a request running when the HTTP server stops accepting connections still gets its response"""
+    app = Flask(__name__)
+    started = threading.Event()
+
+    @app.route("/slow")
+    def slow():
+        started.set()
+        # Longer than serve_forever takes to notice the shutdown
+        time.sleep(1)
+        return "done"
+
+    in_flight = InFlightRequests(app.wsgi_app)
+    app.wsgi_app = in_flight
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    server.block_on_close = False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    responses = []
+    request = threading.Thread(target=lambda: responses.append(urlopen(f"http://127.0.0.1:{server.port}/slow", timeout=5).read()))
+    request.start()
+    started.wait(5)
+
+    server.shutdown()
+    assert in_flight.count == 1
+    assert in_flight.wait_idle(5)
+    server.server_close()
+    request.join()
+    assert responses == [b"done"]
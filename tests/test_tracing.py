@@ -0,0 +1,113 @@
+import grpc
+import json
+import psycopg2
+import pytest
+from concurrent import futures
+from unittest.mock import Mock, patch
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.trace import SpanKind
+from services import car_service_pb2, car_service_pb2_grpc
+from microservices.car.car import CarService
+from microservices.common import tracing
+from microservices.common.db import statement_name
+
+CAR_ROW = (42, 2016, "Toyota", "Corolla", "good", "4 cylinders", "gas", 85000, "automatic", "4T1BF1FK5GU123456",
+           "fwd", "compact", "sedan", "silver", 3)
+
+@pytest.fixture
+def exporter():
+    exporter = InMemorySpanExporter()
+    tracing.configure("test", exporter=exporter)
+    yield exporter
+    tracing.configure("test")
+
+@pytest.fixture
+def mock_cursor():
+    with patch('psycopg2.connect') as mock_connect:
+        mock_cursor = Mock()
+        mock_cursor.fetchone.return_value = CAR_ROW
+        mock_connect.return_value.cursor.return_value = mock_cursor
+        yield mock_cursor
+
+@pytest.fixture
+def car_client(mock_cursor):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2), interceptors=[tracing.ServerInterceptor()])
+    car_service_pb2_grpc.add_CarServiceServicer_to_server(CarService(), server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    channel = grpc.insecure_channel(f"127.0.0.1:{port}")
+    yield car_service_pb2_grpc.CarServiceStub(channel)
+    channel.close()
+    server.stop(None)
+
+def spans_named(exporter, name):
+    return [span for span in exporter.get_finished_spans() if span.name == name]
+
+def test_trace_continues_in_servicer(exporter, car_client):
+    """Test the caller's trace context sent as metadata becomes the parent of the servicer's span"""
+    with tracing.span("gateway", kind=SpanKind.CLIENT) as parent:
+        car = car_client.CarsReadOne(car_service_pb2.CarsReadOneRequest(carId=42), metadata=tracing.inject())
+    assert car.carId == 42
+
+    server_span, = spans_named(exporter, "CarService/CarsReadOne")
+    assert server_span.kind == SpanKind.SERVER
+    assert server_span.context.trace_id == parent.get_span_context().trace_id
+    assert server_span.parent.span_id == parent.get_span_context().span_id
+    assert server_span.attributes["rpc.grpc.status_code"] == grpc.StatusCode.OK.value[0]
+
+def test_servicer_span_records_error_status(exporter, car_client, mock_cursor):
+    """Test a call the servicer fails with INTERNAL ends its span with an error status"""
+    mock_cursor.execute.side_effect = psycopg2.OperationalError("server closed the connection")
+    with pytest.raises(grpc.RpcError) as error:
+        car_client.CarsReadOne(car_service_pb2.CarsReadOneRequest(carId=42))
+    assert error.value.code() == grpc.StatusCode.INTERNAL
+
+    server_span, = spans_named(exporter, "CarService/CarsReadOne")
+    assert not server_span.status.is_ok
+    assert server_span.parent is None
+
+def test_sampling_follows_the_caller(car_client):
+    """Test a ratio of 0 drops new traces but still records calls whose caller sampled them"""
+    exporter = InMemorySpanExporter()
+    tracing.configure("test", exporter=exporter, sample_ratio=0)
+    try:
+        car_client.CarsReadOne(car_service_pb2.CarsReadOneRequest(carId=42))
+        assert spans_named(exporter, "CarService/CarsReadOne") == []
+
+        sampled = (("traceparent", "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"),)
+        car_client.CarsReadOne(car_service_pb2.CarsReadOneRequest(carId=42), metadata=sampled)
+        server_span, = spans_named(exporter, "CarService/CarsReadOne")
+        assert server_span.context.trace_id == 0x0af7651916cd43dd8448eb211c80319c
+    finally:
+        tracing.configure("test")
+
+def test_file_exporter_writes_json_lines(tmp_path):
+    """Test the file exporter appends one JSON object per finished span"""
+    path = tmp_path / "traces.jsonl"
+    tracing.configure("test", exporter=tracing.JsonLinesSpanExporter(str(path)))
+    try:
+        with tracing.span("outer"):
+            with tracing.span("inner"):
+                pass
+    finally:
+        tracing.configure("test")
+
+    spans = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [span["name"] for span in spans] == ["inner", "outer"]
+    assert spans[0]["parent_id"] == spans[1]["context"]["span_id"]
+    assert spans[1]["resource"]["attributes"]["service.name"] == "test"
+
+def test_tracing_off_by_default():
+    """Test nothing is recorded or sent along when no exporter is configured"""
+    assert not tracing.enabled()
+    with tracing.span("ignored") as span:
+        assert not span.is_recording()
+        assert tracing.inject() == ()
+        assert tracing.traceparent() is None
+
+def test_statement_name():
+    """Test span names for statements are their command and first table"""
+    assert statement_name("SELECT car_id, year FROM car WHERE car_id = %s") == "SELECT car"
+    assert statement_name("\n  UPDATE car_listing SET version = version + 1") == "UPDATE car_listing"
+    assert statement_name("INSERT INTO transactions (buyer_id) VALUES (%s)") == "INSERT transactions"
+    assert statement_name("SELECT set_config('app.traceparent', %s, true)") == "SELECT"
@@ -1,8 +1,12 @@
+import grpc
 import pytest
-from unittest.mock import Mock, patch
-from datetime import datetime
+from unittest.mock import Mock, MagicMock, patch
+from datetime import date, datetime
+from decimal import Decimal
 from services import transaction_service_pb2
 from microservices.transaction.transaction import TransactionService
+from microservices.transaction.partition_maintenance import maintain_partitions
+from microservices.transaction.refresh_reports import refresh_reports
 
 @pytest.fixture
 def mock_db_connection():
@@ -18,6 +22,7 @@ def mock_context():
     context = Mock()
     context.set_code = Mock()
     context.set_details = Mock()
+    context.invocation_metadata = Mock(return_value=())
     return context
 
 @pytest.fixture
@@ -64,7 +69,7 @@ def test_transaction_creation_and_retrieval(transaction_service, mock_db_connect
     transaction_date = datetime(2024, 3, 20, 10, 0, 0)
     mock_cursor.fetchone.side_effect = [
         (1,),
-        (1, 1, 1, "TypeEnum_BUY", 25000.00, "StatusEnum_PENDING", transaction_date, None)
+        (1, 1, 1, "TypeEnum_BUY", 25000.00, "StatusEnum_PENDING", transaction_date, None, 1)
     ]
     
     # Create and then read transaction
@@ -112,4 +117,208 @@ def test_rental_transaction_creation(transaction_service, mock_db_connection, mo
     
     assert response.transactionId == 1
     assert response.type == transaction_service_pb2.Transaction.TypeEnum.TypeEnum_RENT
-    assert response.endDate == "2024-04-20T10:00:00Z" 
\ No newline at end of file
+    assert response.endDate == "2024-04-20T10:00:00Z" 
+
+def test_transactions_read_range(transaction_service, mock_db_connection, mock_context):
+    """Test reading a filtered date range bounds the query on transaction_date"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = [
+        (1, 1, 1, "TypeEnum_BUY", 25000.00, "StatusEnum_COMPLETED", datetime(2024, 3, 10, 14, 30), None),
+        (3, 3, 3, "TypeEnum_BUY", 32000.00, "StatusEnum_COMPLETED", datetime(2024, 3, 18, 16, 45), None)
+    ]
+    
+    request = transaction_service_pb2.TransactionsReadRangeRequest(
+        fromDate="2024-03-01",
+        toDate="2024-04-01",
+        status=transaction_service_pb2.Transaction.StatusEnum.StatusEnum_COMPLETED,
+        pageSize=1
+    )
+    response = transaction_service.TransactionsReadRange(request, mock_context)
+    
+    query, params = mock_cursor.execute.call_args[0]
+    assert "transaction_date >= %s AND transaction_date < %s" in query
+    assert "transaction_status = %s" in query
+    assert "transaction_type = %s" not in query
+    assert params == [datetime(2024, 3, 1), datetime(2024, 4, 1), 0, "StatusEnum_COMPLETED", 2]
+    assert len(response.data) == 1
+    assert response.data[0].transactionId == 1
+    assert response.nextPageToken == "1"
+
+def test_transactions_read_range_invalid(transaction_service, mock_db_connection, mock_context):
+    """Test an empty or inverted date range is rejected"""
+    mock_conn, mock_cursor = mock_db_connection
+    
+    request = transaction_service_pb2.TransactionsReadRangeRequest(fromDate="2024-04-01", toDate="2024-03-01")
+    response = transaction_service.TransactionsReadRange(request, mock_context)
+    
+    assert len(response.data) == 0
+    assert not mock_cursor.execute.called
+    assert mock_context.set_code.called
+
+def test_transactions_patch_clears_end_date(transaction_service, mock_db_connection, mock_context):
+    """Test an endDate in the mask without a value is written as NULL, and unmasked columns are left alone"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchone.return_value = (
+        5, 1, 1, "TypeEnum_RENT", Decimal("1500.00"), "StatusEnum_COMPLETED", datetime(2024, 3, 20, 10, 0, 0), None, 4
+    )
+    
+    request = transaction_service_pb2.TransactionsPatchRequest(
+        transactionId=5,
+        transaction=transaction_service_pb2.Transaction(
+            status=transaction_service_pb2.Transaction.StatusEnum.StatusEnum_COMPLETED, totalAmount=99.0
+        ),
+        expectedVersion=3
+    )
+    request.updateMask.paths.extend(["endDate", "status"])
+    response = transaction_service.TransactionsPatch(request, mock_context)
+    
+    query, params = mock_cursor.execute.call_args[0]
+    assert query.startswith("UPDATE transaction SET end_date = %s, transaction_status = %s, version = version + 1 WHERE")
+    assert "total_amount =" not in query and "transaction_date =" not in query
+    assert params == [None, "StatusEnum_COMPLETED", 5, 3, 3]
+    assert response.endDate == ""
+    assert response.version == 4
+    mock_conn.commit.assert_called_once()
+
+def test_transactions_patch_conflicts(transaction_service, mock_db_connection, mock_context):
+    """Test a stale version fails its precondition, a missing transaction is not found, and an empty mask is invalid"""
+    mock_conn, mock_cursor = mock_db_connection
+    request = transaction_service_pb2.TransactionsPatchRequest(
+        transactionId=5, transaction=transaction_service_pb2.Transaction(totalAmount=99.0), expectedVersion=3
+    )
+    request.updateMask.paths.append("totalAmount")
+    
+    mock_cursor.fetchone.side_effect = [None, (1,)]
+    assert transaction_service.TransactionsPatch(request, mock_context) == transaction_service_pb2.Transaction()
+    mock_context.set_code.assert_called_with(grpc.StatusCode.FAILED_PRECONDITION)
+    
+    mock_cursor.fetchone.side_effect = [None, None]
+    assert transaction_service.TransactionsPatch(request, mock_context) == transaction_service_pb2.Transaction()
+    mock_context.set_code.assert_called_with(grpc.StatusCode.NOT_FOUND)
+    assert not mock_conn.commit.called
+    
+    mock_cursor.execute.reset_mock()
+    del request.updateMask.paths[:]
+    assert transaction_service.TransactionsPatch(request, mock_context) == transaction_service_pb2.Transaction()
+    mock_context.set_code.assert_called_with(grpc.StatusCode.INVALID_ARGUMENT)
+    assert not mock_cursor.execute.called
+
+def test_partition_maintenance():
+    """Test the partition job creates future partitions, detaches old ones and commits"""
+    mock_conn = MagicMock()
+    mock_cursor = mock_conn.cursor.return_value.__enter__.return_value
+    mock_cursor.fetchall.side_effect = [
+        [("transaction_2027_01",)],
+        [("transaction_2023_09",)]
+    ]
+    
+    created, detached = maintain_partitions(mock_conn, 3, 36)
+    
+    assert created == ["transaction_2027_01"]
+    assert detached == ["transaction_2023_09"]
+    assert mock_cursor.execute.call_args_list[0][0][1] == (3,)
+    assert mock_cursor.execute.call_args_list[1][0][1] == (36,)
+    assert mock_conn.commit.called
+
+def test_partition_maintenance_logs_moved_rows(caplog):
+    """Test rows the database moved out of the default partition are reported as a warning"""
+    mock_conn = MagicMock()
+    mock_conn.notices = ["WARNING:  Moved 2 transaction rows from transaction_default into transaction_2027_06\n"]
+    mock_conn.cursor.return_value.__enter__.return_value.fetchall.side_effect = [[("transaction_2027_06",)], []]
+    
+    maintain_partitions(mock_conn, 9, 36)
+    
+    assert "Moved 2 transaction rows from transaction_default into transaction_2027_06" in caplog.text
+    assert caplog.records[0].levelname == "WARNING"
+    assert mock_conn.notices == []
+
+def test_report_revenue_by_month_cached(transaction_service, mock_db_connection, mock_context):
+    """Test monthly revenue is read from the summary once and then served from the cache"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = [
+        (date(2024, 1, 1), Decimal(3), Decimal("75000.00")),
+        (date(2024, 2, 1), Decimal(1), Decimal("500.00"))
+    ]
+    
+    request = transaction_service_pb2.TransactionsReportRequest(fromDate="2024-01-15", toDate="2024-03-01")
+    response = transaction_service.TransactionsReportRevenueByMonth(request, mock_context)
+    cached = transaction_service.TransactionsReportRevenueByMonth(request, mock_context)
+    
+    assert [m.month for m in response.data] == ["2024-01-01", "2024-02-01"]
+    assert response.data[0].transactions == 3
+    assert response.data[0].revenue == 75000.0
+    assert cached == response
+    assert mock_cursor.execute.call_count == 1
+    assert mock_cursor.execute.call_args[0][1] == (date(2024, 1, 1), date(2024, 3, 1), 100)
+    assert not mock_context.set_code.called
+
+def test_report_average_price_and_rent_vs_buy(transaction_service, mock_db_connection, mock_context):
+    """Test average price per car and the rent/buy split with shares"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.side_effect = [
+        [("Toyota", "Corolla", 2020, Decimal(2), Decimal("21000.00"))],
+        [("TypeEnum_BUY", Decimal(3), Decimal("63000.00")), ("TypeEnum_RENT", Decimal(1), Decimal("500.00"))]
+    ]
+    request = transaction_service_pb2.TransactionsReportRequest()
+    
+    prices = transaction_service.TransactionsReportAveragePrice(request, mock_context)
+    splits = transaction_service.TransactionsReportRentVsBuy(request, mock_context)
+    
+    assert prices.data[0].manufacturer == "Toyota"
+    assert prices.data[0].averagePrice == 21000.0
+    assert splits.data[0].type == transaction_service_pb2.Transaction.TypeEnum.TypeEnum_BUY
+    assert [s.share for s in splits.data] == [0.75, 0.25]
+
+def test_report_rent_vs_buy_cached_with_shares(transaction_service, mock_db_connection, mock_context):
+    """Test shares are part of the cached split, which later calls get back as is"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = [("TypeEnum_BUY", Decimal(1), Decimal("21000.00")), ("TypeEnum_RENT", Decimal(3), Decimal("900.00"))]
+    request = transaction_service_pb2.TransactionsReportRequest()
+    
+    splits = transaction_service.TransactionsReportRentVsBuy(request, mock_context)
+    [(expires, cached)] = transaction_service.report_cache.values()
+    assert cached is splits
+    assert [s.share for s in cached.data] == [0.25, 0.75]
+    
+    # Concurrent calls share the cached message, so serving it must not write to it
+    with patch.object(type(cached.data[0]), "__setattr__", side_effect=AssertionError("cached split modified")):
+        assert transaction_service.TransactionsReportRentVsBuy(request, mock_context) is splits
+    assert mock_cursor.execute.call_count == 1
+
+def test_report_invalid_range(transaction_service, mock_db_connection, mock_context):
+    """Test an inverted month range is rejected before querying"""
+    mock_conn, mock_cursor = mock_db_connection
+    
+    request = transaction_service_pb2.TransactionsReportRequest(fromDate="2024-03-01", toDate="2024-03-20")
+    response = transaction_service.TransactionsReportRevenueByMonth(request, mock_context)
+    
+    assert len(response.data) == 0
+    assert not mock_cursor.execute.called
+    assert mock_context.set_code.called
+
+def test_refresh_reports():
+    """Test the report job refreshes the summary view concurrently and commits"""
+    mock_conn = MagicMock()
+    mock_cursor = mock_conn.cursor.return_value.__enter__.return_value
+    
+    refresh_reports(mock_conn)
+    
+    assert "REFRESH MATERIALIZED VIEW CONCURRENTLY" in mock_cursor.execute.call_args[0][0]
+    assert mock_conn.commit.called
+
+def test_transactions_create_idempotent_replay(transaction_service, mock_db_connection, mock_context):
+    """Test a create retried with the same idempotency key returns the stored response without inserting"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_context.invocation_metadata.return_value = (("idempotency-key", "sale-1"),)
+    stored = transaction_service_pb2.Transaction(transactionId=42, buyerId=1, carId=1, totalAmount=25000.00)
+    mock_cursor.fetchone.side_effect = [None, (stored.SerializeToString(),)]
+    
+    request = transaction_service_pb2.TransactionsCreateRequest(
+        transaction=transaction_service_pb2.Transaction(buyerId=1, carId=1, totalAmount=25000.00)
+    )
+    response = transaction_service.TransactionsCreate(request, mock_context)
+    
+    assert response == stored
+    assert not any("INSERT INTO transaction " in call[0][0] for call in mock_cursor.execute.call_args_list)
+    assert mock_conn.commit.called
+    assert not mock_context.set_code.called
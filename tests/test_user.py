@@ -1,3 +1,4 @@
+import grpc
 import pytest
 from unittest.mock import Mock, patch
 from services import user_service_pb2
@@ -17,6 +18,7 @@ def mock_context():
     context = Mock()
     context.set_code = Mock()
     context.set_details = Mock()
+    context.invocation_metadata = Mock(return_value=())
     return context
 
 @pytest.fixture
@@ -101,4 +103,45 @@ def test_user_deletion(user_service, mock_db_connection, mock_context):
     # Verify user was deleted
     assert deleted_user.userId == 0 
     assert mock_context.set_code.called
-    assert mock_context.set_details.called
\ No newline at end of file
+    assert mock_context.set_details.called
+
+def test_users_create_stores_idempotent_response(user_service, mock_db_connection, mock_context):
+    """Test a create with a new idempotency key claims it and stores the response before committing"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_context.invocation_metadata.return_value = (("idempotency-key", "retry-me"),)
+    mock_cursor.fetchone.side_effect = [("retry-me",), (1,)]
+    
+    request = user_service_pb2.UsersCreateRequest(
+        user=user_service_pb2.User(firstName="John", lastName="Fortnite", email="john@example.com")
+    )
+    response = user_service.UsersCreate(request, mock_context)
+    
+    statements = [call[0] for call in mock_cursor.execute.call_args_list]
+    assert "INSERT INTO user_idempotency" in statements[0][0]
+    assert "INSERT INTO users" in statements[1][0]
+    assert statements[2] == (
+        "UPDATE user_idempotency SET response = %s WHERE idempotency_key = %s",
+        (response.SerializeToString(), "retry-me")
+    )
+    assert response.userId == 1
+    mock_conn.commit.assert_called_once()
+
+def test_users_read_with_read_mask(user_service, mock_db_connection, mock_context):
+    """Test a read mask selects only the requested columns and the ID, and an unknown field is rejected unread"""
+    mock_conn, mock_cursor = mock_db_connection
+    mock_cursor.fetchall.return_value = [(1, "ana@example.com")]
+    
+    request = user_service_pb2.UsersReadAllRequest()
+    request.readMask.paths.append("email")
+    response = user_service.UsersReadAll(request, mock_context)
+    
+    query, params = mock_cursor.execute.call_args[0]
+    assert query == "SELECT user_id, email FROM users WHERE user_id > %s ORDER BY user_id LIMIT %s"
+    assert response.data[0] == user_service_pb2.User(userId=1, email="ana@example.com")
+    
+    mock_cursor.execute.reset_mock()
+    request = user_service_pb2.UsersReadOneRequest(userId=1)
+    request.readMask.paths.append("password")
+    assert user_service.UsersReadOne(request, mock_context) == user_service_pb2.User()
+    assert not mock_cursor.execute.called
+    mock_context.set_code.assert_called_once_with(grpc.StatusCode.INVALID_ARGUMENT)